@@ -0,0 +1,188 @@
+-- HTTP callout engine shared by the plugins that call external services.
+--
+-- Connections are kept alive in one pool per upstream (scheme, host, port,
+-- resolved address and TLS settings), so TCP and TLS setup happen once per
+-- pooled connection rather than once per request. URLs are parsed once and
+-- host names are resolved through Kong's caching DNS client.
+--
+-- `request` returns the same `{ status, headers, body }` shape as
+-- `kong.http.client.go`, so callers can switch without other changes.
+
+local http = require "resty.http"
+local lrucache = require "resty.lrucache"
+
+local type = type
+local pairs = pairs
+local tostring = tostring
+local find = string.find
+local upper = string.upper
+
+local DEFAULT_TIMEOUT = 10000
+local DEFAULT_CONNECT_TIMEOUT = 5000
+local DEFAULT_KEEPALIVE_TIMEOUT = 60000
+local DEFAULT_KEEPALIVE_POOL_SIZE = 32
+
+-- Methods that are retried once on a reused connection that turns out to
+-- have been closed by the peer
+local IDEMPOTENT_METHODS = {
+  GET = true,
+  HEAD = true,
+  OPTIONS = true,
+  PUT = true,
+  DELETE = true,
+}
+
+local DEFAULT_PORTS = {
+  http = 80,
+  https = 443,
+}
+
+local parsed_urls = lrucache.new(512)
+
+local _M = {}
+
+local function parse_url(url)
+  local parsed = parsed_urls:get(url)
+  if parsed then
+    return parsed
+  end
+
+  local parts, err = http:parse_uri(url, false)
+  if not parts then
+    return nil, "invalid callout URL '" .. tostring(url) .. "': " .. tostring(err)
+  end
+
+  local scheme, host, port = parts[1], parts[2], parts[3]
+  parsed = {
+    scheme = scheme,
+    host = host,
+    port = port,
+    path = parts[4],
+    query = parts[5] ~= "" and parts[5] or nil,
+    host_header = port == DEFAULT_PORTS[scheme] and host or (host .. ":" .. port),
+    is_ip = find(host, "^[%d%.]+$") ~= nil or find(host, ":", 1, true) ~= nil,
+  }
+  parsed_urls:set(url, parsed)
+  return parsed
+end
+
+-- Resolves the host through Kong's DNS client, which caches records for
+-- their TTL. Outside Kong, nginx's resolver is used at connect time.
+local function resolve(parsed)
+  if parsed.is_ip or not (kong and kong.dns) then
+    return parsed.host, parsed.port
+  end
+
+  local ip, port = kong.dns.toip(parsed.host, parsed.port)
+  if not ip then
+    return nil, "DNS resolution of '" .. parsed.host .. "' failed: " .. tostring(port)
+  end
+  return ip, port or parsed.port
+end
+
+local function connect(parsed, opts)
+  local ip, port = resolve(parsed)
+  if not ip then
+    return nil, port
+  end
+
+  local httpc = http.new()
+  httpc:set_timeouts(opts.connect_timeout or DEFAULT_CONNECT_TIMEOUT,
+                     opts.timeout or DEFAULT_TIMEOUT,
+                     opts.timeout or DEFAULT_TIMEOUT)
+
+  local ssl_verify = opts.ssl_verify ~= false
+  local ok, err = httpc:connect({
+    scheme = parsed.scheme,
+    host = ip,
+    port = port,
+    pool = parsed.scheme .. ":" .. parsed.host .. ":" .. ip .. ":" .. port .. ":" .. tostring(ssl_verify),
+    pool_size = opts.keepalive_pool_size or DEFAULT_KEEPALIVE_POOL_SIZE,
+    ssl_server_name = parsed.host,
+    ssl_verify = ssl_verify,
+  })
+  if not ok then
+    return nil, err
+  end
+  return httpc
+end
+
+local function build_params(parsed, opts)
+  local headers = {}
+  if opts.headers then
+    for name, value in pairs(opts.headers) do
+      headers[name] = value
+    end
+  end
+  if not headers.Host and not headers.host then
+    headers.Host = parsed.host_header
+  end
+
+  return {
+    method = opts.method and upper(opts.method) or "GET",
+    path = parsed.path,
+    query = opts.query or parsed.query,
+    headers = headers,
+    body = opts.body,
+  }
+end
+
+-- Reads the full response and hands the connection back to its pool. The
+-- connection is closed instead when the server asked for that.
+local function finish(httpc, res, opts)
+  local body, err = res:read_body()
+  if err then
+    httpc:close()
+    return nil, err
+  end
+
+  httpc:set_keepalive(opts.keepalive_timeout or DEFAULT_KEEPALIVE_TIMEOUT,
+                      opts.keepalive_pool_size or DEFAULT_KEEPALIVE_POOL_SIZE)
+
+  return {
+    status = res.status,
+    headers = res.headers,
+    body = body,
+  }
+end
+
+--- Sends one HTTP request over a pooled connection.
+-- @param url string Full URL, e.g. `https://example.com/path?x=1`.
+-- @param opts table `method`, `headers`, `body`, `query`, `timeout` and
+--   `connect_timeout` (ms), `ssl_verify` (default true), `keepalive_timeout`
+--   (ms) and `keepalive_pool_size`.
+-- @return `{ status, headers, body }`, or nil and an error.
+function _M.request(url, opts)
+  opts = opts or {}
+  local parsed, err = parse_url(url)
+  if not parsed then
+    return nil, err
+  end
+
+  local params = build_params(parsed, opts)
+
+  for attempt = 1, 2 do
+    local httpc
+    httpc, err = connect(parsed, opts)
+    if not httpc then
+      return nil, err
+    end
+
+    local res
+    res, err = httpc:request(params)
+    if res then
+      return finish(httpc, res, opts)
+    end
+
+    local reused = (httpc:get_reused_times() or 0) > 0
+    httpc:close()
+    -- A pooled connection may have been closed by the peer while idle
+    if attempt == 2 or not reused or not IDEMPOTENT_METHODS[params.method] or type(params.body) == "function" then
+      break
+    end
+  end
+
+  return nil, err
+end
+
+return _M
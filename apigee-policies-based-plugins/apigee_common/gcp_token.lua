@@ -0,0 +1,238 @@
+-- Google Cloud access tokens minted from a service-account key file.
+--
+-- Tokens are obtained with the OAuth 2.0 JWT bearer grant and cached in the
+-- `apigee_gcp_tokens` shared dict, so all workers use the same token. A per-worker timer
+-- refreshes every token in use before it expires, and only one worker mints
+-- at a time. Request phases only ever read the cache (`get`); minting
+-- happens in timers (`fetch`, the refresher), never on a request's path.
+
+local cjson = require "cjson.safe"
+local jwt = require "resty.jwt"
+local lrucache = require "resty.lrucache"
+local callout = require "kong.plugins.apigee_common.callout"
+
+local DEFAULT_TOKEN_ENDPOINT = "https://oauth2.googleapis.com/token"
+local DEFAULT_SCOPE = "https://www.googleapis.com/auth/cloud-platform"
+local JWT_BEARER_GRANT = "urn:ietf:params:oauth:grant-type:jwt-bearer"
+
+-- Lifetime of the signed assertion; Google accepts at most one hour
+local ASSERTION_LIFETIME = 3600
+
+-- Tokens are refreshed when less than this many seconds remain, and are
+-- dropped from the cache this long before they actually expire
+local REFRESH_MARGIN = 300
+local EXPIRY_MARGIN = 60
+
+-- How often each worker checks the tokens it uses
+local REFRESH_INTERVAL = 15
+
+-- Upper bound on one mint, also the lifetime of the cross-worker lock
+local MINT_LOCK_TTL = 30
+
+local key_files = lrucache.new(32)
+
+-- Token sources used by this worker, by cache key
+local sources = {}
+local refresher_started = false
+
+local _M = {
+  -- Must be declared with `nginx_http_lua_shared_dict`
+  SHM = "apigee_gcp_tokens",
+}
+
+local function shm()
+  return ngx.shared[_M.SHM]
+end
+
+local function missing_shm()
+  return "lua_shared_dict '" .. _M.SHM .. "' is not declared"
+end
+
+local function read_key_file(path)
+  local key = key_files:get(path)
+  if key then
+    return key
+  end
+
+  local file, err = io.open(path, "rb")
+  if not file then
+    return nil, "cannot open service account key file: " .. tostring(err)
+  end
+  local content = file:read("*a")
+  file:close()
+
+  local decoded = cjson.decode(content or "")
+  if type(decoded) ~= "table" or not decoded.client_email or not decoded.private_key then
+    return nil, "service account key file '" .. path .. "' lacks client_email or private_key"
+  end
+
+  key = {
+    client_email = decoded.client_email,
+    private_key = decoded.private_key,
+    private_key_id = decoded.private_key_id,
+    token_uri = decoded.token_uri,
+  }
+  key_files:set(path, key)
+  return key
+end
+
+local function source_for(conf)
+  local path = conf.gcp_service_account_key_file
+  local scope = conf.gcp_token_scope or DEFAULT_SCOPE
+  local endpoint = conf.gcp_token_endpoint
+  local cache_key = "gcp_token:" .. path .. "|" .. scope .. "|" .. (endpoint or "")
+
+  local source = sources[cache_key]
+  if not source then
+    source = { cache_key = cache_key, path = path, scope = scope, endpoint = endpoint }
+    sources[cache_key] = source
+  end
+  return source
+end
+
+-- Signs an assertion and exchanges it for an access token.
+local function mint(source)
+  local key, err = read_key_file(source.path)
+  if not key then
+    return nil, err
+  end
+
+  local endpoint = source.endpoint or key.token_uri or DEFAULT_TOKEN_ENDPOINT
+  local now = ngx.time()
+  local ok, assertion = pcall(jwt.sign, jwt, key.private_key, {
+    header = { typ = "JWT", alg = "RS256", kid = key.private_key_id },
+    payload = {
+      iss = key.client_email,
+      scope = source.scope,
+      aud = endpoint,
+      iat = now,
+      exp = now + ASSERTION_LIFETIME,
+    },
+  })
+  if not ok or not assertion then
+    return nil, "failed to sign token request: " .. tostring(assertion)
+  end
+
+  local res, req_err = callout.request(endpoint, {
+    method = "POST",
+    headers = { ["Content-Type"] = "application/x-www-form-urlencoded" },
+    body = ngx.encode_args({ grant_type = JWT_BEARER_GRANT, assertion = assertion }),
+  })
+  if not res then
+    return nil, "token request failed: " .. tostring(req_err)
+  end
+  local body = cjson.decode(res.body or "")
+  if res.status ~= 200 or type(body) ~= "table" or not body.access_token then
+    return nil, "token endpoint returned status " .. res.status .. ": " .. tostring(res.body)
+  end
+
+  local ttl = (tonumber(body.expires_in) or ASSERTION_LIFETIME) - EXPIRY_MARGIN
+  if ttl > 0 then
+    shm():set(source.cache_key, body.access_token, ttl)
+  end
+  return body.access_token
+end
+
+-- Mints unless another worker is already doing so; returns the token
+-- cached by whichever worker won.
+local function mint_once(source)
+  local dict = shm()
+  if not dict:add(source.cache_key .. ":lock", true, MINT_LOCK_TTL) then
+    return dict:get(source.cache_key), "token is being minted by another worker"
+  end
+  local token, err = mint(source)
+  dict:delete(source.cache_key .. ":lock")
+  if not token then
+    kong.log.err("GcpToken: Failed to mint access token for '", source.path, "': ", err)
+  end
+  return token, err
+end
+
+local function refresh_all(premature)
+  if premature then
+    return
+  end
+  local dict = shm()
+  for _, source in pairs(sources) do
+    local ttl = dict:ttl(source.cache_key)
+    if not ttl or ttl < REFRESH_MARGIN - EXPIRY_MARGIN then
+      mint_once(source)
+    end
+  end
+end
+
+local function ensure_refresher()
+  if refresher_started then
+    return
+  end
+  local ok, err = ngx.timer.every(REFRESH_INTERVAL, refresh_all)
+  if not ok then
+    kong.log.err("GcpToken: Failed to start token refresher: ", err)
+    return
+  end
+  refresher_started = true
+end
+
+--- Returns the cached access token for a configuration without blocking.
+-- On a cold cache a mint is started in the background and nil is returned.
+-- @param conf table `gcp_service_account_key_file`, optional
+--   `gcp_token_scope` and `gcp_token_endpoint`.
+-- @return the token, or nil and an error.
+function _M.get(conf)
+  if not shm() then
+    return nil, missing_shm()
+  end
+  local source = source_for(conf)
+  ensure_refresher()
+
+  local token = shm():get(source.cache_key)
+  if token then
+    return token
+  end
+
+  local ok, err = ngx.timer.at(0, function(premature)
+    if not premature then
+      mint_once(source)
+    end
+  end)
+  if not ok then
+    return nil, "failed to schedule token mint: " .. tostring(err)
+  end
+  return nil, "access token not minted yet"
+end
+
+--- Returns the access token, minting it first if needed. Only for use
+-- outside request phases (e.g. in timers), since it may wait on the token
+-- endpoint.
+-- @return the token, or nil and an error.
+function _M.fetch(conf)
+  if not shm() then
+    return nil, missing_shm()
+  end
+  local source = source_for(conf)
+  ensure_refresher()
+
+  local dict = shm()
+  local token = dict:get(source.cache_key)
+  if token then
+    return token
+  end
+
+  local err
+  token, err = mint_once(source)
+  if token then
+    return token
+  end
+
+  -- Another worker is minting; wait for it briefly
+  for _ = 1, 20 do
+    ngx.sleep(0.1)
+    token = dict:get(source.cache_key)
+    if token then
+      return token
+    end
+  end
+  return nil, err
+end
+
+return _M
@@ -0,0 +1,298 @@
+-- Per-worker batching queue for Google Cloud Pub/Sub publishing.
+--
+-- Messages are grouped by endpoint, project, topic and access token, and
+-- each group is sent as one `topics/{topic}:publish` call (up to 1000 messages) when it
+-- reaches `batch_max_messages` or `batch_max_bytes`, or when its oldest
+-- message has waited `batch_linger_ms`. Failed calls are retried with
+-- exponential backoff and jitter.
+--
+-- Memory is bounded by `queue_max_messages`, which counts messages waiting
+-- in a group as well as those being sent or retried; messages arriving at a
+-- full queue are dropped and counted. With `spool_enabled`, batches that
+-- still fail after the retries go to the disk spool instead of being lost.
+-- Only batches whose token can be obtained again on replay are spooled:
+-- tokens supplied by callers are never written to disk.
+
+local cjson = require "cjson.safe"
+local callout = require "kong.plugins.apigee_common.callout"
+local gcp_token = require "kong.plugins.apigee_common.gcp_token"
+local retry = require "kong.plugins.apigee_common.retry"
+local spool = require "kong.plugins.apigee_common.spool"
+
+local md5 = ngx.md5
+local min = math.min
+local timer_at = ngx.timer.at
+
+local DEFAULT_ENDPOINT = "https://pubsub.googleapis.com"
+
+-- Pub/Sub accepts at most 1000 messages per publish call
+local MAX_MESSAGES_PER_CALL = 1000
+
+-- Approximate JSON overhead per message on top of data and attributes
+local MESSAGE_OVERHEAD = 32
+
+-- Name of the disk spool for batches that could not be delivered
+local SPOOL_NAME = "pubsub"
+
+-- Configuration fields a spooled batch needs to be replayed
+local SPOOLED_CONF_FIELDS = {
+  "gcp_project_id", "pubsub_topic_name", "pubsub_endpoint",
+  "callout_timeout", "callout_connect_timeout", "callout_keepalive_timeout", "callout_keepalive_pool_size",
+  "gcp_access_token_source_type", "gcp_service_account_key_file", "gcp_token_scope", "gcp_token_endpoint",
+}
+
+-- Token sources a spooled batch can be replayed with: a service account
+-- token is minted afresh, a literal one comes from the configuration
+local REPLAYABLE_TOKEN_SOURCES = {
+  service_account = true,
+  literal = true,
+}
+
+local groups = {}
+local queued_messages = 0
+local stats = {
+  published = 0,
+  dropped = 0,
+  failed = 0,
+  retried = 0,
+  spooled = 0,
+}
+
+local _M = {}
+
+local function publish_url(conf)
+  local endpoint = (conf.pubsub_endpoint or DEFAULT_ENDPOINT):gsub("/+$", "")
+  return endpoint .. "/v1/projects/" .. conf.gcp_project_id .. "/topics/" .. conf.pubsub_topic_name .. ":publish"
+end
+
+local function message_size(message)
+  local size = #message.data + MESSAGE_OVERHEAD
+  if message.attributes then
+    for name, value in pairs(message.attributes) do
+      size = size + #name + #tostring(value) + 6
+    end
+  end
+  return size
+end
+
+--- Publishes messages with a single Pub/Sub API call.
+-- @param conf table Plugin configuration (`gcp_project_id`,
+--   `pubsub_topic_name`, optional `pubsub_endpoint` and `callout_*` settings).
+-- @param token string|nil OAuth access token; nil when `conf` mints its own
+--   with a service account (`gcp_access_token_source_type = service_account`).
+-- @param messages table Array of `{ data = <base64>, attributes = {...} }`.
+-- @return true, or nil, an error and the response status (if any).
+function _M.publish(conf, token, messages)
+  if not token then
+    local err
+    token, err = gcp_token.fetch(conf)
+    if not token then
+      return nil, "no access token: " .. tostring(err)
+    end
+  end
+
+  local res, err = callout.request(publish_url(conf), {
+    method = "POST",
+    headers = {
+      ["Content-Type"] = "application/json",
+      ["Authorization"] = "Bearer " .. token,
+    },
+    body = cjson.encode({ messages = messages }),
+    timeout = conf.callout_timeout,
+    connect_timeout = conf.callout_connect_timeout,
+    ssl_verify = true,
+    keepalive_timeout = conf.callout_keepalive_timeout,
+    keepalive_pool_size = conf.callout_keepalive_pool_size,
+  })
+  if not res then
+    return nil, err
+  end
+  if res.status ~= 200 then
+    return nil, "Pub/Sub API returned status " .. res.status .. ": " .. tostring(res.body), res.status
+  end
+  return true
+end
+
+-- A batch as stored in the disk spool. With a service account the token is
+-- left out and minted afresh on replay; only a literal token is kept.
+local function spooled_batch(conf, token, messages)
+  local snapshot = {}
+  for _, field in ipairs(SPOOLED_CONF_FIELDS) do
+    local value = conf[field]
+    if value ~= nil and value ~= ngx.null then
+      snapshot[field] = value
+    end
+  end
+  if conf.gcp_access_token_source_type ~= "literal" then
+    token = nil
+  end
+  return { conf = snapshot, token = token or nil, messages = messages }
+end
+
+spool.register(SPOOL_NAME, function(record)
+  local ok, err, status = _M.publish(record.conf, record.token, record.messages)
+  return ok, err, retry.retryable(status)
+end)
+
+local send_batch
+
+-- Sends one batch, retrying transport errors, 429 and 5xx responses, with
+-- the token the group's messages were queued with.
+send_batch = function(premature, group, messages, attempt)
+  local conf = group.conf
+  local ok, err, status = _M.publish(conf, group.token, messages)
+  if ok then
+    stats.published = stats.published + #messages
+    queued_messages = queued_messages - #messages
+    return
+  end
+
+  local retryable = retry.retryable(status)
+  if retryable and not premature then
+    local delay = retry.schedule(conf, attempt, send_batch, group, messages, attempt + 1)
+    if delay then
+      stats.retried = stats.retried + #messages
+      kong.log.warn("PubSubQueue: Publishing ", #messages, " message(s) to '", group.key, "' failed (", err,
+                    "). Retrying in ", math.floor(delay), " ms.")
+      return
+    end
+  end
+
+  queued_messages = queued_messages - #messages
+  if retryable and conf.spool_enabled and not REPLAYABLE_TOKEN_SOURCES[conf.gcp_access_token_source_type] then
+    kong.log.warn("PubSubQueue: Not spooling ", #messages, " message(s) for '", group.key, "': the ",
+                  conf.gcp_access_token_source_type, " access token cannot be stored.")
+  elseif retryable and conf.spool_enabled then
+    local spooled, spool_err = spool.store(SPOOL_NAME, spooled_batch(conf, group.token, messages), conf)
+    if spooled then
+      stats.spooled = stats.spooled + #messages
+      return
+    end
+    kong.log.err("PubSubQueue: Could not spool ", #messages, " message(s) for '", group.key, "': ", spool_err)
+  end
+
+  stats.failed = stats.failed + #messages
+  kong.log.err("PubSubQueue: Dropping ", #messages, " message(s) for '", group.key, "' after ", attempt + 1,
+               " attempt(s): ", err)
+end
+
+-- Sends everything queued in a group, split into calls that respect the
+-- count and size limits.
+local function flush(premature, group)
+  group.flush_scheduled = false
+  local conf = group.conf
+  local max_messages = min(conf.batch_max_messages, MAX_MESSAGES_PER_CALL)
+
+  while group.count > 0 do
+    local batch, bytes = {}, 0
+    local pending = group.messages
+    local taken = 0
+    for i = 1, group.count do
+      local message = pending[i]
+      local size = group.sizes[i]
+      if taken > 0 and (taken >= max_messages or bytes + size > conf.batch_max_bytes) then
+        break
+      end
+      taken = taken + 1
+      batch[taken] = message
+      bytes = bytes + size
+    end
+
+    -- Keep the remainder for the next call
+    local rest, rest_sizes = {}, {}
+    for i = taken + 1, group.count do
+      rest[i - taken] = pending[i]
+      rest_sizes[i - taken] = group.sizes[i]
+    end
+    group.messages, group.sizes = rest, rest_sizes
+    group.count = group.count - taken
+    group.bytes = group.bytes - bytes
+
+    send_batch(premature, group, batch, 0)
+  end
+
+  -- Groups are keyed by token, so drop them when idle rather than keep one
+  -- per caller token forever
+  if group.count == 0 and groups[group.id] == group then
+    groups[group.id] = nil
+  end
+end
+
+local function schedule_flush(group, delay)
+  if group.flush_scheduled and delay > 0 then
+    return
+  end
+  local ok, err = timer_at(delay, flush, group)
+  if not ok then
+    kong.log.err("PubSubQueue: Failed to schedule flush for '", group.key, "': ", err)
+    return
+  end
+  group.flush_scheduled = true
+end
+
+--- Queues a message for batched publishing.
+-- @param conf table Plugin configuration; besides the `publish` settings it
+--   provides `batch_max_messages`, `batch_max_bytes`, `batch_linger_ms`,
+--   `queue_max_messages`, `max_retries` and `retry_backoff_ms`.
+-- @param token string|nil OAuth access token, as for `publish`.
+-- @param message table `{ data = <base64>, attributes = {...} }`.
+-- @return true, or nil and an error when the message was dropped.
+function _M.enqueue(conf, token, message)
+  if queued_messages >= conf.queue_max_messages then
+    stats.dropped = stats.dropped + 1
+    if stats.dropped % 1000 == 1 then
+      kong.log.warn("PubSubQueue: Queue full (", queued_messages, " messages). ", stats.dropped,
+                    " message(s) dropped by this worker so far.")
+    end
+    return nil, "publish queue is full"
+  end
+
+  -- A batch is sent with one token, so messages queued with different
+  -- tokens never share a group (the key holds a hash, not the token)
+  local url = publish_url(conf)
+  local id = token and url .. "|" .. md5(token) or url
+  local group = groups[id]
+  if not group then
+    group = { id = id, key = url, token = token, messages = {}, sizes = {}, count = 0, bytes = 0 }
+    groups[id] = group
+  end
+  -- The most recent configuration applies to the whole group
+  group.conf = conf
+
+  local count = group.count + 1
+  local size = message_size(message)
+  group.messages[count] = message
+  group.sizes[count] = size
+  group.count = count
+  group.bytes = group.bytes + size
+  queued_messages = queued_messages + 1
+
+  if count >= min(conf.batch_max_messages, MAX_MESSAGES_PER_CALL) or group.bytes >= conf.batch_max_bytes then
+    schedule_flush(group, 0)
+  else
+    schedule_flush(group, conf.batch_linger_ms / 1000)
+  end
+  return true
+end
+
+--- Resumes replaying batches spooled before a restart. Meant for
+-- init_worker.
+function _M.resume()
+  spool.resume(SPOOL_NAME)
+end
+
+--- Returns this worker's counters: messages `queued` (waiting, in flight or
+-- awaiting retry), `published`, `dropped` (queue full), `failed` (given up
+-- after retries), `retried` and `spooled` (handed to the disk spool).
+function _M.stats()
+  return {
+    queued = queued_messages,
+    published = stats.published,
+    dropped = stats.dropped,
+    failed = stats.failed,
+    retried = stats.retried,
+    spooled = stats.spooled,
+  }
+end
+
+return _M
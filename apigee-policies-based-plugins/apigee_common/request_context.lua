@@ -0,0 +1,119 @@
+-- Request-scoped cache of the parsed query string and request headers.
+--
+-- Plugins read query arguments and headers through this module instead of
+-- calling `kong.request.get_query*` / `get_header*` directly, so that on
+-- routes chaining several policies the query string and headers are parsed
+-- at most once per request. Plugins that modify the upstream request use
+-- the setters below, which keep the cached view in sync.
+--
+-- The cache holds the request as the client sent it, plus the changes made
+-- through this module. Changes made by other plugins, e.g. the
+-- `X-Authenticated-*`, `X-Consumer-*` and `X-Credential-*` headers that
+-- Kong's authentication plugins add, are not seen once the cache is filled;
+-- read such headers with `kong.request.get_header`.
+--
+-- The cache lives in `ngx.ctx`, which backs `kong.ctx`; it is deliberately
+-- kept out of `kong.ctx.shared` so that it is never logged or exposed as
+-- flow variables.
+
+local type = type
+local lower = string.lower
+local gsub = string.gsub
+
+local CTX_KEY = "apigee_request_context"
+
+-- Headers parsed per request; `kong.request.get_headers` stops at 100 by
+-- default, and accepts at most this many
+local MAX_HEADERS = 1000
+
+local _M = {}
+
+local function context()
+  local ctx = ngx.ctx[CTX_KEY]
+  if not ctx then
+    ctx = {}
+    ngx.ctx[CTX_KEY] = ctx
+  end
+  return ctx
+end
+
+-- Header names are case-insensitive and dashes may be written as
+-- underscores, as with `kong.request.get_header`
+local function normalize_header_name(name)
+  return (gsub(lower(name), "_", "-"))
+end
+
+local function first(value)
+  if type(value) == "table" then
+    return value[1]
+  end
+  return value
+end
+
+--- Returns the parsed query arguments of the current request.
+-- The table is shared by all callers and must be treated as read-only.
+function _M.get_query()
+  local ctx = context()
+  local query = ctx.query
+  if not query then
+    query = kong.request.get_query()
+    ctx.query = query
+  end
+  return query
+end
+
+--- Returns the value of a query argument; the first one if repeated.
+function _M.get_query_arg(name)
+  return first(_M.get_query()[name])
+end
+
+--- Returns the request headers, keyed by lowercase name.
+-- The table is shared by all callers and must be treated as read-only.
+function _M.get_headers()
+  local ctx = context()
+  local headers = ctx.headers
+  if not headers then
+    headers = {}
+    local raw, err = kong.request.get_headers(MAX_HEADERS)
+    if err == "truncated" then
+      kong.log.warn("RequestContext: Request has more than ", MAX_HEADERS, " headers; the rest are ignored.")
+    end
+    for name, value in pairs(raw) do
+      headers[lower(name)] = value
+    end
+    ctx.headers = headers
+  end
+  return headers
+end
+
+--- Returns the value of a request header; the first one if repeated.
+function _M.get_header(name)
+  return first(_M.get_headers()[normalize_header_name(name)])
+end
+
+--- Sets a header on the upstream request and updates the cached headers.
+function _M.set_header(name, value)
+  kong.service.request.set_header(name, value)
+  local headers = context().headers
+  if headers then
+    headers[normalize_header_name(name)] = value ~= nil and tostring(value) or nil
+  end
+end
+
+--- Replaces the query arguments of the upstream request.
+function _M.set_query(args)
+  kong.service.request.set_query(args)
+  context().query = nil
+end
+
+--- Sets one query argument on the upstream request, keeping the others.
+function _M.set_query_arg(name, value)
+  local args = {}
+  for k, v in pairs(_M.get_query()) do
+    args[k] = v
+  end
+  args[name] = value
+  _M.set_query(args)
+end
+
+return _M
@@ -0,0 +1,41 @@
+-- Retries with exponential backoff for the background senders (the Pub/Sub
+-- publish queue, the revoke-oauth-v2 queue).
+--
+-- The delay before retry `attempt` (0-based) is `retry_backoff_ms * 2^attempt`
+-- scaled by a random factor between 0.5 and 1.5, so that retries started
+-- together by a failing endpoint spread out instead of arriving at once.
+
+local random = math.random
+
+local _M = {}
+
+--- Tells whether a failed call may succeed when retried: transport errors
+-- (no status), 429 and 5xx responses.
+function _M.retryable(status)
+  return not status or status == 429 or status >= 500
+end
+
+--- Returns the delay in milliseconds before retry `attempt` (0-based).
+function _M.delay(backoff_ms, attempt)
+  return backoff_ms * 2 ^ attempt * (0.5 + random())
+end
+
+--- Runs `fn(premature, ...)` in a timer after the backoff delay of
+-- `attempt`, unless `max_retries` attempts were already retried.
+-- @param conf table `max_retries` and `retry_backoff_ms`.
+-- @param attempt number Retries made so far.
+-- @return the delay in milliseconds, or nil and an error when no retry is
+--   left or the timer could not be created.
+function _M.schedule(conf, attempt, fn, ...)
+  if attempt >= conf.max_retries then
+    return nil, "no retries left"
+  end
+  local delay = _M.delay(conf.retry_backoff_ms, attempt)
+  local ok, err = ngx.timer.at(delay / 1000, fn, ...)
+  if not ok then
+    return nil, "failed to schedule retry: " .. tostring(err)
+  end
+  return delay
+end
+
+return _M
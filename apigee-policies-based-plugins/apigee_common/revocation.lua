@@ -0,0 +1,314 @@
+-- Cluster-wide list of revoked access tokens.
+--
+-- Revoked tokens are known by their hash (`token_cache.hash`) and are kept
+-- until they would have expired anyway:
+--
+--   * in the `revoked_tokens` entity of revoke-oauth-v2, so that nodes
+--     starting later load them;
+--   * in a shared dict on every node, the exact set, as `rv:<hash prefix>`
+--     keys with the token's remaining lifetime as TTL;
+--   * in a Bloom filter in each worker, so that the common case, a token
+--     that was not revoked, is answered without touching shared memory.
+--
+-- A revocation is written to the local exact set and announced to the
+-- node's workers with worker events, and to the other nodes with cluster
+-- events; there the worker receiving it does the same.
+--
+-- Sizing, for one million revoked tokens: the Bloom filter takes 1.2 MB per
+-- worker (9.6 bits per token for a 1% false positive rate, 7 probes). The
+-- exact set takes about 128 bytes per token in the shared dict (shdict
+-- node, 35-byte key and number value, rounded up by the slab allocator),
+-- so 128 MB; give the `apigee_revocations` dict at least that. A false
+-- positive costs one shared dict lookup.
+--
+-- Rebuilding a filter lists the whole exact set with `get_keys(0)`, which
+-- holds the dict's lock for the whole scan and builds a table of every key:
+-- for one million tokens, some hundreds of milliseconds and about 80 MB of
+-- garbage per worker. So filters are only rebuilt when a worker starts and
+-- when the filter has taken as many tokens as it was sized for. Expired
+-- tokens stay in the filter until then; since they are counted, the false
+-- positive rate still stays below 1%. A rebuilt filter is sized for twice
+-- the current list, so rebuilds get rarer as the list grows.
+--
+-- Nodes that do not declare the dict do not use revocations: workers then
+-- allocate no filter and start no timer. Likewise, a worker only allocates
+-- its filter once a revocation is known.
+
+local ffi = require "ffi"
+local bit = require "bit"
+local token_cache = require "kong.plugins.apigee_common.token_cache"
+
+local band = bit.band
+local bor = bit.bor
+local lshift = bit.lshift
+local ceil = math.ceil
+local floor = math.floor
+local max = math.max
+local log = math.log
+local sub = string.sub
+local tonumber = tonumber
+
+local SHM_NAME = "apigee_revocations"
+local KEY_PREFIX = "rv:"
+local LOADED_KEY = "rv-loaded"
+local LOAD_LOCK_KEY = "rv-loading"
+local LOAD_LOCK_TTL = 300
+
+-- Significant hex digits of the token hash kept in the exact set (128 bits)
+local KEY_HASH_LENGTH = 32
+
+local CLUSTER_CHANNEL = "apigee-revocations"
+local WORKER_SOURCE = "apigee-revocations"
+
+-- Bloom filter sizing; the filter is rebuilt from the exact set, larger,
+-- when it holds more than its capacity
+local FILTER_CAPACITY = 1000000
+local FILTER_FALSE_POSITIVE_RATE = 0.01
+
+local filter
+local initialized = false
+
+local _M = {
+  -- Must be declared with `nginx_http_lua_shared_dict`
+  SHM = SHM_NAME,
+}
+
+local function get_dict()
+  return ngx.shared[SHM_NAME]
+end
+
+local function new_filter(capacity)
+  local ln2 = log(2)
+  local bits = ceil(-capacity * log(FILTER_FALSE_POSITIVE_RATE) / (ln2 * ln2))
+  local bytes = ceil(bits / 8)
+  return {
+    bits = bytes * 8,
+    probes = floor(bits / capacity * ln2 + 0.5),
+    data = ffi.new("uint8_t[?]", bytes),
+    bytes = bytes,
+    capacity = capacity,
+    count = 0,
+  }
+end
+
+-- Probes are derived from the token hash by double hashing, so no further
+-- hashing is needed
+local function filter_add(f, hash)
+  local h1 = tonumber(sub(hash, 1, 8), 16)
+  local h2 = tonumber(sub(hash, 9, 16), 16)
+  local data = f.data
+  for i = 0, f.probes - 1 do
+    local position = (h1 + i * h2) % f.bits
+    local index = floor(position / 8)
+    data[index] = bor(data[index], lshift(1, position % 8))
+  end
+  f.count = f.count + 1
+end
+
+local function filter_contains(f, hash)
+  local h1 = tonumber(sub(hash, 1, 8), 16)
+  local h2 = tonumber(sub(hash, 9, 16), 16)
+  local data = f.data
+  for i = 0, f.probes - 1 do
+    local position = (h1 + i * h2) % f.bits
+    if band(data[floor(position / 8)], lshift(1, position % 8)) == 0 then
+      return false
+    end
+  end
+  return true
+end
+
+-- Rebuilds this worker's filter from the node's exact set, dropping
+-- tokens that have expired since they were added. While the set is empty
+-- the worker keeps no filter.
+local function rebuild_filter()
+  local dict = get_dict()
+  if not dict then
+    return
+  end
+  local keys = dict:get_keys(0)
+  local prefix_length = #KEY_PREFIX
+  local rebuilt
+  for _, key in ipairs(keys) do
+    if sub(key, 1, prefix_length) == KEY_PREFIX then
+      -- Grows with the list, leaving room for as many revocations again
+      rebuilt = rebuilt or new_filter(max(FILTER_CAPACITY, 2 * #keys))
+      filter_add(rebuilt, sub(key, prefix_length + 1))
+    end
+  end
+  filter = rebuilt
+end
+
+local function add_local(hash, expires_at)
+  local ttl = expires_at - ngx.time()
+  if ttl <= 0 then
+    return true
+  end
+  local dict = get_dict()
+  if not dict then
+    return nil, "lua_shared_dict '" .. SHM_NAME .. "' not found"
+  end
+  local ok, err = dict:safe_set(KEY_PREFIX .. sub(hash, 1, KEY_HASH_LENGTH), expires_at, ttl)
+  if not ok then
+    return nil, "cannot record revoked token: " .. tostring(err)
+  end
+  return true
+end
+
+-- Tells every worker of this node to add the token to its filter.
+local function announce_local(hash, expires_at)
+  local ok, err = kong.worker_events.post(WORKER_SOURCE, "revoked", { hash = hash, expires_at = expires_at })
+  if not ok then
+    kong.log.err("Revocation: Could not notify workers of a revoked token: ", err)
+  end
+end
+
+-- Loads the persisted revocations into the node's exact set, once per
+-- node, then has every worker rebuild its filter.
+local function load_persisted(premature)
+  if premature then
+    return
+  end
+  local dict = get_dict()
+  local dao = kong.db and kong.db.revoked_tokens
+  if not dict or not dao or dict:get(LOADED_KEY) then
+    return
+  end
+  if not dict:add(LOAD_LOCK_KEY, true, LOAD_LOCK_TTL) then
+    return -- Another worker is loading
+  end
+
+  local now = ngx.time()
+  local loaded = 0
+  for row, err in dao:each(1000) do
+    if err then
+      kong.log.err("Revocation: Could not load revoked tokens: ", err)
+      dict:delete(LOAD_LOCK_KEY)
+      return
+    end
+    if row.expires_at > now then
+      add_local(row.token_hash, row.expires_at)
+      loaded = loaded + 1
+    end
+  end
+  dict:set(LOADED_KEY, true)
+  dict:delete(LOAD_LOCK_KEY)
+  kong.log.notice("Revocation: Loaded ", loaded, " revoked token(s).")
+
+  kong.worker_events.post(WORKER_SOURCE, "rebuild", true)
+end
+
+--- Sets up revocation checks in this worker: subscribes to revocations
+-- from other nodes, builds the Bloom filter and, on the first worker to get
+-- there, loads persisted revocations. Does nothing when the
+-- `apigee_revocations` dict is not declared. Call it from `init_worker` of
+-- every plugin using this module; later calls do nothing.
+function _M.init_worker()
+  if initialized then
+    return
+  end
+  initialized = true
+  if not get_dict() then
+    return
+  end
+
+  kong.worker_events.register(function(data)
+    filter = filter or new_filter(FILTER_CAPACITY)
+    filter_add(filter, data.hash)
+    if filter.count > filter.capacity then
+      rebuild_filter()
+    end
+  end, WORKER_SOURCE, "revoked")
+  kong.worker_events.register(rebuild_filter, WORKER_SOURCE, "rebuild")
+
+  if kong.cluster_events then
+    kong.cluster_events:subscribe(CLUSTER_CHANNEL, function(data)
+      local hash, expires_at = data:match("^(%x+):(%d+)$")
+      if not hash then
+        return
+      end
+      expires_at = tonumber(expires_at)
+      local ok, err = add_local(hash, expires_at)
+      if not ok then
+        kong.log.err("Revocation: ", err)
+      end
+      announce_local(hash, expires_at)
+    end)
+  end
+
+  ngx.timer.at(0, function(premature)
+    if premature then
+      return
+    end
+    rebuild_filter()
+    load_persisted(premature)
+  end)
+end
+
+--- Records a revocation on this node and tells its workers. Does no
+-- network or database I/O, so it may be used in request phases; `broadcast`
+-- then announces the revocation to the other nodes.
+-- @param hash string Token hash, from `token_cache.hash`.
+-- @param expires_at number When the token expires (epoch seconds); the
+--   revocation is kept until then.
+-- @return true, or nil and an error.
+function _M.revoke_local(hash, expires_at)
+  local ok, err = add_local(hash, expires_at)
+  if not ok then
+    return nil, err
+  end
+  announce_local(hash, expires_at)
+  return true
+end
+
+--- Announces a revocation recorded with `revoke_local` to the other nodes.
+-- @return true, or nil and an error.
+function _M.broadcast(hash, expires_at)
+  if not kong.cluster_events then
+    return true
+  end
+  local sent, err = kong.cluster_events:broadcast(CLUSTER_CHANNEL, hash .. ":" .. expires_at)
+  if not sent then
+    return nil, "cannot broadcast revocation to other nodes: " .. tostring(err)
+  end
+  return true
+end
+
+--- Records a revocation on this node and announces it to all workers and
+-- nodes. Persisting it (see revoke-oauth-v2) is up to the caller.
+-- @return true, or nil and an error.
+function _M.revoke(hash, expires_at)
+  local ok, err = _M.revoke_local(hash, expires_at)
+  if not ok then
+    return nil, err
+  end
+  return _M.broadcast(hash, expires_at)
+end
+
+--- Tells whether a token hash was revoked. Most tokens are cleared by the
+-- Bloom filter alone, or right away while this worker knows of no
+-- revocation; the rest are checked against the exact set.
+function _M.is_revoked_hash(hash)
+  if not filter or not filter_contains(filter, hash) then
+    return false
+  end
+  return get_dict():get(KEY_PREFIX .. sub(hash, 1, KEY_HASH_LENGTH)) ~= nil
+end
+
+--- Tells whether a token was revoked.
+function _M.is_revoked(token)
+  return _M.is_revoked_hash(token_cache.hash(token))
+end
+
+--- Returns this worker's filter size in `bloom_bytes`, the tokens added
+-- to it (`bloom_entries`) and the exact set's `shm_free_bytes`.
+function _M.stats()
+  local dict = get_dict()
+  return {
+    bloom_bytes = filter and filter.bytes or 0,
+    bloom_entries = filter and filter.count or 0,
+    shm_free_bytes = dict and dict.free_space and dict:free_space() or nil,
+  }
+end
+
+return _M
@@ -0,0 +1,177 @@
+local cjson = require "cjson"
+
+describe("apigee_common pubsub_queue", function()
+  local pubsub_queue, requests, timers, responses, spooled
+  local original_timer_at = ngx.timer.at
+
+  local function conf(overrides)
+    local c = {
+      gcp_project_id = "proj",
+      pubsub_topic_name = "topic",
+      pubsub_endpoint = "http://127.0.0.1:8085",
+      batch_max_messages = 3,
+      batch_max_bytes = 1048576,
+      batch_linger_ms = 50,
+      queue_max_messages = 10,
+      max_retries = 2,
+      retry_backoff_ms = 100,
+    }
+    for k, v in pairs(overrides or {}) do
+      c[k] = v
+    end
+    return c
+  end
+
+  local function run_timers()
+    while #timers > 0 do
+      local timer = table.remove(timers, 1)
+      timer.fn(false, unpack(timer.args, 1, timer.n))
+    end
+  end
+
+  setup(function()
+    _G.kong = { log = { warn = function() end, err = function() end } }
+    ngx.timer.at = function(delay, fn, ...)
+      timers[#timers + 1] = { delay = delay, fn = fn, args = { ... }, n = select("#", ...) }
+      return true
+    end
+    package.loaded["kong.plugins.apigee_common.callout"] = {
+      request = function(url, opts)
+        requests[#requests + 1] = { url = url, opts = opts, body = cjson.decode(opts.body) }
+        local res = table.remove(responses, 1) or { status = 200, body = "{}" }
+        return res.status and res or nil, res.err
+      end,
+    }
+    package.loaded["kong.plugins.apigee_common.gcp_token"] = {
+      fetch = function() return "minted" end,
+    }
+    package.loaded["kong.plugins.apigee_common.spool"] = {
+      register = function() end,
+      store = function(name, record)
+        spooled[#spooled + 1] = record
+        return true
+      end,
+    }
+    package.loaded["kong.plugins.apigee_common.pubsub_queue"] = nil
+    pubsub_queue = require "kong.plugins.apigee_common.pubsub_queue"
+  end)
+
+  teardown(function()
+    ngx.timer.at = original_timer_at
+    package.loaded["kong.plugins.apigee_common.callout"] = nil
+    package.loaded["kong.plugins.apigee_common.gcp_token"] = nil
+    package.loaded["kong.plugins.apigee_common.spool"] = nil
+    package.loaded["kong.plugins.apigee_common.pubsub_queue"] = nil
+  end)
+
+  before_each(function()
+    requests, timers, responses, spooled = {}, {}, {}, {}
+  end)
+
+  it("sends messages for one topic as a single call after the linger time", function()
+    local c = conf()
+    assert.is_true(pubsub_queue.enqueue(c, "token", { data = "YQ==" }))
+    assert.is_true(pubsub_queue.enqueue(c, "token", { data = "Yg==" }))
+    assert.equals(0, #requests)
+    assert.equals(0.05, timers[1].delay)
+
+    run_timers()
+    assert.equals(1, #requests)
+    assert.equals("http://127.0.0.1:8085/v1/projects/proj/topics/topic:publish", requests[1].url)
+    assert.equals("Bearer token", requests[1].opts.headers.Authorization)
+    assert.equals(2, #requests[1].body.messages)
+  end)
+
+  it("flushes immediately when a batch is full and splits by count", function()
+    local c = conf()
+    for i = 1, 4 do
+      pubsub_queue.enqueue(c, "token", { data = tostring(i) })
+    end
+    local immediate = false
+    for _, timer in ipairs(timers) do
+      immediate = immediate or timer.delay == 0
+    end
+    assert.is_true(immediate)
+
+    run_timers()
+    assert.equals(2, #requests)
+    assert.equals(3, #requests[1].body.messages)
+    assert.equals(1, #requests[2].body.messages)
+  end)
+
+  it("uses a minted token when none is given", function()
+    pubsub_queue.enqueue(conf(), nil, { data = "a" })
+    run_timers()
+    assert.equals("Bearer minted", requests[1].opts.headers.Authorization)
+  end)
+
+  it("groups messages by topic", function()
+    pubsub_queue.enqueue(conf(), "token", { data = "a" })
+    pubsub_queue.enqueue(conf({ pubsub_topic_name = "other" }), "token", { data = "b" })
+    run_timers()
+    assert.equals(2, #requests)
+  end)
+
+  it("retries retryable failures with backoff and gives up on client errors", function()
+    responses = { { status = 503, body = "busy" }, { status = 200, body = "{}" } }
+    pubsub_queue.enqueue(conf(), "token", { data = "a" })
+    run_timers()
+    assert.equals(2, #requests)
+
+    local before = pubsub_queue.stats().failed
+    responses = { { status = 400, body = "bad" } }
+    pubsub_queue.enqueue(conf(), "token", { data = "a" })
+    run_timers()
+    assert.equals(3, #requests)
+    assert.equals(before + 1, pubsub_queue.stats().failed)
+  end)
+
+  it("spools batches that still fail after the retries", function()
+    responses = { { err = "connection refused" }, { err = "connection refused" }, { err = "connection refused" } }
+    pubsub_queue.enqueue(conf({ spool_enabled = true, gcp_access_token_source_type = "literal" }), "token",
+                         { data = "a" })
+    run_timers()
+    assert.equals(3, #requests)
+    assert.equals(1, #spooled)
+    assert.equals("topic", spooled[1].conf.pubsub_topic_name)
+    assert.equals("a", spooled[1].messages[1].data)
+    assert.equals("token", spooled[1].token)
+  end)
+
+  it("never spools caller-supplied tokens", function()
+    responses = { { err = "connection refused" }, { err = "connection refused" }, { err = "connection refused" } }
+    pubsub_queue.enqueue(conf({ spool_enabled = true, gcp_access_token_source_type = "header" }), "caller",
+                         { data = "a" })
+    run_timers()
+    assert.equals(3, #requests)
+    assert.equals(0, #spooled)
+  end)
+
+  it("sends each batch with the token its messages were queued with", function()
+    local c = conf({ gcp_access_token_source_type = "header" })
+    pubsub_queue.enqueue(c, "alice", { data = "a" })
+    pubsub_queue.enqueue(c, "bob", { data = "b" })
+    run_timers()
+    assert.equals(2, #requests)
+    local sent = {}
+    for _, request in ipairs(requests) do
+      sent[request.opts.headers.Authorization] = request.body.messages[1].data
+    end
+    assert.equals("a", sent["Bearer alice"])
+    assert.equals("b", sent["Bearer bob"])
+  end)
+
+  it("drops and counts messages when the queue is full", function()
+    local c = conf({ queue_max_messages = 2, batch_max_messages = 100 })
+    local dropped = pubsub_queue.stats().dropped
+    assert.is_true(pubsub_queue.enqueue(c, "token", { data = "a" }))
+    assert.is_true(pubsub_queue.enqueue(c, "token", { data = "b" }))
+    local ok, err = pubsub_queue.enqueue(c, "token", { data = "c" })
+    assert.is_nil(ok)
+    assert.matches("full", err)
+    assert.equals(dropped + 1, pubsub_queue.stats().dropped)
+
+    run_timers()
+    assert.equals(0, pubsub_queue.stats().queued)
+  end)
+end)
@@ -0,0 +1,52 @@
+describe("apigee_common request_context", function()
+  local request_context, query, upstream_query, max_headers, warnings
+
+  setup(function()
+    package.loaded["kong.plugins.apigee_common.request_context"] = nil
+    request_context = require "kong.plugins.apigee_common.request_context"
+  end)
+
+  teardown(function()
+    package.loaded["kong.plugins.apigee_common.request_context"] = nil
+  end)
+
+  before_each(function()
+    ngx.ctx = {}
+    query = { page = "2", sort = "name" }
+    upstream_query, max_headers, warnings = nil, nil, {}
+    _G.kong = {
+      log = { warn = function(...) warnings[#warnings + 1] = table.concat({ ... }) end },
+      request = {
+        get_query = function() return query end,
+        get_headers = function(max)
+          max_headers = max
+          return { ["X-Tenant"] = "acme" }, "truncated"
+        end,
+      },
+      service = {
+        request = {
+          set_query = function(args) upstream_query = args end,
+          set_header = function() end,
+        },
+      },
+    }
+  end)
+
+  it("reads more headers than the PDK default and warns when truncated", function()
+    assert.equals("acme", request_context.get_header("x_tenant"))
+    assert.equals(1000, max_headers)
+    assert.equals(1, #warnings)
+  end)
+
+  it("keeps the other query arguments when one is set", function()
+    request_context.set_query_arg("page", "3")
+    assert.same({ page = "3", sort = "name" }, upstream_query)
+  end)
+
+  it("parses the query again after it was replaced", function()
+    assert.equals("2", request_context.get_query_arg("page"))
+    request_context.set_query({ page = "5" })
+    query = { page = "5" }
+    assert.equals("5", request_context.get_query_arg("page"))
+  end)
+end)
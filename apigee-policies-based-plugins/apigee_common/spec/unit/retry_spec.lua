@@ -0,0 +1,55 @@
+describe("apigee_common retry", function()
+  local retry, timers
+  local original_timer_at = ngx.timer.at
+
+  setup(function()
+    package.loaded["kong.plugins.apigee_common.retry"] = nil
+    retry = require "kong.plugins.apigee_common.retry"
+  end)
+
+  teardown(function()
+    ngx.timer.at = original_timer_at
+    package.loaded["kong.plugins.apigee_common.retry"] = nil
+  end)
+
+  before_each(function()
+    timers = {}
+    ngx.timer.at = function(delay, fn, ...)
+      timers[#timers + 1] = { delay = delay, fn = fn, args = { ... } }
+      return true
+    end
+  end)
+
+  it("retries transport errors, 429 and 5xx responses only", function()
+    assert.is_true(retry.retryable(nil))
+    assert.is_true(retry.retryable(429))
+    assert.is_true(retry.retryable(503))
+    assert.is_false(retry.retryable(400))
+    assert.is_false(retry.retryable(404))
+  end)
+
+  it("doubles the delay with each attempt, within half to one and a half times", function()
+    for attempt = 0, 4 do
+      local base = 100 * 2 ^ attempt
+      for _ = 1, 50 do
+        local delay = retry.delay(100, attempt)
+        assert(delay >= 0.5 * base and delay <= 1.5 * base, "delay out of range: " .. delay)
+      end
+    end
+  end)
+
+  it("schedules the callback with its arguments after the delay", function()
+    local delay = retry.schedule({ max_retries = 3, retry_backoff_ms = 200 }, 1, print, "a", "b")
+    assert(delay >= 200 and delay <= 600, "delay out of range: " .. delay)
+    assert.equals(delay / 1000, timers[1].delay)
+    assert.equals(print, timers[1].fn)
+    assert.same({ "a", "b" }, timers[1].args)
+  end)
+
+  it("stops after max_retries", function()
+    local delay, err = retry.schedule({ max_retries = 2, retry_backoff_ms = 200 }, 2, print)
+    assert.is_nil(delay)
+    assert.equals("no retries left", err)
+    assert.equals(0, #timers)
+  end)
+end)
@@ -0,0 +1,133 @@
+describe("apigee_common revocation", function()
+  local revocation, dict, handlers, broadcasts, get_keys_calls, periodic_timers
+  local original_shared = ngx.shared.apigee_revocations
+  local original_timer_at, original_timer_every = ngx.timer.at, ngx.timer.every
+  local original_time = ngx.time
+
+  local function hash_of(n)
+    return string.format("%08x%08x", n * 2654435761 % 4294967296, n * 40503 % 4294967296) .. string.rep("0", 48)
+  end
+
+  setup(function()
+    local values = {}
+    dict = {
+      values = values,
+      get = function(_, key) return values[key] end,
+      safe_set = function(_, key, value) values[key] = value return true end,
+      set = function(_, key, value) values[key] = value return true end,
+      add = function(_, key, value)
+        if values[key] ~= nil then return nil, "exists" end
+        values[key] = value
+        return true
+      end,
+      delete = function(_, key) values[key] = nil end,
+      get_keys = function()
+        get_keys_calls = get_keys_calls + 1
+        local keys = {}
+        for key in pairs(values) do keys[#keys + 1] = key end
+        return keys
+      end,
+    }
+    ngx.shared.apigee_revocations = dict
+    ngx.time = function() return 1000 end
+    ngx.timer.at = function() return true end
+    ngx.timer.every = function() periodic_timers = periodic_timers + 1 return true end
+    get_keys_calls, periodic_timers = 0, 0
+
+    handlers = {}
+    broadcasts = {}
+    _G.kong = {
+      log = { err = function() end, notice = function() end },
+      worker_events = {
+        register = function(fn, source, event) handlers[source .. ":" .. event] = fn end,
+        post = function(source, event, data)
+          handlers[source .. ":" .. event](data)
+          return true
+        end,
+      },
+      cluster_events = {
+        subscribe = function(_, channel, fn) handlers["cluster:" .. channel] = fn end,
+        broadcast = function(_, channel, data)
+          broadcasts[#broadcasts + 1] = data
+          return true
+        end,
+      },
+    }
+    package.loaded["kong.plugins.apigee_common.revocation"] = nil
+    revocation = require "kong.plugins.apigee_common.revocation"
+    revocation.init_worker()
+  end)
+
+  teardown(function()
+    ngx.shared.apigee_revocations = original_shared
+    ngx.timer.at, ngx.timer.every = original_timer_at, original_timer_every
+    ngx.time = original_time
+    package.loaded["kong.plugins.apigee_common.revocation"] = nil
+  end)
+
+  it("keeps no filter until a revocation is known", function()
+    assert.equals(0, revocation.stats().bloom_bytes)
+    assert.is_false(revocation.is_revoked_hash(hash_of(1)))
+  end)
+
+  it("does nothing on nodes without the shared dict", function()
+    local timers = 0
+    ngx.shared.apigee_revocations = nil
+    ngx.timer.at = function() timers = timers + 1 return true end
+    ngx.timer.every = ngx.timer.at
+    package.loaded["kong.plugins.apigee_common.revocation"] = nil
+    local disabled = require "kong.plugins.apigee_common.revocation"
+    disabled.init_worker()
+    ngx.shared.apigee_revocations = dict
+    ngx.timer.at = function() return true end
+    ngx.timer.every = ngx.timer.at
+
+    assert.equals(0, timers)
+    assert.equals(0, disabled.stats().bloom_bytes)
+    assert.is_false(disabled.is_revoked_hash(hash_of(1)))
+  end)
+
+  it("does not scan the shared dict periodically or on each revocation", function()
+    assert.equals(0, periodic_timers)
+    revocation.revoke(hash_of(6), 2000)
+    revocation.revoke(hash_of(7), 2000)
+    assert.equals(0, get_keys_calls)
+  end)
+
+  it("reports revoked tokens and only those", function()
+    assert.is_true(revocation.revoke(hash_of(1), 2000))
+    assert.is_true(revocation.is_revoked_hash(hash_of(1)))
+    assert.is_false(revocation.is_revoked_hash(hash_of(2)))
+  end)
+
+  it("broadcasts revocations to other nodes", function()
+    revocation.revoke(hash_of(3), 2000)
+    assert.equals(hash_of(3) .. ":2000", broadcasts[#broadcasts])
+  end)
+
+  it("accepts revocations from other nodes", function()
+    handlers["cluster:apigee-revocations"](hash_of(4) .. ":2000")
+    assert.is_true(revocation.is_revoked_hash(hash_of(4)))
+  end)
+
+  it("does not keep tokens that have already expired", function()
+    revocation.revoke(hash_of(5), 900)
+    assert.is_false(revocation.is_revoked_hash(hash_of(5)))
+  end)
+
+  it("answers most unrevoked tokens from the Bloom filter alone", function()
+    local lookups = 0
+    local get = dict.get
+    dict.get = function(...) lookups = lookups + 1 return get(...) end
+    for n = 1000, 10999 do
+      revocation.is_revoked_hash(hash_of(n))
+    end
+    dict.get = get
+    assert(lookups < 100, "too many shared dict lookups: " .. lookups)
+  end)
+
+  it("sizes the filter for one million tokens at 1.2 MB per worker", function()
+    local stats = revocation.stats()
+    assert.equals(1198133, stats.bloom_bytes)
+  end)
+end)
@@ -0,0 +1,218 @@
+local lfs = require "lfs"
+
+describe("apigee_common spool", function()
+  local spool, prefix, requests, responses, drainers, timers
+  local original_timer_at, original_timer_every, original_worker = ngx.timer.at, ngx.timer.every, ngx.worker
+
+  local function record(n, headers)
+    return { url = "http://collector.test/ingest", opts = { method = "POST", body = "r" .. n, headers = headers } }
+  end
+
+  local function segments()
+    local dir = prefix .. "/apigee-spool/test/worker-0"
+    local found = {}
+    for entry in lfs.dir(dir) do
+      if entry:match("%.seg$") then
+        found[#found + 1] = dir .. "/" .. entry
+      end
+    end
+    table.sort(found)
+    return found
+  end
+
+  local function read_file(path)
+    local file = assert(io.open(path, "rb"))
+    local content = file:read("*a")
+    file:close()
+    return content
+  end
+
+  local function drain()
+    for _, fn in ipairs(drainers) do
+      fn(false)
+    end
+  end
+
+  local function sent_bodies()
+    local bodies = {}
+    for i, req in ipairs(requests) do
+      bodies[i] = req.opts.body
+    end
+    return bodies
+  end
+
+  -- Loads the module as a freshly started worker would
+  local function restart()
+    drainers, timers = {}, {}
+    package.loaded["kong.plugins.apigee_common.spool"] = nil
+    spool = require "kong.plugins.apigee_common.spool"
+    spool.register("test", spool.http_sender)
+  end
+
+  setup(function()
+    ngx.worker = { id = function() return 0 end, pid = function() return 4242 end }
+    ngx.timer.every = function(_, fn)
+      drainers[#drainers + 1] = fn
+      return true
+    end
+    ngx.timer.at = function(_, fn)
+      timers[#timers + 1] = fn
+      return true
+    end
+    package.loaded["kong.plugins.apigee_common.callout"] = {
+      request = function(url, opts)
+        requests[#requests + 1] = { url = url, opts = opts }
+        local res = table.remove(responses, 1) or { status = 200 }
+        return res.status and res or nil, res.err
+      end,
+    }
+  end)
+
+  teardown(function()
+    ngx.timer.at, ngx.timer.every, ngx.worker = original_timer_at, original_timer_every, original_worker
+    package.loaded["kong.plugins.apigee_common.callout"] = nil
+    package.loaded["kong.plugins.apigee_common.spool"] = nil
+    os.execute("rm -rf '" .. prefix .. "'")
+  end)
+
+  before_each(function()
+    if prefix then
+      os.execute("rm -rf '" .. prefix .. "'")
+    end
+    prefix = os.tmpname()
+    os.remove(prefix)
+    assert(lfs.mkdir(prefix))
+    _G.kong = {
+      configuration = { prefix = prefix },
+      log = { warn = function() end, err = function() end, notice = function() end },
+    }
+    requests, responses = {}, {}
+    restart()
+  end)
+
+  it("delivers directly while nothing is spooled", function()
+    assert.is_true(spool.deliver("test", record(1)))
+    assert.equals(1, #requests)
+    assert.equals(0, #segments())
+    assert.is_false(spool.stats("test").pending)
+  end)
+
+  it("spools a record after a retryable failure, and later ones without a delivery attempt", function()
+    responses[1] = { status = 503 }
+    assert.is_true(spool.deliver("test", record(1)))
+    assert.is_true(spool.deliver("test", record(2)))
+
+    assert.equals(1, #requests)
+    assert.equals(1, #segments())
+    assert.is_true(spool.stats("test").pending)
+  end)
+
+  it("does not spool records rejected by the collector", function()
+    responses[1] = { status = 400 }
+    local ok, err = spool.deliver("test", record(1))
+    assert.is_nil(ok)
+    assert.equals("status 400", err)
+    assert.equals(0, #segments())
+  end)
+
+  it("replays spooled records in order and removes replayed segments", function()
+    responses[1] = { status = 503 }
+    spool.deliver("test", record(1))
+    spool.deliver("test", record(2))
+    drain()
+
+    assert.same({ "r1", "r1", "r2" }, sent_bodies())
+    assert.equals(0, #segments())
+    assert.is_false(spool.stats("test").pending)
+    assert.equals(0, spool.stats("test").pending_bytes)
+  end)
+
+  it("stops replaying at a retryable failure and resumes at the same record", function()
+    spool.store("test", record(1))
+    spool.store("test", record(2))
+    responses[2] = { err = "connection refused" }
+    drain()
+    assert.same({ "r1", "r2" }, sent_bodies())
+    assert.is_true(spool.stats("test").pending)
+
+    drain()
+    assert.same({ "r1", "r2", "r2" }, sent_bodies())
+    assert.is_false(spool.stats("test").pending)
+  end)
+
+  it("drops records rejected by the collector during replay", function()
+    spool.store("test", record(1))
+    spool.store("test", record(2))
+    responses[1] = { status = 400 }
+    drain()
+    assert.same({ "r1", "r2" }, sent_bodies())
+    assert.is_false(spool.stats("test").pending)
+  end)
+
+  it("resumes after a restart at the last persisted record", function()
+    spool.store("test", record(1))
+    spool.store("test", record(2))
+    spool.store("test", record(3))
+    responses[2] = { status = 503 }
+    drain()
+    assert.same({ "r1", "r2" }, sent_bodies())
+
+    restart()
+    requests = {}
+    spool.resume("test")
+    timers[1](false)
+    drain()
+    assert.same({ "r2", "r3" }, sent_bodies())
+  end)
+
+  it("skips a record torn by a crash", function()
+    spool.store("test", record(1))
+    local file = assert(io.open(segments()[1], "ab"))
+    file:write('{"url":"http://collector.test/ingest","opts":{"bo')
+    file:close()
+
+    restart()
+    spool.store("test", record(2))
+    drain()
+    assert.same({ "r1", "r2" }, sent_bodies())
+  end)
+
+  it("never writes secret headers to disk", function()
+    spool.store("test", record(1, {
+      ["Authorization"] = "Bearer s3cr3t",
+      ["X-Api-Key"] = "k3y",
+      ["Content-Type"] = "application/json",
+    }))
+
+    local content = read_file(segments()[1])
+    assert.is_nil(content:find("s3cr3t", 1, true))
+    assert.is_nil(content:find("k3y", 1, true))
+    assert.truthy(content:find("application/json", 1, true))
+  end)
+
+  it("restores secret headers on replay", function()
+    spool.store("test", record(1, { ["Authorization"] = "Bearer s3cr3t", ["Content-Type"] = "application/json" }))
+    drain()
+
+    assert.equals(1, #requests)
+    assert.equals("Bearer s3cr3t", requests[1].opts.headers["Authorization"])
+    assert.equals("application/json", requests[1].opts.headers["Content-Type"])
+    assert.equals("POST", requests[1].opts.method)
+  end)
+
+  it("holds records after a restart until a delivery supplies their credentials", function()
+    spool.store("test", record(1, { ["Authorization"] = "Bearer old" }))
+    restart()
+    spool.resume("test")
+    timers[1](false)
+    drain()
+    assert.equals(0, #requests)
+    assert.is_true(spool.stats("test").pending)
+
+    -- Spooled behind the waiting record, with the current credentials
+    spool.deliver("test", record(2, { ["Authorization"] = "Bearer new" }))
+    drain()
+    assert.same({ "r1", "r2" }, sent_bodies())
+    assert.equals("Bearer new", requests[1].opts.headers["Authorization"])
+  end)
+end)
@@ -0,0 +1,121 @@
+describe("apigee_common token_cache", function()
+  local token_cache, dict, shared_ctx, headers, live_headers
+  local original_shared_dict = ngx.shared.apigee_token_cache
+  local original_time = ngx.time
+
+  local function new_dict()
+    local values = {}
+    return {
+      values = values,
+      get = function(_, key)
+        local item = values[key]
+        if item and item.expires > ngx.time() then
+          return item.value
+        end
+      end,
+      safe_set = function(_, key, value, ttl)
+        values[key] = { value = value, expires = ngx.time() + ttl, ttl = ttl }
+        return true
+      end,
+      delete = function(_, key)
+        values[key] = nil
+      end,
+    }
+  end
+
+  setup(function()
+    ngx.time = function() return 1000 end
+    package.loaded["kong.plugins.apigee_common.request_context"] = {
+      get_header = function(name) return headers[name] end,
+    }
+    package.loaded["kong.plugins.apigee_common.token_cache"] = nil
+    token_cache = require "kong.plugins.apigee_common.token_cache"
+  end)
+
+  teardown(function()
+    ngx.shared.apigee_token_cache = original_shared_dict
+    ngx.time = original_time
+    package.loaded["kong.plugins.apigee_common.request_context"] = nil
+    package.loaded["kong.plugins.apigee_common.token_cache"] = nil
+  end)
+
+  before_each(function()
+    dict = new_dict()
+    ngx.shared.apigee_token_cache = dict
+    ngx.ctx = {}
+    shared_ctx = {}
+    headers = {}
+    live_headers = {}
+    _G.kong = {
+      ctx = { shared = shared_ctx },
+      log = { warn = function() end },
+      request = { get_header = function(name) return live_headers[name] end },
+    }
+  end)
+
+  it("identifies the request's oauth2 token and its expiry", function()
+    shared_ctx.authenticated_oauth2_token = { access_token = "abc", created_at = 900, expires_in = 7200 }
+    local hash, expires_at = token_cache.current()
+    assert.equals(token_cache.hash("abc"), hash)
+    assert.equals(8100, expires_at)
+  end)
+
+  it("falls back to the bearer token of the Authorization header", function()
+    headers.Authorization = "Bearer xyz"
+    local hash, expires_at = token_cache.current()
+    assert.equals(token_cache.hash("xyz"), hash)
+    assert.is_nil(expires_at)
+  end)
+
+  it("keeps entries until the token expires", function()
+    local hash = token_cache.hash("abc")
+    assert.is_true(token_cache.set(hash, { client_id = "app" }, { expires_at = 1600 }))
+    assert.equals(600, dict.values["oauth_token:" .. hash].ttl)
+    assert.equals("app", token_cache.get(hash).client_id)
+  end)
+
+  it("merges attributes written by different plugins", function()
+    local hash = token_cache.hash("abc")
+    token_cache.set(hash, { client_id = "app", attributes = { tier = "gold" } }, { ttl = 60 })
+    token_cache.set(hash, { attributes = { region = "eu" } }, { ttl = 60 })
+    local entry = token_cache.get(hash)
+    assert.equals("app", entry.client_id)
+    assert.equals("gold", entry.attributes.tier)
+    assert.equals("eu", entry.attributes.region)
+    -- The expiry of the first write is kept
+    assert.equals(1060, entry.expires_at)
+  end)
+
+  it("returns the same decoded entry while it is unchanged", function()
+    local hash = token_cache.hash("abc")
+    token_cache.set(hash, { client_id = "app" }, { ttl = 60 })
+    assert.equals(token_cache.get(hash), token_cache.get(hash))
+  end)
+
+  it("does not cache expired tokens", function()
+    local hash = token_cache.hash("abc")
+    assert.is_true(token_cache.set(hash, { client_id = "app" }, { expires_at = 900 }))
+    assert.is_nil(token_cache.get(hash))
+  end)
+
+  it("evicts deleted tokens", function()
+    local hash = token_cache.hash("abc")
+    token_cache.set(hash, { client_id = "app" }, { ttl = 60 })
+    token_cache.delete(hash)
+    assert.is_nil(token_cache.get(hash))
+  end)
+
+  it("reads the scopes set by the oauth2 plugin from the live request", function()
+    live_headers["X-Authenticated-Scope"] = "read write"
+    local info = token_cache.describe({ id = "c1", username = "alice" }, { id = "cred", client_id = "app" })
+    assert.equals("read write", info.scopes)
+  end)
+
+  it("bypasses the cache when the dict is not declared", function()
+    ngx.shared.apigee_token_cache = nil
+    local hash = token_cache.hash("abc")
+    assert.is_true(token_cache.set(hash, { client_id = "app" }, { ttl = 60 }))
+    assert.is_nil(token_cache.get(hash))
+    assert.is_true(token_cache.delete(hash))
+  end)
+end)
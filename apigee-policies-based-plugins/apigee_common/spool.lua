@@ -0,0 +1,581 @@
+-- Disk-backed spool for outbound telemetry.
+--
+-- When a collector cannot be reached, deliveries are appended to a spool on
+-- local disk instead of being dropped, and a background drainer replays
+-- them at a bounded rate once the collector answers again.
+--
+-- Each spool has a name (one per plugin) and every worker writes its own
+-- directory, `<kong prefix>/apigee-spool/<name>/worker-<id>/`:
+--
+--   <seq>.seg   append-only segment, one JSON record per line
+--   offset      "<seq> <byte offset>" of the next record to replay
+--   lock        locked by the worker process owning the directory
+--
+-- During a reload the old and the new worker with the same id run side by
+-- side. The directory lock keeps them apart: the new worker then spools to
+-- `worker-<id>.<pid>/` instead. Such directories are adopted (their records
+-- re-spooled) by `resume` once their worker has exited; a `worker-<id>/`
+-- directory left behind by an old worker is picked up at the next reload.
+--
+-- Segments are rotated at SEGMENT_MAX_BYTES, and the segment being written
+-- is rotated before the drainer replays it, so replayed segments are never
+-- appended to and can be deleted whole. The oldest segments are discarded
+-- when the spool outgrows `spool_max_bytes`. The offset
+-- file is replaced atomically (write, then rename), so after a crash replay
+-- resumes at the last persisted record; at worst a few records are sent
+-- twice. A torn last line is skipped.
+--
+-- Credentials never reach the disk: secret headers of HTTP records
+-- (Authorization, cookies, API keys, tokens) are removed before a record is
+-- spooled and kept in worker memory per URL, from the latest delivery to it.
+-- `http_sender` puts them back on replay, and holds the spool until a
+-- delivery after a restart has supplied them again.
+--
+-- All functions doing I/O must run in timers (or init_worker), not in
+-- request phases.
+
+local cjson = require "cjson.safe"
+local lfs = require "lfs"
+local callout = require "kong.plugins.apigee_common.callout"
+
+local floor = math.floor
+local fmt = string.format
+
+local SEGMENT_MAX_BYTES = 4 * 1024 * 1024
+local DRAIN_INTERVAL = 1
+local DEFAULT_MAX_BYTES = 100 * 1024 * 1024
+local DEFAULT_DRAIN_RATE = 100
+
+-- Headers never written to disk, by lowercase name or name pattern
+local SECRET_HEADERS = {
+  ["authorization"] = true,
+  ["proxy-authorization"] = true,
+  ["cookie"] = true,
+}
+local SECRET_HEADER_PATTERNS = { "token", "secret", "password", "api%-?key", "auth" }
+
+local senders = {}
+local spools = {}
+-- url -> header name -> value, for the secret headers of spooled records
+local credentials = {}
+
+local _M = {}
+
+local function mkdir_p(path)
+  local current = ""
+  for part in path:gmatch("[^/]+") do
+    current = current .. "/" .. part
+    if not lfs.attributes(current, "mode") then
+      local ok, err = lfs.mkdir(current)
+      if not ok and not lfs.attributes(current, "mode") then
+        return nil, err
+      end
+    end
+  end
+  return true
+end
+
+local function segment_path(spool, seq)
+  return fmt("%s/%010d.seg", spool.dir, seq)
+end
+
+local function persist_offset(spool)
+  local tmp = spool.dir .. "/offset.tmp"
+  local file, err = io.open(tmp, "wb")
+  if not file then
+    return nil, err
+  end
+  file:write(spool.read_seq, " ", spool.read_offset)
+  file:close()
+  return os.rename(tmp, spool.dir .. "/offset")
+end
+
+local function spool_root(name)
+  local prefix = kong and kong.configuration and kong.configuration.prefix or "/usr/local/kong"
+  return fmt("%s/apigee-spool/%s", prefix, name)
+end
+
+local function spool_dir(name)
+  return fmt("%s/worker-%d", spool_root(name), ngx.worker.id() or 0)
+end
+
+-- Takes the lock of a spool directory for this process. The lock is
+-- released by the OS when the process exits. Returns the open lock file, or
+-- nil when another live process holds it.
+local function lock_dir(dir)
+  local file = io.open(dir .. "/lock", "ab")
+  if not file then
+    return nil
+  end
+  if not lfs.lock(file, "w") then
+    file:close()
+    return nil
+  end
+  return file
+end
+
+-- Opens (creating or recovering) this worker's spool directory.
+local function open_spool(name)
+  local spool = spools[name]
+  if spool then
+    return spool
+  end
+
+  local dir = spool_dir(name)
+  local ok, err = mkdir_p(dir)
+  if not ok then
+    return nil, "cannot create spool directory '" .. dir .. "': " .. tostring(err)
+  end
+
+  local lock = lock_dir(dir)
+  if not lock then
+    -- The worker with the same id from before a reload still owns `dir`
+    dir = fmt("%s.%d", dir, ngx.worker.pid())
+    ok, err = mkdir_p(dir)
+    if not ok then
+      return nil, "cannot create spool directory '" .. dir .. "': " .. tostring(err)
+    end
+    lock = lock_dir(dir)
+    if not lock then
+      return nil, "cannot lock spool directory '" .. dir .. "'"
+    end
+  end
+
+  spool = {
+    name = name,
+    dir = dir,
+    lock = lock,
+    max_bytes = DEFAULT_MAX_BYTES,
+    drain_rate = DEFAULT_DRAIN_RATE,
+    read_seq = 0,
+    read_offset = 0,
+    write_seq = 0,
+    write_size = 0,
+    total_bytes = 0,
+    dropped_bytes = 0,
+  }
+
+  local offset_file = io.open(dir .. "/offset", "rb")
+  if offset_file then
+    local seq, offset = (offset_file:read("*a") or ""):match("^(%d+) (%d+)")
+    offset_file:close()
+    spool.read_seq, spool.read_offset = tonumber(seq) or 0, tonumber(offset) or 0
+  end
+
+  local first, last
+  for entry in lfs.dir(dir) do
+    local seq = tonumber(entry:match("^(%d+)%.seg$"))
+    if seq then
+      if seq < spool.read_seq then
+        os.remove(dir .. "/" .. entry) -- Replayed before the restart
+      else
+        first = (not first or seq < first) and seq or first
+        last = (not last or seq > last) and seq or last
+        spool.total_bytes = spool.total_bytes + (lfs.attributes(dir .. "/" .. entry, "size") or 0)
+      end
+    end
+  end
+
+  if first then
+    if first > spool.read_seq then
+      spool.read_seq, spool.read_offset = first, 0
+    end
+    -- Never append after a possibly torn record: write to a new segment
+    spool.write_seq = last + 1
+  else
+    spool.read_seq, spool.read_offset = spool.write_seq, 0
+  end
+  spool.pending = spool.total_bytes > spool.read_offset
+
+  spools[name] = spool
+  return spool
+end
+
+-- Discards the oldest segments until the spool fits `max_bytes`. The
+-- segment being written is never discarded.
+local function enforce_cap(spool)
+  while spool.total_bytes > spool.max_bytes and spool.read_seq < spool.write_seq do
+    local path = segment_path(spool, spool.read_seq)
+    local size = lfs.attributes(path, "size") or 0
+    os.remove(path)
+    spool.total_bytes = spool.total_bytes - size
+    spool.dropped_bytes = spool.dropped_bytes + size - spool.read_offset
+    kong.log.warn("Spool: '", spool.name, "' is over its size limit; discarded ", size - spool.read_offset,
+                  " bytes of unsent records.")
+    spool.read_seq, spool.read_offset = spool.read_seq + 1, 0
+    persist_offset(spool)
+  end
+end
+
+-- Starts a new segment for appends
+local function rotate(spool)
+  if spool.writer then
+    spool.writer:close()
+    spool.writer = nil
+  end
+  spool.write_seq, spool.write_size = spool.write_seq + 1, 0
+end
+
+local function append(spool, record)
+  local line, err = cjson.encode(record)
+  if not line then
+    return nil, "cannot encode record: " .. tostring(err)
+  end
+  line = line .. "\n"
+
+  if spool.write_size > 0 and spool.write_size + #line > SEGMENT_MAX_BYTES then
+    rotate(spool)
+  end
+
+  if not spool.writer then
+    spool.writer, err = io.open(segment_path(spool, spool.write_seq), "ab")
+    if not spool.writer then
+      return nil, "cannot open spool segment: " .. tostring(err)
+    end
+  end
+
+  spool.writer:write(line)
+  spool.writer:flush()
+  spool.write_size = spool.write_size + #line
+  spool.total_bytes = spool.total_bytes + #line
+  spool.pending = true
+
+  enforce_cap(spool)
+  return true
+end
+
+-- Replays up to `drain_rate * DRAIN_INTERVAL` records, stopping at the
+-- first retryable failure (the collector is still down).
+local function drain(spool)
+  local sender = senders[spool.name]
+  if not sender then
+    return
+  end
+
+  local budget = floor(spool.drain_rate * DRAIN_INTERVAL)
+  while spool.pending and budget > 0 do
+    if spool.read_seq == spool.write_seq and spool.write_size > 0 then
+      -- `sender` yields, and records appended to the segment meanwhile
+      -- would be deleted with it: never replay the segment being written.
+      rotate(spool)
+    end
+
+    local seq = spool.read_seq
+    local path = segment_path(spool, seq)
+    local file = io.open(path, "rb")
+    if not file and spool.read_seq < spool.write_seq then
+      spool.read_seq, spool.read_offset = spool.read_seq + 1, 0
+    elseif not file then
+      spool.pending = false
+    else
+      file:seek("set", spool.read_offset)
+      local blocked, at_end, discarded = false, false, false
+      while budget > 0 do
+        local line = file:read("*l")
+        local line_end = file:seek()
+        -- A line without its newline is a record torn by a crash
+        if not line or line_end - spool.read_offset ~= #line + 1 then
+          at_end = true
+          break
+        end
+
+        local record = cjson.decode(line)
+        local ok, err, retryable = true, nil, false
+        if record then
+          ok, err, retryable = sender(record)
+        end
+        if spool.read_seq ~= seq then
+          discarded = true -- Dropped by enforce_cap while sending
+          break
+        end
+        if not ok and retryable then
+          blocked = true
+          break
+        end
+        if not ok then
+          kong.log.err("Spool: Dropping undeliverable record from '", spool.name, "': ", err)
+        end
+        spool.read_offset = line_end
+        budget = budget - 1
+      end
+      file:close()
+
+      if blocked then
+        persist_offset(spool)
+        return
+      end
+
+      if at_end and not discarded then
+        -- Replayed segments are no longer written to (see above)
+        local size = lfs.attributes(path, "size") or 0
+        os.remove(path)
+        spool.total_bytes = spool.total_bytes - size
+        spool.read_seq, spool.read_offset = seq + 1, 0
+      end
+    end
+  end
+  persist_offset(spool)
+end
+
+local function start_drainer(spool)
+  if spool.drainer_started then
+    return
+  end
+  local ok, err = ngx.timer.every(DRAIN_INTERVAL, function(premature)
+    if premature or spool.draining or not spool.pending then
+      return
+    end
+    spool.draining = true
+    local drained, drain_err = pcall(drain, spool)
+    spool.draining = false
+    if not drained then
+      kong.log.err("Spool: Draining '", spool.name, "' failed: ", drain_err)
+    end
+  end)
+  if not ok then
+    kong.log.err("Spool: Failed to start drainer for '", spool.name, "': ", err)
+    return
+  end
+  spool.drainer_started = true
+end
+
+local function is_secret_header(name)
+  name = name:lower()
+  if SECRET_HEADERS[name] then
+    return true
+  end
+  for _, pattern in ipairs(SECRET_HEADER_PATTERNS) do
+    if name:find(pattern) then
+      return true
+    end
+  end
+  return false
+end
+
+-- Returns the record as written to disk: an HTTP record loses its secret
+-- headers, which are remembered for its URL and listed by name in
+-- `secret_headers`.
+local function without_secrets(record)
+  local opts = type(record.opts) == "table" and record.opts
+  if not opts or type(opts.headers) ~= "table" or not record.url then
+    return record
+  end
+
+  local headers, names = {}, {}
+  for name, value in pairs(opts.headers) do
+    if is_secret_header(name) then
+      names[#names + 1] = name
+      credentials[record.url] = credentials[record.url] or {}
+      credentials[record.url][name] = value
+    else
+      headers[name] = value
+    end
+  end
+  if #names == 0 then
+    return record
+  end
+
+  local stored_opts = {}
+  for k, v in pairs(opts) do
+    stored_opts[k] = v
+  end
+  stored_opts.headers = headers
+  local stored = {}
+  for k, v in pairs(record) do
+    stored[k] = v
+  end
+  stored.opts = stored_opts
+  stored.secret_headers = names
+  return stored
+end
+
+--- Sends an HTTP record `{ url = ..., opts = <callout options> }`. Usable
+-- as a sender; transport errors, 429 and 5xx responses are retryable. A
+-- replayed record whose secret headers are not known in this worker yet
+-- is retryable too, so the spool waits for the next delivery to supply them.
+function _M.http_sender(record)
+  local opts = record.opts
+  if record.secret_headers then
+    local known = credentials[record.url]
+    local headers = {}
+    for name, value in pairs(opts.headers or {}) do
+      headers[name] = value
+    end
+    for _, name in ipairs(record.secret_headers) do
+      if not known or known[name] == nil then
+        return nil, "credentials for '" .. record.url .. "' are not known yet", true
+      end
+      headers[name] = known[name]
+    end
+    local replay_opts = {}
+    for k, v in pairs(opts) do
+      replay_opts[k] = v
+    end
+    replay_opts.headers = headers
+    opts = replay_opts
+  end
+
+  local res, err = callout.request(record.url, opts)
+  if not res then
+    return nil, err, true
+  end
+  if res.status >= 400 then
+    return nil, "status " .. res.status, res.status == 429 or res.status >= 500
+  end
+  return true
+end
+
+--- Registers the function replaying records of a spool. It receives a
+-- decoded record and returns true, or nil, an error and whether the failure
+-- is retryable.
+function _M.register(name, sender)
+  senders[name] = sender
+end
+
+--- Delivers a record now, or spools it. Records are spooled without a
+-- delivery attempt while older ones are still waiting, so that the backlog
+-- drains in order and at the configured rate.
+-- @param name string Spool name (a registered sender).
+-- @param record table JSON-serializable record.
+-- @param limits table|nil `spool_max_bytes` and `spool_drain_rate`.
+-- @return true when sent or spooled, or nil and an error.
+function _M.deliver(name, record, limits)
+  local spool, err = open_spool(name)
+  if not spool then
+    kong.log.err("Spool: ", err)
+    return senders[name](record)
+  end
+  if limits then
+    spool.max_bytes = limits.spool_max_bytes or spool.max_bytes
+    spool.drain_rate = limits.spool_drain_rate or spool.drain_rate
+  end
+
+  if not spool.pending then
+    local ok, send_err, retryable = senders[name](record)
+    if ok or not retryable then
+      return ok, send_err
+    end
+    kong.log.warn("Spool: Delivery for '", name, "' failed (", send_err, "); spooling to disk.")
+  end
+
+  start_drainer(spool)
+  return append(spool, without_secrets(record))
+end
+
+--- Spools a record without trying to deliver it first, e.g. after the
+-- caller's own retries failed.
+-- @return true, or nil and an error.
+function _M.store(name, record, limits)
+  local spool, err = open_spool(name)
+  if not spool then
+    return nil, err
+  end
+  if limits then
+    spool.max_bytes = limits.spool_max_bytes or spool.max_bytes
+    spool.drain_rate = limits.spool_drain_rate or spool.drain_rate
+  end
+  start_drainer(spool)
+  return append(spool, without_secrets(record))
+end
+
+-- Re-spools the unsent records of `dir`, a `worker-<id>.<pid>` directory
+-- whose worker has exited, and removes it.
+local function adopt(spool, dir)
+  local lock = lock_dir(dir)
+  if not lock then
+    return -- Its worker is still running
+  end
+
+  local read_seq, read_offset = 0, 0
+  local offset_file = io.open(dir .. "/offset", "rb")
+  if offset_file then
+    local seq, offset = (offset_file:read("*a") or ""):match("^(%d+) (%d+)")
+    offset_file:close()
+    read_seq, read_offset = tonumber(seq) or 0, tonumber(offset) or 0
+  end
+
+  local seqs = {}
+  for entry in lfs.dir(dir) do
+    local seq = tonumber(entry:match("^(%d+)%.seg$"))
+    if seq then
+      seqs[#seqs + 1] = seq
+    end
+  end
+  table.sort(seqs)
+
+  local adopted = 0
+  for _, seq in ipairs(seqs) do
+    local path = fmt("%s/%010d.seg", dir, seq)
+    local file = seq >= read_seq and io.open(path, "rb")
+    if file then
+      if seq == read_seq then
+        file:seek("set", read_offset)
+      end
+      for line in file:lines() do
+        local record = cjson.decode(line) -- A torn last line does not decode
+        if record and append(spool, record) then
+          adopted = adopted + 1
+        end
+      end
+      file:close()
+    end
+    os.remove(path)
+  end
+
+  os.remove(dir .. "/offset")
+  os.remove(dir .. "/offset.tmp")
+  os.remove(dir .. "/lock")
+  lock:close()
+  lfs.rmdir(dir)
+  kong.log.notice("Spool: Adopted ", adopted, " records for '", spool.name, "' from ", dir, ".")
+end
+
+--- Resumes replaying a spool left over from a previous run, and adopts the
+-- spools of exited workers that ran during a reload. Meant for init_worker.
+function _M.resume(name)
+  local ok, err = ngx.timer.at(0, function(premature)
+    local root = spool_root(name)
+    if premature or not lfs.attributes(root, "mode") then
+      return -- Nothing was ever spooled
+    end
+    local spool, open_err = open_spool(name)
+    if not spool then
+      kong.log.err("Spool: ", open_err)
+      return
+    end
+
+    for entry in lfs.dir(root) do
+      local dir = root .. "/" .. entry
+      if entry:match("^worker%-%d+%.%d+$") and dir ~= spool.dir then
+        local adopted, adopt_err = pcall(adopt, spool, dir)
+        if not adopted then
+          kong.log.err("Spool: Failed to adopt ", dir, ": ", adopt_err)
+        end
+      end
+    end
+
+    if spool.pending then
+      kong.log.notice("Spool: Replaying ", spool.total_bytes - spool.read_offset, " bytes spooled for '", name, "'.")
+      start_drainer(spool)
+    end
+  end)
+  if not ok then
+    kong.log.err("Spool: Failed to schedule resume of '", name, "': ", err)
+  end
+end
+
+--- Returns this worker's spool state for a name: `pending` bytes (approx.),
+-- `dropped_bytes` and whether records are waiting.
+function _M.stats(name)
+  local spool = spools[name]
+  if not spool then
+    return { pending_bytes = 0, dropped_bytes = 0, pending = false }
+  end
+  return {
+    pending_bytes = spool.total_bytes - spool.read_offset,
+    dropped_bytes = spool.dropped_bytes,
+    pending = spool.pending,
+  }
+end
+
+return _M
@@ -0,0 +1,216 @@
+-- Shared cache of OAuth access token metadata.
+--
+-- What the OAuth plugins read about a token (client and application, end
+-- user, scopes, custom consumer or credential attributes) does not change
+-- during the token's lifetime. It is cached in a shared dict keyed by the
+-- SHA-256 hash of the token, so it is resolved once per token rather than
+-- once per request and worker: set-oauth-v2-info and get-oauth-v2-info
+-- write through, delete-oauth-v2-info evicts, and entries expire with the
+-- token. The dict, `apigee_token_cache` unless configured otherwise, must be
+-- declared with `nginx_http_lua_shared_dict`.
+--
+-- Entries are stored as JSON. Each worker keeps the decoded table of recent
+-- entries next to the string it was decoded from, so a read is a single shm
+-- lookup plus a string comparison unless the entry has changed.
+
+local cjson = require "cjson.safe"
+local lrucache = require "resty.lrucache"
+local resty_sha256 = require "resty.sha256"
+local to_hex = require("resty.string").to_hex
+local request_context = require "kong.plugins.apigee_common.request_context"
+
+local type = type
+local pairs = pairs
+local concat = table.concat
+
+local KEY_PREFIX = "oauth_token:"
+local DEFAULT_SHM = "apigee_token_cache"
+local DEFAULT_TTL = 3600
+
+-- Request-scoped memo of the current token's hash
+local CTX_KEY = "apigee_token_hash"
+
+local decoded_entries = lrucache.new(1024)
+
+-- Missing dicts already reported by this worker
+local missing_logged = {}
+
+local _M = {}
+
+-- Marks a value that was looked up and found absent, so that the lookup is
+-- not repeated. Survives the JSON round trip.
+_M.ABSENT = cjson.null
+
+-- Returns the dict, or nil when it is not declared on this node; the cache
+-- is then bypassed, with a warning logged once per worker.
+local function get_dict(shm)
+  local name = shm or DEFAULT_SHM
+  local dict = ngx.shared[name]
+  if not dict and not missing_logged[name] then
+    missing_logged[name] = true
+    kong.log.warn("TokenCache: lua_shared_dict '", name, "' is not declared on this node. ",
+                  "Token metadata is not cached.")
+  end
+  return dict
+end
+
+--- Returns the hex SHA-256 hash identifying a token.
+function _M.hash(token)
+  local digest = resty_sha256:new()
+  digest:update(token)
+  return to_hex(digest:final())
+end
+
+--- Returns the hash of the token the current request was authenticated
+-- with: the one validated by Kong's oauth2 or jwt plugin, or else the
+-- bearer token of the Authorization header.
+-- @return the hash and the token's expiry (epoch seconds) when known, or nil.
+function _M.current()
+  local ctx = ngx.ctx
+  local memo = ctx[CTX_KEY]
+  if memo then
+    return memo.hash, memo.expires_at
+  end
+
+  local shared = kong.ctx.shared
+  local token, expires_at
+  local oauth2_token = shared.authenticated_oauth2_token
+  if type(oauth2_token) == "table" and oauth2_token.access_token then
+    token = oauth2_token.access_token
+    local expires_in = tonumber(oauth2_token.expires_in) or 0
+    if expires_in > 0 and oauth2_token.created_at then
+      expires_at = oauth2_token.created_at + expires_in
+    end
+  elseif type(shared.authenticated_jwt_token) == "string" then
+    token = shared.authenticated_jwt_token
+  else
+    local authorization = request_context.get_header("Authorization")
+    token = authorization and authorization:match("^[Bb][Ee][Aa][Rr][Ee][Rr]%s+(%S+)")
+  end
+
+  if not token then
+    return nil
+  end
+  memo = { hash = _M.hash(token), expires_at = expires_at }
+  ctx[CTX_KEY] = memo
+  return memo.hash, memo.expires_at
+end
+
+--- Returns the cached metadata of a token.
+-- The table is shared by all callers and must be treated as read-only.
+-- @param hash string Token hash, from `hash` or `current`.
+-- @param shm string|nil Shared dict name (default `apigee_token_cache`).
+-- @return the entry, or nil (also when the dict is missing).
+function _M.get(hash, shm)
+  local dict = get_dict(shm)
+  if not dict then
+    return nil
+  end
+  local raw = dict:get(KEY_PREFIX .. hash)
+  if not raw then
+    return nil
+  end
+
+  local cached = decoded_entries:get(hash)
+  if cached and cached.raw == raw then
+    return cached.entry
+  end
+  local entry = cjson.decode(raw)
+  if type(entry) ~= "table" then
+    return nil
+  end
+  decoded_entries:set(hash, { raw = raw, entry = entry })
+  return entry
+end
+
+--- Merges fields into a token's cached metadata. `attributes` is merged
+-- key by key; other fields replace the cached ones.
+-- @param hash string Token hash.
+-- @param fields table Fields to store.
+-- @param opts table|nil `shm`, `expires_at` (epoch seconds) and `ttl`, the
+--   lifetime in seconds used when the token's expiry is unknown.
+-- @return true, or nil and an error (e.g. the dict is full). Without the
+--   dict nothing is stored and true is returned.
+function _M.set(hash, fields, opts)
+  opts = opts or {}
+  local dict = get_dict(opts.shm)
+  if not dict then
+    return true
+  end
+
+  local entry = {}
+  local attributes = {}
+  local current = _M.get(hash, opts.shm)
+  if current then
+    for name, value in pairs(current) do
+      entry[name] = value
+    end
+    for name, value in pairs(current.attributes or {}) do
+      attributes[name] = value
+    end
+  end
+  for name, value in pairs(fields) do
+    if name ~= "attributes" then
+      entry[name] = value
+    end
+  end
+  for name, value in pairs(fields.attributes or {}) do
+    attributes[name] = value
+  end
+  entry.attributes = attributes
+
+  local now = ngx.time()
+  entry.expires_at = entry.expires_at or opts.expires_at or now + (opts.ttl or DEFAULT_TTL)
+  local ttl = entry.expires_at - now
+  if ttl <= 0 then
+    return true -- Expired tokens are not worth caching
+  end
+
+  local raw, err = cjson.encode(entry)
+  if not raw then
+    return nil, "cannot encode token metadata: " .. tostring(err)
+  end
+  -- Never evict other users of the dict to make room
+  local ok
+  ok, err = dict:safe_set(KEY_PREFIX .. hash, raw, ttl)
+  if not ok then
+    return nil, err
+  end
+  decoded_entries:set(hash, { raw = raw, entry = entry })
+  return true
+end
+
+--- Evicts a token's cached metadata. Other workers drop their decoded copy
+-- on their next read, when the shm entry is gone. Does nothing without the
+-- dict.
+function _M.delete(hash, shm)
+  local dict = get_dict(shm)
+  if not dict then
+    return true
+  end
+  dict:delete(KEY_PREFIX .. hash)
+  decoded_entries:delete(hash)
+  return true
+end
+
+--- Builds the standard metadata of a token from the authenticated consumer
+-- and credential of the current request.
+function _M.describe(consumer, credential)
+  -- Set by the oauth2 plugin, so not in request_context's copy of the
+  -- client's headers
+  local scopes = kong.request.get_header("X-Authenticated-Scope") or kong.ctx.authenticated_scope
+  if type(scopes) == "table" then
+    scopes = concat(scopes, " ")
+  end
+  return {
+    consumer_id = consumer and consumer.id,
+    consumer_username = consumer and (consumer.username or consumer.custom_id),
+    consumer_custom_id = consumer and consumer.custom_id,
+    client_id = credential and (credential.client_id or credential.id),
+    application_name = credential and credential.name,
+    scopes = scopes,
+    attributes = {},
+  }
+end
+
+return _M
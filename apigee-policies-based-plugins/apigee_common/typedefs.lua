@@ -0,0 +1,89 @@
+-- Schema field definitions shared by the plugins in this repository.
+--
+-- Used like Kong's own typedefs, either as is or called with overrides:
+--
+--   { callout_timeout = apigee_typedefs.callout_timeout },
+--   { callout_timeout = apigee_typedefs.callout_timeout { default = 2000 } },
+--
+-- `shared_dict_check` builds an entry for a schema's `entity_checks`.
+
+local Schema = require "kong.db.schema"
+
+local typedefs = {}
+
+-- Connection settings of the `callout` client (see callout.lua)
+
+typedefs.callout_timeout = Schema.define {
+  type = "integer",
+  default = 10000,
+  between = { 1, 600000 },
+  description = "Read and send timeout in milliseconds for calls to the external service.",
+}
+
+typedefs.callout_connect_timeout = Schema.define {
+  type = "integer",
+  default = 5000,
+  between = { 1, 600000 },
+  description = "Connect timeout in milliseconds for calls to the external service.",
+}
+
+typedefs.callout_keepalive_timeout = Schema.define {
+  type = "integer",
+  default = 60000,
+  between = { 0, 3600000 },
+  description = "Idle time in milliseconds a connection to the external service is kept in the keep-alive pool.",
+}
+
+typedefs.callout_keepalive_pool_size = Schema.define {
+  type = "integer",
+  default = 32,
+  between = { 1, 1000 },
+  description = "Maximum number of idle keep-alive connections per worker to the external service.",
+}
+
+-- Response to tokens on the revocation list (see revocation.lua)
+
+typedefs.revoked_token_status = Schema.define {
+  type = "integer",
+  default = 401,
+  between = { 400, 599 },
+  description = "The HTTP status code returned when the token is on the revocation list maintained by `revoke-oauth-v2`.",
+}
+
+typedefs.revoked_token_body = Schema.define {
+  type = "string",
+  default = "The access token has been revoked.",
+  description = "The `message` of the JSON response returned when the token is on the revocation list maintained by `revoke-oauth-v2`.",
+}
+
+-- Entity check rejecting a config that needs a lua_shared_dict which is not
+-- declared on this node. `dict_for(config)` returns the dict's name, or nil
+-- when the config does not use it.
+function typedefs.shared_dict_check(field_sources, dict_for)
+  return {
+    custom_entity_check = {
+      field_sources = field_sources,
+      fn = function(entity)
+        local name = dict_for(entity.config)
+        if name and not ngx.shared[name] then
+          return nil, "lua_shared_dict '" .. name .. "' is not declared: add "
+                      .. "'nginx_http_lua_shared_dict = " .. name .. " 1m' to kong.conf"
+        end
+        return true
+      end,
+    },
+  }
+end
+
+-- Requires the token metadata cache's dict (see token_cache.lua) only when
+-- the cache is enabled
+typedefs.token_cache_check = typedefs.shared_dict_check(
+  { "config.token_cache_enabled", "config.token_cache_shm" },
+  function(config)
+    if config.token_cache_enabled then
+      return config.token_cache_shm
+    end
+  end
+)
+
+return typedefs
@@ -0,0 +1,81 @@
+-- Compares evaluating a condition by loading and sandboxing its source on
+-- every request, as the plugin did before, with calling the condition
+-- compiled once per configuration, in both syntaxes; then four chained
+-- conditions, as separate plugin instances would evaluate them, with the
+-- same checks as one decision table.
+--
+-- Usage (with Kong's Lua path set up):
+--   resty bench/condition_bench.lua
+
+-- Minimal request, as seen through the PDK
+local headers = { ["x-api-version"] = "2", ["content-type"] = "application/json", ["x-api-key"] = "key" }
+kong = {
+  request = {
+    get_method = function() return "POST" end,
+    get_headers = function() return headers end,
+    get_header = function(name) return headers[name:lower()] end,
+  },
+  ctx = { shared = { role = "admin" } },
+}
+ngx.ctx = {}
+
+local condition = require "kong.plugins.assert-condition.condition"
+
+local ITERATIONS = 1000000
+
+local LUA_CONDITION = "kong.request.get_method() == 'POST' and tonumber(kong.request.get_header('x-api-version')) >= 2"
+  .. " and kong.ctx.shared.role == 'admin'"
+local EXPRESSION = "request.verb = 'POST' and request.header.x-api-version >= 2 and role = 'admin'"
+
+-- The evaluation as implemented before conditions were compiled
+local function legacy_evaluate()
+  local env = { kong = kong, tonumber = tonumber }
+  local fn = assert(load("return (" .. LUA_CONDITION .. ")", "=condition", "t", env))
+  return pcall(fn)
+end
+
+local function run(label, fn)
+  assert(select(2, fn()) == true, label .. " did not evaluate to true")
+  collectgarbage("collect")
+  local start = os.clock()
+  for _ = 1, ITERATIONS do
+    fn()
+  end
+  local elapsed = os.clock() - start
+  print(string.format("  %-14s %8d iter  %10.1f ns/op", label, ITERATIONS, elapsed * 1e9 / ITERATIONS))
+end
+
+local compiled_lua = assert(condition.compile(LUA_CONDITION, "lua"))
+local compiled_expression = assert(condition.compile(EXPRESSION, "expression"))
+
+run("legacy", legacy_evaluate)
+run("lua", function() return pcall(compiled_lua) end)
+run("expression", function() return pcall(compiled_expression) end)
+
+-- Four assertions sharing the version check; none aborts
+local CHAINED = {
+  "request.header.x-api-key = null",
+  "request.verb != 'GET' and request.header.x-api-version < 2",
+  "request.verb != 'GET' and request.header.x-api-version < 2 and role != 'admin'",
+  "request.verb != 'GET' and role != 'admin'",
+}
+
+local chained = {}
+for i, source in ipairs(CHAINED) do
+  chained[i] = assert(condition.compile(source, "expression"))
+end
+local rules = assert(condition.compile_rules(CHAINED, "expression"))
+
+run("chained x4", function()
+  for i = 1, #chained do
+    local ok, result = pcall(chained[i])
+    if not ok or result then
+      return ok, false
+    end
+  end
+  return true, true
+end)
+run("rules x4", function()
+  local ok, index = pcall(rules)
+  return ok, index == nil
+end)
@@ -0,0 +1,659 @@
+-- Compilation of assert-condition conditions.
+--
+-- A condition is compiled once per plugin configuration into a plain Lua
+-- function, instead of being loaded and sandboxed on every request. Two
+-- syntaxes are supported:
+--
+--   lua         A Lua expression, run in a sandbox that only exposes `kong`
+--               and a few pure standard functions.
+--   expression  A small Apigee-style condition language, e.g.
+--
+--                 request.verb = "POST" and request.header.content-type =| "application/json"
+--
+--               Variables are resolved to accessor functions when the
+--               condition is compiled, and the condition is turned into Lua
+--               source that can only reach those accessors and the
+--               comparison helpers below: it has no access to globals at
+--               all.
+--
+-- An ordered list of conditions, the rules of a decision table, can also be
+-- compiled into a single function returning the first true one.
+--
+-- Expression language:
+--
+--   operators   or, ||   and, &&   not, !   (case-insensitive words)
+--   comparisons =, ==, Equals, Is          !=, NotEquals, IsNot
+--               <, LesserThan              <=, LesserThanOrEquals
+--               >, GreaterThan             >=, GreaterThanOrEquals
+--               =|, StartsWith             ~~, JavaRegex (PCRE, right side
+--                                          must be a string literal)
+--   literals    'text', "text", 42, 1.5, true, false, null
+--   variables   request.header.<name>, request.queryparam.<name>,
+--               request.verb (or request.method), request.path,
+--               request.uri, request.host, request.scheme, client.ip,
+--               consumer.id, consumer.username, consumer.custom_id; any
+--               other name is read from `kong.ctx.shared`, first as a flat
+--               key, then as a dotted path.
+--
+-- Comparing a number with a string compares them as numbers; other mixed
+-- comparisons compare the string forms for (in)equality and are false for
+-- ordering. A variable on its own is true unless it is unset or false.
+
+local request_context = require "kong.plugins.apigee_common.request_context"
+
+local type = type
+local tostring = tostring
+local tonumber = tonumber
+local concat = table.concat
+local format = string.format
+local lower = string.lower
+local sub = string.sub
+
+local _M = {}
+
+---------------------------------------------------------------------------
+-- Lua conditions
+---------------------------------------------------------------------------
+
+-- Read-only views of the standard library, so that a condition cannot
+-- change the real tables
+local function read_only(tbl)
+  return setmetatable({}, { __index = tbl, __newindex = function() error("read-only table", 2) end })
+end
+
+local function lua_env()
+  return {
+    kong = kong,
+    tonumber = tonumber,
+    tostring = tostring,
+    type = type,
+    string = read_only(string),
+    math = read_only(math),
+    table = read_only({ concat = table.concat }),
+  }
+end
+
+local function compile_lua(source)
+  local chunk, err = load("return (" .. source .. "\n)", "=condition", "t", lua_env())
+  if not chunk then
+    return nil, err
+  end
+  return chunk
+end
+
+---------------------------------------------------------------------------
+-- Expression language: tokenizer and parser
+---------------------------------------------------------------------------
+
+local WORD_OPERATORS = {
+  ["and"] = "and",
+  ["or"] = "or",
+  ["not"] = "not",
+  ["equals"] = "eq",
+  ["is"] = "eq",
+  ["notequals"] = "ne",
+  ["isnot"] = "ne",
+  ["lesserthan"] = "lt",
+  ["lesserthanorequals"] = "le",
+  ["greaterthan"] = "gt",
+  ["greaterthanorequals"] = "ge",
+  ["startswith"] = "startswith",
+  ["javaregex"] = "regex",
+}
+
+local SYMBOL_OPERATORS = {
+  { "==", "eq" }, { "!=", "ne" }, { "<=", "le" }, { ">=", "ge" },
+  { "=|", "startswith" }, { "~~", "regex" }, { "&&", "and" }, { "||", "or" },
+  { "=", "eq" }, { "<", "lt" }, { ">", "gt" }, { "!", "not" },
+  { "(", "(" }, { ")", ")" },
+}
+
+local COMPARISONS = {
+  eq = true, ne = true, lt = true, le = true, gt = true, ge = true,
+  startswith = true, regex = true,
+}
+
+local function tokenize(source)
+  local tokens = {}
+  local pos = 1
+  local len = #source
+  while true do
+    pos = source:find("%S", pos)
+    if not pos then
+      break
+    end
+    local c = sub(source, pos, pos)
+
+    if c == "'" or c == '"' then
+      local parts = {}
+      local i = pos + 1
+      while true do
+        local ch = sub(source, i, i)
+        if ch == "" then
+          return nil, "unterminated string at position " .. pos
+        elseif ch == "\\" then
+          parts[#parts + 1] = sub(source, i + 1, i + 1)
+          i = i + 2
+        elseif ch == c then
+          break
+        else
+          parts[#parts + 1] = ch
+          i = i + 1
+        end
+      end
+      tokens[#tokens + 1] = { kind = "literal", value = concat(parts), pos = pos }
+      pos = i + 1
+
+    elseif source:find("^%-?%d", pos) then
+      local number = source:match("^%-?%d+%.?%d*", pos)
+      tokens[#tokens + 1] = { kind = "literal", value = tonumber(number), pos = pos }
+      pos = pos + #number
+
+    elseif source:find("^[%a_]", pos) then
+      local word = source:match("^[%a_][%w_%.%-]*", pos)
+      local key = lower(word)
+      if WORD_OPERATORS[key] then
+        tokens[#tokens + 1] = { kind = WORD_OPERATORS[key], pos = pos }
+      elseif key == "true" or key == "false" then
+        tokens[#tokens + 1] = { kind = "literal", value = key == "true", pos = pos }
+      elseif key == "null" or key == "nil" then
+        tokens[#tokens + 1] = { kind = "null", pos = pos }
+      else
+        tokens[#tokens + 1] = { kind = "variable", name = word, pos = pos }
+      end
+      pos = pos + #word
+
+    else
+      local matched
+      for _, op in ipairs(SYMBOL_OPERATORS) do
+        if sub(source, pos, pos + #op[1] - 1) == op[1] then
+          matched = op
+          break
+        end
+      end
+      if not matched then
+        return nil, "unexpected character '" .. c .. "' at position " .. pos
+      end
+      tokens[#tokens + 1] = { kind = matched[2], pos = pos }
+      pos = pos + #matched[1]
+    end
+
+    if pos > len then
+      break
+    end
+  end
+  tokens[#tokens + 1] = { kind = "end", pos = len + 1 }
+  return tokens
+end
+
+-- Recursive descent over the tokens; returns the AST:
+--   { op = "or"|"and", left, right }   { op = "not", operand }
+--   { op = <comparison>, left, right } { op = "literal", value }
+--   { op = "variable", name }
+local function parse(tokens)
+  local index = 1
+
+  local function peek()
+    return tokens[index]
+  end
+
+  local function take()
+    local token = tokens[index]
+    index = index + 1
+    return token
+  end
+
+  local function fail(token, message)
+    error({ message = message .. " at position " .. token.pos }, 0)
+  end
+
+  local parse_or
+
+  local function parse_operand()
+    local token = take()
+    if token.kind == "literal" then
+      return { op = "literal", value = token.value }
+    elseif token.kind == "null" then
+      return { op = "literal", value = nil }
+    elseif token.kind == "variable" then
+      return { op = "variable", name = token.name }
+    elseif token.kind == "(" then
+      local node = parse_or()
+      if take().kind ~= ")" then
+        fail(token, "unbalanced parenthesis")
+      end
+      return node
+    end
+    fail(token, "expected a value")
+  end
+
+  local function parse_comparison()
+    local left = parse_operand()
+    local token = peek()
+    if not COMPARISONS[token.kind] then
+      return left
+    end
+    take()
+    local right = parse_operand()
+    if token.kind == "regex" and (right.op ~= "literal" or type(right.value) ~= "string") then
+      fail(token, "the pattern of a regular expression match must be a string")
+    end
+    return { op = token.kind, left, right }
+  end
+
+  local function parse_not()
+    if peek().kind == "not" then
+      take()
+      return { op = "not", parse_not() }
+    end
+    return parse_comparison()
+  end
+
+  local function parse_and()
+    local node = parse_not()
+    while peek().kind == "and" do
+      take()
+      node = { op = "and", node, parse_not() }
+    end
+    return node
+  end
+
+  parse_or = function()
+    local node = parse_and()
+    while peek().kind == "or" do
+      take()
+      node = { op = "or", node, parse_and() }
+    end
+    return node
+  end
+
+  local ok, result = pcall(function()
+    local node = parse_or()
+    if peek().kind ~= "end" then
+      fail(peek(), "unexpected token")
+    end
+    return node
+  end)
+  if not ok then
+    return nil, type(result) == "table" and result.message or tostring(result)
+  end
+  return result
+end
+
+---------------------------------------------------------------------------
+-- Expression language: variables and comparison helpers
+---------------------------------------------------------------------------
+
+local function nested_value(tbl, path)
+  local current = tbl
+  for part in path:gmatch("[^.]+") do
+    if type(current) ~= "table" then
+      return nil
+    end
+    current = current[part]
+  end
+  return current
+end
+
+local FIXED_VARIABLES = {
+  ["request.verb"] = function() return kong.request.get_method() end,
+  ["request.method"] = function() return kong.request.get_method() end,
+  ["request.path"] = function() return kong.request.get_path() end,
+  ["request.uri"] = function() return kong.request.get_path_with_query() end,
+  ["request.host"] = function() return kong.request.get_host() end,
+  ["request.scheme"] = function() return kong.request.get_scheme() end,
+  ["client.ip"] = function() return kong.client.get_ip() end,
+}
+
+local CONSUMER_FIELDS = {
+  ["consumer.id"] = "id",
+  ["consumer.username"] = "username",
+  ["consumer.custom_id"] = "custom_id",
+}
+
+-- Returns the accessor of a variable and the key identifying it, so that a
+-- variable used several times is read once.
+local function accessor(name)
+  local key = lower(name)
+  if FIXED_VARIABLES[key] then
+    return FIXED_VARIABLES[key], key
+  end
+
+  local consumer_field = CONSUMER_FIELDS[key]
+  if consumer_field then
+    return function()
+      local consumer = kong.client.get_consumer()
+      return consumer and consumer[consumer_field]
+    end, key
+  end
+
+  if sub(key, 1, 15) == "request.header." then
+    local header = sub(key, 16)
+    return function()
+      return request_context.get_header(header)
+    end, "request.header." .. header
+  end
+
+  if sub(key, 1, 19) == "request.queryparam." then
+    local param = sub(name, 20)
+    return function()
+      return request_context.get_query_arg(param)
+    end, "request.queryparam." .. param
+  end
+
+  return function()
+    local shared = kong.ctx.shared
+    local value = shared[name]
+    if value == nil then
+      value = nested_value(shared, name)
+    end
+    return value
+  end, "shared:" .. name
+end
+
+-- Brings mixed operands to comparable types
+local function coerce(a, b)
+  local ta, tb = type(a), type(b)
+  if ta == tb then
+    return a, b
+  end
+  if ta == "number" and tb == "string" then
+    return a, tonumber(b)
+  elseif ta == "string" and tb == "number" then
+    return tonumber(a), b
+  end
+  if a == nil or b == nil then
+    return a, b
+  end
+  return tostring(a), tostring(b)
+end
+
+local function ordered(a, b)
+  local ta = type(a)
+  return ta == type(b) and (ta == "number" or ta == "string")
+end
+
+local HELPERS = {
+  eq = function(a, b)
+    a, b = coerce(a, b)
+    return a == b
+  end,
+  ne = function(a, b)
+    a, b = coerce(a, b)
+    return a ~= b
+  end,
+  lt = function(a, b)
+    a, b = coerce(a, b)
+    return ordered(a, b) and a < b
+  end,
+  le = function(a, b)
+    a, b = coerce(a, b)
+    return ordered(a, b) and a <= b
+  end,
+  gt = function(a, b)
+    a, b = coerce(a, b)
+    return ordered(a, b) and a > b
+  end,
+  ge = function(a, b)
+    a, b = coerce(a, b)
+    return ordered(a, b) and a >= b
+  end,
+  startswith = function(a, b)
+    if a == nil or b == nil then
+      return false
+    end
+    a, b = tostring(a), tostring(b)
+    return sub(a, 1, #b) == b
+  end,
+  regex = function(a, pattern)
+    if a == nil then
+      return false
+    end
+    return ngx.re.find(tostring(a), pattern, "jo") ~= nil
+  end,
+  truthy = function(a)
+    return a ~= nil and a ~= false
+  end,
+}
+
+local HELPER_NAMES = { "eq", "ne", "lt", "le", "gt", "ge", "startswith", "regex", "truthy" }
+
+---------------------------------------------------------------------------
+-- Expression language: code generation
+---------------------------------------------------------------------------
+
+local function literal_code(value)
+  if value == nil then
+    return "nil"
+  elseif type(value) == "string" then
+    return format("%q", value)
+  elseif type(value) == "number" then
+    return format("%.17g", value)
+  end
+  return tostring(value)
+end
+
+-- Canonical text of a node, identical for equal subexpressions. Variables
+-- get their accessor here.
+local function node_key(node)
+  local key = node.key
+  if not key then
+    local op = node.op
+    if op == "literal" then
+      key = literal_code(node.value)
+    elseif op == "variable" then
+      local fn, variable_key = accessor(node.name)
+      node.accessor = fn
+      key = "$" .. variable_key
+    else
+      key = op .. "(" .. node_key(node[1]) .. (node[2] and ", " .. node_key(node[2]) or "") .. ")"
+    end
+    node.key = key
+  end
+  return key
+end
+
+-- Counts the uses of each subexpression. The parts of a repeated
+-- subexpression are counted once, as they are computed only with it.
+local function count_uses(node, uses)
+  local key = node_key(node)
+  uses[key] = (uses[key] or 0) + 1
+  if uses[key] == 1 then
+    for _, child in ipairs(node) do
+      count_uses(child, uses)
+    end
+  end
+end
+
+-- Locals available for shared subexpressions, below LuaJIT's limit of 200
+-- per function; further ones are computed where they are used
+local MAX_SHARED = 180
+
+-- Generates one function from the ASTs of a list of conditions. Variables
+-- and other subexpressions used more than once are computed once, into
+-- locals, before the first condition using them. With `single`, the
+-- function returns the value of the only condition; otherwise the index of
+-- the first true condition, or nil.
+local function generate(asts, single)
+  local uses = {}
+  for _, ast in ipairs(asts) do
+    count_uses(ast, uses)
+  end
+
+  local accessors = {}
+  local accessor_index = {}
+  local shared = {}
+  local shared_count = 0
+  local lines = {}
+
+  local function code_of(node)
+    local name = shared[node.key]
+    if name then
+      return name
+    end
+    local op = node.op
+    if op == "literal" then
+      return literal_code(node.value)
+    elseif op == "variable" then
+      local index = accessor_index[node.key]
+      if not index then
+        index = #accessors + 1
+        accessors[index] = node.accessor
+        accessor_index[node.key] = index
+      end
+      return "a[" .. index .. "]()"
+    elseif op == "and" or op == "or" then
+      return "(" .. code_of(node[1]) .. " " .. op .. " " .. code_of(node[2]) .. ")"
+    elseif op == "not" then
+      return "(not " .. code_of(node[1]) .. ")"
+    end
+    return op .. "(" .. code_of(node[1]) .. ", " .. code_of(node[2]) .. ")"
+  end
+
+  -- Parts first, so that a shared subexpression uses the shared parts
+  local function hoist(node)
+    if node.op == "literal" or shared[node.key] then
+      return
+    end
+    for _, child in ipairs(node) do
+      hoist(child)
+    end
+    if uses[node.key] > 1 and shared_count < MAX_SHARED then
+      shared_count = shared_count + 1
+      local name = "s" .. shared_count
+      lines[#lines + 1] = "  local " .. name .. " = " .. code_of(node) .. "\n"
+      shared[node.key] = name
+    end
+  end
+
+  for i, ast in ipairs(asts) do
+    hoist(ast)
+    local test = code_of(ast)
+    if single then
+      -- A lone variable or literal is tested for truthiness
+      if ast.op == "variable" or ast.op == "literal" then
+        test = "truthy(" .. test .. ")"
+      end
+      lines[#lines + 1] = "  return " .. test .. "\n"
+    else
+      lines[#lines + 1] = "  if " .. test .. " then return " .. i .. " end\n"
+    end
+  end
+
+  local code = "local a, " .. concat(HELPER_NAMES, ", ") .. " = ...\nreturn function()\n"
+    .. concat(lines) .. "end\n"
+  local chunk, err = load(code, "=condition", "t", {})
+  if not chunk then
+    return nil, err
+  end
+  local helpers = {}
+  for i, name in ipairs(HELPER_NAMES) do
+    helpers[i] = HELPERS[name]
+  end
+  return chunk(accessors, unpack(helpers))
+end
+
+-- Validates the patterns of regular expression matches up front
+local function check_patterns(node)
+  if node.op == "regex" and ngx and ngx.re then
+    local pattern = node[2].value
+    local ok, from, _, err = pcall(ngx.re.find, "", pattern, "jo")
+    if not ok or err then
+      return nil, "invalid regular expression '" .. pattern .. "': " .. tostring(ok and err or from)
+    end
+  end
+  for _, child in ipairs(node) do
+    local ok, err = check_patterns(child)
+    if not ok then
+      return nil, err
+    end
+  end
+  return true
+end
+
+local function parse_expression(source)
+  local tokens, err = tokenize(source)
+  if not tokens then
+    return nil, err
+  end
+  local ast
+  ast, err = parse(tokens)
+  if not ast then
+    return nil, err
+  end
+  local ok
+  ok, err = check_patterns(ast)
+  if not ok then
+    return nil, err
+  end
+  return ast
+end
+
+---------------------------------------------------------------------------
+
+--- Compiles a condition into a function of no arguments returning the
+-- condition's value.
+-- @param source string The condition.
+-- @param syntax string `lua` (default) or `expression`.
+-- @return the function, or nil and an error.
+function _M.compile(source, syntax)
+  if syntax ~= "expression" then
+    return compile_lua(source)
+  end
+  local ast, err = parse_expression(source)
+  if not ast then
+    return nil, err
+  end
+  return generate({ ast }, true)
+end
+
+--- Compiles an ordered list of conditions together, into a function of no
+-- arguments returning the index of the first true condition, or nil when
+-- none is. With the `expression` syntax, variables and subexpressions
+-- shared by several conditions are computed once per call.
+-- @param sources table The conditions.
+-- @param syntax string `lua` (default) or `expression`.
+-- @return the function, or nil and an error naming the faulty condition.
+function _M.compile_rules(sources, syntax)
+  local compiled = {}
+  for i, source in ipairs(sources) do
+    local result, err
+    if syntax == "expression" then
+      result, err = parse_expression(source)
+    else
+      result, err = compile_lua(source)
+    end
+    if not result then
+      return nil, "rule " .. i .. ": " .. tostring(err)
+    end
+    compiled[i] = result
+  end
+
+  if syntax == "expression" then
+    return generate(compiled)
+  end
+  local count = #compiled
+  return function()
+    for i = 1, count do
+      if compiled[i]() then
+        return i
+      end
+    end
+    return nil
+  end
+end
+
+--- Checks that a condition, or a list of conditions (see `compile_rules`),
+-- compiles.
+-- @param source string|table The condition, or the list of conditions.
+-- @return true, or nil and an error.
+function _M.validate(source, syntax)
+  local compile = type(source) == "table" and _M.compile_rules or _M.compile
+  local fn, err = compile(source, syntax)
+  if not fn then
+    return nil, "invalid condition: " .. tostring(err)
+  end
+  return true
+end
+
+return _M
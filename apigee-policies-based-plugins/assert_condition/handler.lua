@@ -1,11 +1,36 @@
 local kong = require "kong"
 local cjson = require "cjson"
+local condition = require "kong.plugins.assert-condition.condition"
 
 local AssertConditionHandler = {}
 
 AssertConditionHandler.PRIORITY = 100
 AssertConditionHandler.VERSION = kong.version
 
+-- Compiled conditions or rules, by plugin configuration. A configuration table is
+-- replaced when the plugin is updated, so entries never go stale and are
+-- collected with the configuration.
+local compiled_conditions = setmetatable({}, { __mode = "k" })
+
+local function get_condition(conf)
+  local compiled = compiled_conditions[conf]
+  if not compiled then
+    local fn, err
+    if conf.rules then
+      local sources = {}
+      for i, rule in ipairs(conf.rules) do
+        sources[i] = rule.condition
+      end
+      fn, err = condition.compile_rules(sources, conf.condition_syntax)
+    else
+      fn, err = condition.compile(conf.condition, conf.condition_syntax)
+    end
+    compiled = { fn = fn, err = err }
+    compiled_conditions[conf] = compiled
+  end
+  return compiled.fn, compiled.err
+end
+
 local function handle_error(conf, message)
   kong.log.err(message)
   if not conf.on_error_continue then
@@ -13,15 +38,40 @@ local function handle_error(conf, message)
   end
 end
 
-local function handle_abort(conf)
-  return kong.response.exit(conf.abort_status, { message = conf.abort_message })
+local function handle_abort(conf, rule)
+  local status = rule and rule.abort_status or conf.abort_status
+  local message = rule and rule.abort_message or conf.abort_message
+  return kong.response.exit(status, { message = message })
+end
+
+-- Applies the action of the first rule whose condition is true; the
+-- request proceeds when none is.
+local function apply_rules(conf, index)
+  if not index then
+    kong.log.debug("Assert Condition: No rule matched. Request proceeds.")
+    return
+  end
+  local rule = conf.rules[index]
+  kong.log.debug("Assert Condition: Rule ", index, " matched. Action: ", rule.action)
+  if rule.action == "abort" then
+    return handle_abort(conf, rule)
+  end
 end
 
 function AssertConditionHandler:access(conf)
-  local ok, result = kong.run_in_sandbox(conf.condition, { kong = kong })
+  local fn, compile_err = get_condition(conf)
+  if not fn then
+    return handle_error(conf, "Invalid condition: " .. tostring(compile_err))
+  end
+
+  local ok, result = pcall(fn)
 
   if not ok then
-    return handle_error(conf, "Error during condition evaluation: " .. result)
+    return handle_error(conf, "Error during condition evaluation: " .. tostring(result))
+  end
+
+  if conf.rules then
+    return apply_rules(conf, result)
   end
 
   if not result then -- Condition evaluated to false or nil
@@ -1,4 +1,5 @@
 local typedefs = require "kong.db.schema.typedefs"
+local condition = require "kong.plugins.assert-condition.condition"
 
 return {
   name = "assert-condition",
@@ -13,16 +14,62 @@ return {
           {
             condition = {
               type = "string",
-              required = true,
-              description = "A Lua expression string that evaluates to true or false. Kong variables (e.g., `kong.request.get_header('X-My-Header')`) and shared context (`kong.ctx.shared.my_var`) can be used.",
+              description = "An expression that evaluates to true or false, in the syntax given by `condition_syntax`. With the `lua` syntax, Kong variables (e.g., `kong.request.get_header('X-My-Header')`) and shared context (`kong.ctx.shared.my_var`) can be used. The condition is compiled once per configuration and checked when the plugin is configured. Exactly one of this and `rules` must be set.",
+            },
+          },
+          {
+            rules = {
+              type = "array",
+              description = "A decision table: an ordered list of rules, each a condition and the action to take when it is true. The rules are compiled together and evaluated in order, and the first rule whose condition is true decides; the request proceeds when none is. Conditions use the syntax given by `condition_syntax`; with the `expression` syntax, variables and subexpressions shared by several rules are computed once. Exactly one of this and `condition` must be set.",
+              elements = {
+                type = "record",
+                fields = {
+                  {
+                    condition = {
+                      type = "string",
+                      required = true,
+                      description = "The rule's condition.",
+                    },
+                  },
+                  {
+                    action = {
+                      type = "string",
+                      required = true,
+                      enum = { "abort", "continue" },
+                      description = "The action to take when the condition is true. 'abort' terminates the request, 'continue' lets it proceed without evaluating the following rules.",
+                    },
+                  },
+                  {
+                    abort_status = {
+                      type = "number",
+                      between = { 400, 599 },
+                      description = "The HTTP status code to return when the rule aborts. Defaults to the plugin's `abort_status`.",
+                    },
+                  },
+                  {
+                    abort_message = {
+                      type = "string",
+                      description = "The response body message to return when the rule aborts. Defaults to the plugin's `abort_message`.",
+                    },
+                  },
+                },
+              },
+            },
+          },
+          {
+            condition_syntax = {
+              type = "string",
+              default = "lua",
+              enum = { "lua", "expression" },
+              description = "The syntax of `condition`: `lua` for a Lua expression run in a sandbox exposing `kong`, or `expression` for Apigee-style conditions such as `request.verb = \"POST\" and request.header.x-api-version >= 2`.",
             },
           },
           {
             on_false_action = {
               type = "string",
-              required = true,
+              default = "abort",
               enum = { "abort", "continue" },
-              description = "The action to take if the 'condition' evaluates to false. 'abort' terminates the request, 'continue' allows it to proceed.",
+              description = "The action to take if the 'condition' evaluates to false. 'abort' terminates the request, 'continue' allows it to proceed. Not used with `rules`.",
             },
           },
           {
@@ -51,4 +98,30 @@ return {
       },
     },
   },
+  entity_checks = {
+    { only_one_of = { "config.condition", "config.rules" } },
+    { at_least_one_of = { "config.condition", "config.rules" } },
+    {
+      custom_entity_check = {
+        field_sources = { "config.condition", "config.condition_syntax" },
+        fn = function(entity)
+          local config = entity.config
+          return condition.validate(config.condition, config.condition_syntax)
+        end,
+      },
+    },
+    {
+      custom_entity_check = {
+        field_sources = { "config.rules", "config.condition_syntax" },
+        fn = function(entity)
+          local config = entity.config
+          local sources = {}
+          for i, rule in ipairs(config.rules) do
+            sources[i] = rule.condition
+          end
+          return condition.validate(sources, config.condition_syntax)
+        end,
+      },
+    },
+  },
 }
\ No newline at end of file
@@ -0,0 +1,106 @@
+describe("assert-condition condition", function()
+  local condition, headers, shared, header_reads
+  local original_kong = _G.kong
+
+  setup(function()
+    _G.kong = {
+      request = {
+        get_method = function() return "POST" end,
+        get_path = function() return "/orders/42" end,
+      },
+      client = {
+        get_ip = function() return "10.0.0.1" end,
+        get_consumer = function() return { username = "alice" } end,
+      },
+      ctx = {},
+    }
+    package.loaded["kong.plugins.apigee_common.request_context"] = {
+      get_header = function(name)
+        header_reads[name] = (header_reads[name] or 0) + 1
+        return headers[name]
+      end,
+      get_query_arg = function() return nil end,
+    }
+    package.loaded["kong.plugins.assert-condition.condition"] = nil
+    condition = require "kong.plugins.assert-condition.condition"
+  end)
+
+  teardown(function()
+    _G.kong = original_kong
+    package.loaded["kong.plugins.apigee_common.request_context"] = nil
+    package.loaded["kong.plugins.assert-condition.condition"] = nil
+  end)
+
+  before_each(function()
+    headers = { ["x-api-version"] = "2", ["content-type"] = "application/json; charset=utf-8" }
+    shared = { role = "admin", quota = { remaining = 5 } }
+    kong.ctx.shared = shared
+    header_reads = {}
+  end)
+
+  it("compiles Lua conditions once, with access to kong only", function()
+    local fn = assert(condition.compile("kong.request.get_method() == 'POST'"))
+    assert.is_true(fn())
+    local leak = assert(condition.compile("os == nil and io == nil and require == nil"))
+    assert.is_true(leak())
+  end)
+
+  it("rejects statements and syntax errors in Lua conditions", function()
+    assert.is_nil(condition.compile("x = 1"))
+    local ok, err = condition.validate("kong.request.get_method( ==")
+    assert.is_nil(ok)
+    assert.matches("invalid condition", err)
+  end)
+
+  it("evaluates expressions with precomputed accessors", function()
+    local fn = assert(condition.compile(
+      'request.verb = "POST" and request.header.Content-Type StartsWith "application/json"', "expression"))
+    assert.is_true(fn())
+    headers["content-type"] = "text/xml"
+    assert.is_false(fn())
+  end)
+
+  it("compares numbers with numeric strings as numbers", function()
+    assert.is_true(assert(condition.compile("request.header.x-api-version >= 2", "expression"))())
+    assert.is_true(assert(condition.compile("request.header.x-api-version != '3'", "expression"))())
+    assert.is_false(assert(condition.compile("request.header.x-missing > 1", "expression"))())
+  end)
+
+  it("reads other variables from the shared context", function()
+    local fn = assert(condition.compile("role == 'admin' && !(quota.remaining < 1) and consumer.username Is 'alice'", "expression"))
+    assert.is_true(fn())
+    shared.quota.remaining = 0
+    assert.is_false(fn())
+    assert.is_true(assert(condition.compile("not unset.variable", "expression"))())
+  end)
+
+  it("reports expression syntax errors with their position", function()
+    local ok, err = condition.validate("request.verb = ", "expression")
+    assert.is_nil(ok)
+    assert.matches("expected a value at position 16", err)
+    assert.is_nil(condition.compile("role == 'admin' ; os.exit()", "expression"))
+    assert.is_nil(condition.compile("request.path ~~ request.verb", "expression"))
+  end)
+
+  it("returns the first matching rule, computing shared subexpressions once", function()
+    local rules = assert(condition.compile_rules({
+      "request.header.x-api-version < 2 and request.verb = 'POST'",
+      "request.header.x-api-version < 2 and role != 'admin'",
+      "role = 'admin'",
+      "request.header.x-other = 'never read'",
+    }, "expression"))
+    assert.equals(3, rules())
+    assert.equals(1, header_reads["x-api-version"])
+    assert.is_nil(header_reads["x-other"])
+    shared.role = "user"
+    assert.is_nil(rules())
+  end)
+
+  it("evaluates Lua rules in order and names the rule that does not compile", function()
+    local rules = assert(condition.compile_rules({ "false", "kong.ctx.shared.role == 'admin'", "error('not reached')" }))
+    assert.equals(2, rules())
+    local ok, err = condition.validate({ "true", "request.verb = " }, "expression")
+    assert.is_nil(ok)
+    assert.matches("rule 2: expected a value", err)
+  end)
+end)
@@ -1,3 +1,5 @@
+local request_context = require "kong.plugins.apigee_common.request_context"
+
 local policies = {
   local_policy = require("kong.plugins.apigee-policies-based-plugins.concurrent-rate-limit.policies.local"),
   cluster_policy = require("kong.plugins.apigee-policies-based-plugins.concurrent-rate-limit.policies.cluster")
@@ -8,9 +10,9 @@ local function get_counter_key(conf)
   local key_value
 
   if conf.counter_key_source_type == "header" then
-    key_value = kong.request.get_header(conf.counter_key_source_name)
+    key_value = request_context.get_header(conf.counter_key_source_name)
   elseif conf.counter_key_source_type == "query" then
-    key_value = kong.request.get_query_arg(conf.counter_key_source_name)
+    key_value = request_context.get_query_arg(conf.counter_key_source_name)
   elseif conf.counter_key_source_type == "path" then
     if conf.counter_key_source_name == "." then
       key_value = kong.request.get_uri()
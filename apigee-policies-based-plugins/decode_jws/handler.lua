@@ -1,4 +1,5 @@
 local cjson = require "cjson"
+local request_context = require "kong.plugins.apigee_common.request_context"
 
 -- Helper to safely get value from JSON body using simple dot notation
 local function get_json_value(json_table, path)
@@ -21,13 +22,13 @@ end
 local function get_value_from_source(source_type, source_name)
   local value = nil
   if source_type == "header" then
-    value = kong.request.get_header(source_name)
+    value = request_context.get_header(source_name)
     -- Handle Authorization: Bearer token_string, etc. if applicable
     if value and source_name:lower() == "authorization" and value:lower():sub(1, 7) == "bearer " then
       value = value:sub(8)
     end
   elseif source_type == "query" then
-    value = kong.request.get_query_arg(source_name)
+    value = request_context.get_query_arg(source_name)
   elseif source_type == "body" then
     local raw_body = kong.request.get_raw_body()
     if raw_body then
@@ -1,5 +1,7 @@
 local cjson = require "cjson"
 local jwt = require "resty.jwt"
+local request_context = require "kong.plugins.apigee_common.request_context"
+local revocation = require "kong.plugins.apigee_common.revocation"
 
 -- Helper to safely get value from JSON body using simple dot notation
 local function get_json_value(json_table, path)
@@ -22,12 +24,12 @@ end
 local function get_value_from_source(source_type, source_name)
   local value
   if source_type == "header" then
-    value = kong.request.get_header(source_name)
+    value = request_context.get_header(source_name)
     if value and source_name:lower() == "authorization" and value:lower():sub(1, 7) == "bearer " then
       value = value:sub(8)
     end
   elseif source_type == "query" then
-    value = kong.request.get_query_arg(source_name)
+    value = request_context.get_query_arg(source_name)
   elseif source_type == "body" then
     local raw_body = kong.request.get_raw_body()
     if raw_body and raw_body ~= "" then
@@ -48,6 +50,10 @@ local DecodeJWTHandler = {
   PRIORITY = 1000
 }
 
+function DecodeJWTHandler:init_worker()
+  revocation.init_worker()
+end
+
 function DecodeJWTHandler:access(conf)
   local jwt_string = get_value_from_source(conf.jwt_source_type, conf.jwt_source_name)
   if not jwt_string or jwt_string == "" then
@@ -58,6 +64,11 @@ function DecodeJWTHandler:access(conf)
     return
   end
 
+  if conf.reject_revoked_tokens and revocation.is_revoked(jwt_string) then
+    kong.log.info("DecodeJWT: JWT has been revoked.")
+    return kong.response.exit(conf.revoked_token_status, { message = conf.revoked_token_body })
+  end
+
   -- Use the library to decode the JWT without verification
   local decoded_jwt = jwt:load_jwt(jwt_string)
 
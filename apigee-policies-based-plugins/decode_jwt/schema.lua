@@ -1,4 +1,6 @@
 local typedefs = require "kong.db.schema.typedefs"
+local apigee_typedefs = require "kong.plugins.apigee_common.typedefs"
+local revocation = require "kong.plugins.apigee_common.revocation"
 
 return {
   name = "decode-jwt",
@@ -64,6 +66,15 @@ return {
               description = "Optional: If set, the entire decoded JWT header (as a Lua table) will be stored in `kong.ctx.shared` under this key.",
             },
           },
+          {
+            reject_revoked_tokens = {
+              type = "boolean",
+              default = false,
+              description = "If `true`, a JWT on the revocation list maintained by `revoke-oauth-v2` is rejected with `revoked_token_status` and `revoked_token_body`, regardless of `on_error_continue`. Requires the `apigee_revocations` shared dict.",
+            },
+          },
+          { revoked_token_status = apigee_typedefs.revoked_token_status },
+          { revoked_token_body = apigee_typedefs.revoked_token_body },
           {
             on_error_status = {
               type = "number",
@@ -90,4 +101,11 @@ return {
       },
     },
   },
+  entity_checks = {
+    apigee_typedefs.shared_dict_check({ "config.reject_revoked_tokens" }, function(config)
+      if config.reject_revoked_tokens then
+        return revocation.SHM
+      end
+    end),
+  },
 }
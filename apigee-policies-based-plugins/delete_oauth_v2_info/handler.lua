@@ -1,4 +1,6 @@
 local cjson = require "cjson"
+local request_context = require "kong.plugins.apigee_common.request_context"
+local token_cache = require "kong.plugins.apigee_common.token_cache"
 
 -- Helper to safely get value from JSON body using simple dot notation
 local function get_json_value(json_table, path)
@@ -21,12 +23,12 @@ end
 local function get_value_from_source(source_type, source_name)
   local value
   if source_type == "header" then
-    value = kong.request.get_header(source_name)
+    value = request_context.get_header(source_name)
     if value and source_name:lower() == "authorization" and value:lower():sub(1, 7) == "bearer " then
       value = value:sub(8)
     end
   elseif source_type == "query" then
-    value = kong.request.get_query_arg(source_name)
+    value = request_context.get_query_arg(source_name)
   elseif source_type == "body" then
     local raw_body = kong.request.get_raw_body()
     if raw_body and raw_body ~= "" then
@@ -72,6 +74,14 @@ function DeleteOAuthV2InfoHandler:access(conf)
     return
   end
 
+  -- The token's cached metadata must not outlive it
+  if conf.token_cache_enabled then
+    local _, cache_err = token_cache.delete(token_cache.hash(token_string), conf.token_cache_shm)
+    if cache_err then
+      kong.log.warn("DeleteOAuthV2Info: Could not evict token metadata from the cache: ", cache_err)
+    end
+  end
+
   kong.log.notice("DeleteOAuthV2Info: Successfully deleted OAuth 2.0 access token.")
 end
 
@@ -1,4 +1,5 @@
 local typedefs = require "kong.db.schema.typedefs"
+local apigee_typedefs = require "kong.plugins.apigee_common.typedefs"
 
 return {
   name = "delete-oauth-v2-info",
@@ -33,8 +34,25 @@ return {
               description = "If `true`, request processing will continue even if the token cannot be deleted. If `false`, the request may be terminated on failure.",
             },
           },
+          {
+            token_cache_enabled = {
+              type = "boolean",
+              default = false,
+              description = "If `true`, the deleted token's entry is evicted from the token metadata cache. Enable it when `get-oauth-v2-info` or `set-oauth-v2-info` cache tokens.",
+            },
+          },
+          {
+            token_cache_shm = {
+              type = "string",
+              default = "apigee_token_cache",
+              description = "The `lua_shared_dict` holding the token metadata cache of the OAuth plugins; it must be declared with `nginx_http_lua_shared_dict` when `token_cache_enabled` is `true`. The deleted token's entry is evicted from it.",
+            },
+          },
         },
       },
     },
   },
+  entity_checks = {
+    apigee_typedefs.token_cache_check,
+  },
 }
@@ -1,9 +1,17 @@
 local cjson = require "cjson"
+local callout = require "kong.plugins.apigee_common.callout"
 
 local ExternalCalloutHandler = {
   PRIORITY = 1000
 }
 
+local function send_in_background(premature, url, callout_opts)
+  local _, err = callout.request(url, callout_opts)
+  if err then
+    kong.log.err("ExternalCallout (async): Call to '", url, "' failed: ", err)
+  end
+end
+
 function ExternalCalloutHandler:access(conf)
   local request_body_for_external_service = nil
 
@@ -34,25 +42,20 @@ function ExternalCalloutHandler:access(conf)
     end
   end
 
-  local res, err = kong.http.client.request({
+  local callout_opts = {
     method = conf.method,
-    url = conf.callout_url,
     headers = conf.headers,
     body = request_body_for_external_service,
-    timeout = 10000,          -- Default timeout for callout
-    connect_timeout = 5000,
+    timeout = conf.callout_timeout,
+    connect_timeout = conf.callout_connect_timeout,
     ssl_verify = true,        -- Default to SSL verification
-    follow_redirects = false, -- Default to not follow redirects
-  })
+    keepalive_timeout = conf.callout_keepalive_timeout,
+    keepalive_pool_size = conf.callout_keepalive_pool_size,
+  }
 
   if conf.wait_for_response then
-    local body, body_err
-    if res then
-      body, body_err = res:read_body()
-      if body_err then
-        kong.log.err("ExternalCallout: External service '", conf.callout_url, "' failed to read body: ", body_err)
-      end
-    end
+    local res, err = callout.request(conf.callout_url, callout_opts)
+    local body = res and res.body
 
     local callout_succeeded = true
     if not res then
@@ -80,6 +83,11 @@ function ExternalCalloutHandler:access(conf)
     end
     kong.log.debug("ExternalCallout: Call to external service '", conf.callout_url, "' completed.")
   else -- Fire and forget
+    local ok, err = ngx.timer.at(0, send_in_background, conf.callout_url, callout_opts)
+    if not ok then
+      kong.log.err("ExternalCallout: Failed to create async timer for callout: ", err)
+      return
+    end
     kong.log.debug("ExternalCallout: Fire-and-forget call to '", conf.callout_url, "' initiated. Not waiting for response.")
   end
 end
@@ -1,4 +1,5 @@
 local typedefs = require "kong.db.schema.typedefs"
+local apigee_typedefs = require "kong.plugins.apigee_common.typedefs"
 
 return {
   name = "external-callout",
@@ -60,6 +61,10 @@ return {
               description = "Optional: If set and `wait_for_response` is `true`, the external service's full response (status, headers, body) will be stored in `kong.ctx.shared` under this key, as a Lua table.",
             },
           },
+          { callout_timeout = apigee_typedefs.callout_timeout },
+          { callout_connect_timeout = apigee_typedefs.callout_connect_timeout },
+          { callout_keepalive_timeout = apigee_typedefs.callout_keepalive_timeout },
+          { callout_keepalive_pool_size = apigee_typedefs.callout_keepalive_pool_size },
           {
             on_error_status = {
               type = "number",
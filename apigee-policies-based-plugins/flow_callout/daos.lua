@@ -0,0 +1,68 @@
+local typedefs = require "kong.db.schema.typedefs"
+
+return {
+  shared_flows = {
+    name = "shared_flows",
+    primary_key = { "id" },
+    endpoint_key = "name",
+    -- Lets kong.cache entries keyed by name be invalidated cluster-wide
+    cache_key = { "name" },
+    generate_admin_api = true,
+    fields = {
+      { id = typedefs.uuid },
+      { created_at = typedefs.auto_timestamp_s },
+      {
+        name = {
+          type = "string",
+          required = true,
+          unique = true,
+          description = "The name flow-callout refers to in `shared_flow_name`.",
+        },
+      },
+      {
+        steps = {
+          type = "array",
+          required = true,
+          len_min = 1,
+          description = "The plugins of the shared flow, in execution order.",
+          elements = {
+            type = "record",
+            fields = {
+              {
+                plugin = {
+                  type = "string",
+                  required = true,
+                  description = "Name of an enabled plugin, e.g. `assert-condition`.",
+                },
+              },
+              {
+                config = {
+                  type = "string",
+                  default = "{}",
+                  description = "The plugin's configuration as a JSON object, as it would be given to the Admin API.",
+                },
+              },
+            },
+          },
+        },
+      },
+    },
+    entity_checks = {
+      {
+        custom_entity_check = {
+          field_sources = { "steps" },
+          fn = function(entity)
+            local shared_flow = require "kong.plugins.flow-callout.shared_flow"
+            for _, step in ipairs(entity.steps) do
+              local _, err = shared_flow.process_step(step)
+              if err then
+                return nil, err
+              end
+            end
+            return true
+          end,
+        },
+      },
+    },
+  },
+}
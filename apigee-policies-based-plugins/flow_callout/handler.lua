@@ -1,9 +1,139 @@
+local request_context = require "kong.plugins.apigee_common.request_context"
+local shared_flow = require "kong.plugins.flow-callout.shared_flow"
+
+local PLUGIN_NAME = "flow-callout"
+
+-- Resolved shared flow services, by name. Entries are dropped on service
+-- CRUD events; the TTL bounds staleness for changes made on other nodes,
+-- whose entity events do not reach this one.
+local SERVICE_CACHE_TTL = 60
+local SERVICE_MISS_TTL = 5
+local services = {}
+
+-- Read size when streaming a request body that nginx buffered to disk
+local BODY_CHUNK_SIZE = 64 * 1024
+
 local FlowCalloutHandler = {
   PRIORITY = 1000,
 }
 
+local function invalidate_service(data)
+  local entity = data and data.entity
+  local old_entity = data and data.old_entity
+  if entity and entity.name then
+    services[entity.name] = nil
+  end
+  if old_entity and old_entity.name then
+    services[old_entity.name] = nil
+  end
+end
+
+function FlowCalloutHandler:init_worker()
+  kong.worker_events.register(invalidate_service, "crud", "services")
+  -- A declarative (DB-less) reload replaces every service at once
+  kong.worker_events.register(function()
+    services = {}
+  end, "declarative", "reconfigure")
+end
+
+local function get_service(name)
+  local cached = services[name]
+  local now = ngx.now()
+  if cached and cached.expires > now then
+    return cached.service
+  end
+
+  local service, err = kong.db.services:select_by_name(name)
+  if err then
+    return nil, err -- Lookup failures are not cached
+  end
+  services[name] = {
+    service = service,
+    expires = now + (service and SERVICE_CACHE_TTL or SERVICE_MISS_TTL),
+  }
+  return service
+end
+
+local function get_forwarded_headers(conf)
+  if not conf.forward_headers then
+    return request_context.get_headers()
+  end
+  local headers = {}
+  for _, name in ipairs(conf.forward_headers) do
+    headers[name] = kong.request.get_header(name)
+  end
+  return headers
+end
+
+-- Returns the request body for the shared flow without copying it: the
+-- in-memory buffer as is, or an iterator over the file nginx buffered a
+-- large body to. The original body is left untouched for the upstream.
+local function get_streamed_body()
+  ngx.req.read_body()
+  local data = ngx.req.get_body_data()
+  if data then
+    return data
+  end
+
+  local path = ngx.req.get_body_file()
+  if not path then
+    return nil
+  end
+  local file, err = io.open(path, "rb")
+  if not file then
+    return nil, nil, "cannot open buffered request body: " .. tostring(err)
+  end
+  local size = file:seek("end")
+  file:seek("set", 0)
+  return function()
+    local chunk = file:read(BODY_CHUNK_SIZE)
+    if not chunk then
+      file:close()
+    end
+    return chunk
+  end, size
+end
+
+-- Runs the steps of a `shared_flows` entity in this request. The flow is
+-- remembered in this plugin's context for the later phases.
+local function run_shared_flow(self, conf)
+  local flow, err = shared_flow.get(conf.shared_flow_name)
+  if not flow then
+    kong.log.err("FlowCallout: ", err)
+    if not conf.on_flow_error_continue then
+      return kong.response.exit(conf.on_flow_error_status, conf.on_flow_error_body)
+    end
+    return -- Continue if configured
+  end
+
+  kong.ctx.plugin.shared_flow = flow
+  local ok, flow_err = shared_flow.run_phase(flow, "access", self, PLUGIN_NAME)
+  if not ok then
+    kong.log.err("FlowCallout: Shared flow '", conf.shared_flow_name, "' failed: ", flow_err)
+    if not conf.on_flow_error_continue then
+      return kong.response.exit(conf.on_flow_error_status, conf.on_flow_error_body)
+    end
+    kong.log.warn("FlowCallout: Shared flow failed but 'on_flow_error_continue' is true. Continuing request processing.")
+  end
+end
+
+local function run_shared_flow_phase(self, phase)
+  local flow = kong.ctx.plugin.shared_flow
+  if not flow then
+    return
+  end
+  local ok, err = shared_flow.run_phase(flow, phase, self, PLUGIN_NAME)
+  if not ok then
+    kong.log.err("FlowCallout: Shared flow '", flow.name, "' failed in ", phase, ": ", err)
+  end
+end
+
 function FlowCalloutHandler:access(conf)
-  local service_object, err = kong.db.services:select_by_name(conf.shared_flow_service_name)
+  if conf.shared_flow_name then
+    return run_shared_flow(self, conf)
+  end
+
+  local service_object, err = get_service(conf.shared_flow_service_name)
   if not service_object then
     kong.log.err("FlowCallout: Kong Service '", conf.shared_flow_service_name, "' not found. Error: ", tostring(err))
     if not conf.on_flow_error_continue then
@@ -12,14 +142,34 @@ function FlowCalloutHandler:access(conf)
     return -- Continue if configured
   end
 
-  -- IMPORTANT: This reads the entire request body into memory and consumes it.
-  local request_body = kong.request.get_raw_body()
+  local headers = get_forwarded_headers(conf)
+  local request_body
+  if conf.stream_request_body then
+    local body_size, body_err
+    request_body, body_size, body_err = get_streamed_body()
+    if body_err then
+      kong.log.err("FlowCallout: ", body_err)
+    end
+    if body_size then
+      -- The iterator is sent with an explicit length, never chunked
+      local streamed_headers = {}
+      for name, value in pairs(headers) do
+        streamed_headers[name] = value
+      end
+      streamed_headers["transfer-encoding"] = nil
+      streamed_headers["content-length"] = tostring(body_size)
+      headers = streamed_headers
+    end
+  else
+    -- IMPORTANT: This reads the entire request body into memory and consumes it.
+    request_body = kong.request.get_raw_body()
+  end
 
   -- Make internal request to the shared flow service.
   local flow_res, flow_err = kong.service.request.new({
     method = kong.request.get_method(),
     path = kong.request.get_path_with_query(),
-    headers = kong.request.get_headers(),
+    headers = headers,
     body = request_body,
     service = service_object,
   }):send()
@@ -34,7 +184,10 @@ function FlowCalloutHandler:access(conf)
   end
 
   if conf.store_flow_response_in_shared_context_key then
-    local body, body_err = flow_res:read_body()
+    local body, body_err
+    if flow_res then
+      body, body_err = flow_res:read_body()
+    end
     if body_err then
       kong.log.err("FlowCallout: Could not read body from shared flow service: ", body_err)
     end
@@ -56,8 +209,10 @@ function FlowCalloutHandler:access(conf)
   end
 
   -- CRITICAL FIX: If the original body should be preserved for the final upstream,
-  -- it must be set again, as get_raw_body() consumes it.
-  if conf.preserve_original_request_body and request_body and request_body ~= "" then
+  -- it must be set again, as get_raw_body() consumes it. A streamed body was
+  -- never taken out of nginx's buffer, so there is nothing to restore.
+  if not conf.stream_request_body and conf.preserve_original_request_body
+     and request_body and request_body ~= "" then
     kong.log.debug("FlowCallout: Preserving original request body for upstream service.")
     kong.request.set_body(request_body)
   end
@@ -65,4 +220,16 @@ function FlowCalloutHandler:access(conf)
   kong.log.debug("FlowCallout: Internal call to shared flow service '", conf.shared_flow_service_name, "' completed.")
 end
 
+function FlowCalloutHandler:header_filter(conf)
+  run_shared_flow_phase(self, "header_filter")
+end
+
+function FlowCalloutHandler:body_filter(conf)
+  run_shared_flow_phase(self, "body_filter")
+end
+
+function FlowCalloutHandler:log(conf)
+  run_shared_flow_phase(self, "log")
+end
+
 return FlowCalloutHandler
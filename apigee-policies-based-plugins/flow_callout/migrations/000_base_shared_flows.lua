@@ -0,0 +1,23 @@
+-- apigee-policies-based-plugins/flow-callout/migrations/000_base_shared_flows.lua
+
+-- This migration is for PostgreSQL.
+local migration = {
+  up = [[
+    CREATE TABLE IF NOT EXISTS shared_flows (
+      id UUID PRIMARY KEY,
+      created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+      name TEXT NOT NULL UNIQUE,
+      steps JSONB NOT NULL
+    );
+  ]],
+  teardown = function(connector)
+    local _, err = connector:query([[
+      DROP TABLE IF EXISTS shared_flows;
+    ]])
+    if err then
+      return nil, err
+    end
+  end,
+}
+
+return migration
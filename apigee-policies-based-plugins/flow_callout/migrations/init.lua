@@ -0,0 +1,4 @@
+-- apigee-policies-based-plugins/flow-callout/migrations/init.lua
+return {
+  "000_base_shared_flows",
+}
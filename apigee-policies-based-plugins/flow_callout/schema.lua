@@ -14,8 +14,13 @@ return {
           {
             shared_flow_service_name = {
               type = "string",
-              required = true,
-              description = "The name of the Kong Service that represents the 'shared flow' to be executed internally. This Service should be configured with the necessary plugins and upstream for your shared logic.",
+              description = "The name of the Kong Service that represents the 'shared flow' to be executed internally. This Service should be configured with the necessary plugins and upstream for your shared logic. Exactly one of this and `shared_flow_name` must be set.",
+            },
+          },
+          {
+            shared_flow_name = {
+              type = "string",
+              description = "The name of a `shared_flows` entity whose plugins are executed in-process, within this request's own phases, instead of through an internal request to a Kong Service. Exactly one of this and `shared_flow_service_name` must be set.",
             },
           },
           {
@@ -53,8 +58,26 @@ return {
               description = "Optional: If set, the internal shared flow's full response (status, headers, body) will be stored in `kong.ctx.shared` under this key, as a Lua table.",
             },
           },
+          {
+            stream_request_body = {
+              type = "boolean",
+              default = false,
+              description = "If `true`, the request body is passed to the shared flow straight from nginx's buffer, streamed in chunks when nginx buffered it to disk, instead of being copied into Lua and set again afterwards. The original body stays available to the upstream, so `preserve_original_request_body` has no effect.",
+            },
+          },
+          {
+            forward_headers = {
+              type = "array",
+              elements = { type = "string" },
+              description = "Optional: Names of the request headers to forward to the shared flow. If unset, all request headers are forwarded.",
+            },
+          },
         },
       },
     },
   },
+  entity_checks = {
+    { only_one_of = { "config.shared_flow_service_name", "config.shared_flow_name" } },
+    { at_least_one_of = { "config.shared_flow_service_name", "config.shared_flow_name" } },
+  },
 }
@@ -0,0 +1,152 @@
+-- In-process execution of shared flows.
+--
+-- A shared flow is a named, ordered list of plugin configurations (the
+-- `shared_flows` entity). Rather than being reached through a subrequest to
+-- another Kong Service, its steps are called directly from the calling
+-- request's phases. Each step gets its own `kong.ctx.plugin` scope and log
+-- namespace; `kong.ctx.shared` is the caller's, like Apigee flow variables.
+--
+-- Flows are read through `kong.cache`, so changes to the entity invalidate
+-- them on every node, and each cached version is compiled (configurations
+-- decoded and validated, defaults filled in, handlers resolved) once per
+-- worker.
+
+local cjson = require "cjson.safe"
+local kong_global = require "kong.global"
+
+local ipairs = ipairs
+local pcall = pcall
+
+local PHASES = { "access", "header_filter", "body_filter", "log" }
+
+-- A step may not run flow-callout itself: a flow could then call itself
+local FLOW_CALLOUT = "flow-callout"
+
+-- Compiled flows by the cached entity they were compiled from; a new
+-- entity replaces the cached one on invalidation, leaving the old entry
+-- to be collected
+local compiled_flows = setmetatable({}, { __mode = "k" })
+
+local _M = {}
+
+--- Decodes a step's JSON configuration and validates it against the
+-- plugin's schema.
+-- @param step table `{ plugin = <name>, config = <JSON object> }`.
+-- @return the configuration with defaults filled in, or nil and an error.
+function _M.process_step(step)
+  if step.plugin == FLOW_CALLOUT then
+    return nil, "step '" .. FLOW_CALLOUT .. "' cannot be used inside a shared flow"
+  end
+
+  local config, err = cjson.decode(step.config or "{}")
+  if type(config) ~= "table" then
+    return nil, "configuration of step '" .. step.plugin .. "' is not a JSON object: " .. tostring(err)
+  end
+
+  local plugins_schema = kong.db.plugins.schema
+  local plugin = plugins_schema:process_auto_fields({ name = step.plugin, config = config }, "insert")
+  local ok, errs = plugins_schema:validate_insert(plugin)
+  if not ok then
+    return nil, "invalid configuration for step '" .. step.plugin .. "': " .. (cjson.encode(errs) or "")
+  end
+  return plugin.config
+end
+
+local function load_flow(name)
+  local flow, err = kong.db.shared_flows:select_by_name(name)
+  if err then
+    return nil, err
+  end
+  return flow -- A missing flow is cached as a miss
+end
+
+local function compile(flow)
+  local steps = {}
+  local phases = {}
+  for i, step in ipairs(flow.steps) do
+    local handler = kong.db.plugins.handlers[step.plugin]
+    if not handler then
+      return nil, "plugin '" .. step.plugin .. "' is not enabled"
+    end
+    local config, err = _M.process_step(step)
+    if not config then
+      return nil, err
+    end
+    steps[i] = { name = step.plugin, handler = handler, config = config }
+    for _, phase in ipairs(PHASES) do
+      if type(handler[phase]) == "function" then
+        phases[phase] = true
+      end
+    end
+  end
+  return { name = flow.name, steps = steps, phases = phases }
+end
+
+--- Returns the compiled shared flow of a name.
+-- @return the flow, or nil and an error.
+function _M.get(name)
+  local flow, err = kong.cache:get(kong.db.shared_flows:cache_key(name), nil, load_flow, name)
+  if err then
+    return nil, "could not load shared flow '" .. name .. "': " .. tostring(err)
+  end
+  if not flow then
+    return nil, "shared flow '" .. name .. "' not found"
+  end
+
+  local compiled = compiled_flows[flow]
+  if not compiled then
+    local compile_err
+    compiled, compile_err = compile(flow)
+    -- Failures are remembered too, until the entity changes
+    compiled = compiled or { err = "shared flow '" .. name .. "' is invalid: " .. compile_err }
+    compiled_flows[flow] = compiled
+  end
+  if compiled.err then
+    return nil, compiled.err
+  end
+  return compiled
+end
+
+--- Runs one phase of a flow: every step implementing it, in order. In
+-- `access`, the flow stops at the first step that produced a response
+-- (e.g. with `kong.response.exit`).
+-- @param flow table A flow returned by `get`.
+-- @param phase string `access`, `header_filter`, `body_filter` or `log`.
+-- @param caller table The calling plugin's handler, whose `kong.ctx.plugin`
+--   scope and log namespace are restored afterwards.
+-- @param caller_name string The calling plugin's name.
+-- @return true, or nil and the error raised by a step.
+function _M.run_phase(flow, phase, caller, caller_name)
+  if not flow.phases[phase] then
+    return true
+  end
+
+  local ctx = ngx.ctx
+  local ok, err = true, nil
+  for _, step in ipairs(flow.steps) do
+    local method = step.handler[phase]
+    if method then
+      -- The step table is unique to this step, so two steps of the same
+      -- plugin do not share a scope
+      kong_global.set_named_ctx(kong, "plugin", step, ctx)
+      kong_global.set_namespaced_log(kong, step.name, ctx)
+      ok, err = pcall(method, step.handler, step.config)
+      if not ok then
+        err = "step '" .. step.name .. "' failed: " .. tostring(err)
+        break
+      end
+      if phase == "access" and ctx.delayed_response then
+        break
+      end
+    end
+  end
+
+  kong_global.set_named_ctx(kong, "plugin", caller, ctx)
+  kong_global.set_namespaced_log(kong, caller_name, ctx)
+  if not ok then
+    return nil, err
+  end
+  return true
+end
+
+return _M
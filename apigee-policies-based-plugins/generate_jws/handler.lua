@@ -1,5 +1,6 @@
 local cjson = require "cjson"
 local jwt = require "resty.jwt"
+local request_context = require "kong.plugins.apigee_common.request_context"
 
 -- Helper to safely get value from JSON body using simple dot notation
 local function get_json_value(json_table, path)
@@ -48,9 +49,9 @@ local function get_value_from_source(source_type, source_name)
   end
   local value
   if source_type == "header" then
-    value = kong.request.get_header(source_name)
+    value = request_context.get_header(source_name)
   elseif source_type == "query" then
-    value = kong.request.get_query_arg(source_name)
+    value = request_context.get_query_arg(source_name)
   elseif source_type == "body" then
     local raw_body = kong.request.get_raw_body()
     if raw_body and raw_body ~= "" then
@@ -70,7 +71,7 @@ end
 -- Helper to set a string value to various destinations
 local function set_value_to_destination(destination_type, destination_name, value)
   if destination_type == "header" then
-    kong.request.set_header(destination_name, value)
+    request_context.set_header(destination_name, value)
   elseif destination_type == "query" then
     kong.request.set_query({ [destination_name] = value })
   elseif destination_type == "body" then
@@ -1,6 +1,7 @@
 local BasePlugin = require "kong.plugins.base_plugin"
 local cjson = require "cjson"
 local jwt = require "resty.jwt"
+local request_context = require "kong.plugins.apigee_common.request_context"
 
 -- Helper to safely get value from JSON body using simple dot notation
 local function get_json_value(json_table, path)
@@ -52,9 +53,9 @@ end
 local function get_value_from_source(source_type, source_name)
   local value = nil
   if source_type == "header" then
-    value = kong.request.get_header(source_name)
+    value = request_context.get_header(source_name)
   elseif source_type == "query" then
-    value = kong.request.get_query_arg(source_name)
+    value = request_context.get_query_arg(source_name)
   elseif source_type == "body" then
     local raw_body = kong.request.get_raw_body()
     if raw_body and raw_body ~= "" then
@@ -76,9 +77,9 @@ end
 -- Helper to set a string value to various destinations
 local function set_value_to_destination(destination_type, destination_name, value)
   if destination_type == "header" then
-    kong.service.request.set_header(destination_name, value)
+    request_context.set_header(destination_name, value)
   elseif destination_type == "query" then
-    kong.service.request.set_query({ [destination_name] = value })
+    request_context.set_query_arg(destination_name, value)
   elseif destination_type == "body" then
     local current_body = kong.request.get_raw_body()
     local parsed_body, err = pcall(cjson.decode, current_body or "{}")
@@ -88,11 +89,11 @@ local function set_value_to_destination(destination_type, destination_name, valu
 
     if destination_name == "." or destination_name == "" then
       kong.service.request.set_body(value)
-      kong.service.request.set_header("Content-Type", "application/jwt")
+      request_context.set_header("Content-Type", "application/jwt")
     else
       set_json_value(parsed_body, destination_name, value)
       kong.service.request.set_body(cjson.encode(parsed_body))
-      kong.service.request.set_header("Content-Type", "application/json")
+      request_context.set_header("Content-Type", "application/json")
     end
   elseif destination_type == "shared_context" then
     kong.ctx.shared[destination_name] = value
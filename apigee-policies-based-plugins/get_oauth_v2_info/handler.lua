@@ -1,4 +1,6 @@
 local BasePlugin = require "kong.plugins.base_plugin"
+local token_cache = require "kong.plugins.apigee_common.token_cache"
+local revocation = require "kong.plugins.apigee_common.revocation"
 
 -- Helper to safely get a nested value from a table using dot notation
 local function get_nested_value(tbl, path)
@@ -28,6 +30,11 @@ function GetOAuthV2InfoHandler:new()
   GetOAuthV2InfoHandler.super.new(self)
 end
 
+function GetOAuthV2InfoHandler:init_worker()
+  GetOAuthV2InfoHandler.super.init_worker(self)
+  revocation.init_worker()
+end
+
 function GetOAuthV2InfoHandler:access(conf)
   GetOAuthV2InfoHandler.super.access(self)
 
@@ -39,10 +46,29 @@ function GetOAuthV2InfoHandler:access(conf)
     return
   end
 
+  local token_hash, expires_at, info
+  if conf.token_cache_enabled or conf.reject_revoked_tokens then
+    token_hash, expires_at = token_cache.current()
+  end
+
+  if conf.reject_revoked_tokens and token_hash and revocation.is_revoked_hash(token_hash) then
+    kong.log.info("GetOAuthV2Info: Rejecting revoked access token.")
+    return kong.response.exit(conf.revoked_token_status, { message = conf.revoked_token_body })
+  end
+
+  -- The token's metadata, from the shared token cache when possible
+  if conf.token_cache_enabled and token_hash then
+    info = token_cache.get(token_hash, conf.token_cache_shm)
+  end
+  local fresh = info == nil
+  if fresh then
+    info = token_cache.describe(consumer, credential)
+  end
+
   -- Extract client ID
   if conf.extract_client_id_to_shared_context_key then
     -- For oauth2, the credential is the application, and client_id is a field on it.
-    local client_id = credential.client_id or credential.id
+    local client_id = info.client_id
     if client_id then
       kong.ctx.shared[conf.extract_client_id_to_shared_context_key] = client_id
       kong.log.debug("GetOAuthV2Info: Extracted client_id '", client_id, "'")
@@ -51,7 +77,7 @@ function GetOAuthV2InfoHandler:access(conf)
 
   -- Extract application name
   if conf.extract_app_name_to_shared_context_key then
-    local app_name = credential.name
+    local app_name = info.application_name
     if app_name then
       kong.ctx.shared[conf.extract_app_name_to_shared_context_key] = app_name
       kong.log.debug("GetOAuthV2Info: Extracted app_name '", app_name, "'")
@@ -61,7 +87,7 @@ function GetOAuthV2InfoHandler:access(conf)
   -- Extract end user identifier
   if conf.extract_end_user_to_shared_context_key then
     -- The consumer represents the end user in some OAuth2 grant types
-    local end_user = consumer.username or consumer.custom_id
+    local end_user = info.consumer_username
     if end_user then
       kong.ctx.shared[conf.extract_end_user_to_shared_context_key] = end_user
       kong.log.debug("GetOAuthV2Info: Extracted end_user '", end_user, "'")
@@ -70,35 +96,56 @@ function GetOAuthV2InfoHandler:access(conf)
 
   -- Extract scopes
   if conf.extract_scopes_to_shared_context_key then
-    -- The OAuth2 plugin sets this header on the request to the upstream.
-    -- It may also be available in the context for subsequent plugins.
-    local scopes = kong.request.get_header("X-Authenticated-Scope") or kong.ctx.authenticated_scope
+    -- Taken from the X-Authenticated-Scope header the OAuth2 plugin sets, or
+    -- from the context, when the token was first seen
+    local scopes = info.scopes
     if scopes then
-      -- scopes can be a table or a string, ensure it's a string
-      if type(scopes) == "table" then
-        scopes = table.concat(scopes, " ")
-      end
       kong.ctx.shared[conf.extract_scopes_to_shared_context_key] = scopes
       kong.log.debug("GetOAuthV2Info: Extracted scopes '", scopes, "'")
     end
   end
 
   -- Extract custom attributes
+  local resolved_attributes
   if conf.extract_custom_attributes then
+    local cached_attributes = info.attributes or {}
     for _, attr_mapping in ipairs(conf.extract_custom_attributes) do
-      -- Try to find the attribute in the consumer's custom_id, or the credential's metadata
-      local extracted_value = get_nested_value(consumer, attr_mapping.source_field)
+      local extracted_value = cached_attributes[attr_mapping.source_field]
       if extracted_value == nil then
-        extracted_value = get_nested_value(credential, attr_mapping.source_field)
+        -- Try to find the attribute in the consumer's custom_id, or the credential's metadata
+        extracted_value = get_nested_value(consumer, attr_mapping.source_field)
+        if extracted_value == nil then
+          extracted_value = get_nested_value(credential, attr_mapping.source_field)
+        end
+        resolved_attributes = resolved_attributes or {}
+        if extracted_value == nil then
+          resolved_attributes[attr_mapping.source_field] = token_cache.ABSENT
+        else
+          resolved_attributes[attr_mapping.source_field] = extracted_value
+        end
       end
 
-      if extracted_value ~= nil then
+      if extracted_value ~= nil and extracted_value ~= token_cache.ABSENT then
         kong.ctx.shared[attr_mapping.output_key] = extracted_value
         kong.log.debug("GetOAuthV2Info: Extracted custom attribute '", attr_mapping.source_field, "'")
       end
     end
   end
 
+  -- Write what was resolved back to the cache
+  if conf.token_cache_enabled and token_hash and (fresh or resolved_attributes) then
+    local fields = fresh and info or {}
+    fields.attributes = resolved_attributes or {}
+    local ok, err = token_cache.set(token_hash, fields, {
+      shm = conf.token_cache_shm,
+      expires_at = expires_at,
+      ttl = conf.token_cache_ttl,
+    })
+    if not ok then
+      kong.log.warn("GetOAuthV2Info: Could not cache token metadata: ", err)
+    end
+  end
+
   kong.log.debug("GetOAuthV2Info: OAuth2 information extraction complete.")
 end
 
@@ -1,4 +1,6 @@
 local typedefs = require "kong.db.schema.typedefs"
+local apigee_typedefs = require "kong.plugins.apigee_common.typedefs"
+local revocation = require "kong.plugins.apigee_common.revocation"
 
 return {
   name = "get-oauth-v2-info",
@@ -61,8 +63,47 @@ return {
               description = "Optional: Define custom attributes to extract from the authenticated consumer or credential objects and store in `kong.ctx.shared`.",
             },
           },
+          {
+            reject_revoked_tokens = {
+              type = "boolean",
+              default = false,
+              description = "If `true`, requests whose token is on the revocation list maintained by `revoke-oauth-v2` are rejected with `revoked_token_status` and `revoked_token_body`. Requires the `apigee_revocations` shared dict.",
+            },
+          },
+          { revoked_token_status = apigee_typedefs.revoked_token_status },
+          { revoked_token_body = apigee_typedefs.revoked_token_body },
+          {
+            token_cache_enabled = {
+              type = "boolean",
+              default = false,
+              description = "If `true`, the token's metadata is cached in the `token_cache_shm` shared dict, keyed by a hash of the access token, and reused by the OAuth plugins for as long as the token is valid.",
+            },
+          },
+          {
+            token_cache_shm = {
+              type = "string",
+              default = "apigee_token_cache",
+              description = "The `lua_shared_dict` holding the token metadata cache. When `token_cache_enabled` is `true`, it must be declared with `nginx_http_lua_shared_dict`. It must be the same for all the OAuth plugins.",
+            },
+          },
+          {
+            token_cache_ttl = {
+              type = "number",
+              default = 3600,
+              gt = 0,
+              description = "How long, in seconds, token metadata is cached when the token's expiry is unknown (e.g. JWTs or bearer tokens validated elsewhere).",
+            },
+          },
         },
       },
     },
   },
+  entity_checks = {
+    apigee_typedefs.shared_dict_check({ "config.reject_revoked_tokens" }, function(config)
+      if config.reject_revoked_tokens then
+        return revocation.SHM
+      end
+    end),
+    apigee_typedefs.token_cache_check,
+  },
 }
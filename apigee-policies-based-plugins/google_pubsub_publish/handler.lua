@@ -1,6 +1,9 @@
 local BasePlugin = require "kong.plugins.base_plugin"
 local cjson = require "cjson"
 local util = require "kong.tools.utils" -- For base64 encoding
+local request_context = require "kong.plugins.apigee_common.request_context"
+local pubsub_queue = require "kong.plugins.apigee_common.pubsub_queue"
+local gcp_token = require "kong.plugins.apigee_common.gcp_token"
 
 -- Helper to get a value from a JSON table
 local function get_json_value(tbl, path)
@@ -19,9 +22,9 @@ local function get_value_from_source(source_type, source_name)
 
   local value
   if source_type == "header" then
-    value = kong.request.get_header(source_name)
+    value = request_context.get_header(source_name)
   elseif source_type == "query" then
-    value = kong.request.get_query_arg(source_name)
+    value = request_context.get_query_arg(source_name)
   elseif source_type == "body" then
     local raw_body = kong.request.get_raw_body()
     if raw_body and raw_body ~= "" then
@@ -41,13 +44,26 @@ function GooglePubSubPublishHandler:new()
   GooglePubSubPublishHandler.super.new(self)
 end
 
--- Core function to publish to Pub/Sub
-local function publish_to_pubsub(conf, current_phase)
-  local access_token = get_value_from_source(conf.gcp_access_token_source_type, conf.gcp_access_token_source_name)
-  if not access_token or access_token == "" then
-    local error_msg = "No GCP access token found from source."
-    kong.log.err("GooglePubSubPublish: ", error_msg)
-    return false, error_msg
+-- Resolves the access token and builds the message from the request.
+-- Must run in a request phase: the sources are request data. With a
+-- service account the token is left to the publisher (`false`), unless
+-- `need_token` asks for the cached one now.
+local function build_message(conf, need_token)
+  local access_token
+  if conf.gcp_access_token_source_type == "service_account" then
+    access_token = false
+    if need_token then
+      local err
+      access_token, err = gcp_token.get(conf)
+      if not access_token then
+        return nil, "No GCP access token available: " .. tostring(err)
+      end
+    end
+  else
+    access_token = get_value_from_source(conf.gcp_access_token_source_type, conf.gcp_access_token_source_name)
+    if not access_token or access_token == "" then
+      return nil, "No GCP access token found from source."
+    end
   end
 
   local payload_content = get_value_from_source(conf.message_payload_source_type, conf.message_payload_source_name)
@@ -56,58 +72,46 @@ local function publish_to_pubsub(conf, current_phase)
     payload_content = ""
   end
 
-  local pubsub_api_url = string.format(
-    "https://pubsub.googleapis.com/v1/projects/%s/topics/%s:publish",
-    conf.gcp_project_id,
-    conf.pubsub_topic_name
-  )
-
-  local message_body = {
-    messages = {
-      {
-        data = util.encode_base64(tostring(payload_content)),
-      }
-    }
+  local message = {
+    data = util.encode_base64(tostring(payload_content)),
   }
 
   if conf.message_attributes and next(conf.message_attributes) then -- Check if table is not empty
-    message_body.messages[1].attributes = conf.message_attributes
+    message.attributes = conf.message_attributes
   end
 
-  local callout_opts = {
-    method = "POST",
-    headers = {
-      ["Content-Type"] = "application/json",
-      ["Authorization"] = "Bearer " .. access_token,
-    },
-    body = cjson.encode(message_body),
-    timeout = 10000,
-    connect_timeout = 5000,
-    ssl_verify = true,
-  }
-
-  local res, err = kong.http.client.go(pubsub_api_url, callout_opts)
+  return message, access_token
+end
 
-  if not res then
+-- Core function to publish to Pub/Sub
+local function publish_to_pubsub(conf, access_token, message)
+  local ok, err = pubsub_queue.publish(conf, access_token, { message })
+  if not ok then
     local error_msg = string.format("Failed to publish to Pub/Sub topic '%s'. Error: %s", conf.pubsub_topic_name, err)
     kong.log.err("GooglePubSubPublish: ", error_msg)
     return false, error_msg
-  elseif res.status ~= 200 then
-    local error_msg = string.format("Pub/Sub API returned error status %d. Body: %s", res.status, res.body)
-    kong.log.err("GooglePubSubPublish: ", error_msg)
-    return false, error_msg
-  else
-    kong.log.debug("GooglePubSubPublish: Successfully published message to Pub/Sub topic '", conf.pubsub_topic_name, "'.")
-    return true
   end
+  kong.log.debug("GooglePubSubPublish: Successfully published message to Pub/Sub topic '", conf.pubsub_topic_name, "'.")
+  return true
 end
 
 
+function GooglePubSubPublishHandler:init_worker()
+  GooglePubSubPublishHandler.super.init_worker(self)
+  pubsub_queue.resume()
+end
+
 function GooglePubSubPublishHandler:access(conf)
   GooglePubSubPublishHandler.super.access(self)
 
   if conf.phase == "access" then
-    local ok, err_msg = publish_to_pubsub(conf, "access")
+    local message, access_token = build_message(conf, true)
+    local ok
+    if message then
+      ok = publish_to_pubsub(conf, access_token, message)
+    else
+      kong.log.err("GooglePubSubPublish: ", access_token)
+    end
     if not ok then
       if not conf.on_error_continue then
         return kong.response.exit(conf.on_error_status, conf.on_error_body)
@@ -120,13 +124,27 @@ function GooglePubSubPublishHandler:log(conf)
   GooglePubSubPublishHandler.super.log(self)
 
   if conf.phase == "log" then
+    local message, access_token = build_message(conf)
+    if not message then
+      kong.log.err("GooglePubSubPublish: ", access_token)
+      return
+    end
+
+    if conf.batch_enabled then
+      local ok, err = pubsub_queue.enqueue(conf, access_token, message)
+      if not ok then
+        kong.log.err("GooglePubSubPublish: Message dropped: ", err)
+      end
+      return
+    end
+
     -- Publish asynchronously in log phase
-    local ok, timer_err = kong.timer.at(0, function(_, config)
-      local _, http_err = publish_to_pubsub(config, "log")
+    local ok, timer_err = kong.timer.at(0, function(_, config, token, msg)
+      local _, http_err = publish_to_pubsub(config, token, msg)
       if http_err then
         kong.log.err("GooglePubSubPublish (async): Failed to publish message: ", http_err)
       end
-    end, conf)
+    end, conf, access_token, message)
 
     if not ok then
       kong.log.err("GooglePubSubPublish: Failed to create async timer for logging: ", timer_err)
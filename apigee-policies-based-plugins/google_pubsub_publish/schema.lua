@@ -1,4 +1,6 @@
 local typedefs = require "kong.db.schema.typedefs"
+local apigee_typedefs = require "kong.plugins.apigee_common.typedefs"
+local gcp_token = require "kong.plugins.apigee_common.gcp_token"
 
 return {
   name = "google-pubsub-publish",
@@ -37,8 +39,8 @@ return {
             gcp_access_token_source_type = {
               type = "string",
               required = true,
-              enum = { "header", "query", "body", "shared_context", "literal" },
-              description = "Specifies where to get the Google Cloud access token for authenticating the Pub/Sub API call.",
+              enum = { "header", "query", "body", "shared_context", "literal", "service_account" },
+              description = "Specifies where to get the Google Cloud access token for authenticating the Pub/Sub API call. `service_account` mints and caches tokens from `gcp_service_account_key_file`.",
             },
           },
           {
@@ -47,6 +49,25 @@ return {
               description = "The name of the header/query parameter, the JSON path for a 'body' source, the key in `kong.ctx.shared`, or the literal value itself if `gcp_access_token_source_type` is 'literal'.",
             },
           },
+          {
+            gcp_service_account_key_file = {
+              type = "string",
+              description = "Required if `gcp_access_token_source_type` is `service_account`: path to a service account JSON key file readable by the Kong workers.",
+            },
+          },
+          {
+            gcp_token_scope = {
+              type = "string",
+              default = "https://www.googleapis.com/auth/pubsub",
+              description = "For `service_account`: OAuth scope requested for minted tokens.",
+            },
+          },
+          {
+            gcp_token_endpoint = {
+              type = "string",
+              description = "For `service_account`: OAuth token endpoint. Defaults to the key file's `token_uri`; can point to a local stub for testing.",
+            },
+          },
           {
             message_payload_source_type = {
               type = "string",
@@ -68,6 +89,95 @@ return {
               description = "Optional: A map of key-value pairs to attach as attributes to the Pub/Sub message. Values can reference flow variables (e.g., `{request.headers.X-Transaction-ID}`).",
             },
           },
+          {
+            pubsub_endpoint = {
+              type = "string",
+              default = "https://pubsub.googleapis.com",
+              description = "Base URL of the Pub/Sub API. Can point to the Pub/Sub emulator or a local stand-in for testing.",
+            },
+          },
+          {
+            spool_enabled = {
+              type = "boolean",
+              default = true,
+              description = "If `true`, message batches that still fail with a transport error, a 429 or a 5xx response after `max_retries` retries are written to a spool on local disk under the Kong prefix and replayed in the background once the endpoint recovers, instead of being dropped. Only applies when `gcp_access_token_source_type` is `service_account` or `literal`: tokens supplied by callers are never written to disk.",
+            },
+          },
+          {
+            spool_max_bytes = {
+              type = "integer",
+              default = 104857600,
+              between = { 1048576, 10737418240 },
+              description = "Maximum size in bytes of each worker's spool. When it is exceeded, the oldest spooled records are discarded.",
+            },
+          },
+          {
+            spool_drain_rate = {
+              type = "integer",
+              default = 100,
+              between = { 1, 100000 },
+              description = "Maximum number of spooled records per second each worker replays once the endpoint recovers.",
+            },
+          },
+          { callout_timeout = apigee_typedefs.callout_timeout },
+          { callout_connect_timeout = apigee_typedefs.callout_connect_timeout },
+          { callout_keepalive_timeout = apigee_typedefs.callout_keepalive_timeout },
+          { callout_keepalive_pool_size = apigee_typedefs.callout_keepalive_pool_size },
+          {
+            batch_enabled = {
+              type = "boolean",
+              default = true,
+              description = "For the 'log' phase: If `true`, messages are queued per worker and published in batches grouped by project and topic. If `false`, each message is published with its own API call.",
+            },
+          },
+          {
+            batch_max_messages = {
+              type = "integer",
+              default = 100,
+              between = { 1, 1000 },
+              description = "Maximum number of messages per publish call. A batch is sent as soon as it is full.",
+            },
+          },
+          {
+            batch_max_bytes = {
+              type = "integer",
+              default = 1048576,
+              between = { 1024, 9437184 },
+              description = "Maximum approximate size in bytes of a publish call. A batch is sent as soon as it reaches this size.",
+            },
+          },
+          {
+            batch_linger_ms = {
+              type = "integer",
+              default = 50,
+              between = { 0, 60000 },
+              description = "Maximum time in milliseconds a message waits for its batch to fill before the batch is sent.",
+            },
+          },
+          {
+            queue_max_messages = {
+              type = "integer",
+              default = 10000,
+              between = { 1, 1000000 },
+              description = "Maximum number of messages a worker holds (queued, in flight or awaiting retry). Messages arriving at a full queue are dropped and counted.",
+            },
+          },
+          {
+            max_retries = {
+              type = "integer",
+              default = 3,
+              between = { 0, 20 },
+              description = "Number of retries for a batch after a transport error, a 429 or a 5xx response.",
+            },
+          },
+          {
+            retry_backoff_ms = {
+              type = "integer",
+              default = 200,
+              between = { 1, 60000 },
+              description = "Base delay in milliseconds before the first retry. It doubles with each retry, with random jitter.",
+            },
+          },
           {
             on_error_status = {
               type = "number",
@@ -94,4 +204,11 @@ return {
       },
     },
   },
+  entity_checks = {
+    apigee_typedefs.shared_dict_check({ "config.gcp_access_token_source_type" }, function(config)
+      if config.gcp_access_token_source_type == "service_account" then
+        return gcp_token.SHM
+      end
+    end),
+  },
 }
@@ -1,5 +1,7 @@
 local BasePlugin = require "kong.plugins.base_plugin"
 local cjson = require "cjson"
+local openssl_hmac = require "resty.openssl.hmac"
+local request_context = require "kong.plugins.apigee_common.request_context"
 
 -- Helper to safely get value from JSON body using simple dot notation
 local function get_json_value(json_table, path)
@@ -28,9 +30,9 @@ local function get_component_value(component_type, component_name)
   elseif component_type == "uri" then
     return kong.request.get_path_with_query()
   elseif component_type == "header" then
-    return kong.request.get_header(component_name) or ""
+    return request_context.get_header(component_name) or ""
   elseif component_type == "query" then
-    return kong.request.get_query_arg(component_name) or ""
+    return request_context.get_query_arg(component_name) or ""
   elseif component_type == "body" then
     local raw_body = kong.request.get_raw_body()
     if not raw_body or raw_body == "" then return "" end
@@ -48,10 +50,53 @@ local function get_component_value(component_type, component_name)
   return "" -- Return empty string if value is nil or not found
 end
 
+-- A body component without a JSON path signs the raw body as-is
+local function is_raw_body_component(component)
+  local name = component.component_name
+  return component.component_type == "body" and (not name or name == "" or name == ".")
+end
+
+-- Helper to feed the raw request body into an HMAC context chunk by chunk.
+-- Bodies that nginx spilled to a temp file are read from disk in `chunk_size`
+-- pieces, so large uploads are never loaded into Lua memory as a whole.
+local function update_with_raw_body(hmac_ctx, chunk_size)
+  ngx.req.read_body()
+
+  local body_data = ngx.req.get_body_data()
+  if body_data then
+    return hmac_ctx:update(body_data)
+  end
+
+  local body_file = ngx.req.get_body_file()
+  if not body_file then
+    return true -- Empty body contributes nothing
+  end
+
+  local file, err = io.open(body_file, "rb")
+  if not file then
+    return nil, "could not open buffered body file: " .. tostring(err)
+  end
+
+  while true do
+    local chunk = file:read(chunk_size)
+    if not chunk then
+      break
+    end
+    local ok, update_err = hmac_ctx:update(chunk)
+    if not ok then
+      file:close()
+      return nil, update_err
+    end
+  end
+
+  file:close()
+  return true
+end
+
 -- Helper to set a string value to various destinations
 local function set_value_to_destination(destination_type, destination_name, value)
   if destination_type == "header" then
-    kong.service.request.set_header(destination_name, value)
+    request_context.set_header(destination_name, value)
   elseif destination_type == "shared_context" then
     kong.ctx.shared[destination_name] = value
   end
@@ -91,25 +136,42 @@ function HMACHandler:access(conf)
   end
   secret_string = tostring(secret_string)
 
-  -- 2. Construct String-to-Sign
-  local string_to_sign_parts = {}
-  for _, component in ipairs(conf.string_to_sign_components) do
-    table.insert(string_to_sign_parts, get_component_value(component.component_type, component.component_name))
-  end
-  local string_to_sign = table.concat(string_to_sign_parts, "\n")
-
-  -- 3. Calculate HMAC
+  -- 2. Resolve algorithm
   local algo = ALGORITHM_MAP[conf.algorithm]
   if not algo then
     kong.log.err("HMAC: Unsupported algorithm: ", conf.algorithm)
     return kong.response.exit(500, "Unsupported HMAC algorithm configured.")
   end
 
-  local calculated_hmac, err = ngx.hmac_sha1(secret_string, string_to_sign)
-  if algo == "sha256" then
-    calculated_hmac, err = ngx.hmac_sha256(secret_string, string_to_sign)
-  elseif algo == "sha512" then
-    calculated_hmac, err = ngx.hmac_sha512(secret_string, string_to_sign)
+  local hmac_ctx, err = openssl_hmac.new(secret_string, algo)
+  if not hmac_ctx then
+    kong.log.err("HMAC: Failed to initialize HMAC context: ", err)
+    return kong.response.exit(500, "Internal HMAC calculation error.")
+  end
+
+  -- 3. Feed the String-to-Sign into the HMAC incrementally.
+  -- Components are separated by newlines; a raw body component is streamed
+  -- instead of being concatenated into one in-memory string.
+  local ok = true
+  for i, component in ipairs(conf.string_to_sign_components) do
+    if i > 1 then
+      ok, err = hmac_ctx:update("\n")
+    end
+    if ok then
+      if is_raw_body_component(component) then
+        ok, err = update_with_raw_body(hmac_ctx, conf.body_chunk_size)
+      else
+        ok, err = hmac_ctx:update(tostring(get_component_value(component.component_type, component.component_name)))
+      end
+    end
+    if not ok then
+      break
+    end
+  end
+
+  local calculated_hmac
+  if ok then
+    calculated_hmac, err = hmac_ctx:final()
   end
 
   if not calculated_hmac then
@@ -121,7 +183,7 @@ function HMACHandler:access(conf)
 
   -- 4. Execute mode-specific logic
   if conf.mode == "verify" then
-    local client_signature_header = kong.request.get_header(conf.signature_header_name)
+    local client_signature_header = request_context.get_header(conf.signature_header_name)
     if not client_signature_header then
       kong.log.warn("HMAC: Client signature header '", conf.signature_header_name, "' not found.")
       if not conf.on_verification_failure_continue then
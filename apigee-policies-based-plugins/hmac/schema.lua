@@ -74,6 +74,14 @@ return {
               description = "A list defining the components that form the 'string-to-sign' in the specified order.",
             },
           },
+          {
+            body_chunk_size = {
+              type = "integer",
+              default = 65536,
+              between = { 1024, 1048576 },
+              description = "Size in bytes of the chunks read from a buffered body file when a raw `body` component is streamed into the HMAC.",
+            },
+          },
           -- Verification-specific fields
           {
             signature_header_name = {
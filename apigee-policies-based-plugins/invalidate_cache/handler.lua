@@ -1,5 +1,6 @@
 local BasePlugin = require "kong.plugins.base_plugin"
 local cjson = require "cjson"
+local request_context = require "kong.plugins.apigee_common.request_context"
 
 -- Helper function to resolve fragment values from different sources
 local function resolve_fragment_value(fragment_ref)
@@ -8,9 +9,9 @@ local function resolve_fragment_value(fragment_ref)
   elseif fragment_ref == "request.method" then
     return kong.request.get_method()
   elseif fragment_ref:sub(1, 15) == "request.headers." then
-    return kong.request.get_header(fragment_ref:sub(16))
+    return request_context.get_header(fragment_ref:sub(16))
   elseif fragment_ref:sub(1, 19) == "request.query_param." then
-    return kong.request.get_query_arg(fragment_ref:sub(20))
+    return request_context.get_query_arg(fragment_ref:sub(20))
   elseif fragment_ref:sub(1, 15) == "shared_context." then
     local val = kong.ctx.shared[fragment_ref:sub(16)]
     if type(val) == "table" then
@@ -1,6 +1,7 @@
 local BasePlugin = require "kong.plugins.base_plugin"
 local cjson = require "cjson"
 local fun = require "kong.tools.functional"
+local request_context = require "kong.plugins.apigee_common.request_context"
 
 -- Helper to safely get value from JSON body using simple dot notation
 local function get_json_value(json_table, path)
@@ -132,7 +133,7 @@ function JSONThreatProtectionHandler:access(conf)
 
   -- Apigee's policy only runs on JSON content. Enforce this for request body source.
   if conf.source_type == "request_body" then
-    local content_type = kong.request.get_header("Content-Type")
+    local content_type = request_context.get_header("Content-Type")
     if not content_type or not content_type:find("application/json", 1, true) then
       kong.log.debug("JSONThreatProtection: Content-Type is not application/json, skipping.")
       return
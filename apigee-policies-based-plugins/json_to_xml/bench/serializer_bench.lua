@@ -0,0 +1,71 @@
+-- Compares the cjson + string.buffer serializer with the previous
+-- dkjson + `xml` module conversion for 1 KB, 100 KB and 10 MB payloads.
+--
+-- Usage (with Kong's Lua path set up):
+--   resty bench/serializer_bench.lua
+
+local serializer = require "kong.plugins.json-to-xml.serializer"
+local cjson = require "cjson"
+
+local ok_dkjson, dkjson = pcall(require, "dkjson")
+local ok_xml, xml = pcall(require, "xml")
+
+local SIZES = {
+  { label = "1 KB", bytes = 1024 },
+  { label = "100 KB", bytes = 100 * 1024 },
+  { label = "10 MB", bytes = 10 * 1024 * 1024 },
+}
+
+local OPTS = { root_element_name = "root", array_item_element_name = "item" }
+
+-- Builds a JSON document of roughly `bytes` bytes
+local function build_payload(bytes)
+  local orders = {}
+  local size = 0
+  local i = 0
+  while size < bytes do
+    i = i + 1
+    local order = {
+      order_id = "A" .. i,
+      amount = i + 0.95,
+      customer = { name = "Jane & John Doe", vip = (i % 2 == 0) },
+      tags = { "express", "gift" },
+    }
+    orders[#orders + 1] = order
+    size = size + 110
+  end
+  return cjson.encode({ id = "12345", orders = orders })
+end
+
+-- The conversion as implemented before the serializer was introduced
+local function legacy_convert(json_string)
+  local json_table = dkjson.decode(json_string)
+  return xml.encode({ [OPTS.root_element_name] = json_table })
+end
+
+local function run(label, fn, payload)
+  local iterations = math.max(1, math.floor(20 * 1024 * 1024 / #payload))
+  iterations = math.min(iterations, 10000)
+
+  collectgarbage("collect")
+  local start = os.clock()
+  for _ = 1, iterations do
+    fn(payload)
+  end
+  local elapsed = os.clock() - start
+
+  local mb = #payload * iterations / (1024 * 1024)
+  print(string.format("  %-8s %8d iter  %10.3f ms/op  %8.2f MB/s",
+                      label, iterations, elapsed * 1000 / iterations, mb / elapsed))
+end
+
+for _, size in ipairs(SIZES) do
+  local payload = build_payload(size.bytes)
+  print(string.format("%s payload (%d bytes)", size.label, #payload))
+  run("new", function(p) return assert(serializer.convert(p, OPTS)) end, payload)
+  if ok_dkjson and ok_xml then
+    run("legacy", legacy_convert, payload)
+  else
+    print("  legacy   skipped: dkjson or xml module not installed")
+  end
+end
@@ -1,6 +1,6 @@
-local dkjson = require "dkjson"
-local xml = require "xml"
+local serializer = require "kong.plugins.json-to-xml.serializer"
 local kong_meta = require "kong.meta"
+local request_context = require "kong.plugins.apigee_common.request_context"
 
 local JsonToXmlHandler = {}
 
@@ -20,35 +20,22 @@ local function get_json_source(source_type, source_name)
   elseif source_type == "response_body" then
     return kong.response.get_raw_body()
   elseif source_type == "shared_context" then
-    local data = kong.ctx.shared[source_name]
-    if type(data) == "table" then
-      return dkjson.encode(data)
-    end
-    return data -- Assume it's already a JSON string
+    return kong.ctx.shared[source_name] -- Either a JSON string or an already decoded table
   end
   return nil, "Invalid source_type"
 end
 
-local function perform_conversion(conf, json_string)
-  if not json_string or json_string == "" then
-    return nil, "JSON source is empty or not found."
-  end
-
-  local ok, json_table = pcall(dkjson.decode, json_string)
-  if not ok then
-    return nil, "Failed to decode JSON: " .. (json_table or "unknown error")
+local function perform_conversion(conf, json_source)
+  if type(json_source) == "table" then
+    -- Already decoded; serialize directly instead of an encode/decode round trip
+    return serializer.serialize(json_source, conf)
   end
 
-  -- The xml library expects a single root table
-  local root_name = conf.root_element_name or "root"
-  local xml_table = { [root_name] = json_table }
-
-  local ok, xml_string = pcall(xml.encode, xml_table)
-  if not ok then
-    return nil, "Failed to encode XML: " .. (xml_string or "unknown error")
+  if not json_source or json_source == "" then
+    return nil, "JSON source is empty or not found."
   end
 
-  return xml_string
+  return serializer.convert(json_source, conf)
 end
 
 function JsonToXmlHandler:access(conf)
@@ -70,8 +57,8 @@ function JsonToXmlHandler:access(conf)
   -- Handle the output
   if conf.output_destination == "replace_request_body" then
     kong.service.request.set_raw_body(xml_string)
-    kong.service.request.set_header("Content-Length", #xml_string)
-    kong.service.request.set_header("Content-Type", conf.content_type)
+    request_context.set_header("Content-Length", #xml_string)
+    request_context.set_header("Content-Type", conf.content_type)
   elseif conf.output_destination == "shared_context" then
     kong.ctx.shared[conf.output_destination_name] = xml_string
   end
@@ -0,0 +1,238 @@
+-- JSON to XML serializer.
+--
+-- JSON is decoded with cjson and the XML is written straight into a reusable
+-- LuaJIT string buffer, without building an XML document tree and without
+-- concatenating strings per node.
+--
+-- JSON keys become element names. Keys that are not an XML Name (e.g. "1st",
+-- "a b" or "") are made into one by replacing each offending character with
+-- "_" and prefixing "_" when the first character cannot start a name.
+
+local cjson = require "cjson.safe"
+local string_buffer = require "string.buffer"
+
+local type = type
+local pairs = pairs
+local next = next
+local find = string.find
+local gsub = string.gsub
+local byte = string.byte
+local sub = string.sub
+local match = string.match
+local concat = table.concat
+local format = string.format
+local floor = math.floor
+local huge = math.huge
+
+local null = cjson.null
+
+-- Initial capacity of the per-worker buffer; it grows as needed and is
+-- reset, not freed, between conversions.
+local INITIAL_BUFFER_SIZE = 64 * 1024
+
+local buffer = string_buffer.new(INITIAL_BUFFER_SIZE)
+
+local ESCAPES = {
+  ["<"] = "&lt;",
+  [">"] = "&gt;",
+  ["&"] = "&amp;",
+  ['"'] = "&quot;",
+  ["'"] = "&apos;",
+}
+
+local function escape(text)
+  if find(text, "[<>&\"']") then
+    return (gsub(text, "[<>&\"']", ESCAPES))
+  end
+  return text
+end
+
+-- Code point ranges of NameStartChar beyond ASCII (XML 1.0, 5th edition)
+local NAME_START_RANGES = {
+  { 0xC0, 0xD6 }, { 0xD8, 0xF6 }, { 0xF8, 0x2FF }, { 0x370, 0x37D }, { 0x37F, 0x1FFF },
+  { 0x200C, 0x200D }, { 0x2070, 0x218F }, { 0x2C00, 0x2FEF }, { 0x3001, 0xD7FF },
+  { 0xF900, 0xFDCF }, { 0xFDF0, 0xFFFD }, { 0x10000, 0xEFFFF },
+}
+
+-- Further code point ranges allowed after the first character
+local NAME_RANGES = {
+  { 0xB7, 0xB7 }, { 0x300, 0x36F }, { 0x203F, 0x2040 },
+}
+
+local function in_ranges(code, ranges)
+  for i = 1, #ranges do
+    local range = ranges[i]
+    if code >= range[1] and code <= range[2] then
+      return true
+    end
+  end
+  return false
+end
+
+-- Decodes one UTF-8 sequence; nil when it is malformed
+local function code_point(char)
+  local b1, b2, b3, b4 = byte(char, 1, 4)
+  local len = #char
+  if len == 1 then
+    return b1
+  elseif len == 2 and b1 >= 0xC2 and b1 <= 0xDF then
+    return (b1 - 0xC0) * 0x40 + (b2 - 0x80)
+  elseif len == 3 and b1 >= 0xE0 and b1 <= 0xEF then
+    return (b1 - 0xE0) * 0x1000 + (b2 - 0x80) * 0x40 + (b3 - 0x80)
+  elseif len == 4 and b1 >= 0xF0 and b1 <= 0xF4 then
+    return (b1 - 0xF0) * 0x40000 + (b2 - 0x80) * 0x1000 + (b3 - 0x80) * 0x40 + (b4 - 0x80)
+  end
+  return nil
+end
+
+local function is_name_char(char, first)
+  if #char == 1 then
+    if find(char, "^[%a_:]") then
+      return true
+    end
+    return not first and find(char, "^[%d%.%-]") ~= nil
+  end
+  local code = code_point(char)
+  if not code then
+    return false
+  end
+  return in_ranges(code, NAME_START_RANGES) or (not first and in_ranges(code, NAME_RANGES))
+end
+
+-- Returns `key` as a valid XML element name
+local function element_name(key)
+  -- Fast path: plain ASCII names
+  if find(key, "^[%a_:][%w_:%.%-]*$") then
+    return key
+  end
+
+  local out = {}
+  local i, len = 1, #key
+  while i <= len do
+    local char = match(key, "^[\192-\255][\128-\191]*", i) or sub(key, i, i)
+    if is_name_char(char, #out == 0) then
+      out[#out + 1] = char
+    elseif #out == 0 and is_name_char(char, false) then
+      out[1], out[2] = "_", char -- e.g. a leading digit
+    else
+      out[#out + 1] = "_"
+    end
+    i = i + #char
+  end
+  if #out == 0 then
+    return "_"
+  end
+  return concat(out)
+end
+
+local function number_to_string(n)
+  if n == floor(n) and n > -1e15 and n < 1e15 then
+    return format("%d", n)
+  end
+  if n ~= n or n == huge or n == -huge then
+    return ""
+  end
+  return format("%.14g", n)
+end
+
+-- cjson decodes both `[]` and `{}` to empty tables; a table is treated as an
+-- array when it has a first element or is empty.
+local function is_array(value)
+  return value[1] ~= nil or next(value) == nil
+end
+
+local _M = {}
+
+local write_value
+
+-- Writes `value` as one or more `<name>` elements. JSON arrays become
+-- repeated elements, as in Apigee's JSONToXML policy.
+local function write_element(buf, name, value, opts)
+  if type(value) == "table" and is_array(value) and value[1] ~= nil then
+    for i = 1, #value do
+      local item = value[i]
+      if type(item) == "table" and item[1] ~= nil then
+        -- Nested arrays cannot repeat the parent name; wrap their items
+        buf:put("<", name, ">")
+        write_element(buf, opts.array_item_element_name, item, opts)
+        buf:put("</", name, ">")
+      else
+        write_element(buf, name, item, opts)
+      end
+    end
+    return
+  end
+
+  if value == null or (type(value) == "table" and next(value) == nil) then
+    buf:put("<", name, "/>")
+    return
+  end
+
+  buf:put("<", name, ">")
+  write_value(buf, value, opts)
+  buf:put("</", name, ">")
+end
+
+write_value = function(buf, value, opts)
+  local value_type = type(value)
+  if value_type == "string" then
+    buf:put(escape(value))
+  elseif value_type == "number" then
+    buf:put(number_to_string(value))
+  elseif value_type == "boolean" then
+    buf:put(value and "true" or "false")
+  elseif value_type == "table" then
+    if is_array(value) then
+      for i = 1, #value do
+        write_element(buf, opts.array_item_element_name, value[i], opts)
+      end
+    else
+      for key, child in pairs(value) do
+        write_element(buf, element_name(key), child, opts)
+      end
+    end
+  end
+end
+
+--- Serializes a decoded JSON value as an XML document.
+-- @param value any Decoded JSON (table, string, number, boolean or cjson.null).
+-- @param opts table `root_element_name`, `array_root_element_name`, `array_item_element_name`.
+-- @return the XML string.
+function _M.serialize(value, opts)
+  local buf = buffer
+  buf:reset()
+
+  local root = opts.root_element_name or "root"
+  local item_opts = {
+    array_item_element_name = opts.array_item_element_name or "item",
+  }
+
+  if type(value) == "table" and value[1] ~= nil and opts.array_root_element_name then
+    -- A top-level array gets its own wrapper element inside the root
+    buf:put("<", root, "><", opts.array_root_element_name, ">")
+    write_value(buf, value, item_opts)
+    buf:put("</", opts.array_root_element_name, "></", root, ">")
+  elseif value == null then
+    buf:put("<", root, "/>")
+  else
+    buf:put("<", root, ">")
+    write_value(buf, value, item_opts)
+    buf:put("</", root, ">")
+  end
+
+  local xml = buf:tostring()
+  buf:reset()
+  return xml
+end
+
+--- Decodes a JSON string with cjson and serializes it as XML.
+-- @return the XML string, or nil and an error message.
+function _M.convert(json_string, opts)
+  local value, err = cjson.decode(json_string)
+  if value == nil then
+    return nil, "Failed to decode JSON: " .. tostring(err)
+  end
+  return _M.serialize(value, opts)
+end
+
+return _M
@@ -0,0 +1,48 @@
+local serializer = require "kong.plugins.json-to-xml.serializer"
+local cjson = require "cjson.safe"
+
+local OPTS = {
+  root_element_name = "root",
+  array_item_element_name = "item",
+}
+
+describe("json-to-xml serializer", function()
+
+  it("writes objects as elements and escapes text", function()
+    assert.equals("<root><name>Tom &amp; Jerry</name></root>",
+                  serializer.serialize({ name = "Tom & Jerry" }, OPTS))
+  end)
+
+  it("writes arrays as repeated elements", function()
+    assert.equals("<root><id>1</id><id>2</id></root>", serializer.serialize({ id = { 1, 2 } }, OPTS))
+  end)
+
+  it("writes null and empty values as empty elements", function()
+    assert.equals("<root><a/></root>", serializer.serialize({ a = cjson.null }, OPTS))
+    assert.equals("<root/>", serializer.serialize(cjson.null, OPTS))
+  end)
+
+  it("wraps a top-level array when array_root_element_name is set", function()
+    local opts = { root_element_name = "root", array_root_element_name = "list", array_item_element_name = "item" }
+    assert.equals("<root><list><item>a</item><item>b</item></list></root>", serializer.serialize({ "a", "b" }, opts))
+  end)
+
+  it("keeps keys that are valid XML names", function()
+    assert.equals("<root><ns:a-b.c_1>x</ns:a-b.c_1></root>", serializer.serialize({ ["ns:a-b.c_1"] = "x" }, OPTS))
+    assert.equals("<root><größe>1</größe></root>", serializer.serialize({ ["größe"] = 1 }, OPTS))
+  end)
+
+  it("turns keys that are not XML names into valid element names", function()
+    assert.equals("<root><_1st>x</_1st></root>", serializer.serialize({ ["1st"] = "x" }, OPTS))
+    assert.equals("<root><a_b>x</a_b></root>", serializer.serialize({ ["a b"] = "x" }, OPTS))
+    assert.equals("<root><__script_>x</__script_></root>", serializer.serialize({ ["</script>"] = "x" }, OPTS))
+    assert.equals("<root><_>x</_></root>", serializer.serialize({ [""] = "x" }, OPTS))
+    assert.equals("<root><a_b>x</a_b></root>", serializer.serialize({ ["a×b"] = "x" }, OPTS))
+  end)
+
+  it("reports invalid JSON", function()
+    local xml, err = serializer.convert("{", OPTS)
+    assert.is_nil(xml)
+    assert.matches("Failed to decode JSON", err)
+  end)
+end)
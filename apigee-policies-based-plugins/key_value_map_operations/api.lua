@@ -0,0 +1,11 @@
+-- Admin API endpoint exposing the write-behind queue of this node.
+
+local handler = require "kong.plugins.key-value-map-operations.handler"
+
+return {
+  ["/key-value-map-operations/write-behind"] = {
+    GET = function()
+      return kong.response.exit(200, handler.get_write_behind_stats())
+    end,
+  },
+}
@@ -1,5 +1,7 @@
 local kong_meta = require "kong.meta"
 local cjson = require "cjson"
+local utils = require "kong.tools.utils"
+local request_context = require "kong.plugins.apigee_common.request_context"
 
 local KvmOperationsHandler = {}
 
@@ -11,9 +13,9 @@ local function get_source_value(source_type, source_name)
   if source_type == "literal" then
     return source_name
   elseif source_type == "header" then
-    return kong.request.get_header(source_name)
+    return request_context.get_header(source_name)
   elseif source_type == "query" then
-    return (kong.request.get_query())[source_name]
+    return request_context.get_query_arg(source_name)
   elseif source_type == "shared_context" then
     return kong.ctx.shared[source_name]
   elseif source_type == "body" then
@@ -29,9 +31,9 @@ end
 -- Helper to set a value to a destination
 local function set_destination_value(dest_type, dest_name, value)
   if dest_type == "header" then
-    kong.service.request.set_header(dest_name, value)
+    request_context.set_header(dest_name, value)
   elseif dest_type == "query" then
-    kong.service.request.set_query({ [dest_name] = value })
+    request_context.set_query_arg(dest_name, value)
   elseif dest_type == "shared_context" then
     kong.ctx.shared[dest_name] = value
   elseif dest_type == "body" then
@@ -40,6 +42,39 @@ local function set_destination_value(dest_type, dest_name, value)
   end
 end
 
+-- Writes several values in one pass. Query parameters and body fields are
+-- merged into a single update each, so later entries do not overwrite
+-- earlier ones.
+local function set_destination_values(assignments)
+  local query, body
+  for _, assignment in ipairs(assignments) do
+    local dest_type, dest_name, value = assignment[1], assignment[2], assignment[3]
+    if dest_type == "query" then
+      query = query or {}
+      query[dest_name] = value
+    elseif dest_type == "body" then
+      body = body or {}
+      body[dest_name] = value
+    else
+      set_destination_value(dest_type, dest_name, value)
+    end
+  end
+
+  if query then
+    local args = {}
+    for name, value in pairs(request_context.get_query()) do
+      args[name] = value
+    end
+    for name, value in pairs(query) do
+      args[name] = value
+    end
+    request_context.set_query(args)
+  end
+  if body then
+    kong.service.request.set_body(body)
+  end
+end
+
 local function handle_error(conf, message)
   kong.log.err(message)
   if not conf.on_error_continue then
@@ -76,23 +111,412 @@ local local_policy = {
     end
     dict:delete(key)
     return true
+  end,
+
+  mget = function(conf, keys)
+    local dict = kong.shared[conf.kvm_name]
+    if not dict then
+      return nil, "Shared dictionary not found: " .. conf.kvm_name
+    end
+    local values = {}
+    for _, key in ipairs(keys) do
+      values[key] = dict:get(key)
+    end
+    return values
+  end,
+
+  mput = function(conf, entries)
+    local dict = kong.shared[conf.kvm_name]
+    if not dict then
+      return nil, "Shared dictionary not found: " .. conf.kvm_name
+    end
+    for _, entry in ipairs(entries) do
+      local ok, err = dict:set(entry.key, entry.value, conf.ttl)
+      if not ok then
+        return nil, "Failed to set key in shared dictionary: " .. (err or "capacity exceeded")
+      end
+    end
+    return true
+  end,
+
+  mdelete = function(conf, keys)
+    local dict = kong.shared[conf.kvm_name]
+    if not dict then
+      return nil, "Shared dictionary not found: " .. conf.kvm_name
+    end
+    for _, key in ipairs(keys) do
+      dict:delete(key)
+    end
+    return true
+  end,
+}
+
+-- Interval, in seconds, at which expired cluster KVM rows are purged
+local SWEEP_INTERVAL = 60
+
+local function cluster_cache_key(kvm_name, key)
+  return "kvm_data:" .. kvm_name .. ":" .. key
+end
+
+-- kong.cache callback: loads one row from the database. Missing and expired
+-- rows are returned as nil and cached as misses; expired rows are left for
+-- the background sweeper instead of being deleted inside the request.
+local function load_cluster_value(conf, key)
+  local row, err = kong.db.kvm_data:select({ kvm_name = conf.kvm_name, key = key })
+  if err then
+    return nil, err
+  end
+
+  local now = ngx.time()
+  if not row or (row.expires_at and row.expires_at <= now) then
+    return nil
+  end
+
+  local ttl = conf.cache_ttl
+  if row.expires_at then
+    -- Never serve a cached value past the row's own expiry
+    ttl = math.min(ttl, row.expires_at - now)
+  end
+  return row.value, nil, ttl
+end
+
+-- Converts a key or value to the text stored in `kvm_data`. Values read
+-- from a JSON body or the shared context may be numbers, booleans or tables;
+-- tables are stored as JSON.
+local function to_text(value)
+  if type(value) == "table" then
+    return cjson.encode(value)
+  end
+  return tostring(value)
+end
+
+-- Returns the keys as a comma separated list of SQL text literals
+local function sql_key_list(keys)
+  local connector = kong.db.connector
+  local literals = {}
+  for i, key in ipairs(keys) do
+    literals[i] = connector:escape_literal(to_text(key)) .. "::text"
+  end
+  return table.concat(literals, ", ")
+end
+
+-- Reads several rows of one KVM with a single query. Returns a table of
+-- key -> { value, ttl } for rows that exist and have not expired.
+local function select_cluster_rows(conf, keys)
+  local connector = kong.db.connector
+  local rows, err = connector:query(
+    "SELECT key, value, EXTRACT(EPOCH FROM expires_at) AS expires_at FROM kvm_data" ..
+    " WHERE kvm_name = " .. connector:escape_literal(conf.kvm_name) ..
+    " AND key IN (" .. sql_key_list(keys) .. ");")
+  if not rows then
+    return nil, err
+  end
+
+  local now = ngx.time()
+  local found = {}
+  for _, row in ipairs(rows) do
+    local expires_at = tonumber(row.expires_at)
+    if not expires_at or expires_at > now then
+      local ttl = conf.cache_ttl
+      if expires_at then
+        ttl = math.min(ttl, expires_at - now)
+      end
+      found[row.key] = { value = row.value, ttl = ttl }
+    end
   end
+  return found
+end
+
+-- Writes several rows of one KVM with a single upsert statement. A key may
+-- only appear once per statement, so the last entry for a key wins. Every
+-- column is cast explicitly: PostgreSQL infers the types of a multi-row
+-- VALUES list from its first row, so a row whose value happens to be a
+-- number must not decide the type for the others.
+local function upsert_cluster_rows(kvm_name, entries)
+  local connector = kong.db.connector
+  local name = connector:escape_literal(kvm_name) .. "::text"
+  local values = {}
+  local positions = {}
+  for _, entry in ipairs(entries) do
+    local key = to_text(entry.key)
+    local position = positions[key] or #values + 1
+    positions[key] = position
+    values[position] = "(" .. connector:escape_literal(utils.uuid()) .. "::uuid, " .. name .. ", " ..
+                       connector:escape_literal(key) .. "::text, " ..
+                       connector:escape_literal(to_text(entry.value)) .. "::text, " ..
+                       (entry.expires_at and ("to_timestamp(" .. string.format("%d", entry.expires_at) .. ")")
+                                         or "NULL::timestamptz") .. ")"
+  end
+
+  return connector:query(
+    "INSERT INTO kvm_data (id, kvm_name, key, value, expires_at) VALUES " .. table.concat(values, ", ") ..
+    " ON CONFLICT (kvm_name, key) DO UPDATE SET value = EXCLUDED.value, expires_at = EXCLUDED.expires_at;")
+end
+
+local function return_prefetched(value, ttl)
+  return value, nil, ttl
+end
+
+-- Cluster event channel for KVM cache evictions. One event lists all the
+-- keys a flush or a bulk operation changed, instead of one `invalidations`
+-- event, and so one database insert, per key.
+local INVALIDATION_CHANNEL = "kvm-invalidations"
+
+-- Worker event source telling the workers of a node to drop queued writes
+local WORKER_SOURCE = "kvm-write-behind"
+
+-- Announces changed keys of one KVM to the other nodes, which evict them
+-- from their cache. With `deleted`, they also drop writes still queued for
+-- those keys.
+local function broadcast_invalidation(kvm_name, keys, deleted)
+  if not kong.cluster_events then
+    return
+  end
+  local ok, err = kong.cluster_events:broadcast(INVALIDATION_CHANNEL,
+    cjson.encode({ kvm_name = kvm_name, keys = keys, deleted = deleted }))
+  if not ok then
+    kong.log.err("KVM: Failed to announce changes to '", kvm_name, "' to other nodes: ", err)
+  end
+end
+
+-- Evicts keys of one KVM from the cache of this node and of all others
+local function invalidate_keys(kvm_name, keys, deleted)
+  for _, key in ipairs(keys) do
+    kong.cache:invalidate_local(cluster_cache_key(kvm_name, key))
+  end
+  broadcast_invalidation(kvm_name, keys, deleted)
+end
+
+-- Write-behind queues for cluster puts, one per KVM in each worker. Pending
+-- writes are coalesced by key (last write wins) and flushed from a timer as
+-- batched upserts; readers on the node see the new value immediately through
+-- the shared memory cache. A queue's batch size, size limit and flush
+-- interval come from the configuration that last queued a write to its KVM.
+local write_behind = {
+  queues = {},       -- kvm name -> { kvm_name, pending, depth, scheduled, ... }
+  depth = 0,         -- writes queued in all queues
+  dropped = 0,       -- writes given up on since the worker started
 }
 
+-- Publishes this worker's queue depth and dropped writes so that they can
+-- be read node-wide
+local function publish_queue_depth()
+  local dict = ngx.shared.kong
+  if dict then
+    local worker_id = ngx.worker.id()
+    dict:set("kvm_write_behind_queue_depth:" .. worker_id, write_behind.depth)
+    dict:set("kvm_write_behind_dropped:" .. worker_id, write_behind.dropped)
+  end
+end
+
+local function queue_for(conf)
+  local queue = write_behind.queues[conf.kvm_name]
+  if not queue then
+    queue = { kvm_name = conf.kvm_name, pending = {}, depth = 0, scheduled = false }
+    write_behind.queues[conf.kvm_name] = queue
+  end
+  queue.batch_size = conf.write_behind_max_batch_size
+  queue.max_queue_size = conf.write_behind_max_queue_size
+  queue.interval = conf.write_behind_flush_interval
+  return queue
+end
+
+local function add_pending(queue, entry)
+  if queue.pending[entry.key] == nil then
+    queue.depth = queue.depth + 1
+    write_behind.depth = write_behind.depth + 1
+  end
+  queue.pending[entry.key] = entry
+end
+
+-- Puts back a write whose flush failed. Returns false when the queue is
+-- full: the write is then dropped, and the value it cached on this node is
+-- evicted, as it never reached the database.
+local function requeue(queue, entry)
+  -- A newer write for the same key supersedes the failed one
+  if queue.pending[entry.key] ~= nil then
+    return true
+  end
+  if queue.depth >= queue.max_queue_size then
+    write_behind.dropped = write_behind.dropped + 1
+    kong.cache:invalidate_local(cluster_cache_key(queue.kvm_name, entry.key))
+    return false
+  end
+  add_pending(queue, entry)
+  return true
+end
+
+local schedule_flush
+
+local function flush_batch(queue, batch)
+  local _, err = upsert_cluster_rows(queue.kvm_name, batch)
+  if err then
+    kong.log.err("KVM: Write-behind flush of ", #batch, " entries to '", queue.kvm_name, "' failed: ", err)
+    local dropped = 0
+    for _, entry in ipairs(batch) do
+      if not requeue(queue, entry) then
+        dropped = dropped + 1
+      end
+    end
+    if dropped > 0 then
+      kong.log.err("KVM: Write-behind queue is full; dropped ", dropped, " failed writes to '", queue.kvm_name, "'.")
+    end
+    return
+  end
+
+  -- This node already serves the new values; evict them on the others
+  local keys = {}
+  for i, entry in ipairs(batch) do
+    keys[i] = entry.key
+  end
+  broadcast_invalidation(queue.kvm_name, keys)
+end
+
+-- Flushes a queue in batches of at most `batch_size` rows
+local function flush_queue(premature, queue)
+  queue.scheduled = false
+
+  local pending = queue.pending
+  queue.pending = {}
+  write_behind.depth = write_behind.depth - queue.depth
+  queue.depth = 0
+
+  local batch = {}
+  for _, entry in pairs(pending) do
+    batch[#batch + 1] = entry
+    if #batch >= queue.batch_size then
+      flush_batch(queue, batch)
+      batch = {}
+    end
+  end
+  if #batch > 0 then
+    flush_batch(queue, batch)
+  end
+
+  publish_queue_depth()
+
+  -- Entries left after a failure are retried, unless the worker is exiting
+  if queue.depth > 0 and not premature then
+    schedule_flush(queue)
+  end
+end
+
+schedule_flush = function(queue)
+  if queue.scheduled then
+    return
+  end
+  local ok, err = ngx.timer.at(queue.interval, flush_queue, queue)
+  if not ok then
+    kong.log.err("KVM: Failed to schedule write-behind flush: ", err)
+    return
+  end
+  queue.scheduled = true
+end
+
+-- Queues a cluster put. Returns false when the queue is full, in which case
+-- the caller writes synchronously.
+local function enqueue_write(conf, key, value, expires_at)
+  local queue = queue_for(conf)
+  if queue.pending[key] == nil and queue.depth >= queue.max_queue_size then
+    kong.log.warn("KVM: Write-behind queue of '", conf.kvm_name, "' is full (", queue.depth,
+                  " entries); writing synchronously.")
+    return false
+  end
+  add_pending(queue, { key = key, value = value, expires_at = expires_at })
+
+  if conf.cache_ttl > 0 then
+    local cache_key = cluster_cache_key(conf.kvm_name, key)
+    local ttl = conf.cache_ttl
+    if expires_at then
+      ttl = math.min(ttl, expires_at - ngx.time())
+    end
+    kong.cache:invalidate_local(cache_key)
+    kong.cache:get(cache_key, { ttl = conf.cache_ttl, neg_ttl = conf.cache_ttl },
+                   return_prefetched, value, ttl)
+  end
+
+  publish_queue_depth()
+  schedule_flush(queue)
+  return true
+end
+
+-- Drops writes queued in this worker, so that a delete is not undone by a
+-- later flush
+local function discard_queued_writes(kvm_name, keys)
+  local queue = write_behind.queues[kvm_name]
+  if not queue then
+    return
+  end
+  local discarded = 0
+  for _, key in ipairs(keys) do
+    if queue.pending[key] ~= nil then
+      queue.pending[key] = nil
+      discarded = discarded + 1
+    end
+  end
+  if discarded > 0 then
+    queue.depth = queue.depth - discarded
+    write_behind.depth = write_behind.depth - discarded
+    publish_queue_depth()
+  end
+end
+
+-- Drops queued writes in every worker of this node: in this one right away,
+-- in the others through a worker event
+local function discard_node_writes(kvm_name, keys)
+  discard_queued_writes(kvm_name, keys)
+  local ok, err = kong.worker_events.post(WORKER_SOURCE, "discard", { kvm_name = kvm_name, keys = keys })
+  if not ok then
+    kong.log.err("KVM: Failed to discard queued writes to '", kvm_name, "' in other workers: ", err)
+  end
+end
+
+-- Cluster event handler: evicts keys changed on another node, and drops
+-- writes queued here for keys deleted there
+local function on_invalidation(data)
+  local ok, event = pcall(cjson.decode, data)
+  if not ok or type(event) ~= "table" or type(event.kvm_name) ~= "string" or type(event.keys) ~= "table" then
+    return
+  end
+  for _, key in ipairs(event.keys) do
+    kong.cache:invalidate_local(cluster_cache_key(event.kvm_name, key))
+  end
+  if event.deleted then
+    discard_node_writes(event.kvm_name, event.keys)
+  end
+end
+
+-- Returns the value of a write still queued in this worker, if any
+local function queued_value(kvm_name, key)
+  local queue = write_behind.queues[kvm_name]
+  local entry = queue and queue.pending[key]
+  return entry and entry.value
+end
+
 -- Cluster Policy (database) implementation
 local cluster_policy = {
   get = function(conf, key)
-    local row, err = kong.db.kvm_data:select({ kvm_name = conf.kvm_name, key = key })
-    if err then
-      return nil, "Database error on get: " .. err
+    local queued = queued_value(conf.kvm_name, key)
+    if queued ~= nil then
+      return queued
     end
-    if not row or (row.expires_at and row.expires_at <= ngx.time()) then
-      if row then -- cleanup expired entry
-        kong.db.kvm_data:delete({ id = row.id })
+
+    if conf.cache_ttl == 0 then
+      local value, err = load_cluster_value(conf, key)
+      if err then
+        return nil, "Database error on get: " .. err
       end
-      return nil -- Not found or expired
+      return value
     end
-    return row.value
+
+    local value, err = kong.cache:get(cluster_cache_key(conf.kvm_name, key), {
+      ttl = conf.cache_ttl,
+      neg_ttl = conf.cache_ttl,
+    }, load_cluster_value, conf, key)
+    if err then
+      return nil, "Database error on get: " .. err
+    end
+    return value
   end,
 
   put = function(conf, key, value)
@@ -101,6 +525,10 @@ local cluster_policy = {
       expires_at = ngx.time() + conf.ttl
     end
 
+    if conf.write_mode == "write_behind" and enqueue_write(conf, key, value, expires_at) then
+      return true
+    end
+
     local row, err = kong.db.kvm_data:upsert({
       kvm_name = conf.kvm_name,
       key = key,
@@ -112,29 +540,251 @@ local cluster_policy = {
     if err then
       return nil, "Database error on put: " .. err
     end
+
+    -- Evicts the entry on this node and, through cluster events, on all others
+    invalidate_keys(conf.kvm_name, { key })
     return row
   end,
 
   delete = function(conf, key)
+    discard_node_writes(conf.kvm_name, { key })
     local _, err = kong.db.kvm_data:delete({ kvm_name = conf.kvm_name, key = key })
     if err then
       return nil, "Database error on delete: " .. err
     end
+    invalidate_keys(conf.kvm_name, { key }, true)
     return true
-  end
+  end,
+
+  -- Serves what it can from the cache and loads all remaining keys with one
+  -- query, then stores those results (including misses) in the cache.
+  mget = function(conf, keys)
+    local values = {}
+    local missing = {}
+
+    for _, key in ipairs(keys) do
+      local queued = queued_value(conf.kvm_name, key)
+      if queued ~= nil then
+        values[key] = queued
+      elseif conf.cache_ttl == 0 then
+        missing[#missing + 1] = key
+      else
+        local ttl, _, value = kong.cache:probe(cluster_cache_key(conf.kvm_name, key))
+        if ttl then
+          values[key] = value
+        else
+          missing[#missing + 1] = key
+        end
+      end
+    end
+
+    if #missing == 0 then
+      return values
+    end
+
+    local found, err = select_cluster_rows(conf, missing)
+    if not found then
+      return nil, "Database error on mget: " .. err
+    end
+
+    local cache_opts = { ttl = conf.cache_ttl, neg_ttl = conf.cache_ttl }
+    for _, key in ipairs(missing) do
+      local row = found[to_text(key)]
+      values[key] = row and row.value
+      if conf.cache_ttl > 0 then
+        kong.cache:get(cluster_cache_key(conf.kvm_name, key), cache_opts,
+                       return_prefetched, row and row.value, row and row.ttl)
+      end
+    end
+    return values
+  end,
+
+  mput = function(conf, entries)
+    local expires_at = nil
+    if conf.ttl and conf.ttl > 0 then
+      expires_at = ngx.time() + conf.ttl
+    end
+
+    -- Values are queued as stored, so a queued value reads the same as
+    -- the flushed one
+    local rows = {}
+    local keys = {}
+    for _, entry in ipairs(entries) do
+      local key, value = to_text(entry.key), to_text(entry.value)
+      if conf.write_mode ~= "write_behind" or not enqueue_write(conf, key, value, expires_at) then
+        rows[#rows + 1] = { key = key, value = value, expires_at = expires_at }
+        keys[#keys + 1] = key
+      end
+    end
+    if #rows == 0 then
+      return true
+    end
+
+    local _, err = upsert_cluster_rows(conf.kvm_name, rows)
+    if err then
+      return nil, "Database error on mput: " .. err
+    end
+    invalidate_keys(conf.kvm_name, keys)
+    return true
+  end,
+
+  mdelete = function(conf, keys)
+    local text_keys = {}
+    for i, key in ipairs(keys) do
+      text_keys[i] = to_text(key)
+    end
+    keys = text_keys
+
+    discard_node_writes(conf.kvm_name, keys)
+    local connector = kong.db.connector
+    local _, err = connector:query(
+      "DELETE FROM kvm_data WHERE kvm_name = " .. connector:escape_literal(conf.kvm_name) ..
+      " AND key IN (" .. sql_key_list(keys) .. ");")
+    if err then
+      return nil, "Database error on mdelete: " .. err
+    end
+    invalidate_keys(conf.kvm_name, keys, true)
+    return true
+  end,
 }
 
+-- Deletes expired cluster KVM rows. Runs on one worker per node; concurrent
+-- sweeps from several nodes are harmless.
+local function sweep_expired_rows(premature)
+  if premature then
+    return
+  end
+
+  local _, err = kong.db.connector:query(
+    "DELETE FROM kvm_data WHERE expires_at IS NOT NULL AND expires_at <= CURRENT_TIMESTAMP;")
+  if err then
+    kong.log.err("KVM: Failed to purge expired cluster entries: ", err)
+  end
+end
+
 local policies = {
-  local = local_policy,
+  ["local"] = local_policy,
   cluster = cluster_policy,
 }
 
+-- Runs an mget/mput/mdelete over the configured `entries`
+local function run_bulk_operation(conf, policy_impl)
+  if not conf.entries or #conf.entries == 0 then
+    return handle_error(conf, "'entries' is required for '" .. conf.operation_type .. "' operation.")
+  end
+
+  local keys = {}
+  for i, entry in ipairs(conf.entries) do
+    local key = get_source_value(entry.key_source_type, entry.key_source_name)
+    if not key then
+      return handle_error(conf, "KVM operation key not found or is empty for entry " .. i .. ".")
+    end
+    keys[i] = key
+  end
+
+  if conf.operation_type == "mget" then
+    local values, err = policy_impl.mget(conf, keys)
+    if not values then
+      return handle_error(conf, err)
+    end
+
+    local assignments = {}
+    for i, entry in ipairs(conf.entries) do
+      if not entry.output_destination_type or not entry.output_destination_name then
+        return handle_error(conf, "'output_destination_type' and 'output_destination_name' are required for each 'mget' entry.")
+      end
+      local value = values[keys[i]]
+      if value ~= nil then
+        assignments[#assignments + 1] = { entry.output_destination_type, entry.output_destination_name, value }
+      else
+        kong.log.debug("KVM key not found: ", keys[i])
+      end
+    end
+    set_destination_values(assignments)
+
+  elseif conf.operation_type == "mput" then
+    local entries = {}
+    for i, entry in ipairs(conf.entries) do
+      if not entry.value_source_type or not entry.value_source_name then
+        return handle_error(conf, "'value_source_type' and 'value_source_name' are required for each 'mput' entry.")
+      end
+      local value = get_source_value(entry.value_source_type, entry.value_source_name)
+      if value == nil then
+        return handle_error(conf, "KVM value for 'mput' entry " .. i .. " not found.")
+      end
+      entries[i] = { key = keys[i], value = value }
+    end
+
+    local ok, err = policy_impl.mput(conf, entries)
+    if not ok then
+      return handle_error(conf, err)
+    end
+
+  elseif conf.operation_type == "mdelete" then
+    local ok, err = policy_impl.mdelete(conf, keys)
+    if not ok then
+      return handle_error(conf, err)
+    end
+  end
+end
+
+function KvmOperationsHandler:init_worker()
+  kong.worker_events.register(function(data)
+    discard_queued_writes(data.kvm_name, data.keys)
+  end, WORKER_SOURCE, "discard")
+  if kong.cluster_events then
+    kong.cluster_events:subscribe(INVALIDATION_CHANNEL, on_invalidation)
+  end
+
+  if ngx.worker.id() ~= 0 or not kong.db or kong.db.strategy ~= "postgres" then
+    return
+  end
+
+  local ok, err = ngx.timer.every(SWEEP_INTERVAL, sweep_expired_rows)
+  if not ok then
+    kong.log.err("KVM: Failed to start the expired entry sweeper: ", err)
+  end
+end
+
+local function sum_workers(prefix, own)
+  local dict = ngx.shared.kong
+  if not dict then
+    return own
+  end
+  local total = 0
+  for worker_id = 0, ngx.worker.count() - 1 do
+    total = total + (dict:get(prefix .. worker_id) or 0)
+  end
+  return total
+end
+
+--- Returns the number of cluster writes queued for write-behind across all
+-- workers of this node.
+function KvmOperationsHandler.get_write_behind_queue_depth()
+  return sum_workers("kvm_write_behind_queue_depth:", write_behind.depth)
+end
+
+--- Returns the write-behind state of this node: `queue_depth`, and
+-- `dropped`, the writes given up on because the queue was full when their
+-- flush failed, since the workers started. Served by the Admin API at
+-- `/key-value-map-operations/write-behind`.
+function KvmOperationsHandler.get_write_behind_stats()
+  return {
+    queue_depth = KvmOperationsHandler.get_write_behind_queue_depth(),
+    dropped = sum_workers("kvm_write_behind_dropped:", write_behind.dropped),
+  }
+end
+
 function KvmOperationsHandler:access(conf)
   local policy_impl = policies[conf.policy]
   if not policy_impl then
     return handle_error(conf, "Invalid KVM policy specified: " .. conf.policy)
   end
 
+  if conf.operation_type == "mget" or conf.operation_type == "mput" or conf.operation_type == "mdelete" then
+    return run_bulk_operation(conf, policy_impl)
+  end
+
   -- 1. Get the key for the operation
   local key = get_source_value(conf.key_source_type, conf.key_source_name)
   if not key then
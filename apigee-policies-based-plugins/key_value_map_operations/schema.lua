@@ -30,16 +30,15 @@ return {
             operation_type = {
               type = "string",
               required = true,
-              enum = { "get", "put", "delete" },
-              description = "The Key-Value Map operation to perform.",
+              enum = { "get", "put", "delete", "mget", "mput", "mdelete" },
+              description = "The Key-Value Map operation to perform. `mget`, `mput` and `mdelete` operate on every mapping in `entries` at once.",
             },
           },
           {
             key_source_type = {
               type = "string",
-              required = true,
               enum = { "header", "query", "body", "shared_context", "literal" },
-              description = "Specifies where to get the key for the KVM operation.",
+              description = "Required for 'get', 'put' and 'delete' operations: Specifies where to get the key for the KVM operation.",
             },
           },
           {
@@ -74,6 +73,57 @@ return {
               description = "Required for 'get' operation: The name of the header/query parameter, the JSON path for a 'body' destination, or the key in `kong.ctx.shared` where the retrieved value will be stored.",
             },
           },
+          {
+            entries = {
+              type = "array",
+              elements = {
+                type = "record",
+                fields = {
+                  {
+                    key_source_type = {
+                      type = "string",
+                      required = true,
+                      enum = { "header", "query", "body", "shared_context", "literal" },
+                      description = "Specifies where to get the key of this entry.",
+                    },
+                  },
+                  {
+                    key_source_name = {
+                      type = "string",
+                      description = "The name of the header/query parameter, the JSON path for a 'body' source, the key in `kong.ctx.shared`, or the literal key itself.",
+                    },
+                  },
+                  {
+                    value_source_type = {
+                      type = "string",
+                      enum = { "header", "query", "body", "shared_context", "literal" },
+                      description = "Required for 'mput' operation: Specifies where to get the value of this entry.",
+                    },
+                  },
+                  {
+                    value_source_name = {
+                      type = "string",
+                      description = "Required for 'mput' operation: The name of the value source, or the literal value itself.",
+                    },
+                  },
+                  {
+                    output_destination_type = {
+                      type = "string",
+                      enum = { "header", "query", "body", "shared_context" },
+                      description = "Required for 'mget' operation: Specifies where to place the value of this entry.",
+                    },
+                  },
+                  {
+                    output_destination_name = {
+                      type = "string",
+                      description = "Required for 'mget' operation: The header/query parameter name, body field, or `kong.ctx.shared` key for the value of this entry.",
+                    },
+                  },
+                },
+              },
+              description = "Required for 'mget', 'mput' and 'mdelete' operations: The key/value/destination mappings to process. Cluster reads, writes and deletes for all entries run as a single database query.",
+            },
+          },
           {
             ttl = {
               type = "number",
@@ -81,6 +131,46 @@ return {
               description = "Optional, for 'put' operation: Time-to-live for the entry in seconds. If 0, the entry does not expire. Defaults to no expiry if not set.",
             },
           },
+          {
+            cache_ttl = {
+              type = "number",
+              default = 60,
+              between = { 0, 86400 },
+              description = "For 'cluster' policy: seconds a value (or a miss) read from the database is kept in the node's shared memory cache. Writes and deletes invalidate the entry on all nodes. `0` disables the cache.",
+            },
+          },
+          {
+            write_mode = {
+              type = "string",
+              default = "write_through",
+              enum = { "write_through", "write_behind" },
+              description = "For 'cluster' policy puts: `write_through` writes to the database inside the request. `write_behind` makes the value visible on the node immediately and writes it to the database later, coalesced per key and batched, from a per-worker timer.",
+            },
+          },
+          {
+            write_behind_flush_interval = {
+              type = "number",
+              default = 1,
+              between = { 0.01, 60 },
+              description = "For `write_behind`: seconds between a queued put and its flush to the database. This bounds how much data is at risk if a worker stops abnormally.",
+            },
+          },
+          {
+            write_behind_max_batch_size = {
+              type = "integer",
+              default = 500,
+              between = { 1, 10000 },
+              description = "For `write_behind`: maximum number of rows written by a single upsert statement.",
+            },
+          },
+          {
+            write_behind_max_queue_size = {
+              type = "integer",
+              default = 10000,
+              between = { 1, 1000000 },
+              description = "For `write_behind`: maximum number of distinct keys queued per worker. When the queue is full, further puts are written synchronously.",
+            },
+          },
           {
             on_error_status = {
               type = "number",
@@ -107,4 +197,18 @@ return {
       },
     },
   },
+  entity_checks = {
+    {
+      conditional = {
+        if_field = "config.operation_type", if_match = { one_of = { "get", "put", "delete" } },
+        then_field = "config.key_source_type", then_match = { required = true },
+      },
+    },
+    {
+      conditional = {
+        if_field = "config.operation_type", if_match = { one_of = { "mget", "mput", "mdelete" } },
+        then_field = "config.entries", then_match = { required = true, len_min = 1 },
+      },
+    },
+  },
 }
@@ -0,0 +1,541 @@
+local cjson = require "cjson"
+
+describe("key-value-map-operations handler", function()
+  local handler, api, timers, periodic_timers, statements, query_results, rows, cache, cache_loads
+  local invalidated, broadcasts, worker_handlers, cluster_handlers, shared_ctx, exits, stats_dict
+  local original_timer_at, original_timer_every = ngx.timer.at, ngx.timer.every
+  local original_worker, original_shared_kong = ngx.worker, ngx.shared.kong
+  local original_time = ngx.time
+
+  local function conf(overrides)
+    local c = {
+      policy = "cluster",
+      kvm_name = "kvm",
+      operation_type = "put",
+      key_source_type = "literal",
+      key_source_name = "k1",
+      value_source_type = "literal",
+      value_source_name = "v1",
+      output_destination_type = "shared_context",
+      output_destination_name = "out",
+      cache_ttl = 60,
+      write_mode = "write_behind",
+      write_behind_flush_interval = 1,
+      write_behind_max_batch_size = 500,
+      write_behind_max_queue_size = 10000,
+      on_error_status = 500,
+      on_error_continue = false,
+    }
+    for k, v in pairs(overrides or {}) do
+      c[k] = v
+    end
+    return c
+  end
+
+  local function put(key, value, overrides)
+    local c = conf(overrides)
+    c.key_source_name, c.value_source_name = key, value
+    handler:access(c)
+  end
+
+  local function get(key, overrides)
+    local c = conf(overrides)
+    c.operation_type, c.key_source_name = "get", key
+    shared_ctx.out = nil
+    handler:access(c)
+    return shared_ctx.out
+  end
+
+  local function run_timers()
+    while #timers > 0 do
+      local timer = table.remove(timers, 1)
+      timer.fn(false, unpack(timer.args, 1, timer.n))
+    end
+  end
+
+  local function upserts()
+    local found = {}
+    for _, sql in ipairs(statements) do
+      if sql:find("^INSERT INTO kvm_data") then
+        found[#found + 1] = sql
+      end
+    end
+    return found
+  end
+
+  local function kvm_broadcasts()
+    local found = {}
+    for _, b in ipairs(broadcasts) do
+      if b.channel == "kvm-invalidations" then
+        found[#found + 1] = cjson.decode(b.data)
+      end
+    end
+    return found
+  end
+
+  local function sorted(list)
+    local copy = {}
+    for i, v in ipairs(list) do
+      copy[i] = v
+    end
+    table.sort(copy)
+    return copy
+  end
+
+  setup(function()
+    ngx.time = function() return 1000 end
+    ngx.worker = { id = function() return 0 end, count = function() return 1 end }
+    ngx.timer.at = function(delay, fn, ...)
+      timers[#timers + 1] = { delay = delay, fn = fn, args = { ... }, n = select("#", ...) }
+      return true
+    end
+    ngx.timer.every = function(interval, fn)
+      periodic_timers[#periodic_timers + 1] = { interval = interval, fn = fn }
+      return true
+    end
+    package.loaded["kong.meta"] = { version = "test" }
+    local ids = 0
+    package.loaded["kong.tools.utils"] = {
+      uuid = function()
+        ids = ids + 1
+        return "uuid-" .. ids
+      end,
+    }
+    package.loaded["kong.plugins.apigee_common.request_context"] = {
+      get_header = function() end,
+      get_query_arg = function() end,
+    }
+  end)
+
+  teardown(function()
+    ngx.timer.at, ngx.timer.every = original_timer_at, original_timer_every
+    ngx.worker, ngx.shared.kong = original_worker, original_shared_kong
+    ngx.time = original_time
+    package.loaded["kong.meta"] = nil
+    package.loaded["kong.tools.utils"] = nil
+    package.loaded["kong.plugins.apigee_common.request_context"] = nil
+    package.loaded["kong.plugins.key-value-map-operations.handler"] = nil
+    package.loaded["kong.plugins.key-value-map-operations.api"] = nil
+  end)
+
+  before_each(function()
+    timers, periodic_timers, statements, query_results = {}, {}, {}, {}
+    rows, cache, cache_loads, invalidated, broadcasts = {}, {}, 0, {}, {}
+    worker_handlers, cluster_handlers, shared_ctx, exits = {}, {}, {}, {}
+
+    local stats_values = {}
+    stats_dict = {
+      get = function(_, key) return stats_values[key] end,
+      set = function(_, key, value) stats_values[key] = value return true end,
+    }
+    ngx.shared.kong = stats_dict
+
+    -- A miss is cached as `false`, as mlcache does with its negative cache
+    local function cached(key)
+      local item = cache[key]
+      if item ~= nil then
+        return item.value
+      end
+    end
+
+    _G.kong = {
+      log = { err = function() end, warn = function() end, debug = function() end },
+      ctx = { shared = shared_ctx },
+      response = {
+        exit = function(status, body)
+          exits[#exits + 1] = { status = status, body = body }
+        end,
+      },
+      cache = {
+        get = function(_, key, _, callback, ...)
+          if cache[key] ~= nil then
+            return cached(key)
+          end
+          cache_loads = cache_loads + 1
+          local value, err, ttl = callback(...)
+          if err then
+            return nil, err
+          end
+          cache[key] = { value = value, ttl = ttl }
+          return value
+        end,
+        probe = function(_, key)
+          if cache[key] ~= nil then
+            return 1, nil, cached(key)
+          end
+        end,
+        invalidate_local = function(_, key)
+          invalidated[#invalidated + 1] = key
+          cache[key] = nil
+        end,
+      },
+      db = {
+        strategy = "postgres",
+        kvm_data = {
+          select = function(_, pk)
+            return rows[pk.kvm_name .. ":" .. pk.key]
+          end,
+          upsert = function(_, pk, fields)
+            statements[#statements + 1] = "UPSERT " .. pk.key
+            rows[pk.kvm_name .. ":" .. pk.key] = { value = fields.value, expires_at = fields.expires_at }
+            return true
+          end,
+          delete = function(_, pk)
+            statements[#statements + 1] = "DELETE " .. pk.key
+            rows[pk.kvm_name .. ":" .. pk.key] = nil
+            return true
+          end,
+        },
+        connector = {
+          escape_literal = function(_, value)
+            if type(value) == "number" then
+              return tostring(value)
+            end
+            return "'" .. tostring(value) .. "'"
+          end,
+          query = function(_, sql)
+            statements[#statements + 1] = sql
+            local result = table.remove(query_results, 1)
+            if result then
+              return result()
+            end
+            return {}
+          end,
+        },
+      },
+      worker_events = {
+        register = function(fn, source, event)
+          worker_handlers[source .. ":" .. event] = fn
+        end,
+        post = function(source, event, data)
+          local fn = worker_handlers[source .. ":" .. event]
+          if fn then
+            fn(data)
+          end
+          return true
+        end,
+      },
+      cluster_events = {
+        subscribe = function(_, channel, fn)
+          cluster_handlers[channel] = fn
+        end,
+        broadcast = function(_, channel, data)
+          broadcasts[#broadcasts + 1] = { channel = channel, data = data }
+          return true
+        end,
+      },
+    }
+
+    package.loaded["kong.plugins.key-value-map-operations.handler"] = nil
+    package.loaded["kong.plugins.key-value-map-operations.api"] = nil
+    handler = require "kong.plugins.key-value-map-operations.handler"
+    api = require "kong.plugins.key-value-map-operations.api"
+    handler:init_worker()
+  end)
+
+  describe("write-behind", function()
+    it("coalesces puts per key into one upsert and one invalidation event", function()
+      put("k1", "a")
+      put("k1", "b")
+      put("k2", "c")
+      assert.equals(1, #timers)
+      run_timers()
+
+      local sql = upserts()
+      assert.equals(1, #sql)
+      assert.matches("'b'", sql[1])
+      assert.is_nil(sql[1]:find("'a'", 1, true))
+
+      local events = kvm_broadcasts()
+      assert.equals(1, #events)
+      assert.equals("kvm", events[1].kvm_name)
+      assert.same({ "k1", "k2" }, sorted(events[1].keys))
+      assert.equals(0, #broadcasts - #events)
+    end)
+
+    it("serves queued values before they are flushed", function()
+      put("k1", "queued")
+      assert.equals("queued", get("k1"))
+      assert.equals(0, #statements)
+    end)
+
+    it("splits a flush into batches of write_behind_max_batch_size rows", function()
+      for i = 1, 5 do
+        put("k" .. i, "v", { write_behind_max_batch_size = 2 })
+      end
+      run_timers()
+      assert.equals(3, #upserts())
+      assert.equals(3, #kvm_broadcasts())
+    end)
+
+    it("requeues failed writes up to the queue size and drops the rest", function()
+      local limits = { write_behind_max_queue_size = 2 }
+      put("k1", "a", limits)
+      put("k2", "b", limits)
+      -- While the failing upsert is in flight, two newer writes fill the queue
+      query_results[1] = function()
+        put("k3", "c", limits)
+        put("k4", "d", limits)
+        return nil, "connection refused"
+      end
+      local flush = table.remove(timers, 1)
+      flush.fn(false, unpack(flush.args, 1, flush.n))
+
+      local stats = handler.get_write_behind_stats()
+      assert.equals(2, stats.queue_depth)
+      assert.equals(2, stats.dropped)
+      -- Dropped values never reached the database, so they leave the cache
+      assert.same({ "kvm_data:kvm:k1", "kvm_data:kvm:k2" },
+                  sorted({ invalidated[#invalidated - 1], invalidated[#invalidated] }))
+
+      run_timers()
+      assert.equals(0, handler.get_write_behind_stats().queue_depth)
+      assert.matches("'c'", upserts()[2])
+    end)
+
+    it("retries a failed flush when the queue has room", function()
+      put("k1", "a")
+      query_results[1] = function() return nil, "connection refused" end
+      run_timers()
+      assert.equals(2, #upserts())
+      assert.equals(0, handler.get_write_behind_stats().dropped)
+    end)
+
+    it("keeps the queue limits of each KVM apart", function()
+      put("k1", "a", { kvm_name = "small", write_behind_max_queue_size = 1 })
+      put("k1", "a", { kvm_name = "large", write_behind_max_queue_size = 100 })
+      put("k2", "b", { kvm_name = "large", write_behind_max_queue_size = 100 })
+      -- The small KVM is full, so this one is written synchronously
+      put("k2", "b", { kvm_name = "small", write_behind_max_queue_size = 1 })
+
+      assert.equals("UPSERT k2", statements[1])
+      assert.equals(3, handler.get_write_behind_stats().queue_depth)
+    end)
+
+    it("drops writes queued in every worker when a key is deleted", function()
+      put("k1", "a")
+      handler:access(conf({ operation_type = "delete", write_mode = "write_through" }))
+      run_timers()
+
+      assert.equals(0, #upserts())
+      local events = kvm_broadcasts()
+      assert.same({ "k1" }, events[1].keys)
+      assert.is_true(events[1].deleted)
+    end)
+
+    it("drops writes queued here for keys deleted on another node", function()
+      put("k1", "a")
+      put("k2", "b")
+      cluster_handlers["kvm-invalidations"](cjson.encode({ kvm_name = "kvm", keys = { "k1" }, deleted = true }))
+      run_timers()
+
+      assert.equals(1, #upserts())
+      assert.is_nil(upserts()[1]:find("'k1'", 1, true))
+      assert.equals("kvm_data:kvm:k1", invalidated[#invalidated])
+    end)
+
+    it("serves the node's queue depth on the Admin API", function()
+      put("k1", "a")
+      put("k2", "b")
+      api["/key-value-map-operations/write-behind"].GET()
+      assert.equals(200, exits[1].status)
+      assert.same({ queue_depth = 2, dropped = 0 }, exits[1].body)
+    end)
+  end)
+
+  describe("bulk operations", function()
+    local function bulk(operation, entries, overrides)
+      local c = conf(overrides)
+      c.operation_type, c.entries = operation, entries
+      handler:access(c)
+    end
+
+    local function entry(key, value, destination)
+      return {
+        key_source_type = "literal", key_source_name = key,
+        value_source_type = value and "shared_context", value_source_name = value,
+        output_destination_type = "shared_context", output_destination_name = destination,
+      }
+    end
+
+    it("mget serves cached and queued keys and loads the rest with one query", function()
+      cache["kvm_data:kvm:cached"] = { value = "from cache" }
+      put("queued", "from queue")
+      query_results[1] = function()
+        return { { key = "stored", value = "from db", expires_at = nil } }
+      end
+
+      bulk("mget", {
+        entry("cached", nil, "a"), entry("queued", nil, "b"),
+        entry("stored", nil, "c"), entry("missing", nil, "d"),
+      })
+
+      assert.equals(1, #statements)
+      assert.matches("^SELECT key, value", statements[1])
+      assert.matches("'stored'::text, 'missing'::text", statements[1])
+      assert.equals("from cache", shared_ctx.a)
+      assert.equals("from queue", shared_ctx.b)
+      assert.equals("from db", shared_ctx.c)
+      assert.is_nil(shared_ctx.d)
+      assert.equals(0, #exits)
+    end)
+
+    it("mget caches the rows it loads, including misses", function()
+      query_results[1] = function()
+        return { { key = "stored", value = "from db" } }
+      end
+      bulk("mget", { entry("stored", nil, "a"), entry("missing", nil, "b") })
+      bulk("mget", { entry("stored", nil, "a"), entry("missing", nil, "b") })
+
+      assert.equals(1, #statements)
+      assert.equals("from db", shared_ctx.a)
+    end)
+
+    it("mput writes all entries with one upsert and one invalidation event", function()
+      shared_ctx.first, shared_ctx.second = "text", 42
+      bulk("mput", { entry("k1", "first"), entry("k2", "second") }, { write_mode = "write_through" })
+
+      local sql = upserts()
+      assert.equals(1, #sql)
+      local events = kvm_broadcasts()
+      assert.equals(1, #events)
+      assert.same({ "k1", "k2" }, events[1].keys)
+      assert.is_nil(events[1].deleted)
+      assert.same({ "kvm_data:kvm:k1", "kvm_data:kvm:k2" }, invalidated)
+    end)
+
+    it("mput casts every value in the VALUES list to text", function()
+      shared_ctx.number, shared_ctx.flag, shared_ctx.object = 42, true, { a = 1 }
+      bulk("mput", { entry("n", "number"), entry("f", "flag"), entry("o", "object") },
+           { write_mode = "write_through" })
+
+      local sql = upserts()[1]
+      assert.matches("'42'::text", sql, 1, true)
+      assert.matches("'true'::text", sql, 1, true)
+      assert.matches('{"a":', sql:gsub(" ", ""), 1, true)
+      assert.matches("::uuid, 'kvm'::text, 'n'::text", sql, 1, true)
+      assert.matches("NULL::timestamptz", sql, 1, true)
+      assert.is_nil(sql:find(", 42,", 1, true))
+    end)
+
+    it("mput queues text values in write-behind mode", function()
+      shared_ctx.number = 42
+      bulk("mput", { entry("n", "number") })
+      assert.equals(0, #statements)
+      assert.equals("42", get("n"))
+
+      run_timers()
+      assert.equals(1, #upserts())
+      assert.equals(1, #kvm_broadcasts())
+    end)
+
+    it("mdelete deletes all keys with one query and one invalidation event", function()
+      put("k1", "queued")
+      bulk("mdelete", { entry("k1"), entry("k2") })
+      run_timers()
+
+      assert.equals(1, #statements)
+      assert.matches("^DELETE FROM kvm_data", statements[1])
+      assert.matches("'k1'::text, 'k2'::text", statements[1], 1, true)
+      local events = kvm_broadcasts()
+      assert.equals(1, #events)
+      assert.same({ "k1", "k2" }, events[1].keys)
+      assert.is_true(events[1].deleted)
+    end)
+
+    it("reports a database error on mput", function()
+      shared_ctx.first = "text"
+      query_results[1] = function() return nil, "connection refused" end
+      bulk("mput", { entry("k1", "first") }, { write_mode = "write_through" })
+
+      assert.equals(1, #upserts())
+      assert.equals(500, exits[1].status)
+      assert.equals(0, #kvm_broadcasts())
+    end)
+  end)
+
+  describe("cluster read-through cache", function()
+    it("loads a key from the database once per cache_ttl", function()
+      rows["kvm:k1"] = { value = "stored" }
+      assert.equals("stored", get("k1"))
+      rows["kvm:k1"].value = "changed"
+      assert.equals("stored", get("k1"))
+      assert.equals(1, cache_loads)
+      assert.equals(60, cache["kvm_data:kvm:k1"].ttl)
+    end)
+
+    it("caches misses", function()
+      assert.is_nil(get("missing"))
+      assert.is_nil(get("missing"))
+      assert.equals(1, cache_loads)
+    end)
+
+    it("caches a value no longer than its row lives", function()
+      rows["kvm:k1"] = { value = "stored", expires_at = 1010 }
+      assert.equals("stored", get("k1"))
+      assert.equals(10, cache["kvm_data:kvm:k1"].ttl)
+    end)
+
+    it("treats expired rows as misses without deleting them", function()
+      rows["kvm:k1"] = { value = "stale", expires_at = 1000 }
+      assert.is_nil(get("k1"))
+      assert.equals(0, #statements)
+      assert.truthy(rows["kvm:k1"])
+    end)
+
+    it("reads the database directly when cache_ttl is 0", function()
+      rows["kvm:k1"] = { value = "stored" }
+      assert.equals("stored", get("k1", { cache_ttl = 0 }))
+      assert.equals("stored", get("k1", { cache_ttl = 0 }))
+      assert.equals(0, cache_loads)
+    end)
+
+    it("evicts the key on every node after a put", function()
+      rows["kvm:k1"] = { value = "old" }
+      assert.equals("old", get("k1"))
+      put("k1", "new", { write_mode = "write_through" })
+
+      assert.equals("new", get("k1"))
+      assert.same({ { kvm_name = "kvm", keys = { "k1" } } }, kvm_broadcasts())
+    end)
+
+    it("evicts keys announced by other nodes", function()
+      rows["kvm:k1"] = { value = "old" }
+      get("k1")
+      rows["kvm:k1"].value = "new"
+      cluster_handlers["kvm-invalidations"](cjson.encode({ kvm_name = "kvm", keys = { "k1" } }))
+      assert.equals("new", get("k1"))
+    end)
+  end)
+
+  describe("expiry sweeper", function()
+    it("runs on worker 0 every 60 seconds", function()
+      assert.equals(1, #periodic_timers)
+      assert.equals(60, periodic_timers[1].interval)
+
+      periodic_timers[1].fn(false)
+      assert.equals(1, #statements)
+      assert.matches("^DELETE FROM kvm_data WHERE expires_at IS NOT NULL", statements[1])
+    end)
+
+    it("does nothing when the worker is exiting", function()
+      periodic_timers[1].fn(true)
+      assert.equals(0, #statements)
+    end)
+
+    it("is not started on other workers", function()
+      periodic_timers = {}
+      ngx.worker.id = function() return 1 end
+      handler:init_worker()
+      ngx.worker.id = function() return 0 end
+      assert.equals(0, #periodic_timers)
+    end)
+
+    it("is not started without a postgres database", function()
+      periodic_timers = {}
+      kong.db.strategy = "off"
+      handler:init_worker()
+      assert.equals(0, #periodic_timers)
+    end)
+  end)
+end)
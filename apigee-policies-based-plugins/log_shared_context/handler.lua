@@ -1,5 +1,7 @@
 local BasePlugin = require "kong.plugins.base_plugin"
 local cjson = require "cjson"
+local callout = require "kong.plugins.apigee_common.callout"
+local spool = require "kong.plugins.apigee_common.spool"
 
 local LogSharedContextHandler = BasePlugin:extend("log-shared-context")
 LogSharedContextHandler.PRIORITY = 0 -- Run as late as possible in the log phase
@@ -8,6 +10,14 @@ function LogSharedContextHandler:new()
   LogSharedContextHandler.super.new(self)
 end
 
+local SPOOL_NAME = "log-shared-context"
+spool.register(SPOOL_NAME, spool.http_sender)
+
+function LogSharedContextHandler:init_worker()
+  LogSharedContextHandler.super.init_worker(self)
+  spool.resume(SPOOL_NAME)
+end
+
 function LogSharedContextHandler:log(conf)
   LogSharedContextHandler.super.log(conf)
   
@@ -53,7 +63,12 @@ function LogSharedContextHandler:log(conf)
 
     -- Use a timer to make the call non-blocking
     local ok, timer_err = kong.timer.at(0, function(_, opts, endpoint)
-      local _, http_err = kong.http.client.go(endpoint, opts)
+      local _, http_err
+      if conf.spool_enabled then
+        _, http_err = spool.deliver(SPOOL_NAME, { url = endpoint, opts = opts }, conf)
+      else
+        _, http_err = callout.request(endpoint, opts)
+      end
       if http_err then
         kong.log.err("LogSharedContext: Async HTTP log call failed: ", http_err)
       end
@@ -8,6 +8,9 @@ return {
       { http_endpoint = { type = "string", description = "Optional: If set, the log will be sent to this HTTP endpoint. If omitted, it will be written to Kong's standard log file." } },
       { http_method = { type = "string", default = "POST", enum = { "POST", "PUT", "PATCH" }, description = "The HTTP method to use when sending the log to the endpoint." } },
       { http_headers = { type = "map", default = {}, description = "Optional: Headers to send with the HTTP log request (e.g., for authentication)." } },
+      { spool_enabled = { type = "boolean", default = true, description = "If `true`, logs that cannot be delivered to `http_endpoint` (transport errors, 429 and 5xx responses) are written to a spool on local disk under the Kong prefix and replayed in the background once the endpoint recovers, instead of being dropped." } },
+      { spool_max_bytes = { type = "integer", default = 104857600, between = { 1048576, 10737418240 }, description = "Maximum size in bytes of each worker's spool. When it is exceeded, the oldest spooled records are discarded." } },
+      { spool_drain_rate = { type = "integer", default = 100, between = { 1, 100000 }, description = "Maximum number of spooled records per second each worker replays once the endpoint recovers." } },
     }}},
   },
 }
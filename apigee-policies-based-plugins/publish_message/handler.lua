@@ -2,6 +2,8 @@ local BasePlugin = require "kong.plugins.base_plugin"
 local cjson = require "cjson"
 local fun = require "kong.tools.functional"
 local util = require "kong.tools.utils" -- For base64 encoding
+local request_context = require "kong.plugins.apigee_common.request_context"
+local pubsub_queue = require "kong.plugins.apigee_common.pubsub_queue"
 
 -- Helper to safely get value from JSON body using simple dot notation
 local function get_json_value(json_table, path)
@@ -28,9 +30,9 @@ end
 local function get_value_from_source(source_type, source_name)
   local value = nil
   if source_type == "header" then
-    value = kong.request.get_header(source_name)
+    value = request_context.get_header(source_name)
   elseif source_type == "query" then
-    value = kong.request.get_query_arg(source_name)
+    value = request_context.get_query_arg(source_name)
   elseif source_type == "body" then
     local raw_body = kong.request.get_raw_body()
     if raw_body then
@@ -50,17 +52,36 @@ local function get_value_from_source(source_type, source_name)
 end
 
 
+local function publish_message(premature, conf, access_token, message)
+  local ok, err = pubsub_queue.publish(conf, access_token, { message })
+  if not ok then
+    kong.log.err("PublishMessage: Failed to publish to Pub/Sub topic '", conf.pubsub_topic_name, "'. Error: ", err)
+  else
+    kong.log.debug("PublishMessage: Successfully published message to Pub/Sub topic '", conf.pubsub_topic_name, "'.")
+  end
+end
+
+
 local PublishMessageHandler = BasePlugin:extend("publish-message")
 
 function PublishMessageHandler:new()
   return PublishMessageHandler.super.new(self, "publish-message")
 end
 
+function PublishMessageHandler:init_worker()
+  PublishMessageHandler.super.init_worker(self)
+  pubsub_queue.resume()
+end
+
 function PublishMessageHandler:log(conf)
   PublishMessageHandler.super.log(self)
 
-  local access_token = get_value_from_source(conf.gcp_access_token_source_type, conf.gcp_access_token_source_name)
-  if not access_token or access_token == "" then
+  -- With a service account the token is minted and cached by the publisher
+  local access_token
+  if conf.gcp_access_token_source_type ~= "service_account" then
+    access_token = get_value_from_source(conf.gcp_access_token_source_type, conf.gcp_access_token_source_name)
+  end
+  if conf.gcp_access_token_source_type ~= "service_account" and (not access_token or access_token == "") then
     kong.log.err("PublishMessage: No GCP access token found from source '", conf.gcp_access_token_source_type, ":", conf.gcp_access_token_source_name, "'. Cannot publish message.")
     -- In log phase, cannot exit with client error. Just log and continue.
     return
@@ -72,44 +93,26 @@ function PublishMessageHandler:log(conf)
     payload_content = ""
   end
 
-  local pubsub_api_url = string.format(
-    "https://pubsub.googleapis.com/v1/projects/%s/topics/%s:publish",
-    conf.gcp_project_id,
-    conf.pubsub_topic_name
-  )
-
-  local message_body = {
-    messages = {
-      {
-        data = util.encode_base64(tostring(payload_content)),
-      }
-    }
+  local message = {
+    data = util.encode_base64(tostring(payload_content)),
   }
 
   if next(conf.message_attributes) then -- Check if table is not empty
-    message_body.messages[1].attributes = conf.message_attributes
+    message.attributes = conf.message_attributes
   end
 
-  local callout_opts = {
-    method = "POST",
-    headers = {
-      ["Content-Type"] = "application/json",
-      ["Authorization"] = "Bearer " .. access_token,
-    },
-    body = cjson.encode(message_body),
-    timeout = 10000,
-    connect_timeout = 5000,
-    ssl_verify = true,
-  }
-
-  local res, err = kong.http.client.go(pubsub_api_url, callout_opts)
+  if conf.batch_enabled then
+    local ok, err = pubsub_queue.enqueue(conf, access_token, message)
+    if not ok then
+      kong.log.err("PublishMessage: Message for Pub/Sub topic '", conf.pubsub_topic_name, "' dropped: ", err)
+    end
+    return
+  end
 
-  if not res then
-    kong.log.err("PublishMessage: Failed to publish to Pub/Sub topic '", conf.pubsub_topic_name, "'. Error: ", err)
-  elseif res.status ~= 200 then
-    kong.log.err("PublishMessage: Pub/Sub API returned error status: ", res.status, " Body: ", res.body)
-  else
-    kong.log.debug("PublishMessage: Successfully published message to Pub/Sub topic '", conf.pubsub_topic_name, "'.")
+  -- Sockets are not available in the log phase; publish from a timer
+  local ok, err = ngx.timer.at(0, publish_message, conf, access_token, message)
+  if not ok then
+    kong.log.err("PublishMessage: Failed to create timer for publishing: ", err)
   end
 end
 
@@ -1,4 +1,5 @@
 local kong_meta = require "kong.meta"
+local request_context = require "kong.plugins.apigee_common.request_context"
 
 local RegexProtectionHandler = {}
 
@@ -9,9 +10,9 @@ local function get_input_value(conf)
   if conf.input_source == "request_body" then
     return kong.request.get_raw_body()
   elseif conf.input_source == "header" then
-    return kong.request.get_header(conf.input_name)
+    return request_context.get_header(conf.input_name)
   elseif conf.input_source == "query" then
-    return (kong.request.get_query())[conf.input_name]
+    return request_context.get_query_arg(conf.input_name)
   elseif conf.input_source == "uri_path" then
     return kong.request.get_path()
   end
@@ -1,6 +1,8 @@
 local BasePlugin = require "kong.plugins.base_plugin"
 local cjson = require "cjson"
 local fun = require "kong.tools.functional"
+local request_context = require "kong.plugins.apigee_common.request_context"
+local callout = require "kong.plugins.apigee_common.callout"
 
 -- Helper to safely get value from JSON body using simple dot notation
 local function get_json_value(json_table, path)
@@ -27,9 +29,9 @@ end
 local function get_value_from_source(source_type, source_name)
   local value = nil
   if source_type == "header" then
-    value = kong.request.get_header(source_name)
+    value = request_context.get_header(source_name)
   elseif source_type == "query" then
-    value = kong.request.get_query_arg(source_name)
+    value = request_context.get_query_arg(source_name)
   elseif source_type == "body" then
     local raw_body = kong.request.get_raw_body()
     if raw_body then
@@ -96,12 +98,14 @@ function ResetQuotaHandler:access(conf)
   local callout_opts = {
     method = "DELETE",
     headers = headers,
-    timeout = 10000,
-    connect_timeout = 5000,
+    timeout = conf.callout_timeout,
+    connect_timeout = conf.callout_connect_timeout,
     ssl_verify = true,
+    keepalive_timeout = conf.callout_keepalive_timeout,
+    keepalive_pool_size = conf.callout_keepalive_pool_size,
   }
 
-  local res, err = kong.http.client.go(admin_api_reset_url, callout_opts)
+  local res, err = callout.request(admin_api_reset_url, callout_opts)
 
   local reset_succeeded = true
   if not res then
@@ -1,4 +1,5 @@
 local typedefs = require "kong.db.schema.typedefs"
+local apigee_typedefs = require "kong.plugins.apigee_common.typedefs"
 
 return {
   name = "reset-quota",
@@ -49,6 +50,10 @@ return {
               description = "Required if `scope_type` is set: The name of the header/query parameter, the JSON path for a 'body' source, the key in `kong.ctx.shared`, or the literal ID value itself if `scope_id_source_type` is 'literal'.",
             },
           },
+          { callout_timeout = apigee_typedefs.callout_timeout },
+          { callout_connect_timeout = apigee_typedefs.callout_connect_timeout },
+          { callout_keepalive_timeout = apigee_typedefs.callout_keepalive_timeout },
+          { callout_keepalive_pool_size = apigee_typedefs.callout_keepalive_pool_size },
           {
             on_error_status = {
               type = "number",
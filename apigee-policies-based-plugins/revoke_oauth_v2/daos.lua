@@ -0,0 +1,29 @@
+local typedefs = require "kong.db.schema.typedefs"
+
+return {
+  revoked_tokens = {
+    name = "revoked_tokens",
+    primary_key = { "id" },
+    -- Rows are removed by Kong once the token would have expired
+    ttl = true,
+    fields = {
+      { id = typedefs.uuid },
+      { created_at = typedefs.auto_timestamp_s },
+      {
+        token_hash = {
+          type = "string",
+          required = true,
+          unique = true,
+          description = "Hex SHA-256 hash of the revoked token.",
+        },
+      },
+      {
+        expires_at = {
+          type = "integer",
+          required = true,
+          description = "When the token expires (epoch seconds); the revocation is kept until then.",
+        },
+      },
+    },
+  },
+}
@@ -2,6 +2,11 @@ local BasePlugin = require "kong.plugins.base_plugin"
 local cjson = require "cjson"
 local fun = require "kong.tools.functional"
 local util = require "kong.tools.utils"
+local request_context = require "kong.plugins.apigee_common.request_context"
+local callout = require "kong.plugins.apigee_common.callout"
+local revocation = require "kong.plugins.apigee_common.revocation"
+local token_cache = require "kong.plugins.apigee_common.token_cache"
+local revocation_queue = require "kong.plugins.revoke-oauth-v2.revocation_queue"
 
 -- Helper to safely get value from JSON body using simple dot notation
 local function get_json_value(json_table, path)
@@ -31,13 +36,13 @@ local function get_token_from_source(conf)
   local parsed_body = nil
 
   if conf.token_source_type == "header" then
-    token = kong.request.get_header(conf.token_source_name)
+    token = request_context.get_header(conf.token_source_name)
     -- Handle Authorization: Bearer token_string
     if token and token:lower():sub(1, 7) == "bearer " then
       token = token:sub(8)
     end
   elseif conf.token_source_type == "query" then
-    token = kong.request.get_query_arg(conf.token_source_name)
+    token = request_context.get_query_arg(conf.token_source_name)
   elseif conf.token_source_type == "body" then
     request_body = kong.request.get_raw_body()
     if request_body then
@@ -56,24 +61,50 @@ local function get_token_from_source(conf)
   return token and tostring(token) or nil
 end
 
-local RevokeOAuthV2Handler = BasePlugin:extend("revoke-oauth-v2")
-
-function RevokeOAuthV2Handler:new()
-  return RevokeOAuthV2Handler.super.new(self, "revoke-oauth-v2")
+-- Returns the hash of a token and until when its revocation must be kept:
+-- the token's expiry when known from the token cache, or
+-- `revocation_list_ttl` seconds. The token's cached metadata is dropped.
+local function revocation_entry(conf, token)
+  local hash = token_cache.hash(token)
+  local cached
+  if conf.token_cache_enabled then
+    cached = token_cache.get(hash, conf.token_cache_shm)
+    token_cache.delete(hash, conf.token_cache_shm)
+  end
+  local expires_at = cached and cached.expires_at or ngx.time() + conf.revocation_list_ttl
+  return hash, expires_at
 end
 
-function RevokeOAuthV2Handler:access(conf)
-  RevokeOAuthV2Handler.super.access(self)
+-- Announces a revocation to the other nodes and persists it. Does network
+-- and database I/O.
+local function publish_revocation(hash, expires_at)
+  local ok, err = revocation.broadcast(hash, expires_at)
+  if not ok then
+    kong.log.err("RevokeOAuthV2: ", err)
+  end
 
-  local token_to_revoke = get_token_from_source(conf)
+  local _, db_err = kong.db.revoked_tokens:upsert_by_token_hash(hash, { expires_at = expires_at },
+                                                                { ttl = expires_at - ngx.time() })
+  if db_err then
+    kong.log.err("RevokeOAuthV2: Could not persist token revocation: ", db_err)
+  end
+end
 
-  if not token_to_revoke or token_to_revoke == "" then
-    kong.log.err("RevokeOAuthV2: No token found for revocation from source '", conf.token_source_type, ":", conf.token_source_name, "'")
-    return kong.response.exit(400, "Missing token for revocation.")
+-- Adds the token to the cluster-wide revocation list, so that plugins
+-- checking it reject the token from now on.
+local function mark_revoked(conf, token)
+  local hash, expires_at = revocation_entry(conf, token)
+  local ok, err = revocation.revoke_local(hash, expires_at)
+  if not ok then
+    kong.log.err("RevokeOAuthV2: Could not add token to the revocation list: ", err)
   end
+  publish_revocation(hash, expires_at)
+end
 
+-- Builds the RFC 7009 revocation request for a token.
+local function revocation_request(conf, token)
   local form_params = {
-    token = token_to_revoke,
+    token = token,
   }
   if conf.token_type_hint then
     form_params.token_type_hint = conf.token_type_hint
@@ -92,16 +123,76 @@ function RevokeOAuthV2Handler:access(conf)
     form_params.client_id = conf.client_id
   end
 
-  local callout_opts = {
+  return {
     method = "POST",
     headers = headers,
     body = util.encode_urlencoded(form_params),
-    timeout = 10000,          -- Default timeout for callout
-    connect_timeout = 5000,
+    timeout = conf.callout_timeout,
+    connect_timeout = conf.callout_connect_timeout,
     ssl_verify = true,
+    keepalive_timeout = conf.callout_keepalive_timeout,
+    keepalive_pool_size = conf.callout_keepalive_pool_size,
   }
+end
+
+-- Asynchronous mode: the token is revoked on this node right away, and
+-- the call to the revocation endpoint, along with announcing and
+-- persisting the revocation, is queued. When the queue is full nothing is
+-- revoked, so the client's error response means the token is still valid.
+local function revoke_async(conf, token)
+  if revocation_queue.is_full(conf) then
+    kong.log.err("RevokeOAuthV2: Could not queue revocation call: revocation queue is full")
+    return kong.response.exit(conf.on_error_status, conf.on_error_body)
+  end
+
+  -- The schema requires `revocation_list_enabled` in this mode
+  local hash, expires_at = revocation_entry(conf, token)
+  local ok, err = revocation.revoke_local(hash, expires_at)
+  if not ok then
+    kong.log.err("RevokeOAuthV2: Could not add token to the revocation list: ", err)
+  end
+  local function prepare()
+    publish_revocation(hash, expires_at)
+  end
+
+  local queued, queue_err = revocation_queue.enqueue(conf, revocation_request(conf, token), prepare)
+  if not queued then
+    kong.log.err("RevokeOAuthV2: Could not queue revocation call: ", queue_err)
+    -- The revocation stays local to this node unless announced
+    ngx.timer.at(0, prepare)
+    return kong.response.exit(conf.on_error_status, conf.on_error_body)
+  end
+  return kong.response.exit(conf.on_success_status, conf.on_success_body)
+end
+
+local RevokeOAuthV2Handler = BasePlugin:extend("revoke-oauth-v2")
+
+function RevokeOAuthV2Handler:new()
+  return RevokeOAuthV2Handler.super.new(self, "revoke-oauth-v2")
+end
+
+function RevokeOAuthV2Handler:init_worker()
+  RevokeOAuthV2Handler.super.init_worker(self)
+  revocation.init_worker()
+end
+
+function RevokeOAuthV2Handler:access(conf)
+  RevokeOAuthV2Handler.super.access(self)
+
+  local token_to_revoke = get_token_from_source(conf)
+
+  if not token_to_revoke or token_to_revoke == "" then
+    kong.log.err("RevokeOAuthV2: No token found for revocation from source '", conf.token_source_type, ":", conf.token_source_name, "'")
+    return kong.response.exit(400, "Missing token for revocation.")
+  end
+
+  if conf.async_revocation then
+    return revoke_async(conf, token_to_revoke)
+  end
+
+  local callout_opts = revocation_request(conf, token_to_revoke)
 
-  local res, err = kong.http.client.go(conf.revocation_endpoint, callout_opts)
+  local res, err = callout.request(conf.revocation_endpoint, callout_opts)
 
   if not res then
     kong.log.err("RevokeOAuthV2: Failed to connect to revocation endpoint '", conf.revocation_endpoint, "': ", err)
@@ -110,6 +201,9 @@ function RevokeOAuthV2Handler:access(conf)
 
   if res.status >= 200 and res.status < 300 then -- OAuth spec typically returns 200 for successful revocation
     kong.log.debug("RevokeOAuthV2: Token successfully revoked via endpoint '", conf.revocation_endpoint, "'. Status: ", res.status)
+    if conf.revocation_list_enabled then
+      mark_revoked(conf, token_to_revoke)
+    end
     return kong.response.exit(conf.on_success_status, conf.on_success_body)
   else
     kong.log.err("RevokeOAuthV2: Revocation endpoint '", conf.revocation_endpoint, "' returned error status: ", res.status, " Body: ", res.body)
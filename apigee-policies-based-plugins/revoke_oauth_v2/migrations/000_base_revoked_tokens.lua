@@ -0,0 +1,26 @@
+-- apigee-policies-based-plugins/revoke-oauth-v2/migrations/000_base_revoked_tokens.lua
+
+-- This migration is for PostgreSQL.
+local migration = {
+  up = [[
+    CREATE TABLE IF NOT EXISTS revoked_tokens (
+      id UUID PRIMARY KEY,
+      created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+      ttl TIMESTAMP WITH TIME ZONE,
+      token_hash TEXT NOT NULL UNIQUE,
+      expires_at BIGINT NOT NULL
+    );
+
+    CREATE INDEX IF NOT EXISTS revoked_tokens_ttl_idx ON revoked_tokens (ttl);
+  ]],
+  teardown = function(connector)
+    local _, err = connector:query([[
+      DROP TABLE IF EXISTS revoked_tokens;
+    ]])
+    if err then
+      return nil, err
+    end
+  end,
+}
+
+return migration
@@ -0,0 +1,4 @@
+-- apigee-policies-based-plugins/revoke-oauth-v2/migrations/init.lua
+return {
+  "000_base_revoked_tokens",
+}
@@ -0,0 +1,161 @@
+-- Per-worker queue of calls to the revocation endpoint, for the
+-- asynchronous mode of revoke-oauth-v2.
+--
+-- Calls are queued per endpoint and sent from timers, at most
+-- `async_concurrency` at a time per endpoint and worker, so that a logout
+-- storm reaches the identity provider at a bounded rate instead of one call
+-- per client request. Transport errors, 429 and 5xx responses are retried
+-- with exponential backoff (see apigee_common's retry.lua). Each worker holds at most
+-- `queue_max_revocations` calls, counting those waiting for a retry.
+
+local callout = require "kong.plugins.apigee_common.callout"
+local retry = require "kong.plugins.apigee_common.retry"
+
+local floor = math.floor
+local timer_at = ngx.timer.at
+
+local queues = {}
+local queued = 0
+local stats = {
+  sent = 0,
+  failed = 0,
+  dropped = 0,
+  retried = 0,
+}
+
+local _M = {}
+
+local pump
+
+-- Sends one call; a retryable failure puts it back in the queue after a
+-- delay.
+local function process(premature, queue, job)
+  if job.prepare then
+    job.prepare(job)
+    job.prepare = nil
+  end
+
+  local res, err = callout.request(job.url, job.opts)
+  if res and res.status >= 200 and res.status < 300 then
+    stats.sent = stats.sent + 1
+    queued = queued - 1
+    return
+  end
+
+  local status = res and res.status
+  if res then
+    err = "status " .. status .. ": " .. tostring(res.body)
+  end
+  local conf = job.conf
+  if retry.retryable(status) and not premature then
+    local delay = retry.schedule(conf, job.attempt, function(retry_premature)
+      local jobs = queue.jobs
+      queue.last = queue.last + 1
+      jobs[queue.last] = job
+      pump(queue, retry_premature)
+    end)
+    if delay then
+      job.attempt = job.attempt + 1
+      stats.retried = stats.retried + 1
+      kong.log.warn("RevokeOAuthV2: Revocation call to '", job.url, "' failed (", err, "). Retrying in ",
+                    floor(delay), " ms.")
+      return
+    end
+  end
+
+  stats.failed = stats.failed + 1
+  queued = queued - 1
+  kong.log.err("RevokeOAuthV2: Giving up on revocation call to '", job.url, "' after ", job.attempt + 1,
+               " attempt(s): ", err)
+end
+
+-- A sender: takes calls from the queue until it is empty.
+local function run(premature, queue)
+  while queue.first <= queue.last do
+    local job = queue.jobs[queue.first]
+    queue.jobs[queue.first] = nil
+    queue.first = queue.first + 1
+    local ok, err = pcall(process, premature, queue, job)
+    if not ok then
+      stats.failed = stats.failed + 1
+      queued = queued - 1
+      kong.log.err("RevokeOAuthV2: Revocation call to '", job.url, "' failed: ", err)
+    end
+  end
+  queue.running = queue.running - 1
+end
+
+-- Starts senders until the concurrency limit is reached or every queued
+-- call has one.
+pump = function(queue, premature)
+  local concurrency = queue.concurrency
+  while queue.running < concurrency and queue.running <= queue.last - queue.first do
+    if premature then
+      -- The worker is exiting: send what is left from this timer
+      queue.running = queue.running + 1
+      run(true, queue)
+      return
+    end
+    local ok, err = timer_at(0, run, queue)
+    if not ok then
+      kong.log.err("RevokeOAuthV2: Failed to start revocation sender: ", err)
+      return
+    end
+    queue.running = queue.running + 1
+  end
+end
+
+--- Tells whether this worker's queue is full, counting the call the caller
+-- then gives up on as dropped. Lets the caller refuse a revocation before
+-- acting on it.
+function _M.is_full(conf)
+  if queued >= conf.queue_max_revocations then
+    stats.dropped = stats.dropped + 1
+    return true
+  end
+  return false
+end
+
+--- Queues a revocation call.
+-- @param conf table Plugin configuration (`revocation_endpoint`,
+--   `async_concurrency`, `queue_max_revocations`, `max_retries` and
+--   `retry_backoff_ms`).
+-- @param opts table Callout options of the request.
+-- @param prepare function|nil Called with the job in a timer before the
+--   first attempt, for work that must not run in the request.
+-- @return true, or nil and an error when the queue is full.
+function _M.enqueue(conf, opts, prepare)
+  if queued >= conf.queue_max_revocations then
+    stats.dropped = stats.dropped + 1
+    return nil, "revocation queue is full"
+  end
+
+  local url = conf.revocation_endpoint
+  local queue = queues[url]
+  if not queue then
+    queue = { jobs = {}, first = 1, last = 0, running = 0 }
+    queues[url] = queue
+  end
+  queue.concurrency = conf.async_concurrency
+
+  queue.last = queue.last + 1
+  queue.jobs[queue.last] = { conf = conf, url = url, opts = opts, prepare = prepare, attempt = 0 }
+  queued = queued + 1
+  pump(queue)
+  return true
+end
+
+--- Returns this worker's counters: calls `queued` (waiting, in flight or
+-- awaiting a retry), `sent`, `failed` (given up after retries), `dropped`
+-- (queue full) and `retried`.
+function _M.stats()
+  return {
+    queued = queued,
+    sent = stats.sent,
+    failed = stats.failed,
+    dropped = stats.dropped,
+    retried = stats.retried,
+  }
+end
+
+return _M
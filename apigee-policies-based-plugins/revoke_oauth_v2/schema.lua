@@ -1,4 +1,6 @@
 local typedefs = require "kong.db.schema.typedefs"
+local apigee_typedefs = require "kong.plugins.apigee_common.typedefs"
+local revocation = require "kong.plugins.apigee_common.revocation"
 
 return {
   name = "revoke-oauth-v2",
@@ -49,6 +51,78 @@ return {
               -- Optional hint to the revocation endpoint
             },
           },
+          { callout_timeout = apigee_typedefs.callout_timeout },
+          { callout_connect_timeout = apigee_typedefs.callout_connect_timeout },
+          { callout_keepalive_timeout = apigee_typedefs.callout_keepalive_timeout },
+          { callout_keepalive_pool_size = apigee_typedefs.callout_keepalive_pool_size },
+          {
+            revocation_list_enabled = {
+              type = "boolean",
+              default = false,
+              description = "If `true`, a successfully revoked token is added to the cluster-wide revocation list, so that plugins with `reject_revoked_tokens` reject it without calling the identity provider. Requires the plugin's database migrations and the `apigee_revocations` shared dict.",
+            },
+          },
+          {
+            revocation_list_ttl = {
+              type = "integer",
+              default = 86400,
+              gt = 0,
+              description = "How long, in seconds, a revoked token stays on the revocation list when its expiry is unknown. It should be at least the lifetime of the tokens issued.",
+            },
+          },
+          {
+            token_cache_enabled = {
+              type = "boolean",
+              default = false,
+              description = "If `true`, the revoked token's entry is evicted from the token metadata cache, and its cached expiry bounds how long the token stays on the revocation list. Enable it when `get-oauth-v2-info` or `set-oauth-v2-info` cache tokens.",
+            },
+          },
+          {
+            token_cache_shm = {
+              type = "string",
+              default = "apigee_token_cache",
+              description = "The `lua_shared_dict` holding the token metadata cache of the OAuth plugins; it must be declared with `nginx_http_lua_shared_dict` when `token_cache_enabled` is `true`. The revoked token's entry is evicted from it, and its expiry is used when known.",
+            },
+          },
+          {
+            async_revocation = {
+              type = "boolean",
+              default = false,
+              description = "If `true`, the client is answered as soon as the token is on this node's revocation list, and the call to `revocation_endpoint` is queued and sent in the background with bounded concurrency and retries. Requires `revocation_list_enabled`.",
+            },
+          },
+          {
+            async_concurrency = {
+              type = "integer",
+              default = 4,
+              between = { 1, 100 },
+              description = "Maximum number of concurrent calls to the revocation endpoint per worker in asynchronous mode.",
+            },
+          },
+          {
+            queue_max_revocations = {
+              type = "integer",
+              default = 10000,
+              between = { 1, 1000000 },
+              description = "Maximum number of revocation calls a worker holds in asynchronous mode, including those awaiting a retry. Revocation requests beyond it are answered with `on_error_status`.",
+            },
+          },
+          {
+            max_retries = {
+              type = "integer",
+              default = 3,
+              between = { 0, 10 },
+              description = "How many times a revocation call failing with a transport error, 429 or 5xx is retried in asynchronous mode.",
+            },
+          },
+          {
+            retry_backoff_ms = {
+              type = "integer",
+              default = 500,
+              between = { 1, 60000 },
+              description = "Initial delay in milliseconds before retrying a revocation call; it doubles with each retry and is jittered.",
+            },
+          },
           {
             on_error_status = {
               type = "number",
@@ -79,4 +153,21 @@ return {
       },
     },
   },
+  entity_checks = {
+    apigee_typedefs.shared_dict_check({ "config.revocation_list_enabled" }, function(config)
+      if config.revocation_list_enabled then
+        return revocation.SHM
+      end
+    end),
+    apigee_typedefs.token_cache_check,
+    {
+      -- The client is answered before the identity provider is called, so
+      -- the token must be revoked locally in the meantime
+      conditional = {
+        if_field = "config.async_revocation", if_match = { eq = true },
+        then_field = "config.revocation_list_enabled", then_match = { eq = true },
+        then_err = "'async_revocation' requires 'revocation_list_enabled'",
+      },
+    },
+  },
 }
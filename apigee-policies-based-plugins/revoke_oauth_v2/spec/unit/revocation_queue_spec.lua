@@ -0,0 +1,172 @@
+describe("revoke-oauth-v2 revocation_queue", function()
+  local revocation_queue, requests, timers, responses
+  local original_timer_at = ngx.timer.at
+
+  local function conf(overrides)
+    local c = {
+      revocation_endpoint = "http://idp.test/revoke",
+      async_concurrency = 2,
+      queue_max_revocations = 10,
+      max_retries = 2,
+      retry_backoff_ms = 100,
+    }
+    for k, v in pairs(overrides or {}) do
+      c[k] = v
+    end
+    return c
+  end
+
+  local function run_timers(premature)
+    while #timers > 0 do
+      local timer = table.remove(timers, 1)
+      timer.fn(premature or false, unpack(timer.args, 1, timer.n))
+    end
+  end
+
+  setup(function()
+    _G.kong = { log = { warn = function() end, err = function() end } }
+    ngx.timer.at = function(delay, fn, ...)
+      timers[#timers + 1] = { delay = delay, fn = fn, args = { ... }, n = select("#", ...) }
+      return true
+    end
+    package.loaded["kong.plugins.apigee_common.callout"] = {
+      request = function(url, opts)
+        requests[#requests + 1] = { url = url, opts = opts }
+        local res = table.remove(responses, 1) or { status = 200, body = "" }
+        return res.status and res or nil, res.err
+      end,
+    }
+  end)
+
+  teardown(function()
+    ngx.timer.at = original_timer_at
+    package.loaded["kong.plugins.apigee_common.callout"] = nil
+    package.loaded["kong.plugins.revoke-oauth-v2.revocation_queue"] = nil
+  end)
+
+  before_each(function()
+    requests, timers, responses = {}, {}, {}
+    -- The queue state is per worker, so each test starts from a fresh module
+    package.loaded["kong.plugins.revoke-oauth-v2.revocation_queue"] = nil
+    revocation_queue = require "kong.plugins.revoke-oauth-v2.revocation_queue"
+  end)
+
+  it("starts at most async_concurrency senders per endpoint", function()
+    local c = conf()
+    for i = 1, 5 do
+      assert.is_true(revocation_queue.enqueue(c, { body = "token=" .. i }))
+    end
+    assert.equals(2, #timers)
+    assert.equals(0, #requests)
+
+    run_timers()
+    assert.equals(5, #requests)
+    assert.equals("token=1", requests[1].opts.body)
+    assert.equals("token=5", requests[5].opts.body)
+    assert.same({ queued = 0, sent = 5, failed = 0, dropped = 0, retried = 0 }, revocation_queue.stats())
+  end)
+
+  it("keeps the senders of each endpoint apart", function()
+    revocation_queue.enqueue(conf({ async_concurrency = 1 }), {})
+    revocation_queue.enqueue(conf({ async_concurrency = 1, revocation_endpoint = "http://other.test/revoke" }), {})
+    assert.equals(2, #timers)
+  end)
+
+  it("runs prepare once before the first attempt", function()
+    local prepared = 0
+    responses[1] = { status = 503, body = "unavailable" }
+    revocation_queue.enqueue(conf(), {}, function() prepared = prepared + 1 end)
+    run_timers()
+
+    assert.equals(2, #requests)
+    assert.equals(1, prepared)
+  end)
+
+  it("re-queues calls failing with a retryable status after a backoff", function()
+    responses[1] = { status = 503, body = "unavailable" }
+    revocation_queue.enqueue(conf(), {})
+    timers[1].fn(false, unpack(timers[1].args, 1, timers[1].n))
+    table.remove(timers, 1)
+
+    -- One retry timer, 100 ms scaled by 0.5 to 1.5
+    assert.equals(1, #timers)
+    assert.is_true(timers[1].delay >= 0.05 and timers[1].delay <= 0.15)
+    assert.equals(1, revocation_queue.stats().queued)
+    assert.equals(1, revocation_queue.stats().retried)
+
+    run_timers()
+    assert.equals(2, #requests)
+    assert.same({ queued = 0, sent = 1, failed = 0, dropped = 0, retried = 1 }, revocation_queue.stats())
+  end)
+
+  it("gives up after max_retries", function()
+    for i = 1, 3 do
+      responses[i] = { status = 500, body = "error" }
+    end
+    revocation_queue.enqueue(conf(), {})
+    run_timers()
+
+    assert.equals(3, #requests)
+    assert.same({ queued = 0, sent = 0, failed = 1, dropped = 0, retried = 2 }, revocation_queue.stats())
+  end)
+
+  it("does not retry client errors", function()
+    responses[1] = { status = 400, body = "invalid_request" }
+    revocation_queue.enqueue(conf(), {})
+    run_timers()
+
+    assert.equals(1, #requests)
+    assert.equals(1, revocation_queue.stats().failed)
+    assert.equals(0, revocation_queue.stats().retried)
+  end)
+
+  it("retries transport errors", function()
+    responses[1] = { err = "timeout" }
+    revocation_queue.enqueue(conf(), {})
+    run_timers()
+
+    assert.equals(2, #requests)
+    assert.equals(1, revocation_queue.stats().sent)
+  end)
+
+  it("counts calls awaiting a retry against queue_max_revocations", function()
+    local c = conf({ queue_max_revocations = 1 })
+    responses[1] = { status = 503, body = "unavailable" }
+    assert.is_true(revocation_queue.enqueue(c, {}))
+    timers[1].fn(false, unpack(timers[1].args, 1, timers[1].n))
+    table.remove(timers, 1)
+
+    assert.is_true(revocation_queue.is_full(c))
+    local ok, err = revocation_queue.enqueue(c, {})
+    assert.is_nil(ok)
+    assert.equals("revocation queue is full", err)
+    assert.equals(2, revocation_queue.stats().dropped)
+  end)
+
+  it("sends queued calls from the exiting timer instead of starting new ones", function()
+    responses[1] = { status = 503, body = "unavailable" }
+    revocation_queue.enqueue(conf(), {})
+    timers[1].fn(false, unpack(timers[1].args, 1, timers[1].n))
+    table.remove(timers, 1)
+
+    -- The worker exits before the retry is due
+    run_timers(true)
+    assert.equals(0, #timers)
+    assert.equals(2, #requests)
+    assert.equals(1, revocation_queue.stats().sent)
+    assert.equals(0, revocation_queue.stats().queued)
+  end)
+
+  it("does not schedule retries while the worker is exiting", function()
+    responses[1] = { status = 503, body = "unavailable" }
+    responses[2] = { status = 503, body = "unavailable" }
+    revocation_queue.enqueue(conf(), {})
+    timers[1].fn(false, unpack(timers[1].args, 1, timers[1].n))
+    table.remove(timers, 1)
+
+    run_timers(true)
+    assert.equals(0, #timers)
+    assert.equals(2, #requests)
+    assert.same({ queued = 0, sent = 0, failed = 1, dropped = 0, retried = 1 }, revocation_queue.stats())
+  end)
+end)
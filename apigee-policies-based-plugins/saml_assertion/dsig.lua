@@ -0,0 +1,634 @@
+-- In-process verification of XML-DSig signed SAML assertions, through
+-- libxml2 (LuaJIT FFI) for parsing and exclusive canonicalization and
+-- lua-resty-openssl for the digest and signature checks.
+--
+-- Only the configured certificate or public key is trusted; any KeyInfo
+-- carried in the message is ignored. Claims and validity conditions are read
+-- exclusively from the element covered by the signature, so that wrapped or
+-- injected elements elsewhere in the document are never used.
+
+local ffi = require "ffi"
+local openssl_digest = require "resty.openssl.digest"
+local openssl_pkey = require "resty.openssl.pkey"
+local openssl_x509 = require "resty.openssl.x509"
+
+local C = ffi.C
+
+local decode_base64 = ngx.decode_base64
+local encode_base64 = ngx.encode_base64
+
+-- Struct bodies can only be defined once per LuaJIT state; other modules
+-- binding libxml2 declare the same layouts, so tolerate a prior definition.
+pcall(ffi.cdef, [[
+struct _xmlError {
+  int domain;
+  int code;
+  char *message;
+  int level;
+  char *file;
+  int line;
+  char *str1;
+  char *str2;
+  char *str3;
+  int int1;
+  int int2;
+  void *ctxt;
+  void *node;
+};
+
+struct _xmlNs {
+  struct _xmlNs *next;
+  int type;
+  const unsigned char *href;
+  const unsigned char *prefix;
+};
+
+struct _xmlNode {
+  void *_private;
+  int type;
+  const unsigned char *name;
+  struct _xmlNode *children;
+  struct _xmlNode *last;
+  struct _xmlNode *parent;
+  struct _xmlNode *next;
+  struct _xmlNode *prev;
+  void *doc;
+  struct _xmlNs *ns;
+};
+]])
+
+pcall(ffi.cdef, [[
+struct _xmlNodeSet {
+  int nodeNr;
+  int nodeMax;
+  struct _xmlNode **nodeTab;
+};
+
+struct _xmlXPathObject {
+  int type;
+  struct _xmlNodeSet *nodesetval;
+  int boolval;
+  double floatval;
+  unsigned char *stringval;
+  void *user;
+  int index;
+  void *user2;
+  int index2;
+};
+]])
+
+ffi.cdef [[
+typedef unsigned char xmlChar;
+typedef struct _xmlError xmlError;
+typedef struct _xmlNs xmlNs;
+typedef struct _xmlNode xmlNode;
+typedef struct _xmlDoc xmlDoc;
+typedef struct _xmlNodeSet xmlNodeSet;
+typedef struct _xmlXPathObject xmlXPathObject;
+typedef struct _xmlXPathContext xmlXPathContext;
+typedef void (*xmlFreeFunc)(void *mem);
+
+void xmlInitParser(void);
+void xmlResetLastError(void);
+xmlError *xmlGetLastError(void);
+
+xmlDoc *xmlReadMemory(const char *buffer, int size, const char *URL, const char *encoding, int options);
+void xmlFreeDoc(xmlDoc *doc);
+void xmlUnlinkNode(xmlNode *cur);
+void xmlFreeNode(xmlNode *cur);
+
+xmlXPathContext *xmlXPathNewContext(xmlDoc *doc);
+void xmlXPathFreeContext(xmlXPathContext *ctxt);
+int xmlXPathRegisterNs(xmlXPathContext *ctxt, const xmlChar *prefix, const xmlChar *ns_uri);
+xmlXPathObject *xmlXPathEvalExpression(const xmlChar *str, xmlXPathContext *ctxt);
+xmlXPathObject *xmlXPathNodeEval(xmlNode *node, const xmlChar *str, xmlXPathContext *ctx);
+void xmlXPathFreeObject(xmlXPathObject *obj);
+
+int xmlC14NDocDumpMemory(xmlDoc *doc, xmlNodeSet *nodes, int mode, xmlChar **inclusive_ns_prefixes, int with_comments, xmlChar **doc_txt_ptr);
+]]
+
+-- Parse options: no network access, no entity substitution, no DTD
+-- loading, quiet.
+local XML_PARSE_NOERROR = 32
+local XML_PARSE_NOWARNING = 64
+local XML_PARSE_NONET = 2048
+local PARSE_OPTIONS = XML_PARSE_NOERROR + XML_PARSE_NOWARNING + XML_PARSE_NONET
+
+local XML_C14N_EXCLUSIVE_1_0 = 1
+
+local NAMESPACES = {
+  ds = "http://www.w3.org/2000/09/xmldsig#",
+  ec = "http://www.w3.org/2001/10/xml-exc-c14n#",
+  saml = "urn:oasis:names:tc:SAML:2.0:assertion",
+}
+
+local EXC_C14N = "http://www.w3.org/2001/10/xml-exc-c14n#"
+local EXC_C14N_WITH_COMMENTS = "http://www.w3.org/2001/10/xml-exc-c14n#WithComments"
+local ENVELOPED_SIGNATURE = "http://www.w3.org/2000/09/xmldsig#enveloped-signature"
+
+local CANONICALIZATION_METHODS = {
+  [EXC_C14N] = 0,
+  [EXC_C14N_WITH_COMMENTS] = 1,
+}
+
+local SIGNATURE_METHODS = {
+  ["http://www.w3.org/2000/09/xmldsig#rsa-sha1"] = "sha1",
+  ["http://www.w3.org/2001/04/xmldsig-more#rsa-sha256"] = "sha256",
+  ["http://www.w3.org/2001/04/xmldsig-more#rsa-sha384"] = "sha384",
+  ["http://www.w3.org/2001/04/xmldsig-more#rsa-sha512"] = "sha512",
+  ["http://www.w3.org/2001/04/xmldsig-more#ecdsa-sha256"] = "sha256",
+  ["http://www.w3.org/2001/04/xmldsig-more#ecdsa-sha384"] = "sha384",
+  ["http://www.w3.org/2001/04/xmldsig-more#ecdsa-sha512"] = "sha512",
+}
+
+-- XML-DSig carries ECDSA signatures as the raw concatenation r || s
+-- (RFC 4050), not as the DER structure OpenSSL verifies by default
+local ECDSA_SIGNATURE_METHODS = {
+  ["http://www.w3.org/2001/04/xmldsig-more#ecdsa-sha256"] = true,
+  ["http://www.w3.org/2001/04/xmldsig-more#ecdsa-sha384"] = true,
+  ["http://www.w3.org/2001/04/xmldsig-more#ecdsa-sha512"] = true,
+}
+local ECDSA_VERIFY_OPTIONS = { ecdsa_use_raw = true }
+
+local DIGEST_METHODS = {
+  ["http://www.w3.org/2000/09/xmldsig#sha1"] = "sha1",
+  ["http://www.w3.org/2001/04/xmlenc#sha256"] = "sha256",
+  ["http://www.w3.org/2001/04/xmldsig-more#sha384"] = "sha384",
+  ["http://www.w3.org/2001/04/xmlenc#sha512"] = "sha512",
+}
+
+local lib
+do
+  -- Runtime images often ship only the versioned shared object
+  for _, name in ipairs({ "xml2", "libxml2.so.2" }) do
+    local ok, loaded = pcall(ffi.load, name)
+    if ok then
+      lib = loaded
+      break
+    end
+  end
+  if not lib then
+    -- Fall back to a libxml2 already linked into the nginx binary
+    local found = pcall(function() return C.xmlC14NDocDumpMemory end)
+    lib = found and C or nil
+  end
+end
+
+if lib then
+  lib.xmlInitParser()
+end
+
+-- libxml2 exports its deallocator as a variable so that it matches the
+-- allocator in use; fall back to free(3) if the symbol cannot be resolved.
+local xml_free
+if lib then
+  local ok, fn = pcall(function()
+    ffi.cdef [[ extern xmlFreeFunc xmlFree; ]]
+    return lib.xmlFree
+  end)
+  if not ok then
+    pcall(ffi.cdef, [[ void free(void *ptr); ]])
+    fn = C.free
+  end
+  xml_free = fn
+end
+
+local function last_error(default)
+  local err = lib.xmlGetLastError()
+  if err ~= nil and err.message ~= nil then
+    return (ffi.string(err.message):gsub("%s+$", ""))
+  end
+  return default
+end
+
+local function strip_whitespace(value)
+  return (value:gsub("%s+", ""))
+end
+
+-- Seconds since the epoch of an xs:dateTime in UTC ("2024-05-01T10:00:00Z",
+-- optionally with fractional seconds or a numeric offset).
+local function parse_datetime(value)
+  local y, mo, d, h, mi, s, rest = value:match("^(%d%d%d%d)%-(%d%d)%-(%d%d)T(%d%d):(%d%d):(%d%d)%.?%d*(.*)$")
+  if not y then
+    return nil
+  end
+  y, mo, d = tonumber(y), tonumber(mo), tonumber(d)
+
+  -- Days from the civil calendar date, independent of the local time zone
+  local yy = mo <= 2 and y - 1 or y
+  local era = math.floor(yy / 400)
+  local yoe = yy - era * 400
+  local mp = (mo + 9) % 12
+  local doy = math.floor((153 * mp + 2) / 5) + d - 1
+  local doe = yoe * 365 + math.floor(yoe / 4) - math.floor(yoe / 100) + doy
+  local days = era * 146097 + doe - 719468
+
+  local seconds = days * 86400 + tonumber(h) * 3600 + tonumber(mi) * 60 + tonumber(s)
+
+  if rest ~= "" and rest ~= "Z" then
+    local sign, oh, om = rest:match("^([+-])(%d%d):(%d%d)$")
+    if not sign then
+      return nil
+    end
+    local offset = tonumber(oh) * 3600 + tonumber(om) * 60
+    seconds = sign == "+" and seconds - offset or seconds + offset
+  end
+
+  return seconds
+end
+
+-- XPath helpers bound to one document. Every object is freed before
+-- returning; node pointers stay valid for the lifetime of the document.
+local Document = {}
+Document.__index = Document
+
+local function open_document(xml)
+  lib.xmlResetLastError()
+  local doc = lib.xmlReadMemory(xml, #xml, "assertion.xml", nil, PARSE_OPTIONS)
+  if doc == nil then
+    return nil, "malformed XML: " .. last_error("could not parse assertion")
+  end
+
+  local xpath = lib.xmlXPathNewContext(doc)
+  if xpath == nil then
+    lib.xmlFreeDoc(doc)
+    return nil, "could not create XPath context"
+  end
+  for prefix, uri in pairs(NAMESPACES) do
+    lib.xmlXPathRegisterNs(xpath, prefix, uri)
+  end
+
+  return setmetatable({ doc = doc, xpath = xpath, detached = {} }, Document)
+end
+
+function Document:close()
+  for _, node in ipairs(self.detached) do
+    lib.xmlFreeNode(node)
+  end
+  lib.xmlXPathFreeContext(self.xpath)
+  lib.xmlFreeDoc(self.doc)
+end
+
+function Document:eval(expression, node)
+  if node then
+    return lib.xmlXPathNodeEval(node, expression, self.xpath)
+  end
+  return lib.xmlXPathEvalExpression(expression, self.xpath)
+end
+
+-- Returns the nodes selected by `expression` as a Lua array.
+function Document:nodes(expression, node)
+  local result = self:eval(expression, node)
+  if result == nil then
+    return {}
+  end
+  local nodes = {}
+  local set = result.nodesetval
+  if set ~= nil then
+    for i = 0, set.nodeNr - 1 do
+      nodes[i + 1] = set.nodeTab[i]
+    end
+  end
+  lib.xmlXPathFreeObject(result)
+  return nodes
+end
+
+-- Returns the string value of an XPath expression, nil when it is empty.
+function Document:string(expression, node)
+  local result = self:eval("string(" .. expression .. ")", node)
+  if result == nil then
+    return nil
+  end
+  local value = result.stringval ~= nil and ffi.string(result.stringval) or ""
+  lib.xmlXPathFreeObject(result)
+  if value == "" then
+    return nil
+  end
+  return value
+end
+
+-- Canonicalizes the subtree selected by `expression` with exclusive C14N.
+function Document:canonicalize(expression, with_comments, inclusive_prefixes)
+  local result = self:eval(expression)
+  if result == nil or result.nodesetval == nil or result.nodesetval.nodeNr == 0 then
+    if result ~= nil then
+      lib.xmlXPathFreeObject(result)
+    end
+    return nil, "nothing to canonicalize"
+  end
+
+  local prefixes = nil
+  if inclusive_prefixes and #inclusive_prefixes > 0 then
+    prefixes = ffi.new("xmlChar *[?]", #inclusive_prefixes + 1)
+    for i, prefix in ipairs(inclusive_prefixes) do
+      prefixes[i - 1] = ffi.cast("xmlChar *", prefix)
+    end
+  end
+
+  local out = ffi.new("xmlChar *[1]")
+  local len = lib.xmlC14NDocDumpMemory(self.doc, result.nodesetval, XML_C14N_EXCLUSIVE_1_0,
+                                       prefixes, with_comments, out)
+  lib.xmlXPathFreeObject(result)
+  if len < 0 or out[0] == nil then
+    return nil, "canonicalization failed"
+  end
+
+  local canonical = ffi.string(out[0], len)
+  xml_free(out[0])
+  return canonical
+end
+
+-- Detaches a node from the tree; it is freed along with the document.
+function Document:detach(node)
+  lib.xmlUnlinkNode(node)
+  self.detached[#self.detached + 1] = node
+end
+
+-- Node-set expression covering an element, its attributes and its in-scope
+-- namespaces, as required by the C14N functions for a document subset.
+local function subtree(element_predicate)
+  return "(//. | //@* | //namespace::*)[ancestor-or-self::" .. element_predicate .. "]"
+end
+
+local function inclusive_prefixes(document, node)
+  local list = document:string("ec:InclusiveNamespaces/@PrefixList", node)
+  if not list then
+    return nil
+  end
+  local prefixes = {}
+  for prefix in list:gmatch("%S+") do
+    prefixes[#prefixes + 1] = prefix
+  end
+  return prefixes
+end
+
+-- Reads the SAML claims and conditions out of the signed assertion element.
+local function read_assertion(document, assertion)
+  local result = {
+    id = document:string("@ID", assertion),
+    issuer = document:string("saml:Issuer", assertion),
+    subject = document:string("saml:Subject/saml:NameID", assertion),
+    attributes = {},
+  }
+
+  local not_before = document:string("saml:Conditions/@NotBefore", assertion)
+  local not_on_or_after = document:string("saml:Conditions/@NotOnOrAfter", assertion)
+  local confirmation_expiry = document:string(
+    "saml:Subject/saml:SubjectConfirmation/saml:SubjectConfirmationData/@NotOnOrAfter", assertion)
+
+  if not_before then
+    result.not_before = parse_datetime(not_before)
+    if not result.not_before then
+      return nil, "invalid NotBefore condition"
+    end
+  end
+
+  for _, value in ipairs({ not_on_or_after, confirmation_expiry }) do
+    local expiry = parse_datetime(value or "")
+    if value and not expiry then
+      return nil, "invalid NotOnOrAfter condition"
+    end
+    if expiry and (not result.not_on_or_after or expiry < result.not_on_or_after) then
+      result.not_on_or_after = expiry
+    end
+  end
+
+  for _, attribute in ipairs(document:nodes("saml:AttributeStatement/saml:Attribute", assertion)) do
+    local name = document:string("@Name", attribute)
+    if name then
+      local values = {}
+      for _, value_node in ipairs(document:nodes("saml:AttributeValue", attribute)) do
+        values[#values + 1] = document:string(".", value_node) or ""
+      end
+      -- Single-valued attributes are exposed as plain strings
+      if #values == 1 then
+        result.attributes[name] = values[1]
+      elseif #values > 1 then
+        result.attributes[name] = values
+      end
+    end
+  end
+
+  return result
+end
+
+local function verify_document(document, public_key)
+  -- The assertion's own signature is preferred over one on the enclosing
+  -- response; either way it must be a direct child of the signed element
+  local signatures = document:nodes("//saml:Assertion/ds:Signature")
+  if #signatures == 0 then
+    signatures = document:nodes("/*/ds:Signature")
+  end
+  if #signatures ~= 1 then
+    return nil, #signatures == 0 and "assertion is not signed" or "multiple signatures are not supported"
+  end
+  local signature = signatures[1]
+
+  local references = document:nodes("ds:SignedInfo/ds:Reference", signature)
+  if #references ~= 1 then
+    return nil, "signature must contain exactly one reference"
+  end
+  local reference = references[1]
+
+  local uri = document:string("@URI", reference) or ""
+  local id = uri:match("^#([%a_][%w_%.%-]*)$")
+  if not id then
+    return nil, "unsupported signature reference '" .. uri .. "'"
+  end
+
+  -- Reject documents where the referenced ID is ambiguous, and make sure
+  -- the signature actually belongs to the referenced element
+  local by_id = "*[@ID='" .. id .. "']"
+  if #document:nodes("//" .. by_id) ~= 1 then
+    return nil, "signature reference does not identify a unique element"
+  end
+  if #document:nodes("parent::" .. by_id, signature) ~= 1 then
+    return nil, "signature is not enveloped in the referenced element"
+  end
+
+  local c14n_method = document:string("ds:SignedInfo/ds:CanonicalizationMethod/@Algorithm", signature)
+  local signed_info_comments = CANONICALIZATION_METHODS[c14n_method or ""]
+  if not signed_info_comments then
+    return nil, "unsupported canonicalization method '" .. tostring(c14n_method) .. "'"
+  end
+
+  local signature_method = document:string("ds:SignedInfo/ds:SignatureMethod/@Algorithm", signature)
+  local signature_digest = SIGNATURE_METHODS[signature_method or ""]
+  if not signature_digest then
+    return nil, "unsupported signature method '" .. tostring(signature_method) .. "'"
+  end
+
+  local digest_method = document:string("ds:DigestMethod/@Algorithm", reference)
+  local reference_digest = DIGEST_METHODS[digest_method or ""]
+  if not reference_digest then
+    return nil, "unsupported digest method '" .. tostring(digest_method) .. "'"
+  end
+
+  local reference_comments = 0
+  local reference_prefixes
+  local enveloped = false
+  for _, transform in ipairs(document:nodes("ds:Transforms/ds:Transform", reference)) do
+    local algorithm = document:string("@Algorithm", transform)
+    if algorithm == ENVELOPED_SIGNATURE then
+      enveloped = true
+    elseif CANONICALIZATION_METHODS[algorithm or ""] then
+      reference_comments = CANONICALIZATION_METHODS[algorithm]
+      reference_prefixes = inclusive_prefixes(document, transform)
+    else
+      return nil, "unsupported transform '" .. tostring(algorithm) .. "'"
+    end
+  end
+  if not enveloped then
+    return nil, "signature does not use the enveloped-signature transform"
+  end
+
+  local expected_digest = document:string("ds:DigestValue", reference)
+  local signature_value = document:string("ds:SignatureValue", signature)
+  if not expected_digest or not signature_value then
+    return nil, "signature is missing its digest or signature value"
+  end
+  signature_value = decode_base64(strip_whitespace(signature_value))
+  if not signature_value then
+    return nil, "signature value is not valid base64"
+  end
+
+  -- 1. SignedInfo is signed with the configured key
+  local signed_info_prefixes = inclusive_prefixes(document,
+    document:nodes("ds:SignedInfo/ds:CanonicalizationMethod", signature)[1])
+  local signed_info, err = document:canonicalize(
+    subtree("ds:SignedInfo[parent::ds:Signature[parent::" .. by_id .. "]]"),
+    signed_info_comments, signed_info_prefixes)
+  if not signed_info then
+    return nil, "could not canonicalize SignedInfo: " .. err
+  end
+
+  local valid
+  valid, err = public_key:verify(signature_value, signed_info, signature_digest, nil,
+                                 ECDSA_SIGNATURE_METHODS[signature_method] and ECDSA_VERIFY_OPTIONS or nil)
+  if not valid then
+    return nil, "signature verification failed" .. (err and (": " .. err) or "")
+  end
+
+  -- 2. The referenced element, minus the signature, matches the signed digest
+  local signed_element = document:nodes("//" .. by_id)[1]
+  document:detach(signature)
+
+  local canonical
+  canonical, err = document:canonicalize(subtree(by_id), reference_comments, reference_prefixes)
+  if not canonical then
+    return nil, "could not canonicalize the signed element: " .. err
+  end
+
+  local digest
+  digest, err = openssl_digest.new(reference_digest)
+  if not digest then
+    return nil, err
+  end
+  local computed
+  computed, err = digest:final(canonical)
+  if not computed then
+    return nil, err
+  end
+  if encode_base64(computed) ~= strip_whitespace(expected_digest) then
+    return nil, "digest of the signed element does not match"
+  end
+
+  -- 3. Claims only come from the signed subtree
+  local assertion
+  if document:string("local-name()", signed_element) == "Assertion" then
+    assertion = signed_element
+  else
+    local assertions = document:nodes(".//saml:Assertion", signed_element)
+    if #assertions ~= 1 then
+      return nil, "signed element must contain exactly one assertion"
+    end
+    assertion = assertions[1]
+  end
+
+  return read_assertion(document, assertion)
+end
+
+local _M = {}
+
+_M.parse_datetime = parse_datetime
+
+--- Returns true when libxml2 could be loaded.
+function _M.available()
+  return lib ~= nil
+end
+
+--- Loads a verification key from a PEM or base64 DER certificate or a PEM
+-- public key.
+-- @return a lua-resty-openssl pkey, or nil and an error.
+function _M.load_key(key)
+  if type(key) ~= "string" or key == "" then
+    return nil, "verification key is empty"
+  end
+
+  if not key:find("-----BEGIN", 1, true) then
+    -- Certificates copied from IdP metadata usually come without armour
+    local body = strip_whitespace(key):gsub("(" .. ("."):rep(64) .. ")", "%1\n")
+    key = "-----BEGIN CERTIFICATE-----\n" .. body .. "\n-----END CERTIFICATE-----\n"
+  end
+
+  if key:find("-----BEGIN CERTIFICATE-----", 1, true) then
+    local cert, err = openssl_x509.new(key)
+    if not cert then
+      return nil, "invalid certificate: " .. tostring(err)
+    end
+    return cert:get_pubkey()
+  end
+
+  local pkey, err = openssl_pkey.new(key)
+  if not pkey then
+    return nil, "invalid public key: " .. tostring(err)
+  end
+  return pkey
+end
+
+--- Verifies the enveloped XML signature of a SAML assertion or response.
+-- @param xml string The assertion XML, or its base64 encoding.
+-- @param public_key pkey Key returned by `load_key`.
+-- @param now number Current time in seconds.
+-- @param clock_skew number Allowed clock skew in seconds.
+-- @return a table with `id`, `issuer`, `subject`, `attributes`,
+--   `not_before` and `not_on_or_after`, or nil and an error.
+function _M.verify(xml, public_key, now, clock_skew)
+  if not lib then
+    return nil, "libxml2 is not available"
+  end
+
+  if not xml:find("^%s*<") then
+    local decoded = decode_base64(strip_whitespace(xml))
+    if not decoded then
+      return nil, "assertion is neither XML nor base64-encoded XML"
+    end
+    xml = decoded
+  end
+
+  local document, err = open_document(xml)
+  if not document then
+    return nil, err
+  end
+
+  local ok, result, verify_err = pcall(verify_document, document, public_key)
+  document:close()
+  if not ok then
+    return nil, "verification error: " .. tostring(result)
+  end
+  if not result then
+    return nil, verify_err
+  end
+
+  clock_skew = clock_skew or 0
+  if result.not_before and now + clock_skew < result.not_before then
+    return nil, "assertion is not yet valid"
+  end
+  if result.not_on_or_after and now - clock_skew >= result.not_on_or_after then
+    return nil, "assertion has expired"
+  end
+
+  return result
+end
+
+return _M
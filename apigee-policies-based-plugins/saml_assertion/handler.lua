@@ -1,6 +1,22 @@
 local BasePlugin = require "kong.plugins.base_plugin"
 local cjson = require "cjson"
 local fun = require "kong.tools.functional"
+local lrucache = require "resty.lrucache"
+local resty_sha256 = require "resty.sha256"
+local to_hex = require("resty.string").to_hex
+local dsig = require "kong.plugins.saml_assertion.dsig"
+local request_context = require "kong.plugins.apigee_common.request_context"
+local callout = require "kong.plugins.apigee_common.callout"
+
+-- Parsed verification keys, keyed by the configured certificate/key string,
+-- so each certificate is parsed once rather than on every request.
+local verification_keys = lrucache.new(32)
+
+local function sha256_hex(value)
+  local digest = resty_sha256:new()
+  digest:update(value)
+  return to_hex(digest:final())
+end
 
 -- Helper to safely get value from JSON body using simple dot notation
 local function get_json_value(json_table, path)
@@ -52,9 +68,9 @@ end
 local function get_value_from_source(source_type, source_name)
   local value = nil
   if source_type == "header" then
-    value = kong.request.get_header(source_name)
+    value = request_context.get_header(source_name)
   elseif source_type == "query" then
-    value = kong.request.get_query_arg(source_name)
+    value = request_context.get_query_arg(source_name)
   elseif source_type == "body" then
     local raw_body = kong.request.get_raw_body()
     if raw_body then
@@ -78,9 +94,9 @@ local function set_value_to_destination(destination_type, destination_name, valu
   if not value then value = "" end
 
   if destination_type == "header" then
-    kong.request.set_header(destination_name, tostring(value))
+    request_context.set_header(destination_name, tostring(value))
   elseif destination_type == "query" then
-    kong.request.set_query_arg(destination_name, tostring(value))
+    request_context.set_query_arg(destination_name, tostring(value))
   elseif destination_type == "body" then
     local current_body = kong.request.get_raw_body()
     local parsed_body, err = cjson.decode(current_body or "{}")
@@ -91,17 +107,78 @@ local function set_value_to_destination(destination_type, destination_name, valu
 
     if destination_name == "." or destination_name == "" then
       kong.request.set_body(tostring(value))
-      kong.request.set_header("Content-Type", "application/xml") -- SAML is XML
+      request_context.set_header("Content-Type", "application/xml") -- SAML is XML
     else
       set_json_value(parsed_body, destination_name, value)
       kong.request.set_body(cjson.encode(parsed_body))
-      kong.request.set_header("Content-Type", "application/json")
+      request_context.set_header("Content-Type", "application/json")
     end
   elseif destination_type == "shared_context" then
     kong.ctx.shared[destination_name] = value
   end
 end
 
+local function get_verification_key(key_string)
+  local key = verification_keys:get(key_string)
+  if key then
+    return key
+  end
+
+  local pkey, err = dsig.load_key(key_string)
+  if not pkey then
+    return nil, err
+  end
+  key = { pkey = pkey, fingerprint = sha256_hex(key_string) }
+  verification_keys:set(key_string, key)
+  return key
+end
+
+-- kong.cache callback: verifies the assertion and caches the result until the
+-- assertion expires, capped by `verified_assertion_cache_ttl`. Failures are
+-- returned as errors and therefore never cached.
+local function verify_assertion(saml_assertion, key, conf)
+  local now = ngx.time()
+  local result, err = dsig.verify(saml_assertion, key.pkey, now, conf.clock_skew)
+  if not result then
+    return nil, err
+  end
+
+  local ttl = conf.verified_assertion_cache_ttl
+  if result.not_on_or_after then
+    ttl = math.min(ttl, result.not_on_or_after + conf.clock_skew - now)
+  end
+  return result, nil, math.max(ttl, 1)
+end
+
+-- Verifies the assertion in-process, reusing the outcome for replays of the
+-- same assertion (same ID, same bytes, same key) while it is valid.
+local function verify_locally(conf, saml_assertion, verification_key)
+  local key, err = get_verification_key(verification_key)
+  if not key then
+    return nil, err
+  end
+
+  if conf.verified_assertion_cache_ttl == 0 then
+    return verify_assertion(saml_assertion, key, conf)
+  end
+
+  local assertion_id = saml_assertion:match("<[%w_%.%-]*:?Assertion%s[^>]-ID=[\"']([^\"']+)") or "-"
+  local cache_key = "saml_assertion:" .. assertion_id .. ":" .. sha256_hex(saml_assertion) .. ":" .. key.fingerprint
+  return kong.cache:get(cache_key, nil, verify_assertion, saml_assertion, key, conf)
+end
+
+local function extract_claims(conf, attributes)
+  for _, claim_mapping in ipairs(conf.extract_claims) do
+    local attribute_value = attributes[claim_mapping.attribute_name]
+    if attribute_value ~= nil then
+      kong.ctx.shared[claim_mapping.output_key] = attribute_value
+      kong.log.debug("SAMLAssertion: Extracted SAML attribute '", claim_mapping.attribute_name, "' to '", claim_mapping.output_key, "': ", tostring(attribute_value))
+    else
+      kong.log.debug("SAMLAssertion: SAML attribute '", claim_mapping.attribute_name, "' not found in verified assertion.")
+    end
+  end
+end
+
 local SAMLAssertionHandler = BasePlugin:extend("saml_assertion")
 
 function SAMLAssertionHandler:new()
@@ -144,6 +221,20 @@ function SAMLAssertionHandler:access(conf)
       return
     end
 
+    if conf.verification_mode == "local" then
+      local result, err = verify_locally(conf, saml_assertion, verification_key)
+      if not result then
+        kong.log.err("SAMLAssertion: SAML assertion verification failed: ", err)
+        if not conf.on_error_continue then return kong.response.exit(conf.on_error_status, conf.on_error_body) end
+        kong.log.warn("SAMLAssertion: SAML operation failed but 'on_error_continue' is true. Continuing request processing.")
+        return
+      end
+
+      kong.log.debug("SAMLAssertion: SAML assertion '", result.id, "' verified locally.")
+      extract_claims(conf, result.attributes)
+      return
+    end
+
     request_body_for_service = {
       operation = "verify",
       saml_assertion = saml_assertion,
@@ -151,16 +242,24 @@ function SAMLAssertionHandler:access(conf)
     }
   end
 
+  if not conf.saml_service_url then
+    kong.log.err("SAMLAssertion: 'saml_service_url' is required for 'generate' and for remote verification.")
+    if not conf.on_error_continue then return kong.response.exit(conf.on_error_status, conf.on_error_body) end
+    return
+  end
+
   local callout_opts = {
     method = "POST",
     headers = { ["Content-Type"] = "application/json" },
     body = cjson.encode(request_body_for_service),
-    timeout = 10000,
-    connect_timeout = 5000,
+    timeout = conf.callout_timeout,
+    connect_timeout = conf.callout_connect_timeout,
     ssl_verify = true,
+    keepalive_timeout = conf.callout_keepalive_timeout,
+    keepalive_pool_size = conf.callout_keepalive_pool_size,
   }
 
-  local res, err = kong.http.client.go(conf.saml_service_url, callout_opts)
+  local res, err = callout.request(conf.saml_service_url, callout_opts)
 
   if not res then
     kong.log.err("SAMLAssertion: Call to SAML service '", conf.saml_service_url, "' failed: ", err)
@@ -196,15 +295,7 @@ function SAMLAssertionHandler:access(conf)
       kong.log.debug("SAMLAssertion: SAML assertion verified successfully.")
       -- Extract claims
       if service_response.attributes and type(service_response.attributes) == "table" then
-        for _, claim_mapping in ipairs(conf.extract_claims) do
-          local attribute_value = service_response.attributes[claim_mapping.attribute_name]
-          if attribute_value ~= nil then
-            kong.ctx.shared[claim_mapping.output_key] = attribute_value
-            kong.log.debug("SAMLAssertion: Extracted SAML attribute '", claim_mapping.attribute_name, "' to '", claim_mapping.output_key, "': ", tostring(attribute_value))
-          else
-            kong.log.debug("SAMLAssertion: SAML attribute '", claim_mapping.attribute_name, "' not found in service response.")
-          end
-        end
+        extract_claims(conf, service_response.attributes)
       end
     else
       saml_operation_successful = false -- Service indicated success but didn't provide expected data
@@ -1,4 +1,5 @@
 local typedefs = require "kong.db.schema.typedefs"
+local apigee_typedefs = require "kong.plugins.apigee_common.typedefs"
 
 return {
   name = "saml-assertion",
@@ -13,8 +14,7 @@ return {
           {
             saml_service_url = {
               type = "string",
-              required = true,
-              description = "The URL of the external service responsible for SAML assertion generation or verification.",
+              description = "The URL of the external service responsible for SAML assertion generation, and for verification when `verification_mode` is `remote`. Required for 'generate' operation.",
             },
           },
           {
@@ -104,6 +104,30 @@ return {
               description = "Required for 'verify' operation: The actual public key/certificate string to use for verification.",
             },
           },
+          {
+            verification_mode = {
+              type = "string",
+              default = "local",
+              enum = { "local", "remote" },
+              description = "For 'verify' operation: `local` verifies the XML signature in-process against the configured certificate; `remote` delegates verification to `saml_service_url`.",
+            },
+          },
+          {
+            clock_skew = {
+              type = "number",
+              default = 60,
+              between = { 0, 600 },
+              description = "For `local` verification: seconds of clock skew tolerated when checking the assertion's `NotBefore` and `NotOnOrAfter` conditions.",
+            },
+          },
+          {
+            verified_assertion_cache_ttl = {
+              type = "number",
+              default = 300,
+              between = { 0, 86400 },
+              description = "For `local` verification: maximum seconds a verified assertion is cached, keyed by its ID and digest. Entries never outlive the assertion's `NotOnOrAfter`. `0` disables the cache.",
+            },
+          },
           {
             extract_claims = {
               type = "array",
@@ -130,6 +154,10 @@ return {
               description = "Optional, for 'verify' operation: A list of SAML attributes to extract from the verified assertion and store in `kong.ctx.shared`.",
             },
           },
+          { callout_timeout = apigee_typedefs.callout_timeout },
+          { callout_connect_timeout = apigee_typedefs.callout_connect_timeout },
+          { callout_keepalive_timeout = apigee_typedefs.callout_keepalive_timeout },
+          { callout_keepalive_pool_size = apigee_typedefs.callout_keepalive_pool_size },
           {
             on_error_status = {
               type = "number",
@@ -0,0 +1,118 @@
+local dsig = require "kong.plugins.saml_assertion.dsig"
+
+-- Assertions signed with the private halves of these keys (enveloped
+-- signature, exclusive C14N, SHA-256), valid 09:55 to 10:05 UTC
+local EC_PUBLIC_KEY = [[
+-----BEGIN PUBLIC KEY-----
+MFkwEwYHKoZIzj0CAQYIKoZIzj0DAQcDQgAES2d23ZkyoSx5FcMKpXArUMxS371U
+ktZQHPgf/kroQTe3vKLTAblLpnoCDu6Ua/lCCuB6OtsJ5HNp9026juNVfA==
+-----END PUBLIC KEY-----
+]]
+
+local RSA_PUBLIC_KEY = [[
+-----BEGIN PUBLIC KEY-----
+MIIBIjANBgkqhkiG9w0BAQEFAAOCAQ8AMIIBCgKCAQEArDu2kjMigMf2POFNSkZJ
+iUozXORIUpZ2SRpmOXYXaIW8hW0qHuGKVBnzh0G5jHabi0gT4GhJk7S2QDJRnXXH
+01rbVtRUwgiM9Tuffx4oWIfBNd/H6QQLjKRlLHMrWvk6Z7Ym9QWc9Ukh8m3VEgIi
+C1ruzu3ffecIBdo7ipqN5g2I1vnA8LhW7wCOX7i8iAhvoP/qHi0ajCfBFXiUj9vG
+iNn4eanlkk8wEi+KCNJmr/aUa3fvbrX+Wu03DyFTZ6B+vpHEYESgWbdq1k5sNMD/
+rRSMLpp9kbdvU0bJKEV32oWOQwuO+tOyUT/0ToSZHbPHFVAjSf2tLOXs2XmVo6/g
+7QIDAQAB
+-----END PUBLIC KEY-----
+]]
+
+local EC_SIGNED = [[<saml:Assertion xmlns:saml="urn:oasis:names:tc:SAML:2.0:assertion" ID="_a1" IssueInstant="2024-05-01T10:00:00Z" Version="2.0"><saml:Issuer>https://idp.example.com</saml:Issuer><ds:Signature xmlns:ds="http://www.w3.org/2000/09/xmldsig#"><ds:SignedInfo><ds:CanonicalizationMethod Algorithm="http://www.w3.org/2001/10/xml-exc-c14n#"/><ds:SignatureMethod Algorithm="http://www.w3.org/2001/04/xmldsig-more#ecdsa-sha256"/><ds:Reference URI="#_a1"><ds:Transforms><ds:Transform Algorithm="http://www.w3.org/2000/09/xmldsig#enveloped-signature"/><ds:Transform Algorithm="http://www.w3.org/2001/10/xml-exc-c14n#"/></ds:Transforms><ds:DigestMethod Algorithm="http://www.w3.org/2001/04/xmlenc#sha256"/><ds:DigestValue>++eBwqpRKGDLrCurCQnqzTBwA67RFQhpm7H9n6wLOw4=</ds:DigestValue></ds:Reference></ds:SignedInfo><ds:SignatureValue>ed539OdIpl86XOXmdxBbfcUA3cjk5GMsmocR75FBv1U/skomxWxNctK2/cbaF8UgsYNUw95U7zZ1LyRBYuqydw==</ds:SignatureValue></ds:Signature><saml:Subject><saml:NameID>alice@example.com</saml:NameID></saml:Subject><saml:Conditions NotBefore="2024-05-01T09:55:00Z" NotOnOrAfter="2024-05-01T10:05:00Z"/><saml:AttributeStatement><saml:Attribute Name="role"><saml:AttributeValue>admin</saml:AttributeValue></saml:Attribute></saml:AttributeStatement></saml:Assertion>]]
+
+local RSA_SIGNED = [[<saml:Assertion xmlns:saml="urn:oasis:names:tc:SAML:2.0:assertion" ID="_a1" IssueInstant="2024-05-01T10:00:00Z" Version="2.0"><saml:Issuer>https://idp.example.com</saml:Issuer><ds:Signature xmlns:ds="http://www.w3.org/2000/09/xmldsig#"><ds:SignedInfo><ds:CanonicalizationMethod Algorithm="http://www.w3.org/2001/10/xml-exc-c14n#"/><ds:SignatureMethod Algorithm="http://www.w3.org/2001/04/xmldsig-more#rsa-sha256"/><ds:Reference URI="#_a1"><ds:Transforms><ds:Transform Algorithm="http://www.w3.org/2000/09/xmldsig#enveloped-signature"/><ds:Transform Algorithm="http://www.w3.org/2001/10/xml-exc-c14n#"/></ds:Transforms><ds:DigestMethod Algorithm="http://www.w3.org/2001/04/xmlenc#sha256"/><ds:DigestValue>++eBwqpRKGDLrCurCQnqzTBwA67RFQhpm7H9n6wLOw4=</ds:DigestValue></ds:Reference></ds:SignedInfo><ds:SignatureValue>FF5ChNIFWdcx6H2EPENGMJckBv3Jyl9G2uqz57DE47SlYBA+FW0iiWXg7dZ3SVj3r2wfxOldfOR49P+2PEMC01orvdUDWHZS0G30ij5xIBgpDKz/BiHYNny912SxY/3rcSptaSG1zSSkoUphNj67wDfWV1rYmXEA3Asu4K/3D5nwD0lbmBtmhW/PlHj6VB/bR8ZhQcGFIsfkszdfDUUrqPRrOsZMbsRLijjY1G4/8Iq+LpgNQGYStXvGw7I1KgPqPWNJgFPntIdq3QL87KXuEZBylXfGgCukDCeJfdBNHDl/rrMNqLg88ebt2EjZeEkhapOtt8mwyDG3opu41XAZMA==</ds:SignatureValue></ds:Signature><saml:Subject><saml:NameID>alice@example.com</saml:NameID></saml:Subject><saml:Conditions NotBefore="2024-05-01T09:55:00Z" NotOnOrAfter="2024-05-01T10:05:00Z"/><saml:AttributeStatement><saml:Attribute Name="role"><saml:AttributeValue>admin</saml:AttributeValue></saml:Attribute></saml:AttributeStatement></saml:Assertion>]]
+
+local NOW = dsig.parse_datetime("2024-05-01T10:00:00Z")
+
+local function replace(s, old, new)
+  local from, to = s:find(old, 1, true)
+  assert(from, "fixture does not contain " .. old)
+  return s:sub(1, from - 1) .. new .. s:sub(to + 1)
+end
+
+describe("saml_assertion dsig", function()
+  local ec_key, rsa_key
+
+  setup(function()
+    ec_key = assert(dsig.load_key(EC_PUBLIC_KEY))
+    rsa_key = assert(dsig.load_key(RSA_PUBLIC_KEY))
+  end)
+
+  it("verifies an ECDSA signature and reads the signed claims", function()
+    local result, err = dsig.verify(EC_SIGNED, ec_key, NOW, 0)
+    assert.is_nil(err)
+    assert.equals("_a1", result.id)
+    assert.equals("https://idp.example.com", result.issuer)
+    assert.equals("alice@example.com", result.subject)
+    assert.equals("admin", result.attributes.role)
+    assert.equals(dsig.parse_datetime("2024-05-01T10:05:00Z"), result.not_on_or_after)
+  end)
+
+  it("verifies an RSA signature", function()
+    local result, err = dsig.verify(RSA_SIGNED, rsa_key, NOW, 0)
+    assert.is_nil(err)
+    assert.equals("alice@example.com", result.subject)
+  end)
+
+  it("accepts the base64-encoded assertion", function()
+    assert.is_not_nil(dsig.verify(ngx.encode_base64(EC_SIGNED), ec_key, NOW, 0))
+  end)
+
+  it("rejects a signature made with another key", function()
+    local result, err = dsig.verify(EC_SIGNED, rsa_key, NOW, 0)
+    assert.is_nil(result)
+    assert.matches("signature verification failed", err)
+  end)
+
+  it("rejects a tampered digest value", function()
+    local tampered = replace(EC_SIGNED, "<ds:DigestValue>", "<ds:DigestValue>AAAA")
+    local result, err = dsig.verify(tampered, ec_key, NOW, 0)
+    assert.is_nil(result)
+    assert.matches("signature verification failed", err)
+  end)
+
+  it("rejects a tampered signed element", function()
+    local tampered = replace(EC_SIGNED, "alice@example.com", "mallory@example.com")
+    local result, err = dsig.verify(tampered, ec_key, NOW, 0)
+    assert.is_nil(result)
+    assert.matches("digest of the signed element does not match", err, 1, true)
+  end)
+
+  it("rejects a second element carrying the referenced ID", function()
+    local wrapped = replace(EC_SIGNED, "<saml:Subject>",
+      '<saml:Advice><saml:Assertion ID="_a1"><saml:Subject><saml:NameID>mallory@example.com</saml:NameID>'
+      .. "</saml:Subject></saml:Assertion></saml:Advice><saml:Subject>")
+    local result, err = dsig.verify(wrapped, ec_key, NOW, 0)
+    assert.is_nil(result)
+    assert.matches("does not identify a unique element", err, 1, true)
+  end)
+
+  it("rejects a signature that is not a child of the referenced element", function()
+    local from = EC_SIGNED:find("<ds:Signature", 1, true)
+    local _, to = EC_SIGNED:find("</ds:Signature>", 1, true)
+    local signature = EC_SIGNED:sub(from, to)
+    local unsigned = EC_SIGNED:sub(1, from - 1) .. EC_SIGNED:sub(to + 1)
+    local wrapped = '<samlp:Response xmlns:samlp="urn:oasis:names:tc:SAML:2.0:protocol" ID="_r1">'
+                    .. signature .. unsigned .. "</samlp:Response>"
+    local result, err = dsig.verify(wrapped, ec_key, NOW, 0)
+    assert.is_nil(result)
+    assert.matches("signature is not enveloped in the referenced element", err, 1, true)
+  end)
+
+  it("rejects an expired assertion unless within the clock skew", function()
+    local later = dsig.parse_datetime("2024-05-01T10:05:30Z")
+    local result, err = dsig.verify(EC_SIGNED, ec_key, later, 0)
+    assert.is_nil(result)
+    assert.equals("assertion has expired", err)
+    assert.is_not_nil(dsig.verify(EC_SIGNED, ec_key, later, 60))
+  end)
+
+  it("rejects an assertion that is not yet valid", function()
+    local result, err = dsig.verify(EC_SIGNED, ec_key, dsig.parse_datetime("2024-05-01T09:50:00Z"), 0)
+    assert.is_nil(result)
+    assert.equals("assertion is not yet valid", err)
+  end)
+end)
@@ -1,5 +1,6 @@
 local BasePlugin = require "kong.plugins.base_plugin"
 local cjson = require "cjson"
+local request_context = require "kong.plugins.apigee_common.request_context"
 local html_tags_pattern = "<[^>]*>" -- Simple pattern to remove HTML/XML tags
 
 -- Helper to safely get value from JSON body using simple dot notation
@@ -66,9 +67,9 @@ function SanitizeUserPromptHandler:access(conf)
 
   -- Step 1: Get the user prompt
   if conf.source_type == "header" then
-    user_prompt = kong.request.get_header(conf.source_name)
+    user_prompt = request_context.get_header(conf.source_name)
   elseif conf.source_type == "query" then
-    user_prompt = kong.request.get_query_arg(conf.source_name)
+    user_prompt = request_context.get_query_arg(conf.source_name)
   elseif conf.source_type == "body" then
     -- Read body and parse it once
     request_body = kong.request.get_raw_body()
@@ -130,9 +131,9 @@ function SanitizeUserPromptHandler:access(conf)
 
   -- Step 3: Set the sanitized prompt to the destination
   if conf.destination_type == "header" then
-    kong.request.set_header(conf.destination_name, sanitized_prompt)
+    request_context.set_header(conf.destination_name, sanitized_prompt)
   elseif conf.destination_type == "query" then
-    kong.request.set_query_arg(conf.destination_name, sanitized_prompt)
+    request_context.set_query_arg(conf.destination_name, sanitized_prompt)
   elseif conf.destination_type == "body" then
     if not parsed_body then
       -- If original body was empty or not JSON, create a new JSON body
@@ -157,7 +158,7 @@ function SanitizeUserPromptHandler:access(conf)
 
   if body_is_modified then
     -- Ensure the body content type is set correctly if body was modified
-    kong.request.set_header("Content-Type", "application/json")
+    request_context.set_header("Content-Type", "application/json")
   end
 end
 
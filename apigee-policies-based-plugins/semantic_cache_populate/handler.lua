@@ -1,5 +1,6 @@
 local BasePlugin = require "kong.plugins.base_plugin"
 local fun = require "kong.tools.functional"
+local request_context = require "kong.plugins.apigee_common.request_context"
 
 -- Helper function to resolve fragment values from different sources
 local function resolve_fragment_value(fragment_ref)
@@ -9,10 +10,10 @@ local function resolve_fragment_value(fragment_ref)
     return kong.request.get_method()
   elseif fragment_ref:sub(1, 15) == "request.headers." then
     local header_name = fragment_ref:sub(16)
-    return kong.request.get_header(header_name)
+    return request_context.get_header(header_name)
   elseif fragment_ref:sub(1, 19) == "request.query_param." then
     local query_param_name = fragment_ref:sub(20)
-    return kong.request.get_query_arg(query_param_name)
+    return request_context.get_query_arg(query_param_name)
   elseif fragment_ref:sub(1, 15) == "shared_context." then
     local shared_key = fragment_ref:sub(16)
     local value = kong.ctx.shared[shared_key]
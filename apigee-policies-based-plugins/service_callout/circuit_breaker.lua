@@ -0,0 +1,202 @@
+-- Per-upstream circuit breaker with latency tracking, shared by all workers.
+--
+-- State lives in a `lua_shared_dict` so that every worker sees the same
+-- error rate, latency histogram and open/half-open state for an upstream:
+--
+--   cb:<upstream>:gen               generation, bumped each time the breaker closes
+--   cb:<upstream>:open_until        present while the breaker is open
+--   cb:<upstream>:probe             lock held by the single half-open probe
+--   cb:<upstream>:<gen>:<w>:n|f|hN  requests, failures and latency histogram
+--                                   bucket N for window w
+--
+-- Counters are kept for the current and previous window and combined as a
+-- sliding window, weighting the previous one by the part that still overlaps.
+
+local floor = math.floor
+local max = math.max
+local min = math.min
+local now = ngx.now
+
+-- Upper bounds in milliseconds of the latency histogram buckets
+local LATENCY_BUCKETS = {
+  5, 10, 20, 50, 100, 200, 300, 500, 750, 1000,
+  1500, 2000, 3000, 5000, 7500, 10000, 15000, 30000, 60000, 600000,
+}
+local NUM_BUCKETS = #LATENCY_BUCKETS
+
+-- Per-worker memo of the derived timeout, so the histogram is read from
+-- shared memory at most once per upstream and second
+local TIMEOUT_MEMO_TTL = 1
+local timeout_memo = {}
+
+-- Callout URLs come from plugin configuration, so this stays small
+local upstream_keys = {}
+
+local missing_shm_logged = {}
+
+local _M = {}
+
+--- Returns the key identifying the upstream of a callout URL
+-- (scheme, host and port).
+function _M.upstream_key(url)
+  local key = upstream_keys[url]
+  if not key then
+    key = url:match("^(%a[%w+.-]*://[^/?#]+)") or url
+    upstream_keys[url] = key
+  end
+  return key
+end
+
+local function bucket_index(latency_ms)
+  for i = 1, NUM_BUCKETS do
+    if latency_ms <= LATENCY_BUCKETS[i] then
+      return i
+    end
+  end
+  return NUM_BUCKETS
+end
+
+local function window_prefix(dict, upstream, window, offset)
+  local gen = dict:get("cb:" .. upstream .. ":gen") or 0
+  local w = floor(now() / window) - offset
+  return "cb:" .. upstream .. ":" .. gen .. ":" .. w .. ":"
+end
+
+-- Sliding-window sum of one counter: the current window plus the still
+-- overlapping share of the previous one.
+local function window_sum(dict, current, previous, weight, name)
+  return (dict:get(current .. name) or 0) + (dict:get(previous .. name) or 0) * weight
+end
+
+local function window_prefixes(dict, upstream, window)
+  local t = now()
+  local weight = 1 - (t % window) / window
+  return window_prefix(dict, upstream, window, 0), window_prefix(dict, upstream, window, 1), weight
+end
+
+local function open(dict, upstream, conf)
+  dict:set("cb:" .. upstream .. ":open_until", now() + conf.circuit_breaker_open_duration)
+  dict:delete("cb:" .. upstream .. ":probe")
+  kong.log.warn("ServiceCallout: Circuit breaker opened for '", upstream, "' for ",
+                conf.circuit_breaker_open_duration, "s.")
+end
+
+local function close(dict, upstream)
+  -- A new generation starts the error and latency statistics from scratch
+  dict:incr("cb:" .. upstream .. ":gen", 1, 0)
+  dict:delete("cb:" .. upstream .. ":open_until")
+  dict:delete("cb:" .. upstream .. ":probe")
+  timeout_memo[upstream] = nil
+  kong.log.notice("ServiceCallout: Circuit breaker closed for '", upstream, "'.")
+end
+
+-- Derives the call timeout from the observed p99 latency, bounded by
+-- `adaptive_timeout_min` and `callout_timeout`.
+local function adaptive_timeout(dict, upstream, conf)
+  local memo = timeout_memo[upstream]
+  local t = now()
+  if memo and memo.expires > t then
+    return memo.timeout
+  end
+
+  local current, previous, weight = window_prefixes(dict, upstream, conf.circuit_breaker_window)
+  local total = window_sum(dict, current, previous, weight, "n")
+  local timeout = conf.callout_timeout
+  if total >= conf.circuit_breaker_min_requests then
+    local target = total * 0.99
+    local seen = 0
+    for i = 1, NUM_BUCKETS do
+      seen = seen + window_sum(dict, current, previous, weight, "h" .. i)
+      if seen >= target then
+        timeout = LATENCY_BUCKETS[i] * conf.adaptive_timeout_multiplier
+        break
+      end
+    end
+    timeout = floor(min(conf.callout_timeout, max(conf.adaptive_timeout_min, timeout)))
+  end
+
+  timeout_memo[upstream] = { timeout = timeout, expires = t + TIMEOUT_MEMO_TTL }
+  return timeout
+end
+
+--- Decides whether a call to the upstream may go ahead.
+-- @return `allowed`, `probe` (true when this call is the half-open probe)
+--   and the timeout in milliseconds to use for the call. The schema rejects
+--   a missing shared dict; should a node still lack it, the call is allowed
+--   with the configured timeout and the error logged once per worker.
+function _M.before(conf, upstream)
+  local dict = ngx.shared[conf.circuit_breaker_shm]
+  if not dict then
+    if not missing_shm_logged[conf.circuit_breaker_shm] then
+      missing_shm_logged[conf.circuit_breaker_shm] = true
+      kong.log.err("ServiceCallout: lua_shared_dict '", conf.circuit_breaker_shm, "' is not declared on this node. ",
+                   "Circuit breaker disabled.")
+    end
+    return true, false, conf.callout_timeout
+  end
+
+  local timeout = conf.adaptive_timeout_enabled and adaptive_timeout(dict, upstream, conf)
+                  or conf.callout_timeout
+
+  local open_until = dict:get("cb:" .. upstream .. ":open_until")
+  if not open_until then
+    return true, false, timeout
+  end
+  if now() < open_until then
+    return false
+  end
+
+  -- Half-open: one probe at a time is let through; the lock expires with
+  -- the probe's timeout in case the worker running it dies
+  local ok = dict:add("cb:" .. upstream .. ":probe", true, conf.callout_timeout / 1000 + 1)
+  if not ok then
+    return false
+  end
+  return true, true, conf.callout_timeout
+end
+
+--- Records the outcome of a call.
+-- @param succeeded boolean Whether the upstream answered without error.
+-- @param latency_ms number Duration of the call.
+-- @param probe boolean Whether the call was the half-open probe.
+function _M.after(conf, upstream, succeeded, latency_ms, probe)
+  local dict = ngx.shared[conf.circuit_breaker_shm]
+  if not dict then
+    return
+  end
+
+  if probe then
+    if succeeded then
+      close(dict, upstream)
+    else
+      open(dict, upstream, conf)
+    end
+    return
+  end
+
+  local window = conf.circuit_breaker_window
+  local ttl = 2 * window + 1
+  local current = window_prefix(dict, upstream, window, 0)
+  dict:incr(current .. "n", 1, 0, ttl)
+  dict:incr(current .. "h" .. bucket_index(latency_ms), 1, 0, ttl)
+  if succeeded then
+    return
+  end
+  dict:incr(current .. "f", 1, 0, ttl)
+
+  if dict:get("cb:" .. upstream .. ":open_until") then
+    return
+  end
+
+  local _, previous, weight = window_prefixes(dict, upstream, window)
+  local total = window_sum(dict, current, previous, weight, "n")
+  if total < conf.circuit_breaker_min_requests then
+    return
+  end
+  local failures = window_sum(dict, current, previous, weight, "f")
+  if failures / total >= conf.circuit_breaker_error_threshold then
+    open(dict, upstream, conf)
+  end
+end
+
+return _M
@@ -1,5 +1,7 @@
 local BasePlugin = require "kong.plugins.base_plugin"
 local cjson = require "cjson"
+local callout = require "kong.plugins.apigee_common.callout"
+local circuit_breaker = require "kong.plugins.service-callout.circuit_breaker"
 
 local ServiceCalloutHandler = BasePlugin:extend("service-callout")
 ServiceCalloutHandler.PRIORITY = 1000
@@ -8,49 +10,218 @@ function ServiceCalloutHandler:new()
   ServiceCalloutHandler.super.new(self)
 end
 
-local function do_callout(conf)
-  local request_body_for_callout = nil
-
-  if conf.request_body_source_type == "request_body" then
-    request_body_for_callout = kong.request.get_raw_body()
-  elseif conf.request_body_source_type == "shared_context" then
-    if conf.request_body_source_name then
-      local val = kong.ctx.shared[conf.request_body_source_name]
-      if val then
-        if type(val) == "table" then
-          local ok, json_str = pcall(cjson.encode, val)
-          if ok then
-            request_body_for_callout = json_str
-          else
-            kong.log.warn("ServiceCallout: Failed to JSON encode shared_context value for key '", conf.request_body_source_name, "'. Sending as string.")
-            request_body_for_callout = tostring(val)
-          end
-        else
-          request_body_for_callout = tostring(val)
+-- Calls the upstream through its circuit breaker. While the breaker is open
+-- the call fails immediately; otherwise the call timeout is the one derived
+-- from the upstream's observed latency.
+-- `max_timeout`, when given, caps the call timeout (e.g. to a fan-out deadline).
+-- `in_flight`, when given, describes the call while it runs, so that a caller
+-- killing the thread can still record its outcome.
+local function call_upstream(conf, url, opts, max_timeout, in_flight)
+  if max_timeout then
+    opts.timeout = math.min(opts.timeout, max_timeout)
+    opts.connect_timeout = math.min(opts.connect_timeout, max_timeout)
+  end
+  if not conf.circuit_breaker_enabled then
+    return callout.request(url, opts)
+  end
+
+  local upstream = circuit_breaker.upstream_key(url)
+  local allowed, probe, timeout = circuit_breaker.before(conf, upstream)
+  if not allowed then
+    return nil, "circuit breaker open for '" .. upstream .. "'"
+  end
+  opts.timeout = max_timeout and math.min(timeout, max_timeout) or timeout
+
+  ngx.update_time()
+  local started_at = ngx.now()
+  if in_flight then
+    in_flight.upstream, in_flight.probe, in_flight.started_at = upstream, probe, started_at
+  end
+  local res, err = callout.request(url, opts)
+  ngx.update_time()
+  if in_flight then
+    in_flight.upstream = nil
+  end
+
+  -- Client errors say nothing about the upstream's health
+  local succeeded = res ~= nil and res.status < 500
+  circuit_breaker.after(conf, upstream, succeeded, (ngx.now() - started_at) * 1000, probe)
+  return res, err
+end
+
+-- Resolves the callout request body for `target` (the plugin configuration
+-- or one entry of `callouts`). `raw_body` is the client request body, read
+-- once by the caller.
+local function get_callout_body(target, raw_body)
+  if target.request_body_source_type == "request_body" then
+    return raw_body
+  elseif target.request_body_source_type == "shared_context" then
+    if not target.request_body_source_name then
+      return nil, "'request_body_source_name' is required when 'request_body_source_type' is 'shared_context'."
+    end
+    local val = kong.ctx.shared[target.request_body_source_name]
+    if val then
+      if type(val) == "table" then
+        local ok, json_str = pcall(cjson.encode, val)
+        if ok then
+          return json_str
         end
+        kong.log.warn("ServiceCallout: Failed to JSON encode shared_context value for key '", target.request_body_source_name, "'. Sending as string.")
       end
+      return tostring(val)
+    end
+  end
+  return nil
+end
+
+-- Stores a callout response (or the error, when the call failed) in
+-- `kong.ctx.shared[key]`. JSON bodies are decoded.
+local function store_response(key, res, err)
+  local response_body = res and res.body or nil
+  local body = err -- Store error message in body if call failed
+  if response_body then
+    local ok, json_body = pcall(cjson.decode, response_body)
+    if ok then
+      body = json_body
     else
-      kong.log.err("ServiceCallout: 'request_body_source_name' is required when 'request_body_source_type' is 'shared_context'.")
-      if not conf.on_error_continue and conf.wait_for_response then
-        return kong.response.exit(conf.on_error_status, conf.on_error_body)
-      end
-      return
+      -- if not json, store as raw string
+      body = response_body
     end
   end
+  kong.ctx.shared[key] = {
+    status = res and res.status or 0,
+    headers = res and res.headers or {},
+    body = body,
+  }
+  kong.log.debug("ServiceCallout: External service response stored in shared context key: ", key)
+end
 
-  local callout_opts = {
-    method = conf.method,
-    headers = conf.headers,
-    body = request_body_for_callout,
-    timeout = 10000,
-    connect_timeout = 5000,
+local function callout_opts_for(conf, target, body)
+  return {
+    method = target.method,
+    headers = target.headers,
+    body = body,
+    timeout = conf.callout_timeout,
+    connect_timeout = conf.callout_connect_timeout,
     ssl_verify = true,
-    follow_redirects = false,
+    keepalive_timeout = conf.callout_keepalive_timeout,
+    keepalive_pool_size = conf.callout_keepalive_pool_size,
   }
+end
+
+local function run_target(conf, target, raw_body, deadline, in_flight)
+  local body, err = get_callout_body(target, raw_body)
+  if err then
+    return nil, err
+  end
+  local remaining = math.floor((deadline - ngx.now()) * 1000)
+  if remaining <= 0 then
+    return nil, "fan-out deadline exceeded"
+  end
+  return call_upstream(conf, target.callout_url, callout_opts_for(conf, target, body), remaining, in_flight)
+end
+
+-- Runs every entry of `conf.callouts` concurrently in light threads and
+-- waits for all of them, or until `callouts_deadline` has passed; calls
+-- still running then are aborted and count as failed.
+local function do_parallel_callouts(conf)
+  local targets = conf.callouts
+  local raw_body
+  for _, target in ipairs(targets) do
+    if target.request_body_source_type == "request_body" then
+      raw_body = kong.request.get_raw_body()
+      break
+    end
+  end
+
+  ngx.update_time()
+  local deadline = ngx.now() + conf.callouts_deadline / 1000
+
+  local threads, results, in_flight = {}, {}, {}
+  for i, target in ipairs(targets) do
+    in_flight[i] = {}
+    threads[i] = ngx.thread.spawn(function()
+      return i, run_target(conf, target, raw_body, deadline, in_flight[i])
+    end)
+  end
+  local timer = ngx.thread.spawn(function()
+    ngx.sleep(conf.callouts_deadline / 1000)
+  end)
+
+  local pending = #targets
+  while pending > 0 do
+    local running = {}
+    for i = 1, #targets do
+      if not results[i] then
+        running[#running + 1] = threads[i]
+      end
+    end
+
+    local ok, i, res, err = ngx.thread.wait(timer, unpack(running))
+    if not ok then
+      kong.log.err("ServiceCallout: Callout thread failed: ", i)
+      break
+    end
+    if not i then
+      break -- deadline reached
+    end
+    results[i] = { res = res, err = err }
+    pending = pending - 1
+  end
+  ngx.thread.kill(timer)
+
+  local all_succeeded = true
+  for i, target in ipairs(targets) do
+    local result = results[i]
+    if not result then
+      ngx.thread.kill(threads[i])
+      result = { err = "fan-out deadline exceeded" }
+
+      -- A killed call never reaches circuit_breaker.after: count it as a
+      -- failure, which also releases the half-open probe lock
+      local call = in_flight[i]
+      if call.upstream then
+        ngx.update_time()
+        circuit_breaker.after(conf, call.upstream, false, (ngx.now() - call.started_at) * 1000, call.probe)
+      end
+    end
+
+    local res, err = result.res, result.err
+    if not res then
+      all_succeeded = false
+      kong.log.err("ServiceCallout: Call to external service '", target.callout_url, "' failed: ", err)
+    elseif res.status >= 400 then
+      all_succeeded = false
+      kong.log.warn("ServiceCallout: External service '", target.callout_url, "' returned error status: ", res.status)
+    end
+
+    if target.response_to_shared_context_key then
+      store_response(target.response_to_shared_context_key, res, err)
+    end
+  end
+
+  if not all_succeeded and not conf.on_error_continue then
+    kong.log.err("ServiceCallout: Aborting request due to failed external callout.")
+    return kong.response.exit(conf.on_error_status, conf.on_error_body)
+  end
+end
+
+local function do_callout(conf)
+  local raw_body = conf.request_body_source_type == "request_body" and kong.request.get_raw_body() or nil
+  local request_body_for_callout, body_err = get_callout_body(conf, raw_body)
+  if body_err then
+    kong.log.err("ServiceCallout: ", body_err)
+    if not conf.on_error_continue and conf.wait_for_response then
+      return kong.response.exit(conf.on_error_status, conf.on_error_body)
+    end
+    return
+  end
+
+  local callout_opts = callout_opts_for(conf, conf, request_body_for_callout)
 
   if conf.wait_for_response then
     -- Synchronous call
-    local res, err = kong.http.client.go(conf.callout_url, callout_opts)
+    local res, err = call_upstream(conf, conf.callout_url, callout_opts)
     local callout_succeeded = true
     if not res then
       callout_succeeded = false
@@ -61,31 +232,7 @@ local function do_callout(conf)
     end
 
     if conf.response_to_shared_context_key then
-      local response_body = res and res.body or nil
-      if response_body then
-          local json_body, json_err = cjson.decode(response_body)
-          if json_err then
-             -- if not json, store as raw string
-             kong.ctx.shared[conf.response_to_shared_context_key] = {
-                status = res and res.status or 0,
-                headers = res and res.headers or {},
-                body = response_body,
-             }
-          else
-             kong.ctx.shared[conf.response_to_shared_context_key] = {
-                status = res and res.status or 0,
-                headers = res and res.headers or {},
-                body = json_body,
-             }
-          end
-      else
-        kong.ctx.shared[conf.response_to_shared_context_key] = {
-            status = res and res.status or 0,
-            headers = res and res.headers or {},
-            body = err, -- Store error message in body if call failed
-        }
-      end
-      kong.log.debug("ServiceCallout: External service response stored in shared context key: ", conf.response_to_shared_context_key)
+      store_response(conf.response_to_shared_context_key, res, err)
     end
 
     if not callout_succeeded and not conf.on_error_continue then
@@ -96,7 +243,7 @@ local function do_callout(conf)
     -- Asynchronous (fire and forget) call
     kong.log.debug("ServiceCallout: Initiating fire-and-forget call to '", conf.callout_url, "'.")
     local ok, err = kong.timer.at(0, function(_, url, opts)
-      local _, call_err = kong.http.client.go(url, opts)
+      local _, call_err = call_upstream(conf, url, opts)
       if call_err then
         kong.log.err("ServiceCallout (async): Call to '", url, "' failed: ", call_err)
       end
@@ -110,7 +257,14 @@ end
 
 function ServiceCalloutHandler:access(conf)
   ServiceCalloutHandler.super.access(self)
-  do_callout(conf)
+  if conf.callouts and #conf.callouts > 0 then
+    return do_parallel_callouts(conf)
+  end
+  if not conf.callout_url then
+    kong.log.err("ServiceCallout: Either 'callout_url' or 'callouts' must be configured.")
+    return
+  end
+  return do_callout(conf)
 end
 
 return ServiceCalloutHandler
\ No newline at end of file
@@ -1,4 +1,5 @@
 local typedefs = require "kong.db.schema.typedefs"
+local apigee_typedefs = require "kong.plugins.apigee_common.typedefs"
 
 return {
   name = "service-callout",
@@ -14,8 +15,7 @@ return {
           {
             callout_url = {
               type = "string",
-              required = true,
-              description = "The URL of the external service endpoint to call.",
+              description = "The URL of the external service endpoint to call. Required unless `callouts` is set.",
             },
           },
           {
@@ -60,6 +60,141 @@ return {
               description = "Optional: If set and `wait_for_response` is `true`, the external service's full response (status, headers, body) will be stored in `kong.ctx.shared` under this key, as a Lua table.",
             },
           },
+          {
+            callouts = {
+              type = "array",
+              elements = {
+                type = "record",
+                fields = {
+                  {
+                    callout_url = {
+                      type = "string",
+                      required = true,
+                      description = "The URL of the external service endpoint to call.",
+                    },
+                  },
+                  {
+                    method = {
+                      type = "string",
+                      default = "POST",
+                      enum = { "GET", "POST", "PUT", "PATCH", "DELETE", "HEAD", "OPTIONS" },
+                      description = "The HTTP method for this callout.",
+                    },
+                  },
+                  {
+                    headers = {
+                      type = "map",
+                      keys = { type = "string" },
+                      values = { type = "string" },
+                      description = "Optional: Headers to send with this callout.",
+                    },
+                  },
+                  {
+                    request_body_source_type = {
+                      type = "string",
+                      default = "none",
+                      enum = { "request_body", "shared_context", "none" },
+                      description = "Specifies where to get the request body for this callout.",
+                    },
+                  },
+                  {
+                    request_body_source_name = {
+                      type = "string",
+                      description = "Required if `request_body_source_type` is `shared_context`: the key in `kong.ctx.shared` holding the body.",
+                    },
+                  },
+                  {
+                    response_to_shared_context_key = {
+                      type = "string",
+                      description = "Optional: Key in `kong.ctx.shared` under which this callout's response (status, headers, body) is stored.",
+                    },
+                  },
+                },
+              },
+              description = "Optional: Several callouts to run concurrently. When set, `callout_url`, `method`, `headers`, the request body settings, `response_to_shared_context_key` and `wait_for_response` are ignored. The request waits for all callouts, up to `callouts_deadline`, and fails if any of them fails (see `on_error_continue`).",
+            },
+          },
+          {
+            callouts_deadline = {
+              type = "integer",
+              default = 10000,
+              between = { 1, 600000 },
+              description = "Overall deadline in milliseconds for the callouts in `callouts`. Calls still running when it passes are aborted and count as failed.",
+            },
+          },
+          { callout_timeout = apigee_typedefs.callout_timeout },
+          { callout_connect_timeout = apigee_typedefs.callout_connect_timeout },
+          { callout_keepalive_timeout = apigee_typedefs.callout_keepalive_timeout },
+          { callout_keepalive_pool_size = apigee_typedefs.callout_keepalive_pool_size },
+          {
+            circuit_breaker_enabled = {
+              type = "boolean",
+              default = false,
+              description = "If `true`, calls go through a circuit breaker per upstream (scheme, host and port), shared by all workers. While it is open, calls fail immediately as if the callout had failed. Requires the `circuit_breaker_shm` shared dict.",
+            },
+          },
+          {
+            circuit_breaker_shm = {
+              type = "string",
+              default = "apigee_circuit_breakers",
+              description = "Name of the `lua_shared_dict` holding circuit breaker state and latency statistics. It must be declared in the Kong configuration when `circuit_breaker_enabled` is `true`, e.g. `nginx_http_lua_shared_dict = apigee_circuit_breakers 1m`.",
+            },
+          },
+          {
+            circuit_breaker_window = {
+              type = "integer",
+              default = 10,
+              between = { 1, 3600 },
+              description = "Length in seconds of the sliding window over which error rate and latency are measured.",
+            },
+          },
+          {
+            circuit_breaker_min_requests = {
+              type = "integer",
+              default = 20,
+              between = { 1, 100000 },
+              description = "Minimum number of calls in the window before the breaker may open or the timeout is adapted.",
+            },
+          },
+          {
+            circuit_breaker_error_threshold = {
+              type = "number",
+              default = 0.5,
+              between = { 0.01, 1 },
+              description = "Share of failed calls (connection errors, timeouts and 5xx responses) in the window at which the breaker opens.",
+            },
+          },
+          {
+            circuit_breaker_open_duration = {
+              type = "integer",
+              default = 30,
+              between = { 1, 3600 },
+              description = "Seconds the breaker stays open before a single half-open probe call is let through. A successful probe closes it, a failed one reopens it.",
+            },
+          },
+          {
+            adaptive_timeout_enabled = {
+              type = "boolean",
+              default = true,
+              description = "If `true` and the circuit breaker is enabled, the call timeout is derived from the upstream's observed p99 latency, bounded by `adaptive_timeout_min` and `callout_timeout`.",
+            },
+          },
+          {
+            adaptive_timeout_multiplier = {
+              type = "number",
+              default = 3,
+              between = { 1, 100 },
+              description = "Factor applied to the observed p99 latency to get the adaptive timeout.",
+            },
+          },
+          {
+            adaptive_timeout_min = {
+              type = "integer",
+              default = 500,
+              between = { 1, 600000 },
+              description = "Lower bound in milliseconds of the adaptive timeout.",
+            },
+          },
           {
             on_error_status = {
               type = "number",
@@ -86,4 +221,12 @@ return {
       },
     },
   },
-}
\ No newline at end of file
+  entity_checks = {
+    { at_least_one_of = { "config.callout_url", "config.callouts" } },
+    apigee_typedefs.shared_dict_check({ "config.circuit_breaker_enabled", "config.circuit_breaker_shm" }, function(config)
+      if config.circuit_breaker_enabled then
+        return config.circuit_breaker_shm
+      end
+    end),
+  },
+}
@@ -0,0 +1,146 @@
+describe("service-callout circuit_breaker", function()
+  local circuit_breaker, clock, dict
+  local original_now = ngx.now
+  local UPSTREAM = "https://backend.example.com"
+
+  -- Minimal lua_shared_dict; TTLs are not needed by these tests
+  local function new_dict()
+    local data = {}
+    return {
+      get = function(_, key) return data[key] end,
+      set = function(_, key, value) data[key] = value return true end,
+      add = function(_, key, value)
+        if data[key] ~= nil then
+          return false, "exists"
+        end
+        data[key] = value
+        return true
+      end,
+      incr = function(_, key, value, init)
+        data[key] = (data[key] or init) + value
+        return data[key]
+      end,
+      delete = function(_, key) data[key] = nil end,
+    }
+  end
+
+  local function conf(overrides)
+    local c = {
+      circuit_breaker_shm = "apigee_circuit_breakers",
+      circuit_breaker_window = 10,
+      circuit_breaker_min_requests = 4,
+      circuit_breaker_error_threshold = 0.5,
+      circuit_breaker_open_duration = 30,
+      callout_timeout = 10000,
+      adaptive_timeout_enabled = false,
+      adaptive_timeout_multiplier = 3,
+      adaptive_timeout_min = 500,
+    }
+    for k, v in pairs(overrides or {}) do
+      c[k] = v
+    end
+    return c
+  end
+
+  local function record(c, upstream, succeeded, latency_ms, times)
+    for _ = 1, times do
+      circuit_breaker.after(c, upstream, succeeded, latency_ms, false)
+    end
+  end
+
+  setup(function()
+    _G.kong = { log = { warn = function() end, notice = function() end, err = function() end } }
+    ngx.now = function() return clock end
+    package.loaded["kong.plugins.service-callout.circuit_breaker"] = nil
+    circuit_breaker = require "kong.plugins.service-callout.circuit_breaker"
+  end)
+
+  teardown(function()
+    ngx.now = original_now
+    ngx.shared.apigee_circuit_breakers = nil
+    package.loaded["kong.plugins.service-callout.circuit_breaker"] = nil
+  end)
+
+  before_each(function()
+    clock = 1000
+    dict = new_dict()
+    ngx.shared.apigee_circuit_breakers = dict
+  end)
+
+  it("opens once the error rate reaches the threshold", function()
+    local c = conf()
+    record(c, UPSTREAM, true, 20, 2)
+    record(c, UPSTREAM, false, 20, 1)
+    assert.is_true((circuit_breaker.before(c, UPSTREAM)))
+
+    record(c, UPSTREAM, false, 20, 1)
+    assert.is_false((circuit_breaker.before(c, UPSTREAM)))
+  end)
+
+  it("lets a single probe through when half-open and closes on its success", function()
+    local c = conf()
+    record(c, UPSTREAM, false, 20, 4)
+    assert.is_false((circuit_breaker.before(c, UPSTREAM)))
+
+    clock = clock + 31
+    local allowed, probe = circuit_breaker.before(c, UPSTREAM)
+    assert.is_true(allowed)
+    assert.is_true(probe)
+    -- Only one probe at a time
+    assert.is_false((circuit_breaker.before(c, UPSTREAM)))
+
+    circuit_breaker.after(c, UPSTREAM, true, 20, true)
+    allowed, probe = circuit_breaker.before(c, UPSTREAM)
+    assert.is_true(allowed)
+    assert.is_false(probe)
+
+    -- Closing starts the statistics afresh: one failure does not reopen it
+    record(c, UPSTREAM, false, 20, 1)
+    assert.is_true((circuit_breaker.before(c, UPSTREAM)))
+  end)
+
+  it("reopens when the probe fails", function()
+    local c = conf()
+    record(c, UPSTREAM, false, 20, 4)
+    clock = clock + 31
+    local _, probe = circuit_breaker.before(c, UPSTREAM)
+    assert.is_true(probe)
+
+    circuit_breaker.after(c, UPSTREAM, false, 20, true)
+    assert.is_false((circuit_breaker.before(c, UPSTREAM)))
+    clock = clock + 31
+    assert.is_true((circuit_breaker.before(c, UPSTREAM)))
+  end)
+
+  it("clamps the adaptive timeout to adaptive_timeout_min", function()
+    local c = conf({ adaptive_timeout_enabled = true })
+    local upstream = "https://fast.example.com"
+    record(c, upstream, true, 3, 10)
+    local _, _, timeout = circuit_breaker.before(c, upstream)
+    assert.equals(500, timeout)
+  end)
+
+  it("clamps the adaptive timeout to callout_timeout", function()
+    local c = conf({ adaptive_timeout_enabled = true })
+    local upstream = "https://slow.example.com"
+    record(c, upstream, true, 8000, 10)
+    local _, _, timeout = circuit_breaker.before(c, upstream)
+    assert.equals(10000, timeout)
+  end)
+
+  it("derives the adaptive timeout from the p99 latency", function()
+    local c = conf({ adaptive_timeout_enabled = true })
+    local upstream = "https://steady.example.com"
+    record(c, upstream, true, 180, 10)
+    local _, _, timeout = circuit_breaker.before(c, upstream)
+    assert.equals(600, timeout) -- 200 ms bucket times 3
+  end)
+
+  it("uses callout_timeout until enough calls were seen", function()
+    local c = conf({ adaptive_timeout_enabled = true })
+    local upstream = "https://new.example.com"
+    record(c, upstream, true, 3, 2)
+    local _, _, timeout = circuit_breaker.before(c, upstream)
+    assert.equals(10000, timeout)
+  end)
+end)
@@ -1,6 +1,7 @@
 local BasePlugin = require "kong.plugins.base_plugin"
 local cjson = require "cjson" -- Kong usually has cjson available
 local fun = require "kong.tools.functional"
+local request_context = require "kong.plugins.apigee_common.request_context"
 
 local SetIntegrationRequestHandler = BasePlugin:extend("set-integration-request")
 
@@ -30,9 +31,9 @@ function SetIntegrationRequestHandler:rewrite(conf)
     if param_source == "literal" then
       param_value = param_conf.value
     elseif param_source == "header" then
-      param_value = kong.request.get_header(param_source_name)
+      param_value = request_context.get_header(param_source_name)
     elseif param_source == "query" then
-      param_value = kong.request.get_query_arg(param_source_name)
+      param_value = request_context.get_query_arg(param_source_name)
     elseif param_source == "body" then
       if not request_body then
         request_body = kong.request.get_raw_body()
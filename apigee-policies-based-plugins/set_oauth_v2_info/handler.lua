@@ -1,5 +1,6 @@
 local BasePlugin = require "kong.plugins.base_plugin"
 local fun = require "kong.tools.functional"
+local token_cache = require "kong.plugins.apigee_common.token_cache"
 
 local SetOAuthV2InfoHandler = BasePlugin:extend("set-oauth-v2-info")
 
@@ -10,33 +11,72 @@ end
 function SetOAuthV2InfoHandler:access(conf)
   SetOAuthV2InfoHandler.super.access(self)
 
+  local consumer = kong.client.get_consumer()
+  local credential = kong.client.get_credential()
+
+  -- The token's metadata, from the shared token cache when possible
+  local token_hash, expires_at, cached
+  if conf.token_cache_enabled and (consumer or credential) then
+    token_hash, expires_at = token_cache.current()
+    if token_hash then
+      cached = token_cache.get(token_hash, conf.token_cache_shm)
+    end
+  end
+  local info = cached or token_cache.describe(consumer, credential)
+
   local oauth_info = {}
 
-  local consumer = kong.client.get_consumer()
-  if consumer and consumer.id then
-    oauth_info.consumer_id = consumer.id
-    oauth_info.consumer_username = consumer.username or consumer.custom_id
-    oauth_info.consumer_custom_id = consumer.custom_id
+  if info.consumer_id then
+    oauth_info.consumer_id = info.consumer_id
+    oauth_info.consumer_username = info.consumer_username
+    oauth_info.consumer_custom_id = info.consumer_custom_id
     -- Add more consumer details if needed
   end
 
-  local credential = kong.client.get_credential()
-  if credential then
-    oauth_info.client_id = credential.client_id or credential.id
-    oauth_info.application_name = credential.name
+  if credential or cached then
+    oauth_info.client_id = info.client_id
+    oauth_info.application_name = info.application_name
     -- Add more credential details if needed
   end
 
   -- Extract custom attributes
+  local cached_attributes = info.attributes or {}
+  local resolved_attributes
   for _, attr_name in ipairs(conf.custom_attributes) do
-    if consumer and consumer[attr_name] then
-      oauth_info[attr_name] = consumer[attr_name]
-    elseif credential and credential[attr_name] then
-      oauth_info[attr_name] = credential[attr_name]
-    -- You might want to check other places where custom attributes could be stored
-    -- For example, in kong.ctx.authenticated_oauth2_token if the OAuth 2.0 plugin is used
-    -- or in jwt claims if a JWT plugin is used.
-    -- For now, we'll keep it simple and check consumer and credential directly.
+    local value = cached_attributes[attr_name]
+    if value == nil then
+      if consumer and consumer[attr_name] then
+        value = consumer[attr_name]
+      elseif credential and credential[attr_name] then
+        value = credential[attr_name]
+      -- You might want to check other places where custom attributes could be stored
+      -- For example, in kong.ctx.authenticated_oauth2_token if the OAuth 2.0 plugin is used
+      -- or in jwt claims if a JWT plugin is used.
+      -- For now, we'll keep it simple and check consumer and credential directly.
+      end
+      resolved_attributes = resolved_attributes or {}
+      if value == nil then
+        resolved_attributes[attr_name] = token_cache.ABSENT
+      else
+        resolved_attributes[attr_name] = value
+      end
+    end
+    if value ~= nil and value ~= token_cache.ABSENT then
+      oauth_info[attr_name] = value
+    end
+  end
+
+  -- Write through to the token cache
+  if token_hash and (not cached or resolved_attributes) then
+    local fields = cached and {} or info
+    fields.attributes = resolved_attributes or {}
+    local ok, err = token_cache.set(token_hash, fields, {
+      shm = conf.token_cache_shm,
+      expires_at = expires_at,
+      ttl = conf.token_cache_ttl,
+    })
+    if not ok then
+      kong.log.warn("SetOAuthV2Info plugin: Could not cache token metadata: ", err)
     end
   end
 
@@ -1,4 +1,5 @@
 local typedefs = require "kong.db.schema.typedefs"
+local apigee_typedefs = require "kong.plugins.apigee_common.typedefs"
 
 return {
   name = "set-oauth-v2-info",
@@ -21,8 +22,33 @@ return {
               },
             },
           },
+          {
+            token_cache_enabled = {
+              type = "boolean",
+              default = false,
+              description = "If `true`, the token's metadata is cached in the `token_cache_shm` shared dict, keyed by a hash of the access token, and reused by the OAuth plugins for as long as the token is valid.",
+            },
+          },
+          {
+            token_cache_shm = {
+              type = "string",
+              default = "apigee_token_cache",
+              description = "The `lua_shared_dict` holding the token metadata cache. When `token_cache_enabled` is `true`, it must be declared with `nginx_http_lua_shared_dict`. It must be the same for all the OAuth plugins.",
+            },
+          },
+          {
+            token_cache_ttl = {
+              type = "number",
+              default = 3600,
+              gt = 0,
+              description = "How long, in seconds, token metadata is cached when the token's expiry is unknown (e.g. JWTs or bearer tokens validated elsewhere).",
+            },
+          },
         },
       },
     },
   },
-}
\ No newline at end of file
+  entity_checks = {
+    apigee_typedefs.token_cache_check,
+  },
+}
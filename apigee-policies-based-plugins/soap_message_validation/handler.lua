@@ -1,6 +1,28 @@
 local BasePlugin = require "kong.plugins.base_plugin"
 local cjson = require "cjson"
 local fun = require "kong.tools.functional"
+local lrucache = require "resty.lrucache"
+local resty_sha256 = require "resty.sha256"
+local to_hex = require("resty.string").to_hex
+local semaphore = require "ngx.semaphore"
+local xsd = require "kong.plugins.soap-message-validation.xsd"
+local request_context = require "kong.plugins.apigee_common.request_context"
+local callout = require "kong.plugins.apigee_common.callout"
+
+-- Compiled schemas per worker, keyed by content hash (or URL plus ETag)
+local SCHEMA_CACHE_SIZE = 32
+local schema_cache = assert(lrucache.new(SCHEMA_CACHE_SIZE))
+
+-- Content hash of `xsd_literal` per plugin configuration
+local literal_hashes = setmetatable({}, { __mode = "k" })
+
+-- Last known state of each `url` schema: cache key, ETag and check time
+local url_schemas = {}
+
+-- Remote validator: schemas already registered by this worker (keyed by
+-- service URL and hash) and per-service concurrency limits
+local registered_schemas = assert(lrucache.new(256))
+local remote_semaphores = {}
 
 -- Helper to safely get value from JSON body using simple dot notation
 local function get_json_value(json_table, path)
@@ -27,9 +49,9 @@ end
 local function get_value_from_source(source_type, source_name, phase)
   local value = nil
   if source_type == "header" then
-    value = kong.request.get_header(source_name)
+    value = request_context.get_header(source_name)
   elseif source_type == "query" then
-    value = kong.request.get_query_arg(source_name)
+    value = request_context.get_query_arg(source_name)
   elseif source_type == "body" then
     local raw_body = (phase == "access" and kong.request.get_raw_body()) or (phase == "body_filter" and kong.response.get_raw_body())
     if raw_body then
@@ -80,40 +102,243 @@ local function get_xsd_content(conf)
   return nil
 end
 
--- Main validation logic
-local function perform_validation(self, conf, phase)
-  local soap_message_content = get_message_content(conf, phase)
-  if not soap_message_content or soap_message_content == "" then
-    kong.log.debug("SOAPMessageValidation: No SOAP message content found for validation in phase '", phase, "'. Skipping.")
-    return true -- Continue processing
+local function sha256_hex(value)
+  local digest = resty_sha256:new()
+  digest:update(value)
+  return to_hex(digest:final())
+end
+
+-- Returns the SHA-256 of the XSD; literal schemas are hashed once per config
+local function get_xsd_hash(conf, xsd_content)
+  if conf.xsd_source_type == "literal" then
+    local hash = literal_hashes[conf]
+    if not hash then
+      hash = sha256_hex(xsd_content)
+      literal_hashes[conf] = hash
+    end
+    return hash
   end
+  return sha256_hex(xsd_content)
+end
 
-  local xsd_schema_content = get_xsd_content(conf)
-  if not xsd_schema_content or xsd_schema_content == "" then
-    kong.log.err("SOAPMessageValidation: No XSD schema content found. Cannot validate SOAP message.")
-    if not conf.on_validation_failure_continue then
-      return kong.response.exit(conf.on_validation_failure_status, conf.on_validation_failure_body)
+-- Returns the compiled schema for `key`, compiling `xsd_content` on a miss
+local function get_compiled_schema(key, xsd_content)
+  local schema = schema_cache:get(key)
+  if schema then
+    return schema
+  end
+
+  local err
+  schema, err = xsd.compile(xsd_content)
+  if not schema then
+    return nil, "failed to compile XSD schema: " .. tostring(err)
+  end
+  schema_cache:set(key, schema)
+  return schema
+end
+
+-- Fetches or revalidates a `url` schema. The URL is re-checked at most every
+-- `xsd_cache_ttl` seconds with `If-None-Match`; a 304 keeps the compiled
+-- schema. Must run in a phase where cosockets are available (access).
+local function refresh_url_schema(conf)
+  local url = conf.xsd_source_name
+  local state = url_schemas[url]
+  local cached = state and schema_cache:get(state.key)
+
+  if cached and ngx.now() - state.checked_at < conf.xsd_cache_ttl then
+    return cached
+  end
+
+  local headers = {}
+  if cached and state.etag then
+    headers["If-None-Match"] = state.etag
+  end
+
+  local res, err = callout.request(url, {
+    method = "GET",
+    headers = headers,
+    timeout = conf.callout_timeout,
+    connect_timeout = conf.callout_connect_timeout,
+    ssl_verify = true,
+    keepalive_timeout = conf.callout_keepalive_timeout,
+    keepalive_pool_size = conf.callout_keepalive_pool_size,
+  })
+
+  if res and res.status == 304 and cached then
+    state.checked_at = ngx.now()
+    return cached
+  end
+
+  if not res or res.status ~= 200 then
+    local reason = res and ("status " .. res.status) or err
+    if cached then
+      kong.log.warn("SOAPMessageValidation: Could not refresh XSD from '", url, "' (", reason, "). Using cached schema.")
+      state.checked_at = ngx.now()
+      return cached
+    end
+    return nil, "failed to fetch XSD from '" .. url .. "': " .. tostring(reason)
+  end
+
+  local etag = res.headers and (res.headers["ETag"] or res.headers["etag"])
+  local key = "url:" .. url .. "#" .. (etag or sha256_hex(res.body))
+  local schema, compile_err = get_compiled_schema(key, res.body)
+  if not schema then
+    return nil, compile_err
+  end
+
+  url_schemas[url] = { key = key, etag = etag, checked_at = ngx.now() }
+  return schema
+end
+
+-- Resolves the compiled schema for the configured XSD source
+local function get_schema(conf, phase)
+  if conf.xsd_source_type == "url" then
+    if phase == "access" then
+      return refresh_url_schema(conf)
     end
+    -- No cosockets in body_filter; rely on the schema fetched during access
+    local state = url_schemas[conf.xsd_source_name]
+    local schema = state and schema_cache:get(state.key)
+    if not schema then
+      return nil, "XSD from '" .. tostring(conf.xsd_source_name) .. "' has not been fetched yet"
+    end
+    return schema
+  end
+
+  local xsd_content = get_xsd_content(conf)
+  if not xsd_content or xsd_content == "" then
+    return nil, "no XSD schema content found"
+  end
+
+  return get_compiled_schema(get_xsd_hash(conf, xsd_content), xsd_content)
+end
+
+-- Validates in-process against the cached compiled schema
+local function validate_locally(conf, phase, soap_message_content)
+  local schema, err = get_schema(conf, phase)
+  if not schema then
+    kong.log.err("SOAPMessageValidation: ", err, ". Cannot validate SOAP message.")
+    return false
+  end
+
+  local ok, validation_err = schema:validate(soap_message_content, conf.validate_parts)
+  if not ok then
+    kong.log.warn("SOAPMessageValidation: SOAP message validation failed. Details: ", validation_err)
+    return false
+  end
+
+  kong.log.debug("SOAPMessageValidation: SOAP message validated successfully in phase '", phase, "'.")
+  return true
+end
+
+-- POSTs JSON to the validation service over a keep-alive connection pool.
+-- Concurrent calls per worker are bounded by `remote_max_concurrency`.
+local function remote_post(conf, url, body)
+  local sema_key = conf.soap_validation_service_url .. "|" .. conf.remote_max_concurrency
+  local sema = remote_semaphores[sema_key]
+  if not sema then
+    sema = assert(semaphore.new(conf.remote_max_concurrency))
+    remote_semaphores[sema_key] = sema
+  end
+
+  local ok, err = sema:wait(conf.callout_timeout / 1000)
+  if not ok then
+    return nil, "too many concurrent validation calls (" .. tostring(err) .. ")"
+  end
+
+  local res, req_err = callout.request(url, {
+    method = "POST",
+    headers = { ["Content-Type"] = "application/json" },
+    body = body,
+    timeout = conf.callout_timeout,
+    connect_timeout = conf.callout_connect_timeout,
+    ssl_verify = true,
+    keepalive_timeout = conf.callout_keepalive_timeout,
+    keepalive_pool_size = conf.callout_keepalive_pool_size,
+  })
+
+  sema:post(1)
+  return res, req_err
+end
+
+-- Registers a schema with the validation service under its hash, once per
+-- worker unless `force` is set (e.g. after the service forgot it).
+local function register_schema(conf, hash, xsd_content, force)
+  local key = conf.soap_validation_service_url .. "#" .. hash
+  if not force and registered_schemas:get(key) then
     return true
   end
 
-  local request_body_for_service = cjson.encode({
+  local registration_url = conf.soap_validation_schema_registration_url
+                           or (conf.soap_validation_service_url:gsub("/+$", "") .. "/schemas")
+  local res, err = remote_post(conf, registration_url, cjson.encode({
+    xsd_hash = hash,
+    xsd_schema = xsd_content,
+  }))
+  if not res then
+    return nil, "schema registration failed: " .. tostring(err)
+  end
+  if res.status ~= 200 and res.status ~= 201 and res.status ~= 204 then
+    return nil, "schema registration returned status " .. res.status
+  end
+
+  registered_schemas:set(key, true)
+  return true
+end
+
+-- Sends the message with the schema inline, or only the schema hash when
+-- `remote_schema_protocol` is `by_reference`. URL schemas are always sent
+-- inline since only the URL travels.
+local function send_for_validation(conf, soap_message_content, xsd_schema_content)
+  if conf.remote_schema_protocol ~= "by_reference" or conf.xsd_source_type == "url" then
+    return remote_post(conf, conf.soap_validation_service_url, cjson.encode({
+      soap_message = soap_message_content,
+      xsd_schema = xsd_schema_content,
+      xsd_source_type = conf.xsd_source_type, -- Pass type to service if it needs to fetch URL
+      validate_parts = conf.validate_parts,
+    }))
+  end
+
+  local hash = get_xsd_hash(conf, xsd_schema_content)
+  local ok, err = register_schema(conf, hash, xsd_schema_content, false)
+  if not ok then
+    return nil, err
+  end
+
+  local body = cjson.encode({
     soap_message = soap_message_content,
-    xsd_schema = xsd_schema_content,
-    xsd_source_type = conf.xsd_source_type, -- Pass type to service if it needs to fetch URL
+    xsd_hash = hash,
     validate_parts = conf.validate_parts,
   })
+  local res
+  res, err = remote_post(conf, conf.soap_validation_service_url, body)
 
-  local callout_opts = {
-    method = "POST",
-    headers = { ["Content-Type"] = "application/json" },
-    body = request_body_for_service,
-    timeout = 15000, -- Increased timeout for external validation service
-    connect_timeout = 5000,
-    ssl_verify = true,
-  }
+  -- 404: the service does not know this hash (e.g. it restarted); register again and retry once
+  if res and res.status == 404 then
+    ok, err = register_schema(conf, hash, xsd_schema_content, true)
+    if not ok then
+      return nil, err
+    end
+    res, err = remote_post(conf, conf.soap_validation_service_url, body)
+  end
+  return res, err
+end
 
-  local res, err = kong.http.client.go(conf.soap_validation_service_url, callout_opts)
+-- Delegates validation to the external service. Only used when
+-- `validation_mode` is `remote`.
+local function validate_remotely(conf, phase, soap_message_content)
+  local xsd_schema_content = get_xsd_content(conf)
+  if not xsd_schema_content or xsd_schema_content == "" then
+    kong.log.err("SOAPMessageValidation: No XSD schema content found. Cannot validate SOAP message.")
+    return false
+  end
+
+  if not conf.soap_validation_service_url then
+    kong.log.err("SOAPMessageValidation: 'soap_validation_service_url' is required when 'validation_mode' is 'remote'.")
+    return false
+  end
+
+  local res, err = send_for_validation(conf, soap_message_content, xsd_schema_content)
 
   local validation_succeeded = false
   if not res then
@@ -132,6 +357,24 @@ local function perform_validation(self, conf, phase)
     end
   end
 
+  return validation_succeeded
+end
+
+-- Main validation logic
+local function perform_validation(self, conf, phase)
+  local soap_message_content = get_message_content(conf, phase)
+  if not soap_message_content or soap_message_content == "" then
+    kong.log.debug("SOAPMessageValidation: No SOAP message content found for validation in phase '", phase, "'. Skipping.")
+    return true -- Continue processing
+  end
+
+  local validation_succeeded
+  if conf.validation_mode == "remote" then
+    validation_succeeded = validate_remotely(conf, phase, soap_message_content)
+  else
+    validation_succeeded = validate_locally(conf, phase, soap_message_content)
+  end
+
   if not validation_succeeded then
     if not conf.on_validation_failure_continue then
       return kong.response.exit(conf.on_validation_failure_status, conf.on_validation_failure_body)
@@ -144,6 +387,15 @@ end
 
 function SOAPMessageValidationHandler:access(conf)
   SOAPMessageValidationHandler.super.access(self)
+  -- Fetch or revalidate a URL schema here, where cosockets are available,
+  -- so that response-side validation can use the compiled schema.
+  if conf.validation_mode ~= "remote" and conf.xsd_source_type == "url"
+     and conf.message_source_type == "response_body" then
+    local _, err = refresh_url_schema(conf)
+    if err then
+      kong.log.err("SOAPMessageValidation: ", err)
+    end
+  end
   -- Only validate request body or shared context for request-side
   if conf.message_source_type == "request_body" or conf.message_source_type == "shared_context" then
     return perform_validation(self, conf, "access")
@@ -1,4 +1,5 @@
 local typedefs = require "kong.db.schema.typedefs"
+local apigee_typedefs = require "kong.plugins.apigee_common.typedefs"
 
 return {
   name = "soap-message-validation",
@@ -10,11 +11,45 @@ return {
       config = {
         type = "record",
         fields = {
+          {
+            validation_mode = {
+              type = "string",
+              default = "local",
+              enum = { "local", "remote" },
+              description = "Where validation runs: `local` validates in-process against a cached compiled schema; `remote` delegates to `soap_validation_service_url`.",
+            },
+          },
           {
             soap_validation_service_url = {
               type = "string",
-              required = true,
-              description = "The URL of the external service responsible for SOAP message validation.",
+              description = "Required if `validation_mode` is `remote`. The URL of the external service responsible for SOAP message validation.",
+            },
+          },
+          {
+            remote_schema_protocol = {
+              type = "string",
+              default = "inline",
+              enum = { "inline", "by_reference" },
+              description = "For `remote` mode: `inline` sends the XSD with every message; `by_reference` registers the XSD once under its SHA-256 hash and then sends only the hash with each message.",
+            },
+          },
+          {
+            soap_validation_schema_registration_url = {
+              type = "string",
+              description = "Optional: Where schemas are registered in `by_reference` mode. Defaults to `soap_validation_service_url` + `/schemas`.",
+            },
+          },
+          -- Used for both `url` schema fetches and the remote validator
+          { callout_timeout = apigee_typedefs.callout_timeout { default = 15000 } },
+          { callout_connect_timeout = apigee_typedefs.callout_connect_timeout },
+          { callout_keepalive_timeout = apigee_typedefs.callout_keepalive_timeout },
+          { callout_keepalive_pool_size = apigee_typedefs.callout_keepalive_pool_size },
+          {
+            remote_max_concurrency = {
+              type = "integer",
+              default = 64,
+              between = { 1, 10000 },
+              description = "For `remote` mode: maximum number of concurrent calls per worker to the validation service. Further calls wait for a free slot.",
             },
           },
           {
@@ -51,6 +86,14 @@ return {
               description = "Required if `xsd_source_type` is 'literal'. The actual XSD schema XML string.",
             },
           },
+          {
+            xsd_cache_ttl = {
+              type = "number",
+              default = 300,
+              between = { 0, 86400 },
+              description = "For `xsd_source_type` `url` in `local` mode: seconds before the XSD URL is revalidated with `If-None-Match`. The compiled schema is kept while the ETag is unchanged.",
+            },
+          },
           {
             validate_parts = {
               type = "array",
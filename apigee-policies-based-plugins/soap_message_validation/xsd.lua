@@ -0,0 +1,266 @@
+-- In-process XSD validation through libxml2 (LuaJIT FFI).
+--
+-- Schemas are compiled once with `compile` and the returned object is meant
+-- to be cached and reused: it owns the parsed schema and a validation
+-- context, both freed by the garbage collector.
+
+local ffi = require "ffi"
+
+local C = ffi.C
+
+-- Struct bodies can only be defined once per LuaJIT state; other modules
+-- binding libxml2 declare the same layouts, so tolerate a prior definition.
+pcall(ffi.cdef, [[
+struct _xmlError {
+  int domain;
+  int code;
+  char *message;
+  int level;
+  char *file;
+  int line;
+  char *str1;
+  char *str2;
+  char *str3;
+  int int1;
+  int int2;
+  void *ctxt;
+  void *node;
+};
+
+struct _xmlNs {
+  struct _xmlNs *next;
+  int type;
+  const unsigned char *href;
+  const unsigned char *prefix;
+};
+
+struct _xmlNode {
+  void *_private;
+  int type;
+  const unsigned char *name;
+  struct _xmlNode *children;
+  struct _xmlNode *last;
+  struct _xmlNode *parent;
+  struct _xmlNode *next;
+  struct _xmlNode *prev;
+  void *doc;
+  struct _xmlNs *ns;
+};
+]])
+
+ffi.cdef [[
+typedef unsigned char xmlChar;
+typedef struct _xmlError xmlError;
+typedef struct _xmlNs xmlNs;
+typedef struct _xmlNode xmlNode;
+
+typedef struct _xmlDoc xmlDoc;
+typedef struct _xmlSchema xmlSchema;
+typedef struct _xmlSchemaParserCtxt xmlSchemaParserCtxt;
+typedef struct _xmlSchemaValidCtxt xmlSchemaValidCtxt;
+typedef void (*xmlStructuredErrorFunc)(void *userData, xmlError *error);
+
+void xmlInitParser(void);
+void xmlResetLastError(void);
+xmlError *xmlGetLastError(void);
+
+xmlDoc *xmlReadMemory(const char *buffer, int size, const char *URL, const char *encoding, int options);
+void xmlFreeDoc(xmlDoc *doc);
+xmlNode *xmlDocGetRootElement(const xmlDoc *doc);
+
+xmlSchemaParserCtxt *xmlSchemaNewMemParserCtxt(const char *buffer, int size);
+void xmlSchemaSetParserStructuredErrors(xmlSchemaParserCtxt *ctxt, xmlStructuredErrorFunc serror, void *ctx);
+xmlSchema *xmlSchemaParse(xmlSchemaParserCtxt *ctxt);
+void xmlSchemaFreeParserCtxt(xmlSchemaParserCtxt *ctxt);
+void xmlSchemaFree(xmlSchema *schema);
+
+xmlSchemaValidCtxt *xmlSchemaNewValidCtxt(xmlSchema *schema);
+void xmlSchemaSetValidStructuredErrors(xmlSchemaValidCtxt *ctxt, xmlStructuredErrorFunc serror, void *ctx);
+void xmlSchemaFreeValidCtxt(xmlSchemaValidCtxt *ctxt);
+int xmlSchemaValidateDoc(xmlSchemaValidCtxt *ctxt, xmlDoc *doc);
+int xmlSchemaValidateOneElement(xmlSchemaValidCtxt *ctxt, xmlNode *elem);
+]]
+
+local XML_ELEMENT_NODE = 1
+
+-- Parse options: no network access, no entity substitution, quiet.
+local XML_PARSE_NOERROR = 32
+local XML_PARSE_NOWARNING = 64
+local XML_PARSE_NONET = 2048
+local PARSE_OPTIONS = XML_PARSE_NOERROR + XML_PARSE_NOWARNING + XML_PARSE_NONET
+
+local lib
+do
+  -- Runtime images often ship only the versioned shared object
+  for _, name in ipairs({ "xml2", "libxml2.so.2" }) do
+    local ok, loaded = pcall(ffi.load, name)
+    if ok then
+      lib = loaded
+      break
+    end
+  end
+  if not lib then
+    -- Fall back to a libxml2 already linked into the nginx binary
+    local found = pcall(function() return C.xmlSchemaNewValidCtxt end)
+    lib = found and C or nil
+  end
+end
+
+-- Errors are read back through xmlGetLastError; this handler only keeps
+-- libxml2 from printing them to stderr. Callers run with the JIT off, as
+-- required for C code that calls back into Lua.
+local silent_handler = lib and ffi.cast("xmlStructuredErrorFunc", function() end)
+
+if lib then
+  lib.xmlInitParser()
+end
+
+local function last_error(default)
+  local err = lib.xmlGetLastError()
+  if err ~= nil and err.message ~= nil then
+    return (ffi.string(err.message):gsub("%s+$", ""))
+  end
+  return default
+end
+
+local function local_name(node)
+  return ffi.string(node.name)
+end
+
+local function first_child_element(node, name)
+  local child = node.children
+  while child ~= nil do
+    if child.type == XML_ELEMENT_NODE and (not name or local_name(child) == name) then
+      return child
+    end
+    child = child.next
+  end
+  return nil
+end
+
+local Schema = {}
+Schema.__index = Schema
+
+local _M = {}
+
+--- Returns true when libxml2 could be loaded.
+function _M.available()
+  return lib ~= nil
+end
+
+--- Compiles an XSD document.
+-- @param xsd string XSD source.
+-- @return a schema object with a `validate` method, or nil and an error.
+function _M.compile(xsd)
+  if not lib then
+    return nil, "libxml2 is not available"
+  end
+
+  lib.xmlResetLastError()
+  local parser_ctxt = lib.xmlSchemaNewMemParserCtxt(xsd, #xsd)
+  if parser_ctxt == nil then
+    return nil, "could not create schema parser context"
+  end
+  lib.xmlSchemaSetParserStructuredErrors(parser_ctxt, silent_handler, nil)
+
+  local schema = lib.xmlSchemaParse(parser_ctxt)
+  lib.xmlSchemaFreeParserCtxt(parser_ctxt)
+  if schema == nil then
+    return nil, last_error("invalid XSD schema")
+  end
+  schema = ffi.gc(schema, lib.xmlSchemaFree)
+
+  local valid_ctxt = lib.xmlSchemaNewValidCtxt(schema)
+  if valid_ctxt == nil then
+    return nil, "could not create schema validation context"
+  end
+  valid_ctxt = ffi.gc(valid_ctxt, lib.xmlSchemaFreeValidCtxt)
+  lib.xmlSchemaSetValidStructuredErrors(valid_ctxt, silent_handler, nil)
+
+  return setmetatable({
+    schema = schema, -- Keeps the schema alive as long as the context
+    valid_ctxt = valid_ctxt,
+  }, Schema)
+end
+
+-- Collects the elements to validate for the requested SOAP parts. Header and
+-- Body contents are validated element by element, Fault is the Body's Fault.
+local function collect_part_elements(root, parts)
+  local elements = {}
+  for _, part in ipairs(parts) do
+    local container
+    if part == "Header" or part == "Body" then
+      container = first_child_element(root, part)
+    elseif part == "Fault" then
+      local body = first_child_element(root, "Body")
+      local fault = body and first_child_element(body, "Fault")
+      if fault then
+        elements[#elements + 1] = fault
+      end
+    end
+
+    if container then
+      local child = container.children
+      while child ~= nil do
+        if child.type == XML_ELEMENT_NODE then
+          elements[#elements + 1] = child
+        end
+        child = child.next
+      end
+    end
+  end
+  return elements
+end
+
+--- Validates an XML message against the schema.
+-- @param message string The XML (SOAP) message.
+-- @param parts table|nil SOAP parts to validate (`Envelope`, `Header`,
+--   `Body`, `Fault`); nil, empty or containing `Envelope` validates the whole document.
+-- @return true, or nil and a description of the first validation error.
+function Schema:validate(message, parts)
+  lib.xmlResetLastError()
+  local doc = lib.xmlReadMemory(message, #message, "message.xml", nil, PARSE_OPTIONS)
+  if doc == nil then
+    return nil, "malformed XML: " .. last_error("could not parse message")
+  end
+
+  local whole_document = not parts or #parts == 0
+  if not whole_document then
+    for _, part in ipairs(parts) do
+      if part == "Envelope" then
+        whole_document = true
+        break
+      end
+    end
+  end
+
+  local rc
+  if whole_document then
+    rc = lib.xmlSchemaValidateDoc(self.valid_ctxt, doc)
+  else
+    local root = lib.xmlDocGetRootElement(doc)
+    rc = 0
+    if root ~= nil then
+      for _, element in ipairs(collect_part_elements(root, parts)) do
+        rc = lib.xmlSchemaValidateOneElement(self.valid_ctxt, element)
+        if rc ~= 0 then
+          break
+        end
+      end
+    end
+  end
+
+  local err = rc ~= 0 and last_error("schema validation failed") or nil
+  lib.xmlFreeDoc(doc)
+
+  if err then
+    return nil, err
+  end
+  return true
+end
+
+-- libxml2 may call back into Lua (the error handler) from these functions
+jit.off(_M.compile)
+jit.off(Schema.validate)
+
+return _M
@@ -1,6 +1,9 @@
 local BasePlugin = require "kong.plugins.base_plugin"
 local cjson = require "cjson"
 local fun = require "kong.tools.functional"
+local request_context = require "kong.plugins.apigee_common.request_context"
+local callout = require "kong.plugins.apigee_common.callout"
+local spool = require "kong.plugins.apigee_common.spool"
 
 -- Helper to safely get value from JSON body using simple dot notation
 local function get_json_value(json_table, path)
@@ -28,9 +31,9 @@ end
 local function get_value_from_source(source_type, source_name, phase)
   local value = nil
   if source_type == "header" then
-    value = kong.request.get_header(source_name)
+    value = request_context.get_header(source_name)
   elseif source_type == "query" then
-    value = kong.request.get_query_arg(source_name)
+    value = request_context.get_query_arg(source_name)
   elseif source_type == "path" then
     value = kong.request.get_uri()
   elseif source_type == "body" then
@@ -78,6 +81,34 @@ function StatisticsCollectorHandler:new()
   return StatisticsCollectorHandler.super.new(self, "statistics-collector")
 end
 
+local SPOOL_NAME = "statistics-collector"
+spool.register(SPOOL_NAME, spool.http_sender)
+
+function StatisticsCollectorHandler:init_worker()
+  StatisticsCollectorHandler.super.init_worker(self)
+  spool.resume(SPOOL_NAME)
+end
+
+local function send_statistics(premature, url, callout_opts, conf)
+  if conf.spool_enabled then
+    local ok, err = spool.deliver(SPOOL_NAME, { url = url, opts = callout_opts }, conf)
+    if not ok then
+      kong.log.err("StatisticsCollector: Failed to send statistics to '", url, "'. Error: ", err)
+    end
+    return
+  end
+
+  local res, err = callout.request(url, callout_opts)
+
+  if not res then
+    kong.log.err("StatisticsCollector: Failed to send statistics to '", url, "'. Error: ", err)
+  elseif res.status >= 400 then
+    kong.log.warn("StatisticsCollector: Statistics service '", url, "' returned error status: ", res.status, " Body: ", res.body)
+  else
+    kong.log.debug("StatisticsCollector: Successfully sent statistics to '", url, "'.")
+  end
+end
+
 function StatisticsCollectorHandler:log(conf)
   StatisticsCollectorHandler.super.log(self)
 
@@ -103,18 +134,16 @@ function StatisticsCollectorHandler:log(conf)
     headers = conf.headers,
     body = cjson.encode(collected_statistics),
     timeout = conf.timeout,
-    connect_timeout = 5000, -- Hardcoded, could be configurable
-    ssl_verify = true,      -- Hardcoded, could be configurable
+    connect_timeout = conf.callout_connect_timeout,
+    ssl_verify = true,
+    keepalive_timeout = conf.callout_keepalive_timeout,
+    keepalive_pool_size = conf.callout_keepalive_pool_size,
   }
 
-  local res, err = kong.http.client.go(conf.collection_service_url, callout_opts)
-
-  if not res then
-    kong.log.err("StatisticsCollector: Failed to send statistics to '", conf.collection_service_url, "'. Error: ", err)
-  elseif res.status >= 400 then
-    kong.log.warn("StatisticsCollector: Statistics service '", conf.collection_service_url, "' returned error status: ", res.status, " Body: ", res.body)
-  else
-    kong.log.debug("StatisticsCollector: Successfully sent statistics to '", conf.collection_service_url, "'.")
+  -- Cosockets are not available in the log phase
+  local ok, err = ngx.timer.at(0, send_statistics, conf.collection_service_url, callout_opts, conf)
+  if not ok then
+    kong.log.err("StatisticsCollector: Failed to schedule statistics delivery: ", err)
   end
 end
 
@@ -1,6 +1,9 @@
 local BasePlugin = require "kong.plugins.base_plugin"
 local cjson = require "cjson"
 local fun = require "kong.tools.functional"
+local request_context = require "kong.plugins.apigee_common.request_context"
+local callout = require "kong.plugins.apigee_common.callout"
+local spool = require "kong.plugins.apigee_common.spool"
 
 -- Helper to safely get value from JSON body using simple dot notation
 local function get_json_value(json_table, path)
@@ -27,9 +30,9 @@ end
 local function get_value_for_trace_point(source_type, source_name, phase)
   local value = nil
   if source_type == "header" then
-    value = kong.request.get_header(source_name)
+    value = request_context.get_header(source_name)
   elseif source_type == "query" then
-    value = kong.request.get_query_arg(source_name)
+    value = request_context.get_query_arg(source_name)
   elseif source_type == "path" then
     value = kong.request.get_uri()
   elseif source_type == "body" then
@@ -119,6 +122,34 @@ function TraceCaptureHandler:body_filter(conf)
   return capture_and_store_data(conf, "body_filter")
 end
 
+local SPOOL_NAME = "trace-capture"
+spool.register(SPOOL_NAME, spool.http_sender)
+
+function TraceCaptureHandler:init_worker()
+  TraceCaptureHandler.super.init_worker(self)
+  spool.resume(SPOOL_NAME)
+end
+
+local function send_trace(premature, url, callout_opts, conf)
+  if conf.spool_enabled then
+    local ok, err = spool.deliver(SPOOL_NAME, { url = url, opts = callout_opts }, conf)
+    if not ok then
+      kong.log.err("TraceCapture: Failed to send trace data to '", url, "'. Error: ", err)
+    end
+    return
+  end
+
+  local res, err = callout.request(url, callout_opts)
+
+  if not res then
+    kong.log.err("TraceCapture: Failed to send trace data to '", url, "'. Error: ", err)
+  elseif res.status >= 400 then
+    kong.log.warn("TraceCapture: Logger service '", url, "' returned error status: ", res.status, " Body: ", res.body)
+  else
+    kong.log.debug("TraceCapture: Successfully sent trace data to '", url, "'.")
+  end
+end
+
 function TraceCaptureHandler:log(conf)
   TraceCaptureHandler.super.log(self)
 
@@ -131,18 +162,16 @@ function TraceCaptureHandler:log(conf)
       headers = conf.headers,
       body = cjson.encode(kong.ctx.shared.trace_capture_data_for_logger),
       timeout = conf.timeout,
-      connect_timeout = 5000, -- Default
-      ssl_verify = true,      -- Default
+      connect_timeout = conf.callout_connect_timeout,
+      ssl_verify = true,
+      keepalive_timeout = conf.callout_keepalive_timeout,
+      keepalive_pool_size = conf.callout_keepalive_pool_size,
     }
 
-    local res, err = kong.http.client.go(conf.external_logger_url, callout_opts)
-
-    if not res then
-      kong.log.err("TraceCapture: Failed to send trace data to '", conf.external_logger_url, "'. Error: ", err)
-    elseif res.status >= 400 then
-      kong.log.warn("TraceCapture: Logger service '", conf.external_logger_url, "' returned error status: ", res.status, " Body: ", res.body)
-    else
-      kong.log.debug("TraceCapture: Successfully sent trace data to '", conf.external_logger_url, "'.")
+    -- Cosockets are not available in the log phase
+    local ok, err = ngx.timer.at(0, send_trace, conf.external_logger_url, callout_opts, conf)
+    if not ok then
+      kong.log.err("TraceCapture: Failed to schedule trace delivery: ", err)
     end
   end
 end
@@ -1,4 +1,5 @@
 local typedefs = require "kong.db.schema.typedefs"
+local apigee_typedefs = require "kong.plugins.apigee_common.typedefs"
 
 return {
   name = "trace-capture",
@@ -85,6 +86,32 @@ return {
               description = "If `true`, request processing (and external logging in 'log' phase) will continue even if an error occurs during data retrieval or external call. If `false`, it might terminate the request (in 'access' phase) or just log an error (in 'log' phase).",
             },
           },
+          { callout_connect_timeout = apigee_typedefs.callout_connect_timeout },
+          { callout_keepalive_timeout = apigee_typedefs.callout_keepalive_timeout },
+          { callout_keepalive_pool_size = apigee_typedefs.callout_keepalive_pool_size },
+          {
+            spool_enabled = {
+              type = "boolean",
+              default = true,
+              description = "If `true`, traces that cannot be delivered (transport errors, 429 and 5xx responses) are written to a spool on local disk under the Kong prefix and replayed in the background once the endpoint recovers, instead of being dropped.",
+            },
+          },
+          {
+            spool_max_bytes = {
+              type = "integer",
+              default = 104857600,
+              between = { 1048576, 10737418240 },
+              description = "Maximum size in bytes of each worker's spool. When it is exceeded, the oldest spooled records are discarded.",
+            },
+          },
+          {
+            spool_drain_rate = {
+              type = "integer",
+              default = 100,
+              between = { 1, 100000 },
+              description = "Maximum number of spooled records per second each worker replays once the endpoint recovers.",
+            },
+          },
         },
       },
     },
@@ -1,6 +1,9 @@
 local BasePlugin = require "kong.plugins.base_plugin"
 local cjson = require "cjson"
 local fun = require "kong.tools.functional"
+local scanner = require "kong.plugins.xml-threat-protection.scanner"
+local request_context = require "kong.plugins.apigee_common.request_context"
+local callout = require "kong.plugins.apigee_common.callout"
 
 -- Helper to safely get value from JSON body using simple dot notation
 local function get_json_value(json_table, path)
@@ -27,9 +30,9 @@ end
 local function get_value_from_source(source_type, source_name, phase)
   local value = nil
   if source_type == "header" then
-    value = kong.request.get_header(source_name)
+    value = request_context.get_header(source_name)
   elseif source_type == "query" then
-    value = kong.request.get_query_arg(source_name)
+    value = request_context.get_query_arg(source_name)
   elseif source_type == "body" then
     local raw_body = (phase == "access" and kong.request.get_raw_body()) or (phase == "body_filter" and kong.response.get_raw_body())
     if raw_body then
@@ -40,6 +43,8 @@ local function get_value_from_source(source_type, source_name, phase)
         kong.log.warn("XMLThreatProtection: Could not decode body as JSON for source '", source_name, "'.")
       end
     end
+  elseif source_type == "request_body" then
+    value = kong.request.get_raw_body()
   elseif source_type == "shared_context" then
     value = kong.ctx.shared[source_name]
   elseif source_type == "literal" then
@@ -48,22 +53,9 @@ local function get_value_from_source(source_type, source_name, phase)
   return value and tostring(value) or nil
 end
 
-local XMLThreatProtectionHandler = BasePlugin:extend("xml-threat-protection")
-
-function XMLThreatProtectionHandler:new()
-  return XMLThreatProtectionHandler.super.new(self, "xml-threat-protection")
-end
-
-function XMLThreatProtectionHandler:access(conf)
-  XMLThreatProtectionHandler.super.access(self)
-
-  local xml_message_content = get_value_from_source(conf.message_source_type, conf.message_source_name, "access")
-
-  if not xml_message_content or xml_message_content == "" then
-    kong.log.debug("XMLThreatProtection: No XML message content found from source '", conf.message_source_type, "'. Skipping threat protection.")
-    return true -- Continue processing
-  end
-
+-- Delegates the checks to the external XML threat protection service.
+-- Only used when `validation_mode` is `remote`.
+local function validate_remotely(conf, xml_message_content)
   local request_body_for_service = {
     xml_message = xml_message_content,
     max_element_depth = conf.max_element_depth,
@@ -78,12 +70,14 @@ function XMLThreatProtectionHandler:access(conf)
     method = "POST",
     headers = { ["Content-Type"] = "application/json" },
     body = cjson.encode(request_body_for_service),
-    timeout = 15000, -- Increased timeout for external validation service
-    connect_timeout = 5000,
+    timeout = conf.callout_timeout,
+    connect_timeout = conf.callout_connect_timeout,
     ssl_verify = true,
+    keepalive_timeout = conf.callout_keepalive_timeout,
+    keepalive_pool_size = conf.callout_keepalive_pool_size,
   }
 
-  local res, err = kong.http.client.go(conf.xml_threat_protection_service_url, callout_opts)
+  local res, err = callout.request(conf.xml_threat_protection_service_url, callout_opts)
 
   local validation_succeeded = false
   if not res then
@@ -102,6 +96,38 @@ function XMLThreatProtectionHandler:access(conf)
     end
   end
 
+  return validation_succeeded
+end
+
+local XMLThreatProtectionHandler = BasePlugin:extend("xml-threat-protection")
+
+function XMLThreatProtectionHandler:new()
+  return XMLThreatProtectionHandler.super.new(self, "xml-threat-protection")
+end
+
+function XMLThreatProtectionHandler:access(conf)
+  XMLThreatProtectionHandler.super.access(self)
+
+  local xml_message_content = get_value_from_source(conf.message_source_type, conf.message_source_name, "access")
+
+  if not xml_message_content or xml_message_content == "" then
+    kong.log.debug("XMLThreatProtection: No XML message content found from source '", conf.message_source_type, "'. Skipping threat protection.")
+    return true -- Continue processing
+  end
+
+  local validation_succeeded
+  if conf.validation_mode == "remote" then
+    validation_succeeded = validate_remotely(conf, xml_message_content)
+  else
+    local ok, violation = scanner.scan(xml_message_content, conf)
+    validation_succeeded = ok == true
+    if validation_succeeded then
+      kong.log.debug("XMLThreatProtection: XML message passed threat protection.")
+    else
+      kong.log.warn("XMLThreatProtection: XML threat protection violation detected. Details: ", violation)
+    end
+  end
+
   if not validation_succeeded then
     if not conf.on_violation_continue then
       return kong.response.exit(conf.on_violation_status, conf.on_violation_body)
@@ -0,0 +1,370 @@
+-- Single-pass, SAX-style XML scanner used to enforce XML threat protection
+-- limits in-process. The scanner walks the message once, never builds a DOM,
+-- and stops at the first violation it encounters.
+
+local find = string.find
+local sub = string.sub
+local byte = string.byte
+local gmatch = string.gmatch
+local concat = table.concat
+
+local BYTE_LT = byte("<")
+local BYTE_GT = byte(">")
+local BYTE_SLASH = byte("/")
+local BYTE_BANG = byte("!")
+local BYTE_QUESTION = byte("?")
+local BYTE_HASH = byte("#")
+
+-- References to these entities never expand to markup and are not counted
+local PREDEFINED_ENTITIES = {
+  lt = true,
+  gt = true,
+  amp = true,
+  apos = true,
+  quot = true,
+}
+
+local _M = {}
+
+-- A limit of nil or 0 means "unlimited"
+local function effective_limit(value)
+  if value and value > 0 then
+    return value
+  end
+  return nil
+end
+
+-- Marks an entity whose expansion count is being computed
+local IN_PROGRESS = -1
+
+local function is_counted_reference(kind, name)
+  return kind == "%" or (byte(name, 1) ~= BYTE_HASH and not PREDEFINED_ENTITIES[name])
+end
+
+-- Returns the number of expansions one reference to an entity causes: the
+-- reference itself plus, transitively, the references in its replacement
+-- text. Counts are memoized per entity, so a "billion laughs" DTD is
+-- evaluated in time linear to its size. Parameter entities are keyed as
+-- `%name`; undeclared and external entities count as one expansion.
+local function expansion_count(state, key)
+  local counts = state.expansions
+  local count = counts[key]
+  if count == IN_PROGRESS then
+    return nil, "Malformed XML: recursive reference to entity '" .. key .. "'"
+  elseif count then
+    return count
+  end
+
+  local value = state.entities[key]
+  if type(value) ~= "string" then
+    counts[key] = 1
+    return 1
+  end
+
+  counts[key] = IN_PROGRESS
+  count = 1
+  for kind, name in gmatch(value, "([&%%])([^%s;&%%<]+);") do
+    if is_counted_reference(kind, name) then
+      local nested, err = expansion_count(state, kind == "%" and "%" .. name or name)
+      if not nested then
+        return nil, err
+      end
+      count = count + nested
+    end
+  end
+  counts[key] = count
+  return count
+end
+
+local function add_expansions(state, key)
+  local count, err = expansion_count(state, key)
+  if not count then
+    return nil, err
+  end
+  state.entity_count = state.entity_count + count
+  if state.entity_count > state.max_entity_expansion then
+    return nil, "Entity expansion count exceeds limit of " .. state.max_entity_expansion
+  end
+  return true
+end
+
+-- Counts the expansions of general entity references (`&name;`) between
+-- `from` and `to`. `state.next_amp` caches the position of the next '&' in
+-- the whole message, so text without references is skipped without
+-- rescanning the document.
+local function count_entity_references(xml, from, to, state)
+  if not state.max_entity_expansion then
+    return true
+  end
+  local next_amp = state.next_amp
+  if next_amp == false or (next_amp and next_amp > to) then
+    return true
+  end
+  if not next_amp or next_amp < from then
+    next_amp = find(xml, "&", from, true)
+  end
+
+  while next_amp and next_amp <= to do
+    local _, ref_end, name = find(xml, "^&([^%s;&<]+);", next_amp)
+    if ref_end and ref_end <= to and is_counted_reference("&", name) then
+      local ok, err = add_expansions(state, name)
+      if not ok then
+        return nil, err
+      end
+    end
+    next_amp = find(xml, "&", next_amp + 1, true)
+  end
+
+  state.next_amp = next_amp or false
+  return true
+end
+
+-- Reads the `<!ENTITY>` declarations of a DOCTYPE declaration into
+-- `state.entities` (name -> replacement text, or true for external
+-- entities), then counts the expansions of the references made outside
+-- them, such as parameter entity references in the internal subset.
+-- References inside replacement text only count when the entity is used.
+local function count_dtd_references(dtd, state)
+  if not state.max_entity_expansion then
+    return true
+  end
+  local entities = state.entities
+  local outside = {}
+  local pos = 1
+  while true do
+    local decl = find(dtd, "<!ENTITY", pos, true)
+    outside[#outside + 1] = sub(dtd, pos, (decl or 0) - 1)
+    if not decl then
+      break
+    end
+
+    local _, name_end, percent, name = find(dtd, "^%s+(%%?)%s*([^%s\"'>]+)", decl + 8)
+    if not name_end then
+      return nil, "Malformed XML: invalid entity declaration"
+    end
+    local key = percent .. name
+    local _, quote_pos, quote = find(dtd, "^%s+([\"'])", name_end + 1)
+    local value = true
+    if quote_pos then
+      local value_end = find(dtd, quote, quote_pos + 1, true)
+      if not value_end then
+        return nil, "Malformed XML: unterminated value for entity '" .. key .. "'"
+      end
+      value = sub(dtd, quote_pos + 1, value_end - 1)
+      pos = value_end + 1
+    else
+      pos = name_end + 1
+    end
+    -- The first declaration of an entity is binding
+    if entities[key] == nil then
+      entities[key] = value
+    end
+  end
+
+  for kind, name in gmatch(concat(outside), "([&%%])([^%s;&%%<]+);") do
+    if is_counted_reference(kind, name) then
+      local ok, err = add_expansions(state, kind == "%" and "%" .. name or name)
+      if not ok then
+        return nil, err
+      end
+    end
+  end
+  return true
+end
+
+-- Skips a `<!...>` construct starting at `lt`, returning the position after it
+local function skip_declaration(xml, lt, state)
+  if sub(xml, lt + 2, lt + 3) == "--" then
+    local _, close = find(xml, "-->", lt + 4, true)
+    if not close then
+      return nil, "Malformed XML: unterminated comment"
+    end
+    return close + 1
+  end
+
+  if sub(xml, lt + 2, lt + 8) == "[CDATA[" then
+    local _, close = find(xml, "]]>", lt + 9, true)
+    if not close then
+      return nil, "Malformed XML: unterminated CDATA section"
+    end
+    return close + 1
+  end
+
+  if sub(xml, lt + 2, lt + 8) == "DOCTYPE" then
+    local first_gt = find(xml, ">", lt + 9, true)
+    local bracket = find(xml, "[", lt + 9, true)
+    local close
+    if bracket and first_gt and bracket < first_gt then
+      local _, subset_end = find(xml, "]%s*>", bracket + 1)
+      close = subset_end
+    else
+      close = first_gt
+    end
+    if not close then
+      return nil, "Malformed XML: unterminated DOCTYPE declaration"
+    end
+    local ok, err = count_dtd_references(sub(xml, lt, close), state)
+    if not ok then
+      return nil, err
+    end
+    return close + 1
+  end
+
+  return nil, "Malformed XML: unexpected markup declaration"
+end
+
+--- Scans an XML document and enforces the configured structural limits.
+-- @param xml string The XML message.
+-- @param limits table Any of `max_element_depth`, `max_element_count`,
+--   `max_attribute_count`, `max_attribute_name_length`,
+--   `max_attribute_value_length` and `max_entity_expansion`, the number of
+--   entity expansions, counted transitively through the DTD's declarations;
+--   nil or 0 disables a limit.
+-- @return true when the message is within all limits, otherwise nil and a
+--   description of the first violation found.
+function _M.scan(xml, limits)
+  local max_element_depth = effective_limit(limits.max_element_depth)
+  local max_element_count = effective_limit(limits.max_element_count)
+  local max_attribute_count = effective_limit(limits.max_attribute_count)
+  local max_attribute_name_length = effective_limit(limits.max_attribute_name_length)
+  local max_attribute_value_length = effective_limit(limits.max_attribute_value_length)
+
+  local state = {
+    entity_count = 0,
+    max_entity_expansion = effective_limit(limits.max_entity_expansion),
+    entities = {},
+    expansions = {},
+    next_amp = nil,
+  }
+
+  local len = #xml
+  local pos = 1
+  local depth = 0
+  local element_count = 0
+  local open_elements = {}
+  local ok, err
+
+  while pos <= len do
+    local lt = find(xml, "<", pos, true)
+
+    -- Character data up to the next markup
+    local text_end = (lt or (len + 1)) - 1
+    if text_end >= pos then
+      ok, err = count_entity_references(xml, pos, text_end, state)
+      if not ok then
+        return nil, err
+      end
+    end
+    if not lt then
+      break
+    end
+
+    local marker = byte(xml, lt + 1)
+
+    if marker == BYTE_QUESTION then
+      local _, close = find(xml, "?>", lt + 2, true)
+      if not close then
+        return nil, "Malformed XML: unterminated processing instruction"
+      end
+      pos = close + 1
+
+    elseif marker == BYTE_BANG then
+      pos, err = skip_declaration(xml, lt, state)
+      if not pos then
+        return nil, err
+      end
+
+    elseif marker == BYTE_SLASH then
+      local close = find(xml, ">", lt + 2, true)
+      if not close then
+        return nil, "Malformed XML: unterminated end tag"
+      end
+      local name = sub(xml, lt + 2, close - 1):match("^([^%s]+)%s*$")
+      if depth == 0 or open_elements[depth] ~= name then
+        return nil, "Malformed XML: unexpected end tag '" .. tostring(name) .. "'"
+      end
+      open_elements[depth] = nil
+      depth = depth - 1
+      pos = close + 1
+
+    else
+      local _, name_end, name = find(xml, "^([^%s/>]+)", lt + 1)
+      if not name_end then
+        return nil, "Malformed XML: invalid start tag"
+      end
+
+      element_count = element_count + 1
+      if max_element_count and element_count > max_element_count then
+        return nil, "Element count exceeds limit of " .. max_element_count
+      end
+
+      local p = name_end + 1
+      local attribute_count = 0
+      local self_closing
+
+      while true do
+        local _, ws_end = find(xml, "^%s*", p)
+        p = ws_end + 1
+        local c = byte(xml, p)
+
+        if c == BYTE_GT then
+          self_closing = false
+          p = p + 1
+          break
+        elseif c == BYTE_SLASH and byte(xml, p + 1) == BYTE_GT then
+          self_closing = true
+          p = p + 2
+          break
+        elseif not c then
+          return nil, "Malformed XML: unterminated start tag '" .. name .. "'"
+        end
+
+        local _, value_start, attr_name, quote = find(xml, "^([^%s=/>]+)%s*=%s*([\"'])", p)
+        if not value_start then
+          return nil, "Malformed XML: invalid attribute in element '" .. name .. "'"
+        end
+
+        attribute_count = attribute_count + 1
+        if max_attribute_count and attribute_count > max_attribute_count then
+          return nil, "Attribute count of element '" .. name .. "' exceeds limit of " .. max_attribute_count
+        end
+        if max_attribute_name_length and #attr_name > max_attribute_name_length then
+          return nil, "Attribute name length exceeds limit of " .. max_attribute_name_length
+        end
+
+        local value_end = find(xml, quote, value_start + 1, true)
+        if not value_end then
+          return nil, "Malformed XML: unterminated value for attribute '" .. attr_name .. "'"
+        end
+        if max_attribute_value_length and (value_end - value_start - 1) > max_attribute_value_length then
+          return nil, "Attribute value length exceeds limit of " .. max_attribute_value_length
+        end
+        if value_end - value_start > 1 then
+          ok, err = count_entity_references(xml, value_start + 1, value_end - 1, state)
+          if not ok then
+            return nil, err
+          end
+        end
+
+        p = value_end + 1
+      end
+
+      if not self_closing then
+        depth = depth + 1
+        if max_element_depth and depth > max_element_depth then
+          return nil, "Element depth exceeds limit of " .. max_element_depth
+        end
+        open_elements[depth] = name
+      end
+      pos = p
+    end
+  end
+
+  if depth > 0 then
+    return nil, "Malformed XML: element '" .. open_elements[depth] .. "' is not closed"
+  end
+
+  return true
+end
+
+return _M
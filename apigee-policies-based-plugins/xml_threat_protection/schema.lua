@@ -1,4 +1,5 @@
 local typedefs = require "kong.db.schema.typedefs"
+local apigee_typedefs = require "kong.plugins.apigee_common.typedefs"
 
 return {
   name = "xml-threat-protection",
@@ -10,11 +11,18 @@ return {
       config = {
         type = "record",
         fields = {
+          {
+            validation_mode = {
+              type = "string",
+              default = "local",
+              enum = { "local", "remote" },
+              description = "Where the XML checks run: `local` scans the message in-process in a single pass; `remote` delegates to `xml_threat_protection_service_url`.",
+            },
+          },
           {
             xml_threat_protection_service_url = {
               type = "string",
-              required = true,
-              description = "The URL of the external service responsible for XML threat protection.",
+              description = "Required if `validation_mode` is `remote`. The URL of the external service responsible for XML threat protection.",
             },
           },
           {
@@ -95,8 +103,20 @@ return {
               description = "If `true`, request processing will continue even if an XML threat protection violation is detected. If `false`, the request will be terminated.",
             },
           },
+          { callout_timeout = apigee_typedefs.callout_timeout { default = 15000 } },
+          { callout_connect_timeout = apigee_typedefs.callout_connect_timeout },
+          { callout_keepalive_timeout = apigee_typedefs.callout_keepalive_timeout },
+          { callout_keepalive_pool_size = apigee_typedefs.callout_keepalive_pool_size },
         },
       },
     },
   },
+  entity_checks = {
+    {
+      conditional = {
+        if_field = "config.validation_mode", if_match = { eq = "remote" },
+        then_field = "config.xml_threat_protection_service_url", then_match = { required = true },
+      },
+    },
+  },
 }
@@ -0,0 +1,69 @@
+local scanner = require "kong.plugins.xml-threat-protection.scanner"
+
+describe("xml-threat-protection scanner", function()
+
+  it("accepts a well-formed document within limits", function()
+    local xml = '<?xml version="1.0"?><a x="1"><b>hi &amp; bye</b><c/><!-- note --><![CDATA[<raw>]]></a>'
+    assert.is_true(scanner.scan(xml, { max_element_depth = 2, max_element_count = 3 }))
+  end)
+
+  it("treats 0 as unlimited", function()
+    assert.is_true(scanner.scan("<a><b><c/></b></a>", { max_element_depth = 0, max_element_count = 0 }))
+  end)
+
+  it("enforces max_element_depth", function()
+    local ok, err = scanner.scan("<a><b><c></c></b></a>", { max_element_depth = 2 })
+    assert.is_nil(ok)
+    assert.matches("depth", err)
+  end)
+
+  it("enforces max_element_count", function()
+    local ok, err = scanner.scan("<a><b/><b/><b/></a>", { max_element_count = 3 })
+    assert.is_nil(ok)
+    assert.matches("Element count", err)
+  end)
+
+  it("enforces attribute count and lengths", function()
+    assert.is_nil(scanner.scan('<a x="1" y="2" z="3"/>', { max_attribute_count = 2 }))
+    assert.is_nil(scanner.scan('<a xyz="1"/>', { max_attribute_name_length = 2 }))
+    assert.is_nil(scanner.scan("<a x='1234'/>", { max_attribute_value_length = 3 }))
+  end)
+
+  it("counts entity references including the DOCTYPE internal subset", function()
+    local bomb = '<!DOCTYPE lolz [<!ENTITY lol "lol"><!ENTITY lol2 "&lol;&lol;&lol;">]><a>&lol2;</a>'
+    local ok, err = scanner.scan(bomb, { max_entity_expansion = 3 })
+    assert.is_nil(ok)
+    assert.matches("Entity expansion", err)
+  end)
+
+  it("counts the transitive expansions of a billion laughs DTD", function()
+    local decls = { '<!ENTITY lol "lol">' }
+    for i = 2, 9 do
+      local refs = string.rep("&lol" .. (i > 2 and (i - 1) or "") .. ";", 10)
+      decls[#decls + 1] = "<!ENTITY lol" .. i .. ' "' .. refs .. '">'
+    end
+    local bomb = "<!DOCTYPE lolz [" .. table.concat(decls) .. "]><lolz>&lol9;</lolz>"
+    -- 80 references in the DTD, over 10^8 expansions
+    local ok, err = scanner.scan(bomb, { max_entity_expansion = 1000 })
+    assert.is_nil(ok)
+    assert.matches("Entity expansion", err)
+    assert.is_true(scanner.scan(bomb:gsub("&lol9;", "&lol2;"), { max_entity_expansion = 1000 }))
+  end)
+
+  it("rejects recursive entity declarations", function()
+    local xml = '<!DOCTYPE a [<!ENTITY x "&y;"><!ENTITY y "&x;">]><a>&x;</a>'
+    local ok, err = scanner.scan(xml, { max_entity_expansion = 100 })
+    assert.is_nil(ok)
+    assert.matches("recursive", err)
+  end)
+
+  it("does not count predefined entities or character references", function()
+    assert.is_true(scanner.scan("<a>&lt;&gt;&amp;&#38;&#x26;</a>", { max_entity_expansion = 1 }))
+  end)
+
+  it("rejects malformed documents", function()
+    assert.is_nil(scanner.scan("<a><b></a>", {}))
+    assert.is_nil(scanner.scan('<a x="1>', {}))
+    assert.is_nil(scanner.scan("<a>", {}))
+  end)
+end)
@@ -0,0 +1,56 @@
+-- Throughput benchmark for the streaming XML to JSON converter.
+--
+-- Usage (from the plugin directory, after `luarocks make` has installed it):
+--   resty bench/converter_bench.lua [size_mb] [chunk_kb]
+
+local converter = require "kong.plugins.xml-to-json.converter"
+
+local size_mb = tonumber(arg and arg[1]) or 10
+local chunk_size = (tonumber(arg and arg[2]) or 64) * 1024
+
+-- Builds a SOAP response with repeated records until it reaches `bytes`
+local function build_soap_document(bytes)
+  local parts = {
+    '<?xml version="1.0" encoding="UTF-8"?>',
+    '<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"><soap:Body>',
+    '<m:GetOrdersResponse xmlns:m="http://www.example.com/orders">',
+  }
+  local record = '<m:Order id="%d" status="shipped"><m:Customer>Jane &amp; John Doe</m:Customer>'
+              .. '<m:Total currency="EUR">%d.99</m:Total><m:Items><m:Item>A</m:Item><m:Item>B</m:Item></m:Items></m:Order>'
+  local size, i = 0, 0
+  while size < bytes do
+    i = i + 1
+    local piece = string.format(record, i, i)
+    parts[#parts + 1] = piece
+    size = size + #piece
+  end
+  parts[#parts + 1] = "</m:GetOrdersResponse></soap:Body></soap:Envelope>"
+  return table.concat(parts)
+end
+
+local opts = {
+  strip_namespaces = true,
+  attribute_prefix = "@",
+  text_node_name = "#text",
+  arrays_key_ending = "",
+}
+
+local xml = build_soap_document(size_mb * 1024 * 1024)
+
+collectgarbage("collect")
+local start = os.clock()
+
+local stream = converter.new(opts)
+local out_bytes = 0
+for offset = 1, #xml, chunk_size do
+  local json = assert(stream:feed(xml:sub(offset, offset + chunk_size - 1)))
+  out_bytes = out_bytes + #json
+end
+out_bytes = out_bytes + #assert(stream:finish())
+
+local elapsed = os.clock() - start
+local mb = #xml / (1024 * 1024)
+
+print(string.format("input: %.2f MB, output: %.2f MB, chunk: %d KB", mb, out_bytes / (1024 * 1024), chunk_size / 1024))
+print(string.format("time: %.3f s, throughput: %.2f MB/s", elapsed, mb / elapsed))
+print(string.format("lua memory after run: %.2f MB", collectgarbage("count") / 1024))
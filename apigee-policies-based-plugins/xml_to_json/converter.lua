@@ -0,0 +1,513 @@
+-- Streaming XML to JSON converter.
+--
+-- XML is fed in arbitrary chunks and parsed as it arrives, so only the last
+-- incomplete token of the input is kept between chunks. No DOM or
+-- intermediate Lua table is built: each element is rendered to JSON text as
+-- soon as it closes and handed to its parent.
+--
+-- Repeated child names are grouped into one JSON array per parent, wherever
+-- the siblings occur (`<a><b/><c/><b/></a>` gives `b` as a two-element
+-- array). Since a repeated name can appear anywhere before its parent
+-- closes, a parent's JSON is only complete at its end tag and the document's
+-- JSON is released when the root element closes. Memory is therefore bounded
+-- by the size of the JSON output, not by the XML input plus a parsed tree.
+
+local cjson = require "cjson"
+
+local find = string.find
+local sub = string.sub
+local byte = string.byte
+local gsub = string.gsub
+local match = string.match
+local rep = string.rep
+local concat = table.concat
+local tonumber = tonumber
+local char = string.char
+
+local encode_string = cjson.encode
+
+local BYTE_GT = byte(">")
+local BYTE_SLASH = byte("/")
+local BYTE_BANG = byte("!")
+local BYTE_QUESTION = byte("?")
+
+local ENTITIES = {
+  lt = "<",
+  gt = ">",
+  amp = "&",
+  apos = "'",
+  quot = '"',
+}
+
+local function utf8_char(code)
+  if code < 0x80 then
+    return char(code)
+  elseif code < 0x800 then
+    return char(0xC0 + math.floor(code / 0x40), 0x80 + code % 0x40)
+  elseif code < 0x10000 then
+    return char(0xE0 + math.floor(code / 0x1000),
+                0x80 + math.floor(code / 0x40) % 0x40,
+                0x80 + code % 0x40)
+  end
+  return char(0xF0 + math.floor(code / 0x40000),
+              0x80 + math.floor(code / 0x1000) % 0x40,
+              0x80 + math.floor(code / 0x40) % 0x40,
+              0x80 + code % 0x40)
+end
+
+local function replace_entity(name)
+  local predefined = ENTITIES[name]
+  if predefined then
+    return predefined
+  end
+  local code
+  if sub(name, 1, 2) == "#x" then
+    code = tonumber(sub(name, 3), 16)
+  elseif sub(name, 1, 1) == "#" then
+    code = tonumber(sub(name, 2))
+  end
+  if code then
+    return utf8_char(code)
+  end
+  return "&" .. name .. ";" -- Unknown entities are kept verbatim
+end
+
+local function decode_entities(text)
+  if not find(text, "&", 1, true) then
+    return text
+  end
+  return (gsub(text, "&(#?[%w]+);", replace_entity))
+end
+
+local Converter = {}
+Converter.__index = Converter
+
+local _M = {}
+
+--- Creates a converter.
+-- @param opts table `strip_namespaces`, `attribute_prefix`, `text_node_name`,
+--   `arrays_key_ending`, `arrays_key_ending_strip` and `pretty_print`.
+function _M.new(opts)
+  local arrays_key_ending = opts.arrays_key_ending
+  if arrays_key_ending == "" then
+    arrays_key_ending = nil
+  end
+
+  return setmetatable({
+    strip_namespaces = opts.strip_namespaces,
+    attribute_prefix = opts.attribute_prefix or "@",
+    text_node_name = encode_string(opts.text_node_name or "#text"),
+    arrays_key_ending = arrays_key_ending,
+    arrays_key_ending_strip = opts.arrays_key_ending_strip,
+    pretty_print = opts.pretty_print,
+
+    input = "",   -- unconsumed input (at most one incomplete token)
+    pending = {}, -- chunks received since, not yet joined to `input`
+    wait_for = nil, -- text that must arrive before `input` can be parsed further
+    tail = "",    -- end of the buffered input, for a `wait_for` split across chunks
+    stack = {},   -- open element frames
+    result = nil, -- JSON text of the document once the root element closes
+    root_done = false,
+    failed = nil,
+  }, Converter)
+end
+
+function Converter:local_name(name)
+  if self.strip_namespaces then
+    return match(name, ":([^:]*)$") or name
+  end
+  return name
+end
+
+function Converter:newline(depth)
+  if self.pretty_print then
+    return "\n" .. rep("  ", depth)
+  end
+  return ""
+end
+
+-- Adds the rendered JSON `value` of a closed child element to `frame`,
+-- grouped with any earlier sibling of the same name.
+function Converter:add_child(frame, key, value)
+  local forced_array = self.arrays_key_ending
+                       and sub(key, -#self.arrays_key_ending) == self.arrays_key_ending
+  local output_key = key
+  if forced_array and self.arrays_key_ending_strip then
+    output_key = sub(key, 1, -#self.arrays_key_ending - 1)
+  end
+
+  local group = frame.groups[output_key]
+  if not group then
+    group = { forced_array = false }
+    frame.groups[output_key] = group
+    frame.order[#frame.order + 1] = output_key
+  end
+  group.forced_array = group.forced_array or forced_array
+  group[#group + 1] = value
+end
+
+-- Renders the JSON value of a closed element
+function Converter:render(frame)
+  local members = frame.attributes
+  local depth = frame.depth
+
+  local item_separator = "," .. self:newline(depth + 2)
+  for _, output_key in ipairs(frame.order) do
+    local group = frame.groups[output_key]
+    local value
+    if #group == 1 and not group.forced_array then
+      value = group[1]
+    else
+      value = "[" .. concat(group, item_separator) .. "]"
+    end
+    members[#members + 1] = encode_string(output_key) .. ":" .. value
+  end
+
+  local text = frame.text and concat(frame.text)
+  if not members[1] then
+    return text and encode_string(text) or "{}"
+  end
+  if text then
+    members[#members + 1] = self.text_node_name .. ":" .. encode_string(text)
+  end
+
+  local indent = self:newline(depth + 1)
+  return "{" .. indent .. concat(members, "," .. indent) .. self:newline(depth) .. "}"
+end
+
+function Converter:start_element(name, attributes, self_closing)
+  local stack = self.stack
+  if not stack[1] and self.root_done then
+    return nil, "multiple root elements"
+  end
+
+  local rendered = {}
+  local prefix = self.attribute_prefix
+  for i = 1, #attributes, 2 do
+    rendered[#rendered + 1] = encode_string(prefix .. self:local_name(attributes[i]))
+                              .. ":" .. encode_string(attributes[i + 1])
+  end
+
+  stack[#stack + 1] = {
+    name = name,
+    depth = #stack + 1,
+    attributes = rendered, -- rendered attribute members
+    groups = {},           -- output key -> rendered values of the children
+    order = {},            -- output keys in order of first appearance
+    text = nil,
+  }
+
+  if self_closing then
+    return self:end_element(name)
+  end
+  return true
+end
+
+function Converter:end_element(name)
+  local stack = self.stack
+  local frame = stack[#stack]
+  if not frame or frame.name ~= name then
+    return nil, "unexpected end tag '" .. name .. "'"
+  end
+  stack[#stack] = nil
+
+  local key = self:local_name(name)
+  local value = self:render(frame)
+  local parent = stack[#stack]
+  if parent then
+    self:add_child(parent, key, value)
+    return true
+  end
+
+  self.result = "{" .. self:newline(1) .. encode_string(key) .. ":" .. value .. self:newline(0) .. "}"
+  self.root_done = true
+  return true
+end
+
+function Converter:characters(text)
+  local frame = self.stack[#self.stack]
+  if not find(text, "%S") then
+    return true -- Whitespace between elements carries no data
+  end
+  if not frame then
+    return nil, "text outside of the root element"
+  end
+  local parts = frame.text
+  if not parts then
+    parts = {}
+    frame.text = parts
+  end
+  parts[#parts + 1] = text
+  return true
+end
+
+-- Parses a start tag at `lt`. Returns the position after the tag, or nil when
+-- the tag is not complete yet.
+function Converter:parse_start_tag(input, lt)
+  local _, name_end, name = find(input, "^([^%s/>]+)", lt + 1)
+  if not name_end then
+    if lt + 1 > #input then
+      return nil
+    end
+    return nil, "invalid start tag"
+  end
+
+  local attributes = {}
+  local p = name_end + 1
+  while true do
+    local _, ws_end = find(input, "^%s*", p)
+    p = ws_end + 1
+    local c = byte(input, p)
+
+    if c == BYTE_GT then
+      local ok, err = self:start_element(name, attributes, false)
+      if not ok then
+        return nil, err
+      end
+      return p + 1
+    elseif c == BYTE_SLASH then
+      local next_c = byte(input, p + 1)
+      if not next_c then
+        return nil
+      elseif next_c ~= BYTE_GT then
+        return nil, "invalid start tag '" .. name .. "'"
+      end
+      local ok, err = self:start_element(name, attributes, true)
+      if not ok then
+        return nil, err
+      end
+      return p + 2
+    elseif not c then
+      return nil
+    end
+
+    local _, value_start, attr_name, quote = find(input, "^([^%s=/>]+)%s*=%s*([\"'])", p)
+    if not value_start then
+      if not find(input, ">", p, true) then
+        return nil -- Attribute may still be arriving
+      end
+      return nil, "invalid attribute in element '" .. name .. "'"
+    end
+    local value_end = find(input, quote, value_start + 1, true)
+    if not value_end then
+      return nil
+    end
+    attributes[#attributes + 1] = attr_name
+    attributes[#attributes + 1] = decode_entities(sub(input, value_start + 1, value_end - 1))
+    p = value_end + 1
+  end
+end
+
+-- Consumes as many complete tokens from `self.input` as possible
+function Converter:parse(final)
+  local input = self.input
+  local len = #input
+  local pos = 1
+  local ok, err
+
+  local wait_for
+
+  while pos <= len do
+    local lt = find(input, "<", pos, true)
+    wait_for = nil
+
+    if not lt then
+      if not final then
+        wait_for = "<"
+        break -- Text may continue in the next chunk
+      end
+      ok, err = self:characters(decode_entities(sub(input, pos)))
+      if not ok then
+        return nil, err
+      end
+      pos = len + 1
+      break
+    end
+
+    if lt > pos then
+      ok, err = self:characters(decode_entities(sub(input, pos, lt - 1)))
+      if not ok then
+        return nil, err
+      end
+      pos = lt
+    end
+
+    local marker = byte(input, lt + 1)
+    local next_pos
+
+    if not marker then
+      break
+    elseif marker == BYTE_QUESTION then
+      local _, close = find(input, "?>", lt + 2, true)
+      next_pos = close and close + 1
+      wait_for = "?>"
+    elseif marker == BYTE_BANG then
+      if sub(input, lt + 2, lt + 3) == "--" then
+        local _, close = find(input, "-->", lt + 4, true)
+        next_pos = close and close + 1
+        wait_for = "-->"
+      elseif sub(input, lt + 2, lt + 8) == "[CDATA[" then
+        local close = find(input, "]]>", lt + 9, true)
+        wait_for = "]]>"
+        if close then
+          local cdata = sub(input, lt + 9, close - 1)
+          local frame = self.stack[#self.stack]
+          if frame and cdata ~= "" then
+            frame.text = frame.text or {}
+            frame.text[#frame.text + 1] = cdata
+          end
+          next_pos = close + 3
+        end
+      elseif len - lt < 8 then
+        next_pos = nil -- Too short to tell which declaration this is
+      else
+        -- DOCTYPE and other declarations; an internal subset ends with "]>"
+        local first_gt = find(input, ">", lt + 2, true)
+        local bracket = find(input, "[", lt + 2, true)
+        wait_for = ">"
+        if bracket and (not first_gt or bracket < first_gt) then
+          local _, close = find(input, "]%s*>", bracket + 1)
+          next_pos = close and close + 1
+        else
+          next_pos = first_gt and first_gt + 1
+        end
+      end
+    elseif marker == BYTE_SLASH then
+      local close = find(input, ">", lt + 2, true)
+      wait_for = ">"
+      if close then
+        local name = match(sub(input, lt + 2, close - 1), "^([^%s]+)%s*$")
+        if not name then
+          return nil, "invalid end tag"
+        end
+        ok, err = self:end_element(name)
+        if not ok then
+          return nil, err
+        end
+        next_pos = close + 1
+      end
+    else
+      next_pos, err = self:parse_start_tag(input, lt)
+      if err then
+        return nil, err
+      end
+      wait_for = ">"
+    end
+
+    if not next_pos then
+      break -- Incomplete token, wait for more input
+    end
+    pos = next_pos
+  end
+
+  self.input = sub(input, pos)
+  self.wait_for = pos <= len and wait_for or nil
+  self.tail = self.wait_for and #self.wait_for > 1 and sub(self.input, 1 - #self.wait_for) or ""
+  return true
+end
+
+-- Buffers `chunk` and tells whether it may complete the token at the end
+-- of `input`. Until one does, chunks are only collected: a long text node
+-- or CDATA section arriving in many chunks is joined and scanned once,
+-- instead of being copied and rescanned with every chunk.
+function Converter:buffer(chunk)
+  local pending = self.pending
+  pending[#pending + 1] = chunk
+
+  local wait_for = self.wait_for
+  if not wait_for then
+    return true
+  end
+  local window = self.tail .. chunk
+  if #wait_for > 1 then
+    self.tail = sub(window, 1 - #wait_for)
+  end
+  return find(window, wait_for, 1, true) ~= nil
+end
+
+-- Appends the buffered chunks to `input`
+function Converter:join()
+  local pending = self.pending
+  if #pending > 0 then
+    self.input = self.input .. concat(pending)
+    self.pending = {}
+  end
+end
+
+-- Returns the document's JSON once, after the root element has closed
+function Converter:release()
+  local result = self.result
+  if not result then
+    return ""
+  end
+  self.result = nil
+  return result
+end
+
+--- Feeds a chunk of XML.
+-- @return the JSON text that became final with this chunk (possibly ""),
+--   or nil and an error message if the XML is malformed.
+function Converter:feed(chunk)
+  if self.failed then
+    return nil, self.failed
+  end
+
+  if chunk and chunk ~= "" and not self:buffer(chunk) then
+    return ""
+  end
+  self:join()
+
+  local ok, err = self:parse(false)
+  if not ok then
+    self.failed = err
+    return nil, err
+  end
+  return self:release()
+end
+
+--- Signals the end of the XML input.
+-- @return the remaining JSON text, or nil and an error message.
+function Converter:finish()
+  if self.failed then
+    return nil, self.failed
+  end
+
+  self:join()
+  local ok, err = self:parse(true)
+  if not ok then
+    self.failed = err
+    return nil, err
+  end
+
+  if self.input ~= "" then
+    self.failed = "unexpected end of XML document"
+    return nil, self.failed
+  end
+  if #self.stack > 0 then
+    self.failed = "element '" .. self.stack[#self.stack].name .. "' is not closed"
+    return nil, self.failed
+  end
+  if not self.root_done then
+    self.failed = "no root element"
+    return nil, self.failed
+  end
+
+  return self:release()
+end
+
+--- Converts a complete XML string in one go.
+function _M.convert(xml_string, opts)
+  local converter = _M.new(opts)
+  local head, err = converter:feed(xml_string)
+  if not head then
+    return nil, err
+  end
+  local tail
+  tail, err = converter:finish()
+  if not tail then
+    return nil, err
+  end
+  return head .. tail
+end
+
+return _M
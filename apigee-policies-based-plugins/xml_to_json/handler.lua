@@ -1,102 +1,81 @@
-local cjson = require "cjson"
-local xml2lua = require "xml2lua"
-local kong_meta = require "kong.meta"
+local BasePlugin = require "kong.plugins.base_plugin"
+local converter = require "kong.plugins.xml-to-json.converter"
+local request_context = require "kong.plugins.apigee_common.request_context"
 
-local XmlToJsonHandler = {}
+local XMLToJSONHandler = BasePlugin:extend("xml-to-json")
+XMLToJSONHandler.PRIORITY = 980
 
-XmlToJsonHandler.PRIORITY = 980
-XmlToJsonHandler.VERSION = kong_meta.version
-
-local function handle_error(conf, message)
-  kong.log.err(message)
-  if not conf.on_error_continue then
-    return kong.response.exit(conf.on_error_status, { message = message })
-  end
+local function is_xml(content_type_header)
+  return content_type_header and content_type_header:lower():find("xml") ~= nil
 end
 
-local function get_xml_source(source_type, source_name)
-  if source_type == "request_body" then
-    return kong.request.get_raw_body()
-  elseif source_type == "response_body" then
-    return kong.response.get_raw_body()
-  elseif source_type == "shared_context" then
-    return kong.ctx.shared[source_name]
-  end
-  return nil, "Invalid source_type"
+function XMLToJSONHandler:new()
+  XMLToJSONHandler.super.new(self, "xml-to-json")
 end
 
-local function perform_conversion(conf, xml_string)
-  if not xml_string or xml_string == "" then
-    return nil, "XML source is empty or not found."
-  end
-
-  local parser = xml2lua.parser()
-  local ok, xml_table = pcall(parser.parse, parser, xml_string)
-
-  if not ok then
-    return nil, "Failed to parse XML: " .. (xml_table or "unknown error")
+function XMLToJSONHandler:access(conf)
+  if conf.source == "request" then
+    self:transform_request(conf)
   end
+end
 
-  local ok, json_string = pcall(cjson.encode, xml_table)
-  if not ok then
-    return nil, "Failed to encode JSON: " .. (json_string or "unknown error")
+-- Response bodies are parsed chunk by chunk as they stream through
+-- body_filter, so the XML document is never held in memory as a whole. The
+-- JSON is sent once the root element closes (see converter.lua).
+function XMLToJSONHandler:header_filter(conf)
+  if conf.source ~= "response" or not is_xml(kong.response.get_header("Content-Type")) then
+    return
   end
 
-  return json_string
+  kong.ctx.plugin.converter = converter.new(conf)
+  kong.response.clear_header("Content-Length")
+  kong.response.set_header("Content-Type", conf.content_type)
 end
 
-function XmlToJsonHandler:access(conf)
-  -- This phase handles transformations on the request
-  if conf.xml_source ~= "request_body" and conf.xml_source ~= "shared_context" then
-    return -- Not a request-side transformation
+function XMLToJSONHandler:body_filter(conf)
+  local stream = kong.ctx.plugin.converter
+  if not stream then
+    return
   end
 
-  local xml_string, err = get_xml_source(conf.xml_source, conf.xml_source_name)
-  if err then
-    return handle_error(conf, err)
+  local chunk, eof = ngx.arg[1], ngx.arg[2]
+  local json_str, err = stream:feed(chunk)
+  if json_str and eof then
+    local tail
+    tail, err = stream:finish()
+    json_str = tail and json_str .. tail
   end
 
-  local json_string, err = perform_conversion(conf, xml_string)
-  if err then
-    return handle_error(conf, err)
+  if not json_str then
+    -- Headers are already sent; the client gets an empty body.
+    kong.log.err("XML parsing error: ", err)
+    kong.ctx.plugin.converter = nil
+    ngx.arg[1] = ""
+    return
   end
 
-  -- Handle the output
-  if conf.output_destination == "replace_request_body" then
-    kong.service.request.set_raw_body(json_string)
-    kong.service.request.set_header("Content-Length", #json_string)
-    kong.service.request.set_header("Content-Type", conf.content_type)
-  elseif conf.output_destination == "shared_context" then
-    kong.ctx.shared[conf.output_destination_name] = json_string
-  end
+  ngx.arg[1] = json_str
 end
 
-function XmlToJsonHandler:body_filter(conf)
-  -- This phase handles transformations on the response body
-  if conf.xml_source ~= "response_body" then
+function XMLToJSONHandler:transform_request(conf)
+  local body_str = kong.request.get_raw_body()
+  if not body_str or #body_str == 0 then
     return
   end
 
-  local xml_string, err = get_xml_source(conf.xml_source)
-  if err then
-    return handle_error(conf, "Failed to get response body: " .. err)
+  -- Only transform if Content-Type is XML
+  if not is_xml(request_context.get_header("Content-Type")) then
+    return
   end
 
-  local json_string, err = perform_conversion(conf, xml_string)
-  if err then
-    kong.log.err("XML to JSON transformation failed: ", err)
-    if not conf.on_error_continue then
-      -- In body_filter, we cannot exit. We replace the body with an error.
-      kong.response.set_status(conf.on_error_status)
-      kong.response.set_body({ message = conf.on_error_body })
-    end
+  local json_str, err = converter.convert(body_str, conf)
+  if not json_str then
+    kong.log.err("XML parsing error: ", err)
     return
   end
 
-  -- Handle the output
-  kong.response.set_raw_body(json_string)
-  kong.response.set_header("Content-Length", #json_string)
-  kong.response.set_header("Content-Type", conf.content_type)
+  kong.service.request.set_raw_body(json_str)
+  request_context.set_header("Content-Type", conf.content_type)
 end
 
-return XmlToJsonHandler
\ No newline at end of file
+return XMLToJSONHandler
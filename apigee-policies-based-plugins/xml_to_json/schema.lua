@@ -3,79 +3,70 @@ local typedefs = require "kong.db.schema.typedefs"
 return {
   name = "xml-to-json",
   fields = {
-    { consumer = typedefs.no_consumer },
-    { route = typedefs.no_route },
-    { service = typedefs.no_service },
-    {
-      config = {
+    { consumer = typedefs.consumer },
+    { route = typedefs.route },
+    { service = typedefs.service },
+    { protocols = typedefs.protocols_http },
+    { config = {
         type = "record",
         fields = {
-          {
-            xml_to_json_service_url = {
+          { source = {
               type = "string",
-              required = true,
-              description = "The URL of the external service responsible for XML to JSON conversion.",
+              default = "response",
+              enum = { "request", "response" },
+              description = "Specifies whether to convert XML in the request or response body.",
             },
           },
-          {
-            message_source_type = {
-              type = "string",
-              required = true,
-              enum = { "request_body", "response_body", "shared_context" },
-              description = "Specifies where to get the XML content (XML string) for conversion.",
+          { strip_namespaces = {
+              type = "boolean",
+              default = true,
+              description = "When true, removes XML namespaces during conversion.",
             },
           },
-          {
-            message_source_name = {
+          { attribute_prefix = {
               type = "string",
-              description = "Required if `message_source_type` is `shared_context`. This is the key in `kong.ctx.shared` that holds the XML message string.",
+              default = "@",
+              description = "Prefix for XML attributes when converted to JSON keys.",
             },
           },
-          {
-            output_destination_type = {
+          { text_node_name = {
               type = "string",
-              required = true,
-              enum = { "request_body", "response_body", "shared_context" },
-              description = "Specifies where to place the converted JSON content.",
+              default = "#text",
+              description = "Key name for XML text content within JSON objects.",
             },
           },
-          {
-            output_destination_name = {
-              type = "string",
-              description = "Required if `output_destination_type` is `shared_context`. This is the key in `kong.ctx.shared` where the converted JSON content will be stored.",
+          { pretty_print = {
+              type = "boolean",
+              default = false,
+              description = "When true, the output JSON will be pretty-printed.",
             },
           },
-          {
-            conversion_options = {
-              type = "map",
-              default = {},
-              description = "Optional: A map of conversion options to pass to the external service (e.g., 'omit_xml_declaration', 'strip_comments', 'format', 'indent'). These options depend on the external service's capabilities.",
+          { content_type = {
+              type = "string",
+              default = "application/json",
+              description = "The Content-Type header to set for the transformed body.",
             },
           },
-          {
-            on_error_status = {
-              type = "number",
-              default = 500,
-              between = { 400, 599 },
-              description = "The HTTP status code to return to the client if XML to JSON conversion fails and `on_error_continue` is `false`.",
+          { remove_xml_declaration = {
+              type = "boolean",
+              default = false,
+              description = "Kept for compatibility. The streaming converter always skips the XML declaration and other processing instructions.",
             },
           },
-          {
-            on_error_body = {
+          { arrays_key_ending = {
               type = "string",
-              default = "XML to JSON conversion failed.",
-              description = "The response body to return to the client if XML to JSON conversion fails and `on_error_continue` is `false`.",
+              default = "",
+              description = "If an XML element's name ends with this string, it is always emitted as a JSON array, even when it occurs once. Example: '_list'",
             },
           },
-          {
-            on_error_continue = {
+          { arrays_key_ending_strip = {
               type = "boolean",
               default = false,
-              description = "If `true`, request/response processing will continue even if XML to JSON conversion fails. If `false`, the request will be terminated.",
+              description = "If 'arrays_key_ending' is used, this option strips the ending from the key name in the JSON output.",
             },
           },
         },
       },
     },
   },
-}
+}
\ No newline at end of file
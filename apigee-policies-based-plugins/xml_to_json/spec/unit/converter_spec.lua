@@ -0,0 +1,104 @@
+local converter = require "kong.plugins.xml-to-json.converter"
+local cjson = require "cjson"
+
+local OPTS = {
+  strip_namespaces = true,
+  attribute_prefix = "@",
+  text_node_name = "#text",
+  arrays_key_ending = "",
+}
+
+local function convert(xml, opts)
+  local json = assert(converter.convert(xml, opts or OPTS))
+  return cjson.decode(json)
+end
+
+describe("xml-to-json streaming converter", function()
+
+  it("converts elements, attributes and text", function()
+    local body = convert([[<?xml version="1.0"?>
+      <root>
+        <item id="1"><name>Test &amp; Item</name><value type="numeric">123</value></item>
+        <empty/>
+      </root>]])
+    assert.equal("1", body.root.item["@id"])
+    assert.equal("Test & Item", body.root.item.name)
+    assert.same({ ["@type"] = "numeric", ["#text"] = "123" }, body.root.item.value)
+    assert.same({}, body.root.empty)
+  end)
+
+  it("groups adjacent repeated elements into arrays", function()
+    local body = convert("<root><list><entry>A</entry><entry>B</entry></list></root>")
+    assert.same({ "A", "B" }, body.root.list.entry)
+  end)
+
+  it("strips namespaces", function()
+    local body = convert([[<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">
+      <soap:Body><m:Price xmlns:m="urn:stock"><m:Symbol>GOOG</m:Symbol></m:Price></soap:Body>
+    </soap:Envelope>]])
+    assert.equal("GOOG", body.Envelope.Body.Price.Symbol)
+  end)
+
+  it("forces arrays for arrays_key_ending and strips the ending", function()
+    local body = convert("<root><item_list>1</item_list></root>", {
+      arrays_key_ending = "_list",
+      arrays_key_ending_strip = true,
+    })
+    assert.same({ "1" }, body.root.item)
+  end)
+
+  it("produces the same output when fed one byte at a time", function()
+    local xml = "<r a='x &lt; y'><b>1</b><b>2</b><c><![CDATA[<raw>]]></c><!-- skip --></r>"
+    local stream = converter.new(OPTS)
+    local out = {}
+    for i = 1, #xml do
+      out[#out + 1] = assert(stream:feed(xml:sub(i, i)))
+    end
+    out[#out + 1] = assert(stream:finish())
+    assert.equal(converter.convert(xml, OPTS), table.concat(out))
+  end)
+
+  it("produces the same output for any chunk size", function()
+    local xml = '<?xml version="1.0"?><!DOCTYPE r [<!ENTITY e "v">]><r><!-- a -- b -->'
+             .. "<t>" .. string.rep("text ", 200) .. "</t><d><![CDATA[" .. string.rep("]] > ", 100) .. "]]></d>"
+             .. '<?pi data?><e x="1 > 0"/></r>'
+    local expected = converter.convert(xml, OPTS)
+    for _, size in ipairs({ 1, 2, 3, 7, 64 }) do
+      local stream = converter.new(OPTS)
+      local out = {}
+      for i = 1, #xml, size do
+        out[#out + 1] = assert(stream:feed(xml:sub(i, i + size - 1)))
+      end
+      out[#out + 1] = assert(stream:finish())
+      assert.equal(expected, table.concat(out))
+    end
+  end)
+
+  it("collects the chunks of a long text node without rescanning them", function()
+    local stream = converter.new(OPTS)
+    assert(stream:feed("<r>"))
+    for _ = 1, 1000 do
+      assert.equal("", assert(stream:feed("0123456789")))
+    end
+    -- Only the first chunk was scanned; the others wait for a "<"
+    assert.equal("0123456789", stream.input)
+    assert.equal(999, #stream.pending)
+    assert.equal('{"r":"' .. string.rep("0123456789", 1000) .. '"}', assert(stream:feed("</r>")))
+  end)
+
+  it("groups repeated elements that are not adjacent", function()
+    assert.equal('{"a":{"b":["1","2"],"c":{}}}', converter.convert("<a><b>1</b><c/><b>2</b></a>", OPTS))
+  end)
+
+  it("releases the JSON when the root element closes", function()
+    local stream = converter.new(OPTS)
+    assert.equal("", assert(stream:feed("<r><a>1</a><b>2</b><c/>")))
+    assert.equal('{"r":{"a":"1","b":"2","c":{}}}', assert(stream:feed("</r>")))
+    assert.equal("", assert(stream:finish()))
+  end)
+
+  it("reports malformed XML", function()
+    assert.is_nil(converter.convert("<a><b></a>", OPTS))
+    assert.is_nil(converter.convert("<a>", OPTS))
+  end)
+end)
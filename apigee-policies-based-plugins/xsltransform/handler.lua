@@ -1,5 +1,16 @@
 local saxon = require "saxon"
 local kong_meta = require "kong.meta"
+local lrucache = require "resty.lrucache"
+local request_context = require "kong.plugins.apigee_common.request_context"
+
+-- Resolved stylesheet paths per configured file name, so the plugin
+-- directory is not searched on every request. The Saxon binding has no
+-- separate compile step: it reads the stylesheet from its path on each
+-- transformation, so edits to the file apply on the next request. A path is
+-- looked up again every `stylesheet_check_interval` seconds, so a file that
+-- was moved or removed is noticed.
+local RESOLVED_PATHS_SIZE = 64
+local resolved_paths = assert(lrucache.new(RESOLVED_PATHS_SIZE))
 
 local XslTransformHandler = {}
 
@@ -27,9 +38,42 @@ local function handle_error(conf, message)
   end
 end
 
+-- Returns the path of `conf.xsl_file`, resolving it only on first use and
+-- then at most once every `stylesheet_check_interval` seconds.
+local function get_stylesheet_path(conf)
+  local xsl_path = resolved_paths:get(conf.xsl_file)
+  if xsl_path then
+    return xsl_path
+  end
+
+  xsl_path = kong.plugins.find_file("xsltransform", "xsl/" .. conf.xsl_file)
+  if not xsl_path then
+    return nil, "XSL file not found: " .. conf.xsl_file
+  end
+  if conf.stylesheet_check_interval > 0 then
+    resolved_paths:set(conf.xsl_file, xsl_path, conf.stylesheet_check_interval)
+  end
+  return xsl_path
+end
+
+-- Runs the transformation. A failure may mean that the file went away, so
+-- its path is resolved again on the next request.
+local function transform(conf, xml_string, params)
+  local xsl_path, err = get_stylesheet_path(conf)
+  if not xsl_path then
+    return nil, err
+  end
+  local transformed_xml, transform_err = saxon.transform(xsl_path, xml_string, params)
+  if transform_err then
+    resolved_paths:delete(conf.xsl_file)
+    return nil, "XSL transformation failed: " .. tostring(transform_err)
+  end
+  return transformed_xml
+end
+
 function XslTransformHandler:access(conf)
   -- This phase handles transformations on the request body.
-  if conf.xml_source ~= "request_body" and (conf.xml_source == "shared_context" and conf.output_destination ~= "replace_request_body") then
+  if conf.xml_source == "response_body" or (conf.xml_source == "shared_context" and conf.output_destination ~= "replace_request_body") then
     return -- Not a request transformation, so we'll run in the response phase or just manipulate shared context.
   end
 
@@ -45,23 +89,32 @@ function XslTransformHandler:access(conf)
     end
   end
 
-  -- Locate the XSL file
-  local xsl_path = kong.plugins.find_file("xsltransform", "xsl/" .. conf.xsl_file)
-  if not xsl_path then
-    return handle_error(conf, "XSL file not found: " .. conf.xsl_file)
+  local xml_string
+  if conf.xml_source == "request_body" then
+    local raw_body, err = kong.request.get_raw_body()
+    if err then
+      return handle_error(conf, "Failed to get request body: " .. tostring(err))
+    end
+    xml_string = raw_body
+  else -- 'shared_context'
+    xml_string = get_source_value("shared_context", conf.xml_source_name)
+  end
+
+  if not xml_string or xml_string == "" then
+    return handle_error(conf, "XML source is empty or not found.")
   end
 
   -- Perform the transformation
-  local transformed_xml, err = saxon.transform(xsl_path, xml_string, params)
-  if err then
-    return handle_error(conf, "XSL transformation failed: " .. err)
+  local transformed_xml, err = transform(conf, xml_string, params)
+  if not transformed_xml then
+    return handle_error(conf, err)
   end
 
   -- Handle the output
   if conf.output_destination == "replace_request_body" then
     kong.service.request.set_raw_body(transformed_xml)
-    kong.service.request.set_header("Content-Length", #transformed_xml)
-    kong.service.request.set_header("Content-Type", conf.content_type)
+    request_context.set_header("Content-Length", #transformed_xml)
+    request_context.set_header("Content-Type", conf.content_type)
   elseif conf.output_destination == "shared_context" then
     kong.ctx.shared[conf.output_destination_name] = transformed_xml
   end
@@ -100,31 +153,10 @@ function XslTransformHandler:body_filter(conf)
     end
   end
 
-  local xml_string
-  if conf.xml_source == "request_body" then
-    local raw_body, err = kong.request.get_raw_body()
-    if err then
-      return handle_error(conf, "Failed to get request body: " .. tostring(err))
-    end
-    xml_string = raw_body
-  else -- 'shared_context'
-    xml_string = get_source_value("shared_context", conf.xml_source_name)
-  end
-
-  if not xml_string or xml_string == "" then
-    return handle_error(conf, "XML source is empty or not found.")
-  end
-
-  -- Locate the XSL file
-  local xsl_path = kong.plugins.find_file("xsltransform", "xsl/" .. conf.xsl_file)
-  if not xsl_path then
-    return handle_error(conf, "XSL file not found: " .. conf.xsl_file)
-  end
-
   -- Perform the transformation
-  local transformed_xml, err = saxon.transform(xsl_path, xml_string, params)
-  if err then
-    return handle_error(conf, "XSL transformation failed: " .. tostring(err))
+  local transformed_xml, err = transform(conf, xml_string, params)
+  if not transformed_xml then
+    return handle_error(conf, err)
   end
 
   -- Handle the output
@@ -1,5 +1,6 @@
 -- handler.lua for xsltransform plugin
 local pl_path = require("pl.path") -- Required for path manipulation, might need to be installed
+local request_context = require "kong.plugins.apigee_common.request_context"
                                   -- If not available, we can use string manipulation or kong.db.dao.plugins.get_plugin_path
 
 local PLUGIN_NAME = "xsltransform"
@@ -63,7 +64,7 @@ local function build_xsltproc_command(stylesheet_path, parameters)
                 param_value = kong.ctx.shared[param.ref]
                 if param_value == nil then
                     -- Fallback to other common Kong variables (headers, query args etc.)
-                    param_value = kong.request.get_header(param.ref) or kong.request.get_query_arg(param.ref) or ""
+                    param_value = request_context.get_header(param.ref) or request_context.get_query_arg(param.ref) or ""
                 end
             end
         end
@@ -52,6 +52,14 @@ return {
               description = "The 'Content-Type' header to set on the request/response when the body is replaced.",
             },
           },
+          {
+            stylesheet_check_interval = {
+              type = "number",
+              default = 5,
+              between = { 0, 3600 },
+              description = "How long, in seconds, the resolved path of `xsl_file` is reused before the file is looked up again. Edits to the file apply on the next request regardless. Set to 0 to look it up on every request.",
+            },
+          },
           {
             parameters = {
               type = "array",
@@ -6,9 +6,13 @@ import sys
 PLUGIN_SRC_DIR = "apigee-policies-based-plugins"
 KONG_PLUGIN_DST = "/usr/local/share/lua/5.1/kong/plugins"
 
+# Shared libraries: copied next to the plugins but not enabled in kong.conf
+LIBRARY_DIRS = ["apigee_common"]
+
 # List of plugins to deploy (all folders in the source directory)
 def get_plugin_list():
-    return [d for d in os.listdir(PLUGIN_SRC_DIR) if os.path.isdir(os.path.join(PLUGIN_SRC_DIR, d))]
+    return [d for d in os.listdir(PLUGIN_SRC_DIR)
+            if os.path.isdir(os.path.join(PLUGIN_SRC_DIR, d)) and d not in LIBRARY_DIRS]
 
 def copy_plugin(plugin_name):
     src = os.path.join(PLUGIN_SRC_DIR, plugin_name)
@@ -44,6 +48,8 @@ def restart_kong():
 def main():
     plugins = get_plugin_list()
     print(f"Deploying plugins: {', '.join(plugins)}")
+    for library in LIBRARY_DIRS:
+        copy_plugin(library)
     for plugin in plugins:
         copy_plugin(plugin)
     update_kong_conf(plugins)